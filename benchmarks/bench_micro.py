@@ -0,0 +1,299 @@
+import sys
+import os
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(current_dir)
+sys.path.insert(0, project_root)
+
+import argparse
+import contextlib
+import socket
+import threading
+import time
+import tracemalloc
+from fase2.gbn import GBNPacket, GBN_HEADER_SIZE, BUFFER_SIZE
+from utils.packet import RDTPacket, TCPSegment, TYPE_DATA, set_flag, ACK_BIT, TCP_OPT_MSS
+from utils.simulator import UnreliableChannel, MAX_PACKET_SIZE
+from utils.buffer_pool import BufferPool
+from benchmarks import results as bench_results
+from benchmarks.results import fmt
+from utils.logger import log_info, log_warning
+
+# Micro-benchmarks dos caminhos quentes por pacote: codificação e decodificação de RDTPacket, GBNPacket e TCPSegment,
+# verificação de checksum, UnreliableChannel.send e a recepção de um datagrama GBN (recvfrom() x BufferPool com
+# recvfrom_into()). Para cada operação e tamanho de payload, mede ns/op (o menor de repeats amostras de pelo menos
+# min_time segundos) e bytes alocados por operação (pico do tracemalloc).
+# Os resultados são gravados por commit em results/micro/ e podem ser comparados com os de outro commit.
+
+DEFAULT_SIZES = [0, 64, 512, 1024, 4096, 16384, 65536]
+DEFAULT_MIN_TIME = 0.05 # Duração mínima de cada amostra (segundos)
+DEFAULT_REPEATS = 5
+DEFAULT_TOLERANCE = 0.25 # Micro-benchmarks variam mais que os benchmarks de protocolo
+ALLOC_SAMPLES = 20 # Operações medidas individualmente com o tracemalloc
+MICRO_RESULTS_DIR = os.path.join(current_dir, 'results', 'micro')
+MICRO_METRICS = {'ns_per_op': False, 'alloc_bytes_per_op': False} # Menor é melhor
+
+def _rdt_to_bytes(payload):
+    packet = RDTPacket(TYPE_DATA, 0, payload)
+    return packet.to_bytes
+
+def _rdt_from_bytes(payload):
+    raw = RDTPacket(TYPE_DATA, 0, payload).to_bytes()
+    return lambda: RDTPacket.from_bytes(raw)
+
+def _rdt_is_corrupt(payload):
+    packet = RDTPacket.from_bytes(RDTPacket(TYPE_DATA, 0, payload).to_bytes())
+    return packet.is_corrupt
+
+def _gbn_to_bytes(payload):
+    packet = GBNPacket(TYPE_DATA, 0, payload)
+    return packet.to_bytes
+
+def _gbn_from_bytes(payload):
+    # Inclui a verificação do checksum, feita pelo próprio from_bytes
+    raw = GBNPacket(TYPE_DATA, 0, payload).to_bytes()
+    return lambda: GBNPacket.from_bytes(raw)
+
+def _tcp_segment(payload):
+    return TCPSegment(40000, 40001, 1000, 2000, set_flag(0, ACK_BIT), 0xFFFF, payload)
+
+def _tcp_to_bytes(payload):
+    return _tcp_segment(payload).to_bytes
+
+def _tcp_to_bytes_options(payload):
+    segment = TCPSegment(40000, 40001, 1000, 2000, set_flag(0, ACK_BIT), 0xFFFF, payload,
+                         {TCP_OPT_MSS: (1460).to_bytes(2, 'big')})
+    return segment.to_bytes
+
+def _tcp_from_bytes(payload):
+    raw = _tcp_segment(payload).to_bytes()
+    return lambda: TCPSegment.from_bytes(raw)
+
+def _tcp_is_corrupt(payload):
+    segment = TCPSegment.from_bytes(_tcp_segment(payload).to_bytes())
+    return segment.is_corrupt
+
+class _ChannelSink:
+    """ Canal perfeito enviando para um socket UDP local que é esvaziado por uma thread """
+
+    def __init__(self):
+        self.channel = UnreliableChannel()
+        self.sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.receiver.bind(('127.0.0.1', 0))
+        self.address = self.receiver.getsockname()
+        self.thread = threading.Thread(target=self._drain, daemon=True)
+        self.thread.start()
+        self.idle_threads = threading.active_count()
+
+    def _drain(self):
+        while True:
+            try:
+                self.receiver.recv(65535)
+            except OSError:
+                return
+
+    def close(self):
+        # Envios agendados com atraso (uma thread por pacote) precisam terminar antes de fechar os sockets
+        deadline = time.time() + 10
+        while threading.active_count() > self.idle_threads and time.time() < deadline:
+            time.sleep(0.01)
+        self.sender.close()
+        self.receiver.close()
+
+def _channel_send(payload):
+    # Sem atraso, o simulador envia na thread de quem chama: o custo inclui o sendto()
+    raw = _tcp_segment(payload).to_bytes()
+    sink = _ChannelSink()
+    operation = lambda: sink.channel.send(raw, sink.sender, sink.address)
+    operation.close = sink.close
+    return operation
+
+class _LoopbackPair:
+    """ Dois sockets UDP locais: cada operação envia um datagrama GBN ao receptor e o lê de volta """
+
+    def __init__(self, payload):
+        self.raw = GBNPacket(TYPE_DATA, 0, payload).to_bytes()
+        self.sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.receiver.bind(('127.0.0.1', 0))
+        self.receiver.settimeout(1.0)
+        self.address = self.receiver.getsockname()
+
+    def send(self):
+        self.sender.sendto(self.raw, self.address)
+
+    def close(self):
+        self.sender.close()
+        self.receiver.close()
+
+def _recv_recvfrom(payload):
+    # Sem pool: recvfrom() aloca um bytes de BUFFER_SIZE por datagrama e o decodificador copia o payload
+    pair = _LoopbackPair(payload)
+    def operation():
+        pair.send()
+        raw, _ = pair.receiver.recvfrom(BUFFER_SIZE)
+        return GBNPacket.from_bytes(raw).data
+    operation.close = pair.close
+    return operation
+
+def _recv_recvfrom_into(payload):
+    # Com pool: o datagrama é lido em um slot reutilizado e o payload é copiado uma vez, na entrega
+    pair = _LoopbackPair(payload)
+    pool = BufferPool(BUFFER_SIZE)
+    def operation():
+        pair.send()
+        slot = pool.acquire()
+        raw, _ = slot.recvfrom(pair.receiver)
+        data = bytes(GBNPacket.from_bytes(raw).data)
+        slot.release()
+        return data
+    operation.close = pair.close
+    return operation
+
+# Maior payload de um datagrama GBN
+_recv_recvfrom.max_size = _recv_recvfrom_into.max_size = MAX_PACKET_SIZE - GBN_HEADER_SIZE
+
+# {nome: função(payload) -> operação sem argumentos}
+OPERATIONS = {
+    'rdt.to_bytes': _rdt_to_bytes,
+    'rdt.from_bytes': _rdt_from_bytes,
+    'rdt.is_corrupt': _rdt_is_corrupt,
+    'gbn.to_bytes': _gbn_to_bytes,
+    'gbn.from_bytes': _gbn_from_bytes,
+    'tcp.to_bytes': _tcp_to_bytes,
+    'tcp.to_bytes+options': _tcp_to_bytes_options,
+    'tcp.from_bytes': _tcp_from_bytes,
+    'tcp.is_corrupt': _tcp_is_corrupt,
+    'channel.send': _channel_send,
+    'recv.recvfrom': _recv_recvfrom,
+    'recv.recvfrom_into': _recv_recvfrom_into,
+}
+
+def time_operation(operation, min_time=DEFAULT_MIN_TIME, repeats=DEFAULT_REPEATS):
+    """ (menor, mediana) ns/op entre repeats amostras; o número de operações por amostra é calibrado para que cada
+        uma dure pelo menos min_time """
+    number = 1
+    while True:
+        start = time.perf_counter_ns()
+        for _ in range(number):
+            operation()
+        elapsed = time.perf_counter_ns() - start
+        if elapsed >= min_time * 1e9:
+            break
+        number *= 10 if elapsed < min_time * 1e8 else 2
+    samples = [elapsed / number]
+    for _ in range(repeats - 1):
+        start = time.perf_counter_ns()
+        for _ in range(number):
+            operation()
+        samples.append((time.perf_counter_ns() - start) / number)
+    return min(samples), bench_results.percentile(samples, 50), number
+
+def measure_allocations(operation, samples=ALLOC_SAMPLES):
+    """ Bytes alocados por operação: pico de memória rastreada acima do início, na média de samples operações """
+    operation() # Caches e objetos criados na primeira chamada não contam
+    tracemalloc.start()
+    try:
+        total = 0
+        for _ in range(samples):
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            operation()
+            total += tracemalloc.get_traced_memory()[1] - before
+    finally:
+        tracemalloc.stop()
+    return total / samples
+
+def run_micro(names, sizes, min_time=DEFAULT_MIN_TIME, repeats=DEFAULT_REPEATS, allocations=True):
+    """ Uma linha por (operação, tamanho): {'scenario', 'operation', 'payload_size', 'ns_per_op', ...} """
+    rows = []
+    for name in names:
+        for size in sizes:
+            if size > getattr(OPERATIONS[name], 'max_size', size):
+                continue # Não cabe em um datagrama
+            operation = OPERATIONS[name](bytes(size))
+            try:
+                best, median, number = time_operation(operation, min_time, repeats)
+                alloc = measure_allocations(operation) if allocations else None
+            finally:
+                if hasattr(operation, 'close'):
+                    operation.close()
+            rows.append({'scenario': f"{name}/{size}", 'operation': name, 'payload_size': size,
+                         'ns_per_op': best, 'ns_per_op_median': median, 'ops_per_sample': number,
+                         'mb_per_s': size / best * 1e3 if size else None, 'alloc_bytes_per_op': alloc})
+            log_info(f"{name:22s} {size:6d} B | {best:12.1f} ns/op (mediana {median:.1f}) | "
+                     f"{fmt(rows[-1]['mb_per_s'], '9.1f')} MB/s | {fmt(alloc, '9.0f')} bytes alocados/op", "MICRO")
+    return rows
+
+def results_path(commit, dirty):
+    """ Arquivo de resultados do commit (sufixo -dirty quando há alterações não commitadas) """
+    return os.path.join(MICRO_RESULTS_DIR, f"{commit or 'sem-commit'}{'-dirty' if dirty else ''}.json")
+
+def resolve_baseline(reference):
+    """ Caminho de um JSON, ou commit/revisão git (ex.: HEAD~1) com resultados gravados em results/micro/ """
+    if os.path.exists(reference):
+        return reference
+    commit = bench_results.git_commit(current_dir, reference) or reference
+    path = results_path(commit, False)
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"Sem resultados para {reference} (procurado em {path}).")
+    return path
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Micro-benchmarks de codificação, checksum e canal por pacote")
+    parser.add_argument('-k', '--filter', action='append', default=[],
+                        help="só as operações cujo nome contém o texto (pode repetir)")
+    parser.add_argument('--sizes', nargs='+', type=int, default=DEFAULT_SIZES, help="tamanhos de payload (bytes)")
+    parser.add_argument('--min-time', type=float, default=DEFAULT_MIN_TIME, help="duração mínima de cada amostra")
+    parser.add_argument('--repeats', type=int, default=DEFAULT_REPEATS, help="amostras por medida")
+    parser.add_argument('--no-alloc', action='store_true', help="não mede alocações (tracemalloc)")
+    parser.add_argument('--output', help="arquivo JSON (padrão: results/micro/<commit>.json)")
+    parser.add_argument('--csv', help="também grava os resultados em CSV")
+    parser.add_argument('--baseline', help="JSON ou commit com resultados gravados para comparar")
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help="piora relativa aceita antes de acusar regressão")
+    parser.add_argument('--list', action='store_true', help="lista as operações e sai")
+    args = parser.parse_args(argv)
+
+    names = [name for name in OPERATIONS if not args.filter or any(f in name for f in args.filter)]
+    if args.list:
+        print('\n'.join(names))
+        return 0
+    if not names:
+        parser.error("nenhuma operação corresponde aos filtros")
+
+    # O simulador imprime em alguns casos: saída silenciada
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        rows = run_micro(names, args.sizes, args.min_time, args.repeats, not args.no_alloc)
+
+    commit = bench_results.git_commit(current_dir)
+    dirty = bench_results.git_is_dirty(current_dir)
+    meta = bench_results.run_metadata(dirty=dirty, min_time=args.min_time, repeats=args.repeats)
+    output = args.output or results_path(commit, dirty)
+    bench_results.write_json(output, rows, meta)
+    log_info(f"Resultados gravados em {output}", "MICRO")
+    if args.csv:
+        bench_results.write_csv(args.csv, rows)
+        log_info(f"Resultados gravados em {args.csv}", "MICRO")
+
+    if not args.baseline:
+        return 0
+    try:
+        baseline_meta, baseline = bench_results.load_results(resolve_baseline(args.baseline))
+    except FileNotFoundError as e:
+        log_warning(str(e), "MICRO")
+        return 2
+    log_info(f"\n--- COMPARAÇÃO COM {baseline_meta.get('commit')} ---", "MICRO")
+    regressions = 0
+    for name, metric, old, new, change, regressed in bench_results.compare_to_baseline(rows, baseline, args.tolerance,
+                                                                                     MICRO_METRICS):
+        if regressed:
+            regressions += 1
+            log_warning(f"REGRESSÃO {name} {metric}: {old:.1f} -> {new:.1f} ({change:+.1%})", "MICRO")
+        elif abs(change) > args.tolerance:
+            log_info(f"{name} {metric}: {old:.1f} -> {new:.1f} ({change:+.1%})", "MICRO")
+    log_info(f"{regressions} regressão(ões) acima de {args.tolerance:.0%}.", "MICRO")
+    return 1 if regressions else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,127 @@
+import sys
+import os
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(current_dir)
+sys.path.insert(0, project_root)
+
+import argparse
+import contextlib
+import logging
+import threading
+import time
+from concurrent.futures import wait
+from fase1.rdt30 import RDT30Sender, RDT30Receiver
+from fase1.rdt_mux import RDTMuxEndpoint
+from benchmarks import results as bench_results
+from benchmarks.bench_protocols import LOCALHOST, RUN_TIMEOUT, make_messages
+from benchmarks.results import fmt
+from utils.logger import log_info, main_logger
+
+# Vazão agregada de sessões stop-and-wait (rdt3.0) conforme o número de sessões cresce:
+#   mux        - todas as sessões em um RDTMuxEndpoint de cada lado (uma porta e uma thread de recepção), pelo simulador
+#   mux-direct - o mesmo, enviando direto pelo socket, sem o simulador (só sem perda)
+#   pairs      - um par RDT30Sender/RDT30Receiver por sessão (duas portas e duas threads por sessão)
+# Todas as mensagens são enfileiradas de uma vez com rdt_send_async; cada sessão tem um pacote em trânsito.
+
+DEFAULT_SESSIONS = [1, 10, 100, 1000, 4000]
+DEFAULT_MESSAGES = 20 # Mensagens por sessão
+DEFAULT_PAYLOAD = 64
+MODES = ('mux', 'mux-direct', 'pairs')
+MAX_PAIRS = 200 # Acima disso, pairs esgota threads e descritores de arquivo
+DEFAULT_OUTPUT = os.path.join(current_dir, 'results', 'mux.json')
+
+def _count_threads():
+    """ Threads vivas, sem as entregas agendadas pelo simulador (um threading.Timer por pacote) """
+    return sum(not isinstance(thread, threading.Timer) for thread in threading.enumerate())
+
+def _run_mux(sessions, channel):
+    receiver = RDTMuxEndpoint(0, channel)
+    sender = RDTMuxEndpoint(0, channel)
+    receiver.start()
+    sender.start()
+    receiver_addr = (LOCALHOST, receiver.port)
+    endpoints = [sender.open_session(receiver_addr) for _ in range(sessions)]
+    return endpoints, [sender, receiver], 2, lambda: receiver.stats()['delivered']
+
+def _run_pairs(sessions, channel):
+    endpoints, closers, receivers = [], [], []
+    for _ in range(sessions):
+        receiver = RDT30Receiver(0, None, channel)
+        sender = RDT30Sender(0, (LOCALHOST, receiver.socket.getsockname()[1]), channel)
+        receiver.remote_addr = (LOCALHOST, sender.socket.getsockname()[1])
+        receiver.start()
+        sender.start()
+        endpoints.append(sender)
+        closers.extend([sender, receiver])
+        receivers.append(receiver)
+    return endpoints, closers, 2 * sessions, lambda: sum(len(r.received_data) for r in receivers)
+
+def run_point(mode, sessions, messages, payload_size, loss_rate):
+    """ Uma execução: {'scenario', 'mode', 'sessions', ..., 'msgs_per_s', 'threads', 'ports', 'ok'} """
+    channel = {'loss_rate': loss_rate, 'corrupt_rate': 0.0, 'delay_range': (0.0, 0.0)}
+    if mode == 'mux-direct':
+        channel = None
+    threads_before = _count_threads()
+    setup = _run_pairs if mode == 'pairs' else _run_mux
+    endpoints, closers, ports, delivered = setup(sessions, channel)
+    threads = _count_threads() - threads_before
+    payloads = make_messages(messages, payload_size)
+
+    start = time.perf_counter()
+    futures = [endpoint.rdt_send_async(payload) for payload in payloads for endpoint in endpoints]
+    done, not_done = wait(futures, timeout=RUN_TIMEOUT)
+    elapsed = time.perf_counter() - start
+    retransmissions = sum(endpoint.retransmission_count for endpoint in endpoints)
+    total = delivered()
+    for closer in closers:
+        closer.close()
+
+    ok = not not_done and all(future.exception() is None for future in done) and total == sessions * messages
+    return {'scenario': f"{mode}/{sessions}x{messages}/loss{loss_rate}", 'mode': mode, 'sessions': sessions,
+            'messages_per_session': messages, 'payload_size': payload_size, 'loss_rate': loss_rate,
+            'ok': ok, 'elapsed_s': elapsed, 'delivered': total, 'msgs_per_s': total / elapsed if elapsed > 0 else 0.0,
+            'retransmissions': retransmissions, 'threads': threads, 'ports': ports}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Vazão agregada de sessões stop-and-wait multiplexadas x pares RDT")
+    parser.add_argument('-s', '--sessions', nargs='+', type=int, default=DEFAULT_SESSIONS)
+    parser.add_argument('-m', '--messages', type=int, default=DEFAULT_MESSAGES, help="mensagens por sessão")
+    parser.add_argument('--payload', type=int, default=DEFAULT_PAYLOAD, help="tamanho de cada mensagem (bytes)")
+    parser.add_argument('-l', '--loss', type=float, default=0.0, help="taxa de perda do simulador")
+    parser.add_argument('--modes', nargs='+', choices=MODES, default=list(MODES))
+    parser.add_argument('--json', default=DEFAULT_OUTPUT, help="arquivo JSON de resultados")
+    parser.add_argument('--csv', help="também grava os resultados em CSV")
+    args = parser.parse_args(argv)
+
+    level = main_logger.level
+    progress = sys.stdout
+    rows = []
+    with contextlib.redirect_stdout(open(os.devnull, 'w')):
+        main_logger.setLevel(logging.WARNING)
+        try:
+            for mode in args.modes:
+                for sessions in args.sessions:
+                    if mode == 'pairs' and sessions > MAX_PAIRS:
+                        continue
+                    if mode == 'mux-direct' and args.loss > 0:
+                        continue
+                    print(f"{mode} {sessions} sessões", file=progress, flush=True)
+                    rows.append(run_point(mode, sessions, args.messages, args.payload, args.loss))
+        finally:
+            main_logger.setLevel(level)
+
+    log_info("\n--- RESULTADOS ---", "MUX")
+    for row in rows:
+        log_info(f"{row['mode']:10s} {row['sessions']:5d} sessões | {fmt(row['msgs_per_s'], '9.0f')} mensagens/s | "
+                 f"{row['threads']:4d} threads | {row['ports']:4d} portas | retransmissões: {row['retransmissions']}"
+                 f"{'' if row['ok'] else ' (FALHA)'}", "MUX")
+    meta = bench_results.run_metadata(messages_per_session=args.messages, payload_size=args.payload)
+    bench_results.write_json(args.json, rows, meta)
+    log_info(f"Resultados gravados em {args.json}", "MUX")
+    if args.csv:
+        bench_results.write_csv(args.csv, rows)
+        log_info(f"Resultados gravados em {args.csv}", "MUX")
+    return 0 if all(row['ok'] for row in rows) else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
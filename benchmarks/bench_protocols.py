@@ -0,0 +1,413 @@
+import sys
+import os
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(current_dir)
+sys.path.insert(0, project_root)
+
+import argparse
+import contextlib
+import logging
+import struct
+import threading
+import time
+from fase1.rdt20 import RDT20Sender, RDT20Receiver
+from fase1.rdt21 import RDT21Sender, RDT21Receiver
+from fase1.rdt30 import RDT30Sender, RDT30Receiver
+from fase2.gbn import GBNSender, GBNReceiver
+from fase2.gbn_loop import GBNLoopSender, GBNLoopReceiver
+from fase3.tcp_socket import SimpleTCPSocket, MSS
+from utils.channel_trace import ChannelTrace
+from utils.fec import FEC_MIN_BLOCK
+from benchmarks import results as bench_results
+from benchmarks.results import fmt
+from utils.logger import log_info, log_warning, main_logger
+
+# Benchmark dos protocolos (RDT 2.0/2.1/3.0, GBN com threads e no SelectorLoop, e SimpleTCPSocket) em cenários
+# padronizados.
+# Cada cenário roda warmup + repeats vezes em portas efêmeras; as medidas vão para JSON/CSV e podem ser comparadas
+# com um baseline salvo (python benchmarks/bench_protocols.py --help). Com --seed, ou reproduzindo traços gravados com
+# --record-trace, duas versões de um protocolo são medidas com o mesmo comportamento da rede.
+
+RUN_TIMEOUT = 60.0 # Uma execução que não termina neste tempo é registrada como falha (segundos)
+DEFAULT_REPEATS = 3
+DEFAULT_WARMUP = 1
+DEFAULT_OUTPUT = os.path.join(current_dir, 'results', 'protocols.json')
+LOCALHOST = '127.0.0.1'
+MESSAGE_INDEX = struct.Struct('!I') # Cada mensagem começa com seu índice: duplicatas e trocas aparecem na verificação
+
+PERFECT = {'loss_rate': 0.0, 'corrupt_rate': 0.0, 'delay_range': (0.0, 0.0)}
+CORRUPT = {'loss_rate': 0.0, 'corrupt_rate': 0.1, 'delay_range': (0.0, 0.0)}
+LOSS = {'loss_rate': 0.05, 'corrupt_rate': 0.0, 'delay_range': (0.0, 0.0)}
+DELAY = {'loss_rate': 0.0, 'corrupt_rate': 0.0, 'delay_range': (0.02, 0.02)}
+JITTER = {'loss_rate': 0.0, 'corrupt_rate': 0.0, 'delay_range': (0.01, 0.03)}
+
+def scenario(protocol, payload_size, messages, channel, window=None, fec=None, compression=None):
+    """ Cenário: protocolo, tamanho de cada mensagem, quantidade, janela (GBN: pacotes; TCP: buffers em MSS) e canal.
+        fec (só GBN): pacotes por paridade XOR, ou 'auto' para o bloco adaptativo; compression (só TCP): codec
+        negociado pelos dois lados """
+    entry = {'protocol': protocol, 'payload_size': payload_size, 'messages': messages, 'window': window}
+    if fec is not None:
+        entry['fec'] = fec
+    if compression is not None:
+        entry['compression'] = compression
+    entry.update(channel)
+    entry['delay_range'] = tuple(entry['delay_range'])
+    return entry
+
+# Stop-and-wait só em canais que cada versão trata (o rdt2.0 duplica mensagens quando um ACK é corrompido).
+# Mensagens do RDT cabem no buffer de 1024 bytes do receptor. Atraso variável (JITTER) só no TCP: o simulador
+# reordena os pacotes e o GBN descarta tudo o que chega fora de ordem, esperando um timeout a cada troca. Mensagens de
+# 200000 bytes passam pela fragmentação do canal (4 fragmentos por pacote GBN)
+STANDARD_SCENARIOS = [
+    scenario('rdt20', 512, 200, PERFECT),
+    scenario('rdt21', 512, 200, PERFECT),
+    scenario('rdt21', 512, 200, CORRUPT),
+    scenario('rdt30', 512, 200, PERFECT),
+    scenario('rdt30', 1000, 200, PERFECT),
+    scenario('rdt30', 512, 50, LOSS),
+    scenario('rdt30', 512, 100, DELAY),
+    scenario('gbn', 1000, 300, PERFECT, window=1),
+    scenario('gbn', 1000, 1000, PERFECT, window=5),
+    scenario('gbn', 1000, 1000, PERFECT, window=20),
+    scenario('gbn', 8000, 500, PERFECT, window=20),
+    scenario('gbn', 200000, 30, PERFECT, window=5),
+    scenario('gbn', 200000, 30, LOSS, window=5),
+    scenario('gbn', 1000, 200, CORRUPT, window=5),
+    scenario('gbn', 1000, 200, LOSS, window=5),
+    scenario('gbn', 1000, 200, LOSS, window=20),
+    scenario('gbn', 1000, 200, LOSS, window=5, fec=4),
+    scenario('gbn', 1000, 200, LOSS, window=5, fec='auto'),
+    scenario('gbn', 1000, 200, LOSS, window=20, fec=4),
+    scenario('gbn', 1000, 200, LOSS, window=20, fec='auto'),
+    scenario('gbn', 1000, 100, DELAY, window=5),
+    scenario('gbn', 1000, 100, DELAY, window=20),
+    scenario('gbn-loop', 1000, 300, PERFECT, window=1),
+    scenario('gbn-loop', 1000, 1000, PERFECT, window=5),
+    scenario('gbn-loop', 1000, 1000, PERFECT, window=20),
+    scenario('gbn-loop', 8000, 500, PERFECT, window=20),
+    scenario('gbn-loop', 200000, 30, PERFECT, window=5),
+    scenario('gbn-loop', 200000, 30, LOSS, window=5),
+    scenario('gbn-loop', 1000, 200, CORRUPT, window=5),
+    scenario('gbn-loop', 1000, 200, LOSS, window=5),
+    scenario('gbn-loop', 1000, 200, LOSS, window=20),
+    scenario('gbn-loop', 1000, 100, DELAY, window=5),
+    scenario('gbn-loop', 1000, 100, DELAY, window=20),
+    scenario('tcp', 1024, 256, PERFECT, window=4),
+    scenario('tcp', 1024, 1024, PERFECT, window=64),
+    scenario('tcp', 16384, 256, PERFECT, window=64),
+    scenario('tcp', 16384, 256, PERFECT, window=64, compression='zlib'),
+    scenario('tcp', 1024, 512, CORRUPT, window=64),
+    scenario('tcp', 1024, 512, LOSS, window=64),
+    scenario('tcp', 1024, 512, LOSS, window=64, compression='zlib'),
+    scenario('tcp', 1024, 512, DELAY, window=64),
+    scenario('tcp', 1024, 512, JITTER, window=64),
+]
+
+def scenario_name(entry):
+    """ Nome estável do cenário (chave da comparação com o baseline) """
+    name = f"{entry['protocol']}_p{entry['payload_size']}"
+    if entry.get('window') is not None:
+        name += f"_w{entry['window']}"
+    if entry.get('fec') is not None:
+        name += f"_fec{entry['fec']}"
+    if entry.get('compression') is not None:
+        name += f"_{entry['compression']}"
+    low, high = entry['delay_range']
+    return name + f"_l{entry['loss_rate']:g}_c{entry['corrupt_rate']:g}_d{low:g}-{high:g}"
+
+def channel_params(entry, trace=None, side=0):
+    """ Canal de uma direção (side 0: emissor, 1: receptor). Com 'seed' no cenário, cada direção sorteia com a sua
+        própria semente; trace é o ChannelTrace gravado ou reproduzido pelos canais da execução """
+    params = {'loss_rate': entry['loss_rate'], 'corrupt_rate': entry['corrupt_rate'],
+              'delay_range': tuple(entry['delay_range'])}
+    if entry.get('seed') is not None:
+        params['seed'] = entry['seed'] * 2 + side
+    if trace is not None:
+        params['trace'] = trace
+    return params
+
+def trace_path(directory, entry):
+    return os.path.join(directory, scenario_name(entry) + '.trace')
+
+def make_messages(count, size):
+    """ count mensagens de size bytes, cada uma começando pelo seu índice """
+    filler = b'x' * size
+    if size < MESSAGE_INDEX.size:
+        return [filler] * count
+    return [MESSAGE_INDEX.pack(i) + filler[MESSAGE_INDEX.size:] for i in range(count)]
+
+class DeliveryLog(list):
+    """ Lista de dados entregues à aplicação que registra o instante (perf_counter) de cada entrega; substitui o
+        received_data dos receptores RDT/GBN """
+
+    def __init__(self):
+        super().__init__()
+        self.times = []
+
+    def append(self, data):
+        self.times.append(time.perf_counter())
+        super().append(data)
+
+def _measurement(messages, delivered, sent_at, delivered_at, start, retransmissions, finished):
+    """ Métricas de uma execução: throughput até a última entrega e latência de entrega por mensagem """
+    count = min(len(sent_at), len(delivered_at))
+    latencies = [(delivered_at[i] - sent_at[i]) * 1000 for i in range(count)]
+    elapsed = (delivered_at[-1] if delivered_at else time.perf_counter()) - start
+    delivered_bytes = sum(len(m) for m in delivered)
+    return {'ok': finished and delivered == messages, 'elapsed': elapsed, 'bytes': delivered_bytes,
+            'throughput_mbps': delivered_bytes * 8 / elapsed / 1e6 if elapsed > 0 else 0.0,
+            'latencies_ms': latencies, 'retransmissions': retransmissions}
+
+def _run_datagram(entry, sender_class, receiver_class, trace=None):
+    """ RDT e GBN: emissor e receptor em portas efêmeras; o receptor só conhece o emissor depois de criado """
+    messages = make_messages(entry['messages'], entry['payload_size'])
+    # O receptor é criado primeiro: no traço, o stream 0 é o dos ACKs e o 1 o dos dados
+    receiver = receiver_class(0, None, channel_params(entry, trace, side=1))
+    channel = channel_params(entry, trace, side=0)
+    receiver.received_data = DeliveryLog()
+    receiver_addr = (LOCALHOST, receiver.socket.getsockname()[1])
+    if entry.get('fec') is not None:
+        # 'auto': parte de FEC_MIN_BLOCK e segue a perda medida pelo receptor
+        adaptive = entry['fec'] == 'auto'
+        sender = sender_class(0, receiver_addr, channel, entry['window'], fec_block=FEC_MIN_BLOCK if adaptive else
+                              entry['fec'], fec_adaptive=adaptive)
+    elif entry.get('window') is not None:
+        sender = sender_class(0, receiver_addr, channel, entry['window'])
+    else:
+        sender = sender_class(0, receiver_addr, channel)
+    receiver.remote_addr = (LOCALHOST, sender.socket.getsockname()[1])
+    receiver.start()
+    if hasattr(sender, 'start'):
+        sender.start()
+
+    sent_at = []
+
+    def send_all():
+        for message in messages:
+            sent_at.append(time.perf_counter())
+            sender.rdt_send(message)
+
+    # rdt_send bloqueia (stop-and-wait, janela cheia): o envio roda em uma thread para respeitar RUN_TIMEOUT
+    start = time.perf_counter()
+    deadline = start + RUN_TIMEOUT
+    send_thread = threading.Thread(target=send_all, daemon=True)
+    send_thread.start()
+    while len(receiver.received_data) < len(messages) and time.perf_counter() < deadline:
+        time.sleep(0.005)
+    send_thread.join(max(0.0, deadline - time.perf_counter()))
+    finished = not send_thread.is_alive() and len(receiver.received_data) >= len(messages)
+
+    delivered = list(receiver.received_data)
+    delivered_at = list(receiver.received_data.times)
+    sender.close()
+    receiver.close()
+    return _measurement(messages, delivered, sent_at, delivered_at, start, sender.retransmission_count, finished)
+
+def run_rdt20(entry, trace=None):
+    return _run_datagram(entry, RDT20Sender, RDT20Receiver, trace)
+
+def run_rdt21(entry, trace=None):
+    return _run_datagram(entry, RDT21Sender, RDT21Receiver, trace)
+
+def run_rdt30(entry, trace=None):
+    return _run_datagram(entry, RDT30Sender, RDT30Receiver, trace)
+
+def run_gbn(entry, trace=None):
+    return _run_datagram(entry, GBNSender, GBNReceiver, trace)
+
+def run_gbn_loop(entry, trace=None):
+    return _run_datagram(entry, GBNLoopSender, GBNLoopReceiver, trace)
+
+def run_tcp(entry, trace=None):
+    """ SimpleTCPSocket: o cliente envia as mensagens em sequência; o servidor registra o instante em que o fluxo
+        completa cada mensagem. A janela é o tamanho dos buffers de envio e recepção em MSS """
+    size = entry['payload_size']
+    if size <= 0:
+        raise ValueError("O cenário TCP precisa de mensagens com pelo menos 1 byte.")
+    messages = make_messages(entry['messages'], size)
+    buffer_size = (entry.get('window') or 4) * MSS
+    params = {'recv_buffer_size': buffer_size, 'send_buffer_size': buffer_size,
+              'compression': [entry['compression']] if entry.get('compression') else False}
+    server = SimpleTCPSocket(0, channel_params(entry, trace, side=1), **params)
+    server.listen()
+    received = bytearray()
+    delivered_at = []
+
+    def server_side():
+        try:
+            conn = server.accept(timeout=RUN_TIMEOUT)
+        except TimeoutError:
+            return
+        buffer = bytearray(64 * 1024)
+        while True:
+            n = conn.recv_into(buffer)
+            if n == 0:
+                break
+            now = time.perf_counter()
+            received.extend(buffer[:n])
+            # Mensagens completadas por este recv
+            delivered_at.extend([now] * (len(received) // size - len(delivered_at)))
+        conn.close()
+
+    server_thread = threading.Thread(target=server_side, daemon=True)
+    server_thread.start()
+    client = SimpleTCPSocket(0, channel_params(entry, trace, side=0), **params)
+    sent_at = []
+    start = time.perf_counter()
+    finished = False
+    try:
+        client.connect((LOCALHOST, server.port))
+        start = time.perf_counter()
+        for message in messages:
+            sent_at.append(time.perf_counter())
+            client.send(message)
+        client.close()
+        server_thread.join(max(0.0, start + RUN_TIMEOUT - time.perf_counter()))
+        finished = not server_thread.is_alive()
+    except (TimeoutError, ConnectionError) as e:
+        log_warning(f"Execução TCP interrompida: {e}", "BENCH")
+        client.close()
+    server.close()
+
+    delivered = [bytes(received[i:i + size]) for i in range(0, len(received), size)]
+    return _measurement(messages, delivered, sent_at, delivered_at, start, client.retransmission_count, finished)
+
+RUNNERS = {'rdt20': run_rdt20, 'rdt21': run_rdt21, 'rdt30': run_rdt30, 'gbn': run_gbn, 'gbn-loop': run_gbn_loop,
+           'tcp': run_tcp}
+
+def run_once(entry, trace=None):
+    """ Uma execução do cenário; retorna as métricas brutas """
+    return RUNNERS[entry['protocol']](entry, trace)
+
+def run_scenario(entry, repeats=DEFAULT_REPEATS, warmup=DEFAULT_WARMUP, record_dir=None, replay_dir=None):
+    """ warmup execuções descartadas seguidas de repeats medidas; retorna a linha de resultado do cenário:
+        parâmetros, throughput (mediana e desvio das repetições), percentis de latência sobre todas as mensagens
+        medidas e retransmissões por execução.
+        record_dir: grava o traço do canal da primeira execução medida; replay_dir: todas as execuções reproduzem o
+        traço gravado do cenário """
+    runs = []
+    for i in range(warmup + repeats):
+        trace = None
+        if replay_dir:
+            trace = ChannelTrace.load(trace_path(replay_dir, entry))
+        elif record_dir and i == warmup:
+            trace = ChannelTrace()
+        run = run_once(entry, trace)
+        if record_dir and i == warmup:
+            os.makedirs(record_dir, exist_ok=True)
+            trace.save(trace_path(record_dir, entry))
+        if i >= warmup:
+            runs.append(run)
+    throughput = bench_results.summarize([run['throughput_mbps'] for run in runs])
+    latencies = [latency for run in runs for latency in run['latencies_ms']]
+    row = {'scenario': entry.get('name') or scenario_name(entry)}
+    row.update(entry)
+    row.update({
+        'repeats': repeats,
+        'warmup': warmup,
+        'ok': all(run['ok'] for run in runs),
+        'throughput_mbps': throughput['median'],
+        'throughput_stdev': throughput['stdev'],
+        'elapsed_s': bench_results.summarize([run['elapsed'] for run in runs])['median'],
+        'latency_p50_ms': bench_results.percentile(latencies, 50),
+        'latency_p90_ms': bench_results.percentile(latencies, 90),
+        'latency_p99_ms': bench_results.percentile(latencies, 99),
+        'retransmissions': bench_results.summarize([run['retransmissions'] for run in runs])['mean'],
+    })
+    return row
+
+def log_row(row):
+    log_info(f"{row['scenario']:38s} {'OK  ' if row['ok'] else 'FALHA'} | {fmt(row['throughput_mbps'], '8.2f')} Mbps "
+             f"(±{fmt(row['throughput_stdev'], '.2f')}) | latência p50/p90/p99: {fmt(row['latency_p50_ms'], '.2f')}/"
+             f"{fmt(row['latency_p90_ms'], '.2f')}/{fmt(row['latency_p99_ms'], '.2f')} ms | "
+             f"retransmissões: {fmt(row['retransmissions'], '.1f')}", "BENCH")
+
+def select_scenarios(filters):
+    """ Cenários padrão cujo nome contém algum dos filtros (todos se não houver filtro) """
+    named = [(scenario_name(entry), entry) for entry in STANDARD_SCENARIOS]
+    return [entry for name, entry in named if not filters or any(f in name for f in filters)]
+
+def report_comparison(comparisons, tolerance):
+    """ Registra a comparação com o baseline; retorna quantas métricas regrediram """
+    regressions = 0
+    for name, metric, old, new, change, regressed in comparisons:
+        if regressed:
+            regressions += 1
+            log_warning(f"REGRESSÃO {name} {metric}: {old:.3f} -> {new:.3f} ({change:+.1%})", "BENCH")
+        else:
+            log_info(f"{name} {metric}: {old:.3f} -> {new:.3f} ({change:+.1%})", "BENCH")
+    log_info(f"{regressions} regressão(ões) acima de {tolerance:.0%} em {len(comparisons)} métricas comparadas.", "BENCH")
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark de RDT 2.0/2.1/3.0, GBN e SimpleTCPSocket")
+    parser.add_argument('-k', '--filter', action='append', default=[],
+                        help="roda só os cenários cujo nome contém o texto (pode repetir)")
+    parser.add_argument('--repeats', type=int, default=DEFAULT_REPEATS, help="execuções medidas por cenário")
+    parser.add_argument('--warmup', type=int, default=DEFAULT_WARMUP, help="execuções descartadas por cenário")
+    parser.add_argument('--json', default=DEFAULT_OUTPUT, help="arquivo JSON de resultados")
+    parser.add_argument('--csv', help="também grava os resultados em CSV")
+    parser.add_argument('--baseline', help="JSON de uma execução anterior para comparar")
+    parser.add_argument('--save-baseline', help="também grava os resultados como baseline neste arquivo")
+    parser.add_argument('--tolerance', type=float, default=bench_results.DEFAULT_TOLERANCE,
+                        help="variação relativa aceita antes de acusar regressão")
+    parser.add_argument('--list', action='store_true', help="lista os cenários e sai")
+    parser.add_argument('-v', '--verbose', action='store_true', help="mantém os logs dos protocolos e do simulador")
+    parser.add_argument('--seed', type=int, help="semente dos canais: todas as execuções sorteiam a mesma rede")
+    trace_group = parser.add_mutually_exclusive_group()
+    trace_group.add_argument('--record-trace', metavar='DIR', help="grava o traço do canal de cada cenário em DIR")
+    trace_group.add_argument('--replay-trace', metavar='DIR', help="reproduz os traços gravados em DIR")
+    args = parser.parse_args(argv)
+
+    scenarios = select_scenarios(args.filter)
+    if args.seed is not None:
+        scenarios = [dict(entry, seed=args.seed) for entry in scenarios]
+    if args.list:
+        for entry in scenarios:
+            print(scenario_name(entry))
+        return 0
+    if not scenarios:
+        parser.error("nenhum cenário corresponde aos filtros")
+
+    # Sem -v: só avisos e erros dos protocolos, e sem os prints por pacote do simulador
+    level = main_logger.level
+    progress = sys.stdout
+    quiet = contextlib.ExitStack()
+    if not args.verbose:
+        main_logger.setLevel(logging.WARNING)
+        quiet.enter_context(contextlib.redirect_stdout(open(os.devnull, 'w')))
+    rows = []
+    try:
+        for index, entry in enumerate(scenarios, 1):
+            print(f"[{index}/{len(scenarios)}] {scenario_name(entry)}", file=progress, flush=True)
+            rows.append(run_scenario(entry, args.repeats, args.warmup, args.record_trace, args.replay_trace))
+    finally:
+        quiet.close()
+        main_logger.setLevel(level)
+
+    log_info("\n--- RESULTADOS ---", "BENCH")
+    for row in rows:
+        log_row(row)
+
+    meta = bench_results.run_metadata(repeats=args.repeats, warmup=args.warmup, seed=args.seed,
+                                      trace=args.replay_trace)
+    bench_results.write_json(args.json, rows, meta)
+    log_info(f"Resultados gravados em {args.json}", "BENCH")
+    if args.csv:
+        bench_results.write_csv(args.csv, rows)
+        log_info(f"Resultados gravados em {args.csv}", "BENCH")
+    if args.save_baseline:
+        bench_results.write_json(args.save_baseline, rows, meta)
+        log_info(f"Baseline gravado em {args.save_baseline}", "BENCH")
+
+    failures = sum(not row['ok'] for row in rows)
+    regressions = 0
+    if args.baseline:
+        baseline_meta, baseline = bench_results.load_results(args.baseline)
+        log_info(f"\n--- COMPARAÇÃO COM O BASELINE (commit {baseline_meta.get('commit')}) ---", "BENCH")
+        regressions = report_comparison(bench_results.compare_to_baseline(rows, baseline, args.tolerance),
+                                        args.tolerance)
+    return 1 if failures or regressions else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
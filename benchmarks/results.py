@@ -0,0 +1,110 @@
+import csv
+import json
+import math
+import os
+import platform
+import subprocess
+import time
+
+# Resultados de benchmark: estatísticas das repetições, arquivos JSON/CSV e comparação com um baseline salvo.
+# Formato do JSON: {'meta': {...}, 'results': [{'scenario': nome, ...parâmetros, ...métricas}]}
+
+DEFAULT_TOLERANCE = 0.2 # Variação relativa aceita antes de acusar regressão
+
+# Métricas verificadas contra o baseline: True quando maior é melhor
+GATED_METRICS = {
+    'throughput_mbps': True,
+    'latency_p50_ms': False,
+    'latency_p99_ms': False,
+}
+
+def percentile(values, p):
+    """ Percentil p (0-100) com interpolação linear; None para lista vazia """
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * p / 100
+    low = math.floor(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+def summarize(values):
+    """ {'mean', 'median', 'stdev', 'min', 'max'} de uma lista de medidas """
+    if not values:
+        return {'mean': None, 'median': None, 'stdev': None, 'min': None, 'max': None}
+    mean = sum(values) / len(values)
+    variance = sum((v - mean) ** 2 for v in values) / (len(values) - 1) if len(values) > 1 else 0.0
+    return {'mean': mean, 'median': percentile(values, 50), 'stdev': math.sqrt(variance),
+            'min': min(values), 'max': max(values)}
+
+def fmt(value, spec):
+    """ format() que mostra '-' para métricas sem valor """
+    return format(value, spec) if value is not None else '-'
+
+def git_commit(cwd=None, revision='HEAD'):
+    """ Hash curto de revision (padrão: o commit atual); None fora de um checkout git ou se a revisão não existe """
+    try:
+        out = subprocess.run(['git', 'rev-parse', '--short', revision], cwd=cwd, capture_output=True, text=True,
+                             timeout=10)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return out.stdout.strip() or None
+
+def git_is_dirty(cwd=None):
+    """ True se há alterações não commitadas em arquivos rastreados """
+    try:
+        out = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=cwd, capture_output=True,
+                             text=True, timeout=10)
+    except (OSError, subprocess.SubprocessError):
+        return False
+    return bool(out.stdout.strip())
+
+def run_metadata(**extra):
+    """ Ambiente da execução, gravado junto com os resultados """
+    meta = {'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'), 'commit': git_commit(os.path.dirname(__file__)),
+            'python': platform.python_version(), 'platform': platform.platform(), 'cpus': os.cpu_count()}
+    meta.update(extra)
+    return meta
+
+def write_json(path, results, meta):
+    """ Grava {'meta', 'results'} em path (cria o diretório se preciso) """
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump({'meta': meta, 'results': results}, f, indent=2)
+
+def write_csv(path, results):
+    """ Uma linha por cenário; valores compostos (dicts, tuplas) são gravados como JSON """
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    columns = []
+    for row in results:
+        columns.extend(key for key in row if key not in columns)
+    with open(path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=columns)
+        writer.writeheader()
+        for row in results:
+            writer.writerow({key: json.dumps(value) if isinstance(value, (dict, list, tuple)) else value
+                             for key, value in row.items()})
+
+def load_results(path):
+    """ Lê um arquivo gravado por write_json(); retorna (meta, {cenário: resultado}) """
+    with open(path) as f:
+        content = json.load(f)
+    return content.get('meta', {}), {row['scenario']: row for row in content.get('results', [])}
+
+def compare_to_baseline(results, baseline, tolerance=DEFAULT_TOLERANCE, metrics=GATED_METRICS):
+    """ Compara cada cenário com o mesmo cenário do baseline ({cenário: resultado}).
+        Retorna [(cenário, métrica, baseline, atual, variação relativa, regrediu)]; cenários ausentes no baseline
+        e métricas sem valor são ignorados """
+    comparisons = []
+    for row in results:
+        reference = baseline.get(row['scenario'])
+        if reference is None:
+            continue
+        for metric, higher_is_better in metrics.items():
+            old, new = reference.get(metric), row.get(metric)
+            if old is None or new is None or old == 0:
+                continue
+            change = (new - old) / old
+            regressed = change < -tolerance if higher_is_better else change > tolerance
+            comparisons.append((row['scenario'], metric, old, new, change, regressed))
+    return comparisons
@@ -0,0 +1,225 @@
+import sys
+import os
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(current_dir)
+sys.path.insert(0, project_root)
+
+import argparse
+import itertools
+import json
+import logging
+import multiprocessing
+import signal
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from benchmarks import bench_protocols
+from benchmarks import results as bench_results
+from benchmarks.results import fmt
+from utils.logger import log_info, log_warning, log_error, main_logger
+
+# Varredura de parâmetros: o produto cartesiano de uma grade de protocolos e canais, com cada execução em um processo
+# de um pool. Os runners do bench_protocols usam portas efêmeras, então execuções simultâneas não colidem.
+# Cada execução concluída vira uma linha JSON no arquivo de resultados; rodar de novo com o mesmo arquivo retoma a
+# varredura, pulando o que já foi medido.
+
+DEFAULT_RESULTS = os.path.join(current_dir, 'results', 'sweep.jsonl')
+WINDOWED_PROTOCOLS = ('gbn', 'gbn-loop', 'tcp') # Nos demais, a janela não se aplica e é ignorada na grade
+
+# Padrão: throughput do GBN por janela com 0-30% de perda
+DEFAULT_GRID = {
+    'protocol': ['gbn'],
+    'payload_size': [1000],
+    'messages': [200],
+    'window': [1, 5, 20],
+    'loss_rate': [0.0, 0.1, 0.2, 0.3],
+    'corrupt_rate': [0.0],
+    'delay_range': [(0.0, 0.0)],
+}
+
+def expand_grid(grid):
+    """ Lista de cenários (sem repetições) do produto cartesiano da grade {parâmetro: [valores]} """
+    keys = list(DEFAULT_GRID)
+    unknown = set(grid) - set(keys)
+    if unknown:
+        raise ValueError(f"Parâmetros desconhecidos na grade: {', '.join(sorted(unknown))}")
+    values = [grid.get(key, DEFAULT_GRID[key]) for key in keys]
+    scenarios = {}
+    for combination in itertools.product(*values):
+        params = dict(zip(keys, combination))
+        if params['protocol'] not in bench_protocols.RUNNERS:
+            raise ValueError(f"Protocolo desconhecido: {params['protocol']}")
+        if params['protocol'] not in WINDOWED_PROTOCOLS:
+            params['window'] = None
+        channel = {'loss_rate': params['loss_rate'], 'corrupt_rate': params['corrupt_rate'],
+                   'delay_range': params['delay_range']}
+        entry = bench_protocols.scenario(params['protocol'], params['payload_size'], params['messages'], channel,
+                                         params['window'])
+        scenarios.setdefault(bench_protocols.scenario_name(entry), entry)
+    return list(scenarios.values())
+
+def load_completed(path):
+    """ Linhas já gravadas em path. Uma linha final incompleta (varredura interrompida no meio da escrita) é removida
+        do arquivo, para que as próximas linhas sejam anexadas a partir de uma linha nova """
+    rows = []
+    if not os.path.exists(path):
+        return rows
+    with open(path, 'rb+') as f:
+        content = f.read()
+        complete = content.rfind(b'\n') + 1
+        if complete < len(content):
+            log_warning(f"Linha incompleta removida do final de {path}.", "SWEEP")
+            f.truncate(complete)
+    for line in content[:complete].splitlines():
+        if line.strip():
+            rows.append(json.loads(line))
+    return rows
+
+def _init_worker():
+    """ Processos do pool: só avisos e erros, sem os prints por pacote do simulador. Ctrl+C chega a todo o grupo de
+        processos, mas quem decide o que fazer com as execuções em andamento é o processo principal """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    main_logger.setLevel(logging.WARNING)
+    sys.stdout = open(os.devnull, 'w')
+
+def _run_point(entry, repeat):
+    """ Uma execução no processo do pool; retorna a linha da tabela """
+    run = bench_protocols.run_once(entry)
+    row = {'scenario': bench_protocols.scenario_name(entry), 'repeat': repeat}
+    row.update(entry)
+    row.update({
+        'ok': run['ok'],
+        'elapsed_s': run['elapsed'],
+        'bytes': run['bytes'],
+        'throughput_mbps': run['throughput_mbps'],
+        'latency_p50_ms': bench_results.percentile(run['latencies_ms'], 50),
+        'latency_p99_ms': bench_results.percentile(run['latencies_ms'], 99),
+        'retransmissions': run['retransmissions'],
+        'pid': os.getpid(),
+        'finished_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    })
+    return row
+
+def run_sweep(scenarios, repeats, results_path, workers=None):
+    """ Executa (cenário, repetição) que ainda não estão em results_path no pool; retorna todas as linhas """
+    rows = load_completed(results_path)
+    done = {(row['scenario'], row['repeat']) for row in rows}
+    pending = [(entry, repeat) for entry in scenarios for repeat in range(repeats)
+               if (bench_protocols.scenario_name(entry), repeat) not in done]
+    log_info(f"{len(scenarios)} cenários x {repeats} repetições: {len(done)} execuções já medidas, "
+             f"{len(pending)} pendentes.", "SWEEP")
+    if not pending:
+        return rows
+
+    os.makedirs(os.path.dirname(os.path.abspath(results_path)), exist_ok=True)
+    workers = workers or os.cpu_count() or 1
+    start = time.time()
+    # spawn: cada execução começa em um processo sem as threads (wheel de timers, canais) dos runners anteriores
+    context = multiprocessing.get_context('spawn')
+    with open(results_path, 'a') as out, \
+            ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_worker) as pool:
+        futures = {pool.submit(_run_point, entry, repeat): (entry, repeat) for entry, repeat in pending}
+        recorded = set()
+
+        def record(future):
+            entry, repeat = futures[future]
+            name = bench_protocols.scenario_name(entry)
+            recorded.add(future)
+            try:
+                row = future.result()
+            except Exception as e:
+                log_error(f"{name} #{repeat}: {e}", "SWEEP")
+                return
+            # Uma linha por execução, gravada assim que termina: a varredura pode ser retomada a qualquer momento
+            out.write(json.dumps(row) + '\n')
+            out.flush()
+            rows.append(row)
+            log_info(f"[{len(recorded)}/{len(pending)}] {name} #{repeat}: {row['throughput_mbps']:.2f} Mbps, "
+                     f"{row['retransmissions']} retransmissões{'' if row['ok'] else ' (FALHA)'}", "SWEEP")
+
+        try:
+            for future in as_completed(futures):
+                record(future)
+        except KeyboardInterrupt:
+            # As execuções que já começaram terminam em até RUN_TIMEOUT e são gravadas; as demais são canceladas
+            running = [future for future in futures if future not in recorded and not future.cancel()]
+            log_warning(f"Varredura interrompida: aguardando {len(running)} execuções em andamento. Rode de novo "
+                        f"com o mesmo arquivo para retomar.", "SWEEP")
+            for future in as_completed(running):
+                record(future)
+            raise
+    log_info(f"{len(pending)} execuções em {time.time() - start:.1f}s com {workers} processos.", "SWEEP")
+    return rows
+
+def summarize_rows(rows, scenarios):
+    """ Uma linha por cenário da grade: medianas das repetições e execuções que falharam """
+    by_scenario = {}
+    for row in rows:
+        by_scenario.setdefault(row['scenario'], []).append(row)
+    table = []
+    for entry in scenarios:
+        name = bench_protocols.scenario_name(entry)
+        runs = by_scenario.get(name, [])
+        summary = {'scenario': name}
+        summary.update(entry)
+        summary['runs'] = len(runs)
+        summary['failures'] = sum(not run['ok'] for run in runs)
+        for metric in ('throughput_mbps', 'latency_p50_ms', 'latency_p99_ms', 'retransmissions'):
+            summary[metric] = bench_results.summarize([run[metric] for run in runs if run[metric] is not None])['median']
+        table.append(summary)
+    return table
+
+def _parse_delay(text):
+    """ '0.02' ou '0.01-0.03' -> (mínimo, máximo) """
+    low, _, high = text.partition('-')
+    return (float(low), float(high or low))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Varredura de parâmetros dos protocolos em um pool de processos")
+    parser.add_argument('--grid', help="arquivo JSON {parâmetro: [valores]}; as opções abaixo substituem seus valores")
+    parser.add_argument('-p', '--protocol', nargs='+', choices=sorted(bench_protocols.RUNNERS))
+    parser.add_argument('--payload', nargs='+', type=int, dest='payload_size')
+    parser.add_argument('--messages', nargs='+', type=int)
+    parser.add_argument('-w', '--window', nargs='+', type=int)
+    parser.add_argument('-l', '--loss', nargs='+', type=float, dest='loss_rate')
+    parser.add_argument('-c', '--corrupt', nargs='+', type=float, dest='corrupt_rate')
+    parser.add_argument('-d', '--delay', nargs='+', type=_parse_delay, dest='delay_range',
+                        help="atraso em segundos: fixo (0.02) ou intervalo (0.01-0.03)")
+    parser.add_argument('--repeats', type=int, default=3, help="execuções por cenário")
+    parser.add_argument('--workers', type=int, help="processos no pool (padrão: número de CPUs)")
+    parser.add_argument('--results', default=DEFAULT_RESULTS, help="arquivo JSONL por execução (retomado se existir)")
+    parser.add_argument('--csv', help="grava a tabela resumida (uma linha por cenário) em CSV")
+    args = parser.parse_args(argv)
+
+    grid = {}
+    if args.grid:
+        with open(args.grid) as f:
+            grid = json.load(f)
+        if 'delay_range' in grid:
+            grid['delay_range'] = [tuple(delay) for delay in grid['delay_range']]
+    for key in DEFAULT_GRID:
+        if getattr(args, key, None):
+            grid[key] = getattr(args, key)
+    try:
+        scenarios = expand_grid(grid)
+    except ValueError as e:
+        parser.error(str(e))
+
+    try:
+        rows = run_sweep(scenarios, args.repeats, args.results, args.workers)
+    except KeyboardInterrupt:
+        return 130
+    table = summarize_rows(rows, scenarios)
+    log_info("\n--- RESULTADOS (medianas por cenário) ---", "SWEEP")
+    for summary in table:
+        log_info(f"{summary['scenario']:38s} {summary['runs']} execuções ({summary['failures']} falhas) | "
+                 f"{fmt(summary['throughput_mbps'], '8.2f')} Mbps | latência p50/p99: "
+                 f"{fmt(summary['latency_p50_ms'], '.2f')}/"
+                 f"{fmt(summary['latency_p99_ms'], '.2f')} ms | retransmissões: "
+                 f"{fmt(summary['retransmissions'], '.1f')}", "SWEEP")
+    if args.csv:
+        bench_results.write_csv(args.csv, table)
+        log_info(f"Tabela gravada em {args.csv}", "SWEEP")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,17 +1,19 @@
 import socket
-import threading
 import time
 from utils.packet import RDTPacket, TYPE_DATA, TYPE_ACK, TYPE_NAK
 from utils.simulator import UnreliableChannel
 from utils.logger import log_info, log_error
+from utils.receive_pump import ReceivePump, set_socket_buffers
 
 # Constantes
 BUFFER_SIZE = 1024
 TIMEOUT = 1.0 # Timeout em segundos
 
 class RDT20Sender:
-    def __init__(self, local_port, remote_addr, channel_params):
+    def __init__(self, local_port, remote_addr, channel_params, rcvbuf=None, sndbuf=None):
+        """ rcvbuf/sndbuf: SO_RCVBUF/SO_SNDBUF do socket (padrão: os do sistema) """
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        set_socket_buffers(self.socket, rcvbuf, sndbuf)
         self.socket.bind(('0.0.0.0', local_port))
         self.remote_addr = remote_addr
         self.channel = UnreliableChannel(**channel_params)
@@ -92,66 +94,57 @@ class RDT20Sender:
         log_info("Sender encerrado.", "RDT2.0")
 
 class RDT20Receiver:
-    def __init__(self, local_port, remote_addr, channel_params):
+    def __init__(self, local_port, remote_addr, channel_params, rcvbuf=None, sndbuf=None):
+        """ rcvbuf/sndbuf: SO_RCVBUF/SO_SNDBUF do socket (padrão: os do sistema) """
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        set_socket_buffers(self.socket, rcvbuf, sndbuf)
         self.socket.bind(('0.0.0.0', local_port))
         self.remote_addr = remote_addr
         self.channel = UnreliableChannel(**channel_params)
         self.received_data = []
         self.is_running = True
-        self.thread = threading.Thread(target=self._receive_loop)
+        self.pump = ReceivePump(self.socket, self._on_datagrams, BUFFER_SIZE, "RDT2.0-RECEIVER")
         log_info(f"Receiver iniciado na porta {local_port}", "RDT2.0")
 
     def start(self):
-        self.thread.start()
+        self.pump.start()
 
-    def _receive_loop(self):
-        while self.is_running:
-            try:
-                # Remove o timeout para esperar indefinidamente
-                self.socket.settimeout(None) 
-                raw_packet, addr = self.socket.recvfrom(BUFFER_SIZE)
-                
-                packet = RDTPacket.from_bytes(raw_packet)
-                
-                if packet is None:
-                    log_info("Pacote inválido recebido. Ignorando.", "RDT2.0-RECEIVER")
-                    continue
+    def _on_datagrams(self, datagrams):
+        """ Lote de datagramas lidos pela ReceivePump: as respostas (ACK/NAK) de todos saem juntas ao final """
+        responses = []
+        for raw_packet, addr in datagrams:
+            packet = RDTPacket.from_bytes(raw_packet)
+            
+            if packet is None:
+                log_info("Pacote inválido recebido. Ignorando.", "RDT2.0-RECEIVER")
+                continue
+            
+            if packet.is_corrupt():
+                log_info("Pacote DATA corrompido. Enviando NAK.", "RDT2.0-RECEIVER")
+                responses.append(self._nak_packet())
+            else:
+                log_info("Pacote DATA recebido corretamente. Entregando dados.", "RDT2.0-RECEIVER")
+                # Entregar dados para a aplicação (cópia: packet.data aponta para o buffer de recepção)
+                self.received_data.append(bytes(packet.data))
                 
-                if packet.is_corrupt():
-                    log_info("Pacote DATA corrompido. Enviando NAK.", "RDT2.0-RECEIVER")
-                    self._send_nak()
-                else:
-                    log_info("Pacote DATA recebido corretamente. Entregando dados.", "RDT2.0-RECEIVER")
-                    # Entregar dados para a aplicação
-                    self.received_data.append(packet.data)
-                    
-                    # Enviar ACK
-                    self._send_ack()
-                    
-            except Exception as e:
-                if self.is_running:
-                    log_error(f"Erro no loop de recepção: {e}", "RDT2.0-RECEIVER")
+                # Enviar ACK
+                responses.append(self._ack_packet())
+        for raw in responses:
+            self.channel.send(raw, self.socket, self.remote_addr)
 
-    def _send_ack(self):
-        """ Envia um pacote ACK (sem dados) """
-        ack_packet = RDTPacket(TYPE_ACK, 0)
-        self.channel.send(ack_packet.to_bytes(), self.socket, self.remote_addr)
+    def _ack_packet(self):
+        """ Pacote ACK (sem dados) """
+        return RDTPacket(TYPE_ACK, 0).to_bytes()
 
-    def _send_nak(self):
-        """ Envia um pacote NAK (sem dados) """
-        nak_packet = RDTPacket(TYPE_NAK, 0)
-        self.channel.send(nak_packet.to_bytes(), self.socket, self.remote_addr)
+    def _nak_packet(self):
+        """ Pacote NAK (sem dados) """
+        return RDTPacket(TYPE_NAK, 0).to_bytes()
 
     def get_received_data(self):
         return self.received_data
 
     def close(self):
         self.is_running = False
-        # Cria um socket temporário para desbloquear o recvfrom
-        temp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        temp_socket.sendto(b'stop', ('127.0.0.1', self.socket.getsockname()[1]))
-        temp_socket.close()
-        self.thread.join()
+        self.pump.stop()
         self.socket.close()
         log_info("Receiver encerrado.", "RDT2.0")
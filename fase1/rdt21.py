@@ -1,17 +1,19 @@
 import socket
-import threading
 import time
 from utils.packet import RDTPacket, TYPE_DATA, TYPE_ACK, TYPE_NAK
 from utils.simulator import UnreliableChannel
 from utils.logger import log_info, log_error
+from utils.receive_pump import ReceivePump, set_socket_buffers
 
 # Constantes
 BUFFER_SIZE = 1024
 TIMEOUT = 1.0 # Timeout em segundos
 
 class RDT21Sender:
-    def __init__(self, local_port, remote_addr, channel_params):
+    def __init__(self, local_port, remote_addr, channel_params, rcvbuf=None, sndbuf=None):
+        """ rcvbuf/sndbuf: SO_RCVBUF/SO_SNDBUF do socket (padrão: os do sistema) """
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        set_socket_buffers(self.socket, rcvbuf, sndbuf)
         self.socket.bind(('0.0.0.0', local_port))
         self.remote_addr = remote_addr
         self.channel = UnreliableChannel(**channel_params)
@@ -77,72 +79,66 @@ class RDT21Sender:
         log_info("Sender encerrado.", "RDT2.1")
 
 class RDT21Receiver:
-    def __init__(self, local_port, remote_addr, channel_params):
+    def __init__(self, local_port, remote_addr, channel_params, rcvbuf=None, sndbuf=None):
+        """ rcvbuf/sndbuf: SO_RCVBUF/SO_SNDBUF do socket (padrão: os do sistema) """
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        set_socket_buffers(self.socket, rcvbuf, sndbuf)
         self.socket.bind(('0.0.0.0', local_port))
         self.remote_addr = remote_addr
         self.channel = UnreliableChannel(**channel_params)
         self.expected_seq_num = 0 # Próximo número de sequência esperado (0 ou 1)
         self.received_data = []
         self.is_running = True
-        self.thread = threading.Thread(target=self._receive_loop)
+        self.pump = ReceivePump(self.socket, self._on_datagrams, BUFFER_SIZE, "RDT2.1-RECEIVER")
         log_info(f"Receiver iniciado na porta {local_port}", "RDT2.1")
 
     def start(self):
-        self.thread.start()
+        self.pump.start()
 
-    def _receive_loop(self):
-        while self.is_running:
-            try:
-                self.socket.settimeout(None) 
-                raw_packet, addr = self.socket.recvfrom(BUFFER_SIZE)
-                
-                packet = RDTPacket.from_bytes(raw_packet)
+    def _on_datagrams(self, datagrams):
+        """ Lote de datagramas lidos pela ReceivePump: os ACKs de todos saem juntos ao final """
+        acks = []
+        for raw_packet, addr in datagrams:
+            packet = RDTPacket.from_bytes(raw_packet)
+            
+            if packet is None:
+                log_info("Pacote inválido recebido. Ignorando.", "RDT2.1-RECEIVER")
+                continue
+            
+            if packet.is_corrupt():
+                log_info("Pacote DATA corrompido. Reenviando ACK do último pacote correto.", "RDT2.1-RECEIVER")
+                # Envia ACK do pacote anterior (1 - expected_seq_num)
+                acks.append(self._ack_packet(1 - self.expected_seq_num))
+            
+            elif packet.seq_num == self.expected_seq_num:
+                log_info(f"Pacote DATA({packet.seq_num}) recebido corretamente. Entregando dados.", "RDT2.1-RECEIVER")
+                # 1. Entregar dados para a aplicação
+                self.received_data.append(bytes(packet.data))
                 
-                if packet is None:
-                    log_info("Pacote inválido recebido. Ignorando.", "RDT2.1-RECEIVER")
-                    continue
+                # 2. Enviar ACK com o número de sequência esperado
+                acks.append(self._ack_packet(self.expected_seq_num))
                 
-                if packet.is_corrupt():
-                    log_info("Pacote DATA corrompido. Reenviando ACK do último pacote correto.", "RDT2.1-RECEIVER")
-                    # Envia ACK do pacote anterior (1 - expected_seq_num)
-                    self._send_ack(1 - self.expected_seq_num)
+                # 3. Alternar número esperado
+                self.expected_seq_num = 1 - self.expected_seq_num
                 
-                elif packet.seq_num == self.expected_seq_num:
-                    log_info(f"Pacote DATA({packet.seq_num}) recebido corretamente. Entregando dados.", "RDT2.1-RECEIVER")
-                    # 1. Entregar dados para a aplicação
-                    self.received_data.append(packet.data)
-                    
-                    # 2. Enviar ACK com o número de sequência esperado
-                    self._send_ack(self.expected_seq_num)
-                    
-                    # 3. Alternar número esperado
-                    self.expected_seq_num = 1 - self.expected_seq_num
-                    
-                else:
-                    # Pacote duplicado (número de sequência incorreto)
-                    log_info(f"Pacote DATA({packet.seq_num}) duplicado/fora de ordem. Descartando e reenviando ACK do último pacote correto.", "RDT2.1-RECEIVER")
-                    # Reenvia ACK do pacote anterior (1 - expected_seq_num)
-                    self._send_ack(1 - self.expected_seq_num)
-                    
-            except Exception as e:
-                if self.is_running:
-                    log_error(f"Erro no loop de recepção: {e}", "RDT2.1-RECEIVER")
+            else:
+                # Pacote duplicado (número de sequência incorreto)
+                log_info(f"Pacote DATA({packet.seq_num}) duplicado/fora de ordem. Descartando e reenviando ACK do último pacote correto.", "RDT2.1-RECEIVER")
+                # Reenvia ACK do pacote anterior (1 - expected_seq_num)
+                acks.append(self._ack_packet(1 - self.expected_seq_num))
+        for raw in acks:
+            self.channel.send(raw, self.socket, self.remote_addr)
 
-    def _send_ack(self, seq_num):
-        """ Envia um pacote ACK com o número de sequência """
-        ack_packet = RDTPacket(TYPE_ACK, seq_num)
-        self.channel.send(ack_packet.to_bytes(), self.socket, self.remote_addr)
+    def _ack_packet(self, seq_num):
+        """ Pacote ACK com o número de sequência """
+        return RDTPacket(TYPE_ACK, seq_num).to_bytes()
 
     def get_received_data(self):
         return self.received_data
 
     def close(self):
         self.is_running = False
-        temp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        temp_socket.sendto(b'stop', ('127.0.0.1', self.socket.getsockname()[1]))
-        temp_socket.close()
-        self.thread.join()
+        self.pump.stop()
         self.socket.close()
         log_info("Receiver encerrado.", "RDT2.1")
 
@@ -1,33 +1,70 @@
 import socket
 import threading
-import time
+from collections import deque
+from concurrent.futures import Future
 from utils.packet import RDTPacket, TYPE_DATA, TYPE_ACK
-from utils.logger import log_info, log_error
+from utils.logger import log_info
 from utils.simulator import UnreliableChannel
+from utils.timing_wheel import default_wheel
+from utils.receive_pump import ReceivePump, set_socket_buffers
 
 # Constantes
 BUFFER_SIZE = 1024
 TIMEOUT = 2.0 # Timeout em segundos (conforme especificação)
 
-class RDT30Sender:
-    def __init__(self, local_port, remote_addr, channel_params):
-        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        self.socket.bind(('0.0.0.0', local_port))
-        self.remote_addr = remote_addr
-        self.channel = UnreliableChannel(**channel_params)
+class StopAndWaitSender:
+    """ Metade emissora do rdt3.0 (bit alternante, fila de mensagens com Future e timer de retransmissão), comum ao
+        RDT30Sender e às sessões do rdt_mux. As subclasses montam (_make_packet) e transmitem (_udt_send) os pacotes """
+
+    def _init_sender(self, timers):
         self.seq_num = 0 # Próximo número de sequência a ser usado (0 ou 1)
         self.last_packet = None
+        self.current_future = None # Future do pacote em trânsito (last_packet)
+        self.send_queue = deque() # (dados, Future) aguardando o pacote em trânsito ser confirmado
         self.retransmission_count = 0
-        self.timer = None
+        self.timers = timers
+        self.timer = None # TimerHandle do timeout do pacote atual
         self.lock = threading.Lock()
         self.is_running = True
-        log_info(f"Sender iniciado na porta {local_port}", "RDT3.0")
+
+    def rdt_send(self, data):
+        """ Envia dados da aplicação, implementando Stop-and-Wait com alternância de SeqNum e Timer.
+            Bloqueia até o ACK (ou até as mensagens enfileiradas antes desta serem confirmadas) """
+        self.rdt_send_async(data).result()
+
+    def rdt_send_async(self, data):
+        """ Enfileira os dados e retorna imediatamente um concurrent.futures.Future, resolvido (com None) pelo loop de
+            recepção quando o ACK chega. As mensagens são enviadas uma a uma, na ordem das chamadas; o próximo pacote
+            sai assim que o ACK do anterior é recebido. Em código asyncio: await asyncio.wrap_future(future) """
+        future = Future()
+        with self.lock:
+            if not self.is_running:
+                raise Exception(f"{self._closed_message()}.")
+            self.send_queue.append((data, future))
+            if self.last_packet is None:
+                self._send_next()
+        return future
+
+    def _send_next(self):
+        """ Envia o próximo pacote da fila, se houver (chamado com o lock adquirido e nenhum pacote em trânsito).
+            Mensagens cujo Future foi cancelado antes do envio são descartadas """
+        while self.send_queue:
+            data, future = self.send_queue.popleft()
+            if not future.set_running_or_notify_cancel():
+                continue
+            # 1. Criar pacote com o número de sequência atual
+            packet = self._make_packet(data)
+            self.last_packet = packet
+            self.current_future = future
+            # 2. Enviar pacote e iniciar timer (a confirmação chega pelo loop de recepção)
+            self._udt_send(packet)
+            self._start_timer()
+            return
 
     def _start_timer(self):
         if self.timer:
             self.timer.cancel()
-        self.timer = threading.Timer(TIMEOUT, self._handle_timeout)
-        self.timer.start()
+        self.timer = self.timers.schedule(TIMEOUT, self._handle_timeout)
 
     def _stop_timer(self):
         if self.timer:
@@ -36,161 +73,182 @@ class RDT30Sender:
 
     def _handle_timeout(self):
         with self.lock:
-            if not self.is_running:
-                return
-            log_info(f"Timeout! Retransmitindo pacote DATA({self.last_packet.seq_num}).", "RDT3.0-SENDER")
+            if not self.is_running or self.last_packet is None:
+                return # Encerrado, ou o ACK chegou enquanto o timer disparava
+            self._log_timeout(self.last_packet)
             self.retransmission_count += 1
             # Retransmite o último pacote e reinicia o timer
             self._udt_send(self.last_packet)
             self._start_timer()
 
-    def _receive_ack_loop(self):
-        while self.is_running:
-            try:
-                # O timeout do socket é usado para o timer, mas o loop de recepção deve ser contínuo
-                self.socket.settimeout(None) 
-                raw_response, _ = self.socket.recvfrom(BUFFER_SIZE)
-                
+    def _ack_received(self):
+        """ ACK do pacote atual (chamado com o lock adquirido): alterna o número de sequência e envia o próximo da
+            fila. Retorna o Future confirmado, a ser resolvido fora do lock (callbacks podem chamar rdt_send_async()) """
+        self._stop_timer()
+        self.last_packet = None
+        self.seq_num = 1 - self.seq_num
+        confirmed = self.current_future
+        self.current_future = None
+        self._send_next()
+        return confirmed
+
+    def _abort(self):
+        """ Encerra a metade emissora: mensagens não confirmadas falham (quem espera em rdt_send() ou no Future é
+            liberado) """
+        with self.lock:
+            self.is_running = False
+            self._stop_timer()
+            unconfirmed = [future for _, future in self.send_queue]
+            if self.current_future is not None:
+                unconfirmed.append(self.current_future)
+            self.send_queue.clear()
+            self.current_future = None
+            self.last_packet = None
+        for future in unconfirmed:
+            if not future.done():
+                future.set_exception(Exception(f"{self._closed_message()} antes da confirmação."))
+
+    def _make_packet(self, data):
+        """ Pacote DATA com o número de sequência atual """
+        raise NotImplementedError
+
+    def _udt_send(self, packet):
+        """ Envia o pacote através do canal não confiável """
+        raise NotImplementedError
+
+    def _log_timeout(self, packet):
+        raise NotImplementedError
+
+    def _closed_message(self):
+        """ Erro de quem envia depois do encerramento (ou tinha mensagens não confirmadas) """
+        raise NotImplementedError
+
+class RDT30Sender(StopAndWaitSender):
+    def __init__(self, local_port, remote_addr, channel_params, timers=None, rcvbuf=None, sndbuf=None):
+        """ timers: TimingWheel dos timeouts (padrão: o wheel compartilhado do processo). rcvbuf/sndbuf:
+            SO_RCVBUF/SO_SNDBUF do socket (padrão: os do sistema) """
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        set_socket_buffers(self.socket, rcvbuf, sndbuf)
+        self.socket.bind(('0.0.0.0', local_port))
+        self.remote_addr = remote_addr
+        self.channel = UnreliableChannel(**channel_params)
+        self._init_sender(timers or default_wheel())
+        self.pump = ReceivePump(self.socket, self._on_acks, BUFFER_SIZE, "RDT3.0-SENDER")
+        log_info(f"Sender iniciado na porta {local_port}", "RDT3.0")
+
+    def _on_acks(self, datagrams):
+        """ Lote de respostas lido pela ReceivePump, processado com uma única aquisição do lock """
+        confirmed = []
+        with self.lock:
+            for raw_response, _ in datagrams:
                 response_packet = RDTPacket.from_bytes(raw_response)
                 
-                if response_packet is None:
+                if response_packet is None or not self.last_packet:
+                    continue # Inválido, ou não há pacote para confirmar
+                    
+                # 1. Verifica corrupção ou tipo incorreto
+                if response_packet.is_corrupt() or response_packet.type != TYPE_ACK:
+                    # ACK corrompido ou NAK (rdt3.0 usa apenas ACK)
+                    log_info("ACK corrompido/tipo incorreto. Ignorando.", "RDT3.0-SENDER")
                     continue
                 
-                # Processamento do ACK
-                with self.lock:
-                    if not self.last_packet:
-                        continue # Não há pacote para confirmar
-                        
-                    # 1. Verifica corrupção ou tipo incorreto
-                    if response_packet.is_corrupt() or response_packet.type != TYPE_ACK:
-                        # ACK corrompido ou NAK (rdt3.0 usa apenas ACK)
-                        log_info("ACK corrompido/tipo incorreto. Ignorando.", "RDT3.0-SENDER")
-                        continue
+                # 2. Verifica número de sequência
+                if response_packet.seq_num == self.seq_num:
+                    # ACK correto para o pacote atual
+                    log_info(f"Recebido ACK({self.seq_num}). Parando timer.", "RDT3.0-SENDER")
+                    confirmed.append(self._ack_received())
                     
-                    # 2. Verifica número de sequência
-                    if response_packet.seq_num == self.seq_num:
-                        # ACK correto para o pacote atual
-                        log_info(f"Recebido ACK({self.seq_num}). Parando timer.", "RDT3.0-SENDER")
-                        self._stop_timer()
-                        # Sinaliza que o pacote foi confirmado
-                        self.last_packet = None 
-                        
-                    else:
-                        # ACK duplicado ou fora de ordem (para o pacote anterior)
-                        log_info(f"Recebido ACK({response_packet.seq_num}) inesperado. Ignorando.", "RDT3.0-SENDER")
-                        # Não faz nada, o timer continua rodando para o pacote atual
-                        
-            except Exception as e:
-                if self.is_running:
-                    log_error(f"Erro no loop de recepção: {e}", "RDT3.0-SENDER")
-
-    def rdt_send(self, data):
-        """ Envia dados da aplicação, implementando Stop-and-Wait com alternância de SeqNum e Timer """
-        
-        # 1. Criar pacote com o número de sequência atual
-        packet = RDTPacket(TYPE_DATA, self.seq_num, data)
+                else:
+                    # ACK duplicado ou fora de ordem (para o pacote anterior)
+                    # Não faz nada, o timer continua rodando para o pacote atual
+                    log_info(f"Recebido ACK({response_packet.seq_num}) inesperado. Ignorando.", "RDT3.0-SENDER")
         
-        with self.lock:
-            self.last_packet = packet
-            
-            # 2. Enviar pacote e iniciar timer
-            self._udt_send(packet)
-            self._start_timer()
-            
-        # 3. Aguardar confirmação (o loop de recepção em thread fará isso)
-        while True:
-            with self.lock:
-                if self.last_packet is None:
-                    # Pacote confirmado, alternar número de sequência e sair
-                    self.seq_num = 1 - self.seq_num
-                    break
-            time.sleep(0.01) # Pequena pausa para evitar busy-waiting
+        # Fora do lock: callbacks do Future podem chamar rdt_send_async()
+        for future in confirmed:
+            future.set_result(None)
+
+    def _make_packet(self, data):
+        return RDTPacket(TYPE_DATA, self.seq_num, data)
 
     def _udt_send(self, packet):
         """ Envia o pacote através do canal não confiável (simulador) """
         self.channel.send(packet.to_bytes(), self.socket, self.remote_addr)
 
+    def _log_timeout(self, packet):
+        log_info(f"Timeout! Retransmitindo pacote DATA({packet.seq_num}).", "RDT3.0-SENDER")
+
+    def _closed_message(self):
+        return "Sender encerrado"
+
     def start(self):
-        self.thread = threading.Thread(target=self._receive_ack_loop)
-        self.thread.start()
+        self.pump.start()
 
     def close(self):
-        self.is_running = False
-        self._stop_timer()
-        # Desbloqueia o recvfrom
-        temp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        temp_socket.sendto(b'stop', ('127.0.0.1', self.socket.getsockname()[1]))
-        temp_socket.close()
-        self.thread.join()
+        self._abort()
+        self.pump.stop()
         self.socket.close()
         log_info("Sender encerrado.", "RDT3.0")
 
 class RDT30Receiver:
-    def __init__(self, local_port, remote_addr, channel_params):
+    def __init__(self, local_port, remote_addr, channel_params, rcvbuf=None, sndbuf=None):
+        """ rcvbuf/sndbuf: SO_RCVBUF/SO_SNDBUF do socket (padrão: os do sistema) """
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        set_socket_buffers(self.socket, rcvbuf, sndbuf)
         self.socket.bind(('0.0.0.0', local_port))
         self.remote_addr = remote_addr
         self.channel = UnreliableChannel(**channel_params)
         self.expected_seq_num = 0 # Próximo número de sequência esperado (0 ou 1)
         self.received_data = []
         self.is_running = True
-        self.thread = threading.Thread(target=self._receive_loop)
+        self.pump = ReceivePump(self.socket, self._on_datagrams, BUFFER_SIZE, "RDT3.0-RECEIVER")
         log_info(f"Receiver iniciado na porta {local_port}", "RDT3.0")
 
     def start(self):
-        self.thread.start()
+        self.pump.start()
 
-    def _receive_loop(self):
-        while self.is_running:
-            try:
-                self.socket.settimeout(None) 
-                raw_packet, addr = self.socket.recvfrom(BUFFER_SIZE)
-                
-                packet = RDTPacket.from_bytes(raw_packet)
+    def _on_datagrams(self, datagrams):
+        """ Lote de datagramas lidos pela ReceivePump: os ACKs de todos saem juntos ao final """
+        acks = []
+        for raw_packet, addr in datagrams:
+            packet = RDTPacket.from_bytes(raw_packet)
+            
+            if packet is None:
+                continue
+            
+            if packet.is_corrupt():
+                log_info("Pacote DATA corrompido. Ignorando e reenviando ACK do último pacote correto.", "RDT3.0-RECEIVER")
+                # Reenvia ACK do pacote anterior (1 - expected_seq_num)
+                acks.append(self._ack_packet(1 - self.expected_seq_num))
+            
+            elif packet.seq_num == self.expected_seq_num:
+                log_info(f"Pacote DATA({packet.seq_num}) recebido corretamente. Entregando dados.", "RDT3.0-RECEIVER")
+                # 1. Entregar dados para a aplicação
+                self.received_data.append(bytes(packet.data))
                 
-                if packet is None:
-                    continue
+                # 2. Enviar ACK com o número de sequência esperado
+                acks.append(self._ack_packet(self.expected_seq_num))
                 
-                if packet.is_corrupt():
-                    log_info("Pacote DATA corrompido. Ignorando e reenviando ACK do último pacote correto.", "RDT3.0-RECEIVER")
-                    # Reenvia ACK do pacote anterior (1 - expected_seq_num)
-                    self._send_ack(1 - self.expected_seq_num)
+                # 3. Alternar número esperado
+                self.expected_seq_num = 1 - self.expected_seq_num
                 
-                elif packet.seq_num == self.expected_seq_num:
-                    log_info(f"Pacote DATA({packet.seq_num}) recebido corretamente. Entregando dados.", "RDT3.0-RECEIVER")
-                    # 1. Entregar dados para a aplicação
-                    self.received_data.append(packet.data)
-                    
-                    # 2. Enviar ACK com o número de sequência esperado
-                    self._send_ack(self.expected_seq_num)
-                    
-                    # 3. Alternar número esperado
-                    self.expected_seq_num = 1 - self.expected_seq_num
-                    
-                else:
-                    # Pacote duplicado (número de sequência incorreto)
-                    log_info(f"Pacote DATA({packet.seq_num}) duplicado/fora de ordem. Descartando e reenviando ACK do último pacote correto.", "RDT3.0-RECEIVER")
-                    # Reenvia ACK do pacote anterior (1 - expected_seq_num)
-                    self._send_ack(1 - self.expected_seq_num)
-                    
-            except Exception as e:
-                if self.is_running:
-                    log_error(f"Erro no loop de recepção: {e}", "RDT3.0-RECEIVER")
-
-    def _send_ack(self, seq_num):
-        """ Envia um pacote ACK com o número de sequência """
-        ack_packet = RDTPacket(TYPE_ACK, seq_num)
-        self.channel.send(ack_packet.to_bytes(), self.socket, self.remote_addr)
+            else:
+                # Pacote duplicado (número de sequência incorreto)
+                log_info(f"Pacote DATA({packet.seq_num}) duplicado/fora de ordem. Descartando e reenviando ACK do último pacote correto.", "RDT3.0-RECEIVER")
+                # Reenvia ACK do pacote anterior (1 - expected_seq_num)
+                acks.append(self._ack_packet(1 - self.expected_seq_num))
+        for raw in acks:
+            self.channel.send(raw, self.socket, self.remote_addr)
+
+    def _ack_packet(self, seq_num):
+        """ Pacote ACK com o número de sequência """
+        return RDTPacket(TYPE_ACK, seq_num).to_bytes()
 
     def get_received_data(self):
         return self.received_data
 
     def close(self):
         self.is_running = False
-        temp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        temp_socket.sendto(b'stop', ('127.0.0.1', self.socket.getsockname()[1]))
-        temp_socket.close()
-        self.thread.join()
+        self.pump.stop()
         self.socket.close()
         log_info("Receiver encerrado.", "RDT3.0")
 
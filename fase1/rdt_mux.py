@@ -0,0 +1,184 @@
+import socket
+import threading
+from fase1.rdt30 import StopAndWaitSender
+from utils.packet import RDTSessionPacket, TYPE_DATA, TYPE_ACK
+from utils.logger import log_info, log_warning, log_debug
+from utils.simulator import UnreliableChannel
+from utils.timing_wheel import default_wheel
+from utils.receive_pump import ReceivePump, set_socket_buffers, sendto_waiting
+
+# Várias sessões stop-and-wait em uma única porta UDP. Cada pacote leva o ID da sessão (RDTSessionPacket) e um único
+# socket com uma única thread de recepção despacha os pacotes para o estado da sessão, identificada por
+# (endereço do peer, ID). As sessões seguem o rdt3.0 (bit alternante, ACK com número de sequência e timeout, que
+# também cobre a corrupção do rdt2.x) e seus timers ficam no TimingWheel compartilhado: nenhuma sessão tem socket
+# ou thread próprios.
+
+BUFFER_SIZE = 65535
+RCVBUF_SIZE = 1 << 20 # Rajadas de milhares de sessões chegam de uma vez ao mesmo socket
+MAX_SESSIONS = 65536 # Sessões abertas por peers (DATA com ID desconhecido) além deste limite são descartadas
+
+class RDTMuxSession(StopAndWaitSender):
+    """ Uma sessão do RDTMuxEndpoint: metade emissora (a do RDT30Sender, com rdt_send/rdt_send_async) e metade
+        receptora (como o RDT30Receiver, com received_data). Os pacotes chegam pela thread do endpoint """
+
+    def __init__(self, endpoint, remote_addr, session_id):
+        self.endpoint = endpoint
+        self.remote_addr = remote_addr
+        self.session_id = session_id
+        # Emissor (o lock também protege a metade receptora)
+        self._init_sender(endpoint.timers)
+        # Receptor
+        self.expected_seq_num = 0 # Próximo número de sequência esperado (0 ou 1)
+        self.received_data = []
+
+    def _make_packet(self, data):
+        return RDTSessionPacket(self.session_id, TYPE_DATA, self.seq_num, data)
+
+    def _udt_send(self, packet):
+        self.endpoint._udt_send(packet, self.remote_addr)
+
+    def _log_timeout(self, packet):
+        log_debug(f"Sessão {self.session_id}: timeout, retransmitindo DATA({packet.seq_num}).", "RDT-MUX")
+
+    def _closed_message(self):
+        return f"Sessão {self.session_id} encerrada"
+
+    def _handle_ack(self, packet):
+        with self.lock:
+            if self.last_packet is None or packet.seq_num != self.seq_num:
+                return # ACK duplicado ou do pacote anterior: o timer continua para o atual
+            confirmed = self._ack_received()
+        # Fora do lock: callbacks do Future podem chamar rdt_send_async()
+        confirmed.set_result(None)
+
+    def _handle_data(self, packet, acks):
+        """ Entrega o DATA e acrescenta o ACK a acks (enviados pelo endpoint ao final do lote); retorna os dados
+            entregues (None se duplicado) """
+        with self.lock:
+            if packet.seq_num == self.expected_seq_num:
+                delivered = bytes(packet.data) # O datagrama é um slot do pool, reusado após o lote
+                self.received_data.append(delivered)
+                ack_num = self.expected_seq_num
+                self.expected_seq_num = 1 - self.expected_seq_num
+            else:
+                # Duplicado (o ACK anterior se perdeu): confirma de novo o último pacote correto
+                delivered = None
+                ack_num = 1 - self.expected_seq_num
+        acks.append((RDTSessionPacket(self.session_id, TYPE_ACK, ack_num), self.remote_addr))
+        return delivered
+
+    def get_received_data(self):
+        return self.received_data
+
+class RDTMuxEndpoint:
+    """ Ponto de multiplexação: um socket UDP e uma thread de recepção para qualquer número de sessões.
+        open_session() cria sessões para enviar a um peer; DATA com um ID ainda desconhecido abre a sessão do lado
+        receptor (on_receive(sessão, dados) é chamado a cada mensagem entregue, na thread de recepção).
+        channel_params=None envia direto pelo socket, sem o simulador """
+
+    def __init__(self, local_port, channel_params=None, timers=None, on_receive=None, max_sessions=MAX_SESSIONS,
+                 rcvbuf=RCVBUF_SIZE, sndbuf=None):
+        """ rcvbuf/sndbuf: SO_RCVBUF/SO_SNDBUF do socket (sndbuf padrão: o do sistema) """
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        set_socket_buffers(self.socket, rcvbuf, sndbuf)
+        self.socket.bind(('0.0.0.0', local_port))
+        self.port = self.socket.getsockname()[1]
+        self.channel = UnreliableChannel(**channel_params) if channel_params is not None else None
+        self.timers = timers or default_wheel()
+        self.on_receive = on_receive
+        self.max_sessions = max_sessions
+        self.sessions = {} # {(endereço do peer, ID): RDTMuxSession}
+        self.sessions_lock = threading.Lock()
+        self.next_session_id = 1
+        self.rejected_sessions = 0
+        self.is_running = True
+        self.pump = ReceivePump(self.socket, self._on_datagrams, BUFFER_SIZE, "RDT-MUX", daemon=True)
+        log_info(f"Endpoint de sessões iniciado na porta {self.port}", "RDT-MUX")
+
+    def start(self):
+        self.pump.start()
+
+    def open_session(self, remote_addr, session_id=None):
+        """ Nova sessão com o peer em remote_addr; sem session_id, usa o próximo ID livre para esse peer """
+        with self.sessions_lock:
+            if session_id is None:
+                while (remote_addr, self.next_session_id) in self.sessions:
+                    self.next_session_id += 1
+                session_id = self.next_session_id
+                self.next_session_id += 1
+            elif (remote_addr, session_id) in self.sessions:
+                raise ValueError(f"Sessão {session_id} com {remote_addr} já existe.")
+            session = RDTMuxSession(self, remote_addr, session_id)
+            self.sessions[(remote_addr, session_id)] = session
+        return session
+
+    def _accept_session(self, addr, session_id):
+        """ Sessão aberta pelo peer (primeiro DATA com este ID) """
+        with self.sessions_lock:
+            session = self.sessions.get((addr, session_id))
+            if session is None:
+                if len(self.sessions) >= self.max_sessions:
+                    self.rejected_sessions += 1
+                    return None
+                session = RDTMuxSession(self, addr, session_id)
+                self.sessions[(addr, session_id)] = session
+        return session
+
+    def _on_datagrams(self, datagrams):
+        """ Lote de datagramas lidos pela ReceivePump: os ACKs de todas as sessões saem juntos ao final, e só depois
+            on_receive é chamado para as mensagens entregues """
+        acks = []
+        delivered = []
+        for raw_packet, addr in datagrams:
+            packet = RDTSessionPacket.from_bytes(raw_packet)
+            if packet is None:
+                continue
+            if packet.is_corrupt():
+                # Nem o ID da sessão é confiável: o emissor retransmite no timeout
+                log_debug("Pacote corrompido. Descartando.", "RDT-MUX")
+                continue
+
+            session = self.sessions.get((addr, packet.session_id))
+            if packet.type == TYPE_ACK:
+                if session is not None:
+                    session._handle_ack(packet)
+            elif packet.type == TYPE_DATA:
+                if session is None:
+                    session = self._accept_session(addr, packet.session_id)
+                    if session is None:
+                        log_warning(f"Limite de {self.max_sessions} sessões atingido. DATA de {addr} "
+                                    f"descartado.", "RDT-MUX")
+                        continue
+                data = session._handle_data(packet, acks)
+                if data is not None:
+                    delivered.append((session, data))
+        for packet, addr in acks:
+            self._udt_send(packet, addr)
+        if self.on_receive is not None:
+            for session, data in delivered:
+                self.on_receive(session, data)
+
+    def _udt_send(self, packet, addr):
+        if self.channel:
+            self.channel.send(packet.to_bytes(), self.socket, addr)
+        else:
+            sendto_waiting(self.socket, packet.to_bytes(), addr)
+
+    def stats(self):
+        """ {'sessions', 'delivered', 'retransmissions', 'rejected_sessions'} somando todas as sessões """
+        with self.sessions_lock:
+            sessions = list(self.sessions.values())
+        return {'sessions': len(sessions),
+                'delivered': sum(len(session.received_data) for session in sessions),
+                'retransmissions': sum(session.retransmission_count for session in sessions),
+                'rejected_sessions': self.rejected_sessions}
+
+    def close(self):
+        self.is_running = False
+        with self.sessions_lock:
+            sessions = list(self.sessions.values())
+        for session in sessions:
+            session._abort()
+        self.pump.stop()
+        self.socket.close()
+        log_info(f"Endpoint encerrado ({len(sessions)} sessões).", "RDT-MUX")
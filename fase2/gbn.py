@@ -3,8 +3,13 @@ import threading
 import time
 import struct
 import hashlib
-from utils.logger import log_info, log_error
+from utils.logger import log_info
 from utils.simulator import UnreliableChannel
+from utils.timing_wheel import default_wheel
+from utils.fragmentation import Reassembler
+from utils.fec import FECEncoder, FECDecoder
+from utils.receive_pump import ReceivePump, set_socket_buffers
+from utils.profiling import stage, acquire, profiled
 
 BUFFER_SIZE = 65535
 TIMEOUT = 1.0
@@ -13,6 +18,8 @@ GBN_HEADER_FORMAT = '!B I I'
 GBN_HEADER_SIZE = struct.calcsize(GBN_HEADER_FORMAT)
 TYPE_DATA = 0
 TYPE_ACK = 1
+TYPE_PARITY = 2 # Paridade XOR de um bloco de pacotes de dados (FEC); seq_num é o primeiro seq do bloco
+RECEIVER_RCVBUF = 262144
 
 
 class GBNPacket:
@@ -22,14 +29,18 @@ class GBNPacket:
         self.data = data
         self.checksum = self._calc_checksum()
 
+    @profiled('packet.checksum')
     def _calc_checksum(self):
-        header = struct.pack('!B I', self.type, self.seq_num)
-        return int(hashlib.md5(header + self.data).hexdigest(), 16) & 0xFFFFFFFF
+        digest = hashlib.md5(struct.pack('!B I', self.type, self.seq_num))
+        digest.update(self.data) # Sem concatenar: data pode ser um memoryview do buffer de recepção
+        return int(digest.hexdigest(), 16) & 0xFFFFFFFF
 
+    @profiled('packet.encode')
     def to_bytes(self):
         self.checksum = self._calc_checksum()
         return struct.pack(GBN_HEADER_FORMAT, self.type, self.seq_num, self.checksum) + self.data
 
+    @profiled('packet.decode')
     @classmethod
     def from_bytes(cls, raw):
         if len(raw) < GBN_HEADER_SIZE:
@@ -43,8 +54,15 @@ class GBNPacket:
 
 
 class GBNSender:
-    def __init__(self, local_port, remote_addr, channel_params, window_size=5):
+    def __init__(self, local_port, remote_addr, channel_params, window_size=5, timers=None, fec_block=0,
+                 fec_adaptive=False, rcvbuf=None, sndbuf=None):
+        """ timers: TimingWheel do timer da base da janela (padrão: o wheel compartilhado do processo).
+            fec_block: envia uma paridade XOR a cada fec_block pacotes de dados (0: sem FEC); o bloco é limitado à
+            janela, senão o bloco de um pacote perdido não fecha antes do timeout. fec_adaptive: o bloco passa a
+            seguir a perda medida pelo receptor (utils/fec.py). rcvbuf/sndbuf: SO_RCVBUF/SO_SNDBUF do socket (padrão:
+            os do sistema) """
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        set_socket_buffers(self.socket, rcvbuf, sndbuf)
         self.socket.bind(('0.0.0.0', local_port))
         self.remote_addr = remote_addr
         self.channel = UnreliableChannel(**channel_params)
@@ -52,18 +70,21 @@ class GBNSender:
         self.nextseqnum = 0
         self.window_size = window_size
         self.send_buffer = {}
-        self.timer = None
+        self.timers = timers or default_wheel()
+        self.timer = None # TimerHandle do timeout da base (reiniciado a cada ACK)
         self.lock = threading.Lock()
         self.is_running = True
         self.retransmission_count = 0
-        self.thread = threading.Thread(target=self._recv_ack_loop)
-        log_info(f"Sender iniciado na porta {local_port} (Janela={self.window_size})", "GBN")
+        self.fec = FECEncoder(fec_block, fec_adaptive, max_block=window_size) if fec_block else None
+        self.pump = ReceivePump(self.socket, self._on_acks, BUFFER_SIZE, "GBN-SENDER")
+        log_info(f"Sender iniciado na porta {local_port} (Janela={self.window_size}"
+                 + (f", FEC=1/{self.fec.block_size}{' adaptativo' if fec_adaptive else ''})" if self.fec else ")"),
+                 "GBN")
 
     def _start_timer(self):
         if self.timer:
             self.timer.cancel()
-        self.timer = threading.Timer(TIMEOUT, self._timeout)
-        self.timer.start()
+        self.timer = self.timers.schedule(TIMEOUT, self._timeout)
 
     def _stop_timer(self):
         if self.timer:
@@ -71,146 +92,178 @@ class GBNSender:
             self.timer = None
 
     def _timeout(self):
-        with self.lock:
-            if not self.is_running:
-                return
+        with acquire(self.lock, 'gbn.lock_wait'):
+            if not self.is_running or self.base == self.nextseqnum:
+                return # Encerrado, ou tudo confirmado enquanto o timer disparava
             log_info(f"Timeout! Retransmitindo janela base={self.base}", "GBN-SENDER")
-            self.retransmission_count += (self.nextseqnum - self.base)
-            for seq in range(self.base, self.nextseqnum):
-                pkt = self.send_buffer.get(seq % SEQ_NUM_SPACE)
-                if pkt:
-                    self._udt_send(pkt)
-            self._start_timer()
-
-    def _recv_ack_loop(self):
-        while self.is_running:
-            try:
-                raw, _ = self.socket.recvfrom(65535)
+            with stage('gbn.retransmit'):
+                self.retransmission_count += (self.nextseqnum - self.base)
+                for seq in range(self.base, self.nextseqnum):
+                    pkt = self.send_buffer.get(seq % SEQ_NUM_SPACE)
+                    if pkt:
+                        self._udt_send(pkt)
+                self._start_timer()
+
+    def _on_acks(self, datagrams):
+        """ Lote de ACKs: processado com uma aquisição do lock; como o ACK é cumulativo, só o maior importa, e o timer
+            é reiniciado uma vez por lote """
+        acks = []
+        with stage('gbn.ack'):
+            for raw, _ in datagrams:
                 pkt = GBNPacket.from_bytes(raw)
-                if not pkt or pkt.is_corrupt or pkt.type != TYPE_ACK:
-                    continue
-                with self.lock:
-                    ack = pkt.seq_num
-                    if ack > self.base:
-                        log_info(f"ACK({ack}) recebido. Base {self.base} → {ack}", "GBN-SENDER")
-                        for s in range(self.base, ack):
-                            self.send_buffer.pop(s % SEQ_NUM_SPACE, None)
-                        self.base = ack
-                        if self.base == self.nextseqnum:
-                            self._stop_timer()
-                        else:
-                            self._start_timer()
-            except OSError as e:
-                if getattr(e, "winerror", None) == 10040:
-                    log_error("ACK maior que buffer do socket. Ignorado com segurança.", "GBN-SENDER")
-                    continue
+                if pkt and not pkt.is_corrupt and pkt.type == TYPE_ACK:
+                    acks.append(pkt)
+            if not acks:
+                return
+            with acquire(self.lock, 'gbn.lock_wait'):
+                if self.fec:
+                    self.fec.update_loss(acks[-1].data)
+                # ACKs além do que foi enviado são descartados (ex.: o receptor responde ACK(2^32 - 1) quando o
+                # primeiro pacote chega fora de ordem)
+                valid = [pkt.seq_num for pkt in acks if self.base < pkt.seq_num <= self.nextseqnum]
+                if not valid:
+                    return
+                ack = max(valid)
+                log_info(f"ACK({ack}) recebido. Base {self.base} → {ack}", "GBN-SENDER")
+                for s in range(self.base, ack):
+                    self.send_buffer.pop(s % SEQ_NUM_SPACE, None)
+                self.base = ack
+                if self.base == self.nextseqnum:
+                    self._stop_timer()
                 else:
-                    if self.is_running:
-                        log_error(f"Erro no loop de ACK: {e}", "GBN-SENDER")
-            except Exception as e:
-                if self.is_running:
-                    log_error(f"Erro no loop de ACK: {e}", "GBN-SENDER")
+                    self._start_timer()
 
     def rdt_send(self, data):
-        while True:
-            with self.lock:
-                if self.nextseqnum < self.base + self.window_size:
-                    break
-            time.sleep(0.01)
-        with self.lock:
-            seq = self.nextseqnum % SEQ_NUM_SPACE
-            pkt = GBNPacket(TYPE_DATA, seq, data)
-            self.send_buffer[seq] = pkt
-            self._udt_send(pkt)
-            if self.base == self.nextseqnum:
-                self._start_timer()
-            self.nextseqnum += 1
+        with stage('gbn.send'):
+            with stage('gbn.window_wait'):
+                while True:
+                    with acquire(self.lock, 'gbn.lock_wait'):
+                        if self.nextseqnum < self.base + self.window_size:
+                            break
+                    time.sleep(0.01)
+            with acquire(self.lock, 'gbn.lock_wait'):
+                seq = self.nextseqnum % SEQ_NUM_SPACE
+                pkt = GBNPacket(TYPE_DATA, seq, data)
+                self.send_buffer[seq] = pkt
+                self._udt_send(pkt)
+                if self.fec:
+                    block = self.fec.add(seq, data)
+                    if block:
+                        self._udt_send(GBNPacket(TYPE_PARITY, *block))
+                if self.base == self.nextseqnum:
+                    self._start_timer()
+                self.nextseqnum += 1
 
     def _udt_send(self, pkt):
         self.channel.send(pkt.to_bytes(), self.socket, self.remote_addr)
 
     def start(self):
-        self.thread.start()
+        self.pump.start()
 
     def close(self):
         self.is_running = False
         self._stop_timer()
-        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        s.sendto(b'stop', ('127.0.0.1', self.socket.getsockname()[1]))
-        s.close()
-        self.thread.join()
+        self.pump.stop()
         self.socket.close()
         log_info("Sender encerrado.", "GBN")
 
 
 class GBNReceiver:
-    def __init__(self, local_port, remote_addr, channel_params):
+    def __init__(self, local_port, remote_addr, channel_params, rcvbuf=RECEIVER_RCVBUF, sndbuf=None, recv_pool=True):
+        """ rcvbuf/sndbuf: SO_RCVBUF/SO_SNDBUF do socket (sndbuf padrão: o do sistema). recv_pool=False lê com
+            recvfrom() em vez dos buffers reutilizáveis do BufferPool (para comparação) """
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 262144)
+        set_socket_buffers(self.socket, rcvbuf, sndbuf)
         self.socket.bind(('0.0.0.0', local_port))
         self.remote_addr = remote_addr
         self.channel = UnreliableChannel(**channel_params)
         self.expected = 0
         self.received_data = []
+        self.reassembler = Reassembler() # Pacotes maiores que um datagrama chegam fragmentados pelo canal
+        # FEC: criado na primeira paridade recebida; a partir daí os pacotes fora de ordem são guardados para a
+        # reconstrução e entregues quando a lacuna antes deles é preenchida
+        self.fec = None
         self.lock = threading.Lock()
         self.is_running = True
-        self.thread = threading.Thread(target=self._recv_loop)
+        self.pump = ReceivePump(self.socket, self._on_datagrams, BUFFER_SIZE, "GBN-RECEIVER", pooled=recv_pool)
         log_info(f"Receiver iniciado na porta {local_port}", "GBN")
 
     def start(self):
-        self.thread.start()
+        self.pump.start()
 
-    def _recv_loop(self):
-        while self.is_running:
-            try:
-                raw, _ = self.socket.recvfrom(65535)
+    def _on_datagrams(self, datagrams):
+        """ Lote de datagramas: processado com uma aquisição do lock e confirmado com um único ACK cumulativo ao final
+            (o próximo esperado se algo foi entregue, senão o ACK anterior), como no GBNLoopReceiver. Os datagramas
+            são memoryviews dos slots da ReceivePump: payloads entregues ou guardados pelo FEC são copiados """
+        packets = []
+        for raw, addr in datagrams:
+            raw = self.reassembler.feed(raw, addr)
+            if raw is not None: # None: fragmento de uma mensagem ainda incompleta (ou descartada)
+                packets.append(raw)
+        if not packets:
+            return
 
-                # segurança: truncar pacotes fora do limite
-                if len(raw) > 65507:
-                    log_error(f"Pacote de {len(raw)} bytes truncado (acima do limite UDP).", "GBN-RECEIVER")
-                    raw = raw[:65507]
-
-                pkt = GBNPacket.from_bytes(raw)
-                if not pkt:
-                    continue
-
-                with self.lock:
+        with stage('gbn.deliver'):
+            delivered = False
+            unexpected = False
+            with acquire(self.lock, 'gbn.lock_wait'):
+                for raw in packets:
+                    pkt = GBNPacket.from_bytes(raw)
+                    if not pkt:
+                        continue
                     if pkt.is_corrupt:
                         log_info("Pacote corrompido, reenviando ACK anterior", "GBN-RECEIVER")
-                        self._send_ack((self.expected - 1) % SEQ_NUM_SPACE)
+                        unexpected = True
+                    elif pkt.type == TYPE_PARITY:
+                        if self.fec is None:
+                            log_info("Paridade recebida: FEC ativado", "GBN-RECEIVER")
+                            self.fec = FECDecoder()
+                        self.fec.add_parity(pkt.seq_num, bytes(pkt.data), self.expected)
+                        delivered |= self._deliver_buffered()
+                    elif self.fec is not None:
+                        self.fec.add_data(pkt.seq_num, bytes(pkt.data), self.expected)
+                        if self._deliver_buffered():
+                            delivered = True
+                        else:
+                            log_info(f"DATA({pkt.seq_num}) fora de ordem (guardado)", "GBN-RECEIVER")
+                            unexpected = True
                     elif pkt.seq_num == self.expected:
                         log_info(f"DATA({pkt.seq_num}) recebido corretamente", "GBN-RECEIVER")
-                        self.received_data.append(pkt.data)
+                        self.received_data.append(bytes(pkt.data))
                         self.expected += 1
-                        self._send_ack(self.expected)
+                        delivered = True
                     else:
                         log_info(f"DATA({pkt.seq_num}) fora de ordem", "GBN-RECEIVER")
-                        self._send_ack((self.expected - 1) % SEQ_NUM_SPACE)
-
-            except OSError as e:
-                if getattr(e, "winerror", None) == 10040:
-                    log_error("Pacote excedeu buffer do socket. Ignorado com segurança.", "GBN-RECEIVER")
-                    continue
+                        unexpected = True
+                if delivered:
+                    ack = self._ack_packet(self.expected)
+                elif unexpected:
+                    ack = self._ack_packet((self.expected - 1) % SEQ_NUM_SPACE)
                 else:
-                    if self.is_running:
-                        log_error(f"Erro no loop de recepção: {e}", "GBN-RECEIVER")
-            except Exception as e:
-                if self.is_running:
-                    log_error(f"Erro inesperado: {e}", "GBN-RECEIVER")
+                    return
+            self.channel.send(ack, self.socket, self.remote_addr)
+
+    def _deliver_buffered(self):
+        """ FEC: entrega em ordem o que já chegou ou foi recuperado a partir de expected """
+        delivered = False
+        while (data := self.fec.ready(self.expected)) is not None:
+            log_info(f"DATA({self.expected}) entregue", "GBN-RECEIVER")
+            self.received_data.append(data)
+            self.expected += 1
+            delivered = True
+        self.fec.prune(self.expected)
+        return delivered
 
-    def _send_ack(self, num):
-        ack = GBNPacket(TYPE_ACK, num)
-        self.channel.send(ack.to_bytes(), self.socket, self.remote_addr)
+    def _ack_packet(self, num):
+        # Com FEC, o ACK leva a perda medida (o emissor adaptativo ajusta o bloco)
+        return GBNPacket(TYPE_ACK, num, self.fec.loss_report() if self.fec else b'').to_bytes()
 
     def get_received_data(self):
         return self.received_data
 
     def close(self):
         self.is_running = False
-        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        s.sendto(b'stop', ('127.0.0.1', self.socket.getsockname()[1]))
-        s.close()
-        self.thread.join()
+        self.pump.stop()
         self.socket.close()
         log_info("Receiver encerrado.", "GBN")
    
\ No newline at end of file
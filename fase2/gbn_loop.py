@@ -0,0 +1,286 @@
+import socket
+from collections import deque
+from concurrent.futures import Future
+from fase2.gbn import GBNPacket, TIMEOUT, SEQ_NUM_SPACE, TYPE_DATA, TYPE_ACK, BUFFER_SIZE, RECEIVER_RCVBUF
+from utils.logger import log_info, log_error, log_debug
+from utils.simulator import UnreliableChannel
+from utils.selector_loop import default_loop
+from utils.fragmentation import Reassembler
+from utils.receive_pump import set_socket_buffers
+from utils.buffer_pool import BufferPool
+from utils.profiling import stage
+
+# Go-Back-N em um SelectorLoop: emissor e receptor com sockets não bloqueantes, timers no heap do loop e o canal
+# simulado agendando as entregas no próprio loop (send_on_loop), sem threads por pacote. Todo o estado do protocolo
+# é tocado só pela thread do loop, então não há locks no caminho dos dados; as chamadas da aplicação (rdt_send,
+# flush, close) entram pela fila de call_soon_threadsafe e esperam um Future. Cada datagrama é lido com
+# recvfrom_into() em um slot do BufferPool e processado antes da próxima leitura, então um slot basta.
+# Mesmo protocolo e formato de pacote do fase2/gbn.py.
+
+RECV_BATCH = 64 # Datagramas lidos por evento de leitura antes de voltar ao loop (timers e submissões não esperam)
+
+class GBNLoopSender:
+    """ Mesma interface do GBNSender: rdt_send() bloqueia enquanto a janela está cheia. flush() espera todos os
+        pacotes enviados serem confirmados """
+
+    def __init__(self, local_port, remote_addr, channel_params, window_size=5, loop=None, rcvbuf=None, sndbuf=None):
+        """ loop: SelectorLoop do emissor (padrão: o loop compartilhado do processo); channel_params=None envia direto
+            pelo socket, sem o simulador. rcvbuf/sndbuf: SO_RCVBUF/SO_SNDBUF do socket (padrão: os do sistema) """
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        set_socket_buffers(self.socket, rcvbuf, sndbuf)
+        self.socket.bind(('0.0.0.0', local_port))
+        self.socket.setblocking(False)
+        self.remote_addr = remote_addr
+        self.channel = UnreliableChannel(**channel_params) if channel_params is not None else None
+        self.loop = loop or default_loop()
+        self.pool = BufferPool(BUFFER_SIZE, 1)
+        self.base = 0
+        self.nextseqnum = 0
+        self.window_size = window_size
+        self.send_buffer = {}
+        self.pending = deque() # (dados, Future) esperando espaço na janela
+        self.flush_waiters = []
+        self.timer = None # LoopTimer do timeout da base
+        self.timer_deadline = None # Prazo atual do timeout (None: parado); o LoopTimer é reagendado só quando dispara
+        self.is_running = True
+        self.retransmission_count = 0
+        log_info(f"Sender (loop) iniciado na porta {local_port} (Janela={self.window_size})", "GBN")
+
+    def start(self):
+        self.loop.call_soon_threadsafe(self.loop.add_reader, self.socket, self._on_readable)
+
+    def _call(self, callback, *args):
+        """ callback(*args, future) na thread do loop; retorna o Future que ele resolve """
+        if self.loop.in_loop_thread():
+            raise RuntimeError("Chamada bloqueante na thread do loop.")
+        future = Future()
+        self.loop.call_soon_threadsafe(callback, *args, future)
+        return future
+
+    def rdt_send(self, data):
+        self._call(self._submit, data).result()
+
+    def flush(self, timeout=None):
+        """ Bloqueia até todos os pacotes enviados serem confirmados """
+        self._call(self._add_flush_waiter).result(timeout)
+
+    # --- Thread do loop ---
+
+    def _submit(self, data, future):
+        if not self.is_running:
+            future.set_exception(Exception("Sender encerrado."))
+            return
+        self.pending.append((data, future))
+        self._fill_window()
+
+    def _fill_window(self):
+        while self.pending and self.nextseqnum < self.base + self.window_size:
+            data, future = self.pending.popleft()
+            if not future.set_running_or_notify_cancel():
+                continue
+            with stage('gbn.send'):
+                seq = self.nextseqnum % SEQ_NUM_SPACE
+                pkt = GBNPacket(TYPE_DATA, seq, data)
+                self.send_buffer[seq] = pkt
+                self._udt_send(pkt)
+                if self.base == self.nextseqnum:
+                    self._start_timer()
+                self.nextseqnum += 1
+            future.set_result(None)
+
+    def _add_flush_waiter(self, future):
+        if self.base == self.nextseqnum and not self.pending:
+            future.set_result(None)
+        else:
+            self.flush_waiters.append(future)
+
+    def _start_timer(self):
+        self.timer_deadline = self.loop.clock() + TIMEOUT
+        if self.timer is None:
+            self.timer = self.loop.call_later(TIMEOUT, self._on_timer)
+
+    def _stop_timer(self):
+        self.timer_deadline = None
+
+    def _on_timer(self):
+        # Reiniciar o timer a cada ACK só move o prazo; o LoopTimer é reagendado aqui se o prazo mudou
+        self.timer = None
+        if self.timer_deadline is None or not self.is_running:
+            return
+        remaining = self.timer_deadline - self.loop.clock()
+        if remaining > 0:
+            self.timer = self.loop.call_later(remaining, self._on_timer)
+            return
+        self._timeout()
+
+    def _timeout(self):
+        if self.base == self.nextseqnum:
+            self._stop_timer()
+            return
+        log_info(f"Timeout! Retransmitindo janela base={self.base}", "GBN-SENDER")
+        with stage('gbn.retransmit'):
+            self.retransmission_count += (self.nextseqnum - self.base)
+            for seq in range(self.base, self.nextseqnum):
+                pkt = self.send_buffer.get(seq % SEQ_NUM_SPACE)
+                if pkt:
+                    self._udt_send(pkt)
+            self._start_timer()
+
+    def _on_readable(self):
+        acked = False
+        for _ in range(RECV_BATCH):
+            slot = self.pool.acquire()
+            try:
+                raw, _ = slot.recvfrom(self.socket)
+            except BlockingIOError:
+                slot.release()
+                break
+            except OSError as e:
+                slot.release()
+                if self.is_running:
+                    log_error(f"Erro no loop de ACK: {e}", "GBN-SENDER")
+                break
+            with stage('gbn.ack'):
+                pkt = GBNPacket.from_bytes(raw)
+                slot.release() # Só o número de sequência é usado
+                if not pkt or pkt.is_corrupt or pkt.type != TYPE_ACK:
+                    continue
+                ack = pkt.seq_num
+                # ACKs além do que foi enviado são descartados, como no GBNSender
+                if self.base < ack <= self.nextseqnum:
+                    log_debug(f"ACK({ack}) recebido. Base {self.base} → {ack}", "GBN-SENDER")
+                    for s in range(self.base, ack):
+                        self.send_buffer.pop(s % SEQ_NUM_SPACE, None)
+                    self.base = ack
+                    acked = True
+        if not acked:
+            return
+        # Um reinício do timer e um preenchimento da janela por lote de ACKs
+        if self.base == self.nextseqnum:
+            self._stop_timer()
+        else:
+            self._start_timer()
+        self._fill_window()
+        if self.flush_waiters and self.base == self.nextseqnum and not self.pending:
+            for future in self.flush_waiters:
+                future.set_result(None)
+            self.flush_waiters = []
+
+    def _udt_send(self, pkt):
+        raw = pkt.to_bytes()
+        if self.channel:
+            self.channel.send_on_loop(raw, self.socket, self.remote_addr, self.loop)
+        else:
+            try:
+                self.socket.sendto(raw, self.remote_addr)
+            except BlockingIOError:
+                pass # Buffer do socket cheio: tratado como perda (o timeout retransmite)
+
+    def _shutdown(self, future):
+        self.is_running = False
+        self._stop_timer()
+        self.loop.remove_reader(self.socket)
+        error = Exception("Sender encerrado antes do envio.")
+        for _, waiting in self.pending:
+            if not waiting.done():
+                waiting.set_exception(error)
+        self.pending.clear()
+        for waiter in self.flush_waiters:
+            waiter.set_exception(Exception("Sender encerrado antes da confirmação."))
+        self.flush_waiters = []
+        future.set_result(None)
+
+    def close(self):
+        self._call(self._shutdown).result()
+        self.socket.close()
+        log_info("Sender (loop) encerrado.", "GBN")
+
+class GBNLoopReceiver:
+    """ Mesma interface do GBNReceiver; os pacotes de um lote de leitura são confirmados com um único ACK
+        cumulativo """
+
+    def __init__(self, local_port, remote_addr, channel_params, loop=None, rcvbuf=RECEIVER_RCVBUF, sndbuf=None):
+        """ rcvbuf/sndbuf: SO_RCVBUF/SO_SNDBUF do socket (sndbuf padrão: o do sistema) """
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        set_socket_buffers(self.socket, rcvbuf, sndbuf)
+        self.socket.bind(('0.0.0.0', local_port))
+        self.socket.setblocking(False)
+        self.remote_addr = remote_addr
+        self.channel = UnreliableChannel(**channel_params) if channel_params is not None else None
+        self.loop = loop or default_loop()
+        self.expected = 0
+        self.received_data = []
+        self.reassembler = Reassembler()
+        self.pool = BufferPool(BUFFER_SIZE, 1)
+        self.is_running = True
+        log_info(f"Receiver (loop) iniciado na porta {local_port}", "GBN")
+
+    def start(self):
+        self.loop.call_soon_threadsafe(self.loop.add_reader, self.socket, self._on_readable)
+
+    def _on_readable(self):
+        in_order = False
+        unexpected = False
+        for _ in range(RECV_BATCH):
+            slot = self.pool.acquire()
+            try:
+                raw, addr = slot.recvfrom(self.socket)
+            except BlockingIOError:
+                slot.release()
+                break
+            except OSError as e:
+                slot.release()
+                if self.is_running:
+                    log_error(f"Erro no loop de recepção: {e}", "GBN-RECEIVER")
+                break
+            try:
+                raw = self.reassembler.feed(raw, addr)
+                if raw is None:
+                    continue
+                with stage('gbn.deliver'):
+                    pkt = GBNPacket.from_bytes(raw)
+                    if not pkt:
+                        continue
+                    if pkt.is_corrupt:
+                        log_debug("Pacote corrompido", "GBN-RECEIVER")
+                        unexpected = True
+                    elif pkt.seq_num == self.expected % SEQ_NUM_SPACE:
+                        log_debug(f"DATA({pkt.seq_num}) recebido corretamente", "GBN-RECEIVER")
+                        self.received_data.append(bytes(pkt.data))
+                        self.expected += 1
+                        in_order = True
+                    else:
+                        log_debug(f"DATA({pkt.seq_num}) fora de ordem", "GBN-RECEIVER")
+                        unexpected = True
+            finally:
+                slot.release() # Entregue (copiado) ou descartado
+        # Os mesmos ACKs do GBNReceiver: o próximo esperado se algo foi entregue, senão o ACK anterior
+        if in_order:
+            self._send_ack(self.expected % SEQ_NUM_SPACE)
+        elif unexpected:
+            self._send_ack((self.expected - 1) % SEQ_NUM_SPACE)
+
+    def _send_ack(self, num):
+        raw = GBNPacket(TYPE_ACK, num).to_bytes()
+        if self.channel:
+            self.channel.send_on_loop(raw, self.socket, self.remote_addr, self.loop)
+        else:
+            try:
+                self.socket.sendto(raw, self.remote_addr)
+            except BlockingIOError:
+                pass
+
+    def get_received_data(self):
+        return self.received_data
+
+    def _shutdown(self, future):
+        self.is_running = False
+        self.loop.remove_reader(self.socket)
+        future.set_result(None)
+
+    def close(self):
+        future = Future()
+        self.loop.call_soon_threadsafe(self._shutdown, future)
+        future.result()
+        self.socket.close()
+        log_info("Receiver (loop) encerrado.", "GBN")
@@ -0,0 +1,468 @@
+import os
+import asyncio
+import socket
+from utils.packet import TCPSegment, is_flag_set, SYN_BIT, ACK_BIT
+from utils.simulator import UnreliableChannel
+from utils.logger import log_info, log_error, log_debug, log_warning
+from fase3.tcp_socket import (
+    TCPConnection, UDP_RCVBUF_FACTOR, DEFAULT_BACKLOG, CLOSE_POLL_INTERVAL, SYN_RCVD_TIMEOUT, CONNECT_TIMEOUT,
+    STATE_CLOSED, STATE_LISTEN, STATE_SYN_RCVD, STATE_ESTABLISHED, STATE_CLOSE_WAIT, PEER_SENDING_STATES,
+    connection_params, fastopen_cookie,
+)
+
+# Versão asyncio do SimpleTCPSocket: a mesma máquina de estados (TCPConnection), executada no event loop.
+# Um único socket UDP por endpoint, sem threads; timers com loop.call_at.
+
+class _TCPEndpoint(asyncio.DatagramProtocol):
+    """ Socket UDP no event loop: demultiplexa segmentos para as conexões pelo endereço do peer """
+
+    def __init__(self, channel, server=None):
+        self.channel = channel
+        self.server = server # TCPServer que recebe SYNs de peers desconhecidos (None: endpoint de cliente)
+        self.connections = {} # {(ip, porta): AsyncTCPConnection}
+        self.transport = None
+        self.loop = asyncio.get_running_loop()
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, raw_segment, addr):
+        segment = TCPSegment.from_bytes(raw_segment)
+        if segment is None or segment.is_corrupt():
+            log_info("Segmento corrompido ou inválido. Descartando.", "TCP-RECEIVER")
+            return
+
+        conn = self.connections.get(addr)
+        if conn is not None:
+            conn._process_segment(segment, addr)
+        elif self.server is not None:
+            conn = self.server._handle_listen_segment(segment, addr)
+        if conn is not None:
+            conn._flush() # Respostas (ACKs, SYN-ACK) montadas pela máquina de estados
+
+    def error_received(self, exc):
+        log_debug(f"Erro no socket UDP: {exc}", "TCP-RECEIVER")
+
+    def sendto(self, raw_segment, addr):
+        if self.transport is None or self.transport.is_closing():
+            return
+        if self.channel:
+            self.channel.send_on_loop(raw_segment, self.transport, addr, self.loop)
+        else:
+            self.transport.sendto(raw_segment, addr)
+
+    def close(self):
+        if self.transport is not None:
+            self.transport.close()
+
+async def _create_endpoint(host, port, channel_params, recv_buffer_size, server=None, num_connections=1):
+    """ Cria o socket UDP (com SO_RCVBUF dimensionado como no SimpleTCPSocket) e o registra no loop.
+        Um endpoint de servidor recebe as janelas de até num_connections conexões no mesmo buffer do kernel
+        (o valor é limitado por net.core.rmem_max) """
+    loop = asyncio.get_running_loop()
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind((host, port))
+    kernel_rcvbuf = recv_buffer_size * UDP_RCVBUF_FACTOR * num_connections
+    if kernel_rcvbuf > sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF):
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, kernel_rcvbuf)
+
+    channel = UnreliableChannel(**channel_params) if channel_params else None
+    _, endpoint = await loop.create_datagram_endpoint(lambda: _TCPEndpoint(channel, server), sock=sock)
+    return endpoint
+
+
+class AsyncTCPConnection(TCPConnection):
+    """ Conexão no event loop: a máquina de estados é a do SimpleTCPSocket (TCPConnection); aqui ficam só a E/S pelo
+        endpoint, os timers (loop.call_at) e a espera das corrotinas. Os locks da máquina de estados nunca são
+        disputados: tudo roda na thread do loop """
+
+    def __init__(self, endpoint, peer_address, listener=None, **params):
+        self.endpoint = endpoint
+        self.loop = endpoint.loop
+        self.listener = listener # TCPServer dono da conexão (None: conexão de cliente com endpoint próprio)
+        self.port = endpoint.transport.get_extra_info('sockname')[1]
+        self._init_connection(**params)
+        self.peer_address = peer_address
+
+        # Timers (asyncio.TimerHandle): próximo prazo da conexão e verificação periódica durante close()
+        self.service_pending = False # _run_service() já agendado com call_soon
+        self.wakeup_handle = None
+        self.close_handle = None
+
+        # Sinalização para as corrotinas da aplicação
+        self.handshake_done = self.loop.create_future()
+        self.readable = asyncio.Event() # Dados ou EOF disponíveis
+        self.writable = asyncio.Event() # Espaço no buffer de envio
+        self.writable.set()
+        self.closed = asyncio.Event()
+        self.released = asyncio.Event() # Fim do TIME_WAIT: o endereço saiu do endpoint
+
+    # --- Transporte ---
+
+    def _flush(self):
+        while self.tx_queue:
+            self.endpoint.sendto(self.tx_queue.popleft(), self.peer_address)
+
+    def _wake_sender(self):
+        if self.is_running and not self.service_pending:
+            self.service_pending = True
+            self.loop.call_soon(self._run_service)
+
+    def _run_service(self):
+        self.service_pending = False
+        if not self.is_running:
+            return
+        ack_due = self._service()
+        if ack_due is not None:
+            self._arm_wakeup(ack_due)
+
+    def _arm_wakeup(self, delay):
+        """Mantém o timer já armado se ele vence antes (um despertar antecipado só recalcula os prazos)"""
+        if not self.is_running:
+            return
+        when = self.loop.time() + delay
+        if self.wakeup_handle is not None:
+            if self.wakeup_handle.when() <= when:
+                return
+            self.wakeup_handle.cancel()
+        self.wakeup_handle = self.loop.call_at(when, self._on_wakeup)
+
+    def _on_wakeup(self):
+        self.wakeup_handle = None
+        self._run_service()
+
+    def _notify_readers(self):
+        self.readable.set()
+
+    def _notify_writers(self):
+        self.writable.set()
+
+    def _handshake_completed(self):
+        if not self.handshake_done.done():
+            self.handshake_done.set_result(True)
+
+    def _close_completed(self):
+        self.closed.set() # Em TIME_WAIT a conexão já terminou para a aplicação; o endpoint ainda responde a FINs
+        if not self.handshake_done.done():
+            self.handshake_done.set_exception(ConnectionError("Conexão abortada."))
+            self.handshake_done.exception() # Evita aviso de exceção não recuperada
+        if self.state == STATE_CLOSED:
+            self._release()
+
+    def _shutdown(self):
+        self._release()
+
+    def _release(self):
+        """Cancela timers, acorda a aplicação e devolve o endereço ao endpoint"""
+        if not self.is_running:
+            return
+        self.is_running = False
+        for handle in (self.wakeup_handle, self.close_handle):
+            if handle is not None:
+                handle.cancel()
+        self.wakeup_handle = self.close_handle = None
+        self.readable.set()
+        self.writable.set()
+        self.closed.set()
+        self.released.set()
+        if self.listener is not None:
+            self.listener._connection_closed(self)
+        else:
+            self.endpoint.close()
+
+    def _close_watchdog(self):
+        """Progresso do peer durante close() (ver TCPConnection._close_stalled())"""
+        self.close_handle = None
+        if self.closed.is_set():
+            return
+        if self._close_stalled():
+            self._release()
+        else:
+            self.close_handle = self.loop.call_later(CLOSE_POLL_INTERVAL, self._close_watchdog)
+
+    # --- API usada por TCPStreamReader/TCPStreamWriter ---
+
+    async def connect(self, data=b''):
+        syn_data = self._start_connect(self.peer_address, data)
+        try:
+            await asyncio.wait_for(asyncio.shield(self.handshake_done), CONNECT_TIMEOUT)
+        except asyncio.TimeoutError:
+            with self.send_lock:
+                self._abort(None)
+            raise TimeoutError("Timeout no handshake de conexão.")
+        log_info(f"Conexão estabelecida com {self.peer_address}. Estado: {self.state}", "TCP-CLIENT")
+        if len(data) > len(syn_data):
+            self.write(data[len(syn_data):])
+
+    async def read_some(self, n):
+        """Até n bytes; b'' no fim da conexão"""
+        while True:
+            while (not self.decoded and not self.recv_buffer and self.is_running
+                   and self.state in PEER_SENDING_STATES):
+                self.readable.clear()
+                await self.readable.wait()
+            if not self.decoded and not self.recv_buffer and self.aborted:
+                raise ConnectionResetError("Conexão abortada.")
+            try:
+                with self.recv_lock:
+                    eof = self._at_eof()
+                    data = self._read(n)
+            except ValueError as e:
+                raise self._decode_failed(e) from e
+            self._flush()
+            # Com compressão, bytes que só completam parte de um quadro não retornam nada: espera o resto
+            if data or eof:
+                return data
+
+    def write(self, data):
+        # Conexão aceita no SYN (fast open): os dados esperam no buffer pelo ACK final do handshake
+        fastopen_pending = self.state == STATE_SYN_RCVD and self.fastopen_accepted
+        if self.closing or (self.state not in (STATE_ESTABLISHED, STATE_CLOSE_WAIT) and not fastopen_pending):
+            raise ConnectionError("Conexão não estabelecida ou em encerramento.")
+        if data:
+            with self.send_lock:
+                self.send_buffer.append(bytes(data))
+                self.send_buffered += len(data)
+            self._wake_sender()
+
+    async def drain(self):
+        """Espera até o buffer de envio voltar ao limite send_buffer_size"""
+        while self.send_buffered and self._send_space() == 0 and self.is_running and not self.aborted:
+            self.writable.clear()
+            await self.writable.wait()
+        if self.aborted:
+            raise ConnectionResetError("Conexão abortada.")
+
+    def close(self):
+        if self.closing or self.state == STATE_CLOSED:
+            return
+        if self.state == STATE_SYN_RCVD and self.fastopen_accepted:
+            # O FIN espera o ACK final do handshake (como em SimpleTCPSocket.close())
+            self.handshake_done.add_done_callback(lambda _: self.close())
+        elif self._begin_close():
+            self.close_handle = self.loop.call_later(CLOSE_POLL_INTERVAL, self._close_watchdog)
+        else:
+            with self.send_lock:
+                self._abort(None)
+
+class TCPStreamReader:
+    """ Leitura no estilo asyncio.StreamReader """
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    async def read(self, n=-1):
+        """Até n bytes (n=-1: tudo até o fim da conexão)"""
+        if n >= 0:
+            return await self._conn.read_some(n)
+        chunks = []
+        while True:
+            data = await self._conn.read_some(self._conn.recv_buffer.capacity)
+            if not data:
+                return b''.join(chunks)
+            chunks.append(data)
+
+    async def readexactly(self, n):
+        chunks = []
+        remaining = n
+        while remaining:
+            data = await self._conn.read_some(remaining)
+            if not data:
+                raise asyncio.IncompleteReadError(b''.join(chunks), n)
+            chunks.append(data)
+            remaining -= len(data)
+        return b''.join(chunks)
+
+    def at_eof(self):
+        conn = self._conn
+        return (not conn.decoded and not conn.recv_buffer
+                and (not conn.is_running or conn.state not in PEER_SENDING_STATES))
+
+class TCPStreamWriter:
+    """ Escrita no estilo asyncio.StreamWriter """
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    @property
+    def connection(self):
+        return self._conn
+
+    def get_extra_info(self, name, default=None):
+        if name == 'peername':
+            return self._conn.peer_address
+        if name == 'sockname':
+            return ('0.0.0.0', self._conn.port)
+        return default
+
+    def write(self, data):
+        self._conn.write(data)
+
+    async def drain(self):
+        await self._conn.drain()
+
+    def is_closing(self):
+        return self._conn.closing or self._conn.state == STATE_CLOSED
+
+    def close(self):
+        self._conn.close()
+
+    async def wait_closed(self):
+        await self._conn.closed.wait()
+
+class TCPServer:
+    """ Socket de escuta: um endpoint UDP compartilhado por todas as conexões aceitas """
+
+    def __init__(self, client_connected_cb, backlog, socket_params):
+        self.client_connected_cb = client_connected_cb
+        self.backlog = backlog
+        self.socket_params = socket_params
+        self.endpoint = None
+        self.port = None
+        self.syn_queue = {} # Conexões em SYN_RCVD {(ip, porta): AsyncTCPConnection}
+        # Chave dos cookies de fast open emitidos por este servidor
+        self.fastopen_key = os.urandom(16) if socket_params['fast_open'] else None
+        self.tasks = set() # Handlers em execução
+        self._closed = asyncio.Event()
+
+    @property
+    def connections(self):
+        return self.endpoint.connections
+
+    def _fastopen_cookie(self, addr):
+        """Cookie do servidor para o IP do cliente"""
+        return fastopen_cookie(self.fastopen_key, addr)
+
+    def _handle_listen_segment(self, segment, addr):
+        """SYN de um peer novo: cria a conexão, se houver espaço no backlog (retorna a conexão, ou None)"""
+        if self._closed.is_set() or not is_flag_set(segment.flags, SYN_BIT) or is_flag_set(segment.flags, ACK_BIT):
+            return None
+        if len(self.syn_queue) >= self.backlog:
+            log_warning(f"Backlog cheio ({self.backlog}). SYN de {addr} descartado.", "TCP-SERVER")
+            return None
+
+        conn = AsyncTCPConnection(self.endpoint, addr, listener=self, **self.socket_params)
+        conn.state = STATE_LISTEN # O SYN recebido leva a conexão para SYN_RCVD
+        self.endpoint.connections[addr] = conn
+        self.syn_queue[addr] = conn
+        self.endpoint.loop.call_later(SYN_RCVD_TIMEOUT, self._syn_rcvd_timeout, conn)
+        conn._process_segment(segment, addr)
+        return conn
+
+    def _syn_rcvd_timeout(self, conn):
+        """Descarta a conexão meio-aberta que não completou o handshake"""
+        if self.syn_queue.get(conn.peer_address) is not conn:
+            return
+        log_warning(f"Handshake com {conn.peer_address} não completou. Descartando.", "TCP-SERVER")
+        with conn.send_lock:
+            conn._abort(None)
+
+    def _connection_established(self, conn):
+        """Handshake completo: entrega a conexão ao callback da aplicação em uma nova task"""
+        if self.syn_queue.pop(conn.peer_address, None) is not conn:
+            return
+        task = asyncio.ensure_future(self._run_client(conn))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def _run_client(self, conn):
+        writer = TCPStreamWriter(conn)
+        try:
+            await self.client_connected_cb(TCPStreamReader(conn), writer)
+        except Exception as e:
+            log_error(f"Erro no handler de {conn.peer_address}: {e}", "TCP-SERVER")
+            writer.close()
+
+    def _connection_closed(self, conn):
+        if self.endpoint.connections.get(conn.peer_address) is conn:
+            del self.endpoint.connections[conn.peer_address]
+        if self.syn_queue.get(conn.peer_address) is conn:
+            del self.syn_queue[conn.peer_address]
+
+    def close(self):
+        """Para de aceitar conexões; o socket UDP é liberado quando as conexões abertas terminarem"""
+        self._closed.set()
+
+    async def wait_closed(self):
+        await self._closed.wait()
+        while self.endpoint.connections:
+            await asyncio.gather(*(conn.released.wait() for conn in list(self.endpoint.connections.values())))
+        self.endpoint.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.close()
+        await self.wait_closed()
+
+async def start_server(client_connected_cb, host='0.0.0.0', port=0, channel_params=None, backlog=DEFAULT_BACKLOG,
+                       **params):
+    """ Equivalente a asyncio.start_server: client_connected_cb(reader, writer) roda para cada conexão.
+        params: os mesmos parâmetros de conexão do SimpleTCPSocket (recv_buffer_size, nodelay, mss, fast_open,
+        compression, ...) """
+    socket_params = connection_params(**params)
+    server = TCPServer(client_connected_cb, backlog, socket_params)
+    server.endpoint = await _create_endpoint(host, port, channel_params, socket_params['recv_buffer_size'],
+                                             server=server, num_connections=backlog)
+    server.port = server.endpoint.transport.get_extra_info('sockname')[1]
+    log_info(f"Escutando na porta {server.port}. Estado: {STATE_LISTEN}", "TCP-SERVER")
+    return server
+
+async def _resolve(host, port):
+    """Endereço numérico de (host, port): os segmentos do servidor chegam dele, então é ele (e não o nome) a chave
+    da conexão no endpoint. Um endereço já numérico não passa pelo executor do getaddrinfo"""
+    try:
+        socket.inet_pton(socket.AF_INET, host)
+        return (host, port)
+    except OSError:
+        pass
+    infos = await asyncio.get_running_loop().getaddrinfo(host, port, family=socket.AF_INET, type=socket.SOCK_DGRAM)
+    return infos[0][4][:2]
+
+async def open_connection(host, port, channel_params=None, data=b'', **params):
+    """ Equivalente a asyncio.open_connection: retorna (reader, writer) após o three-way handshake.
+        data é enviado como em SimpleTCPSocket.connect() (com fast_open e cookie em cache, já no SYN);
+        params: os mesmos parâmetros de conexão de start_server() """
+    socket_params = connection_params(**params)
+    peer_address = await _resolve(host, port)
+    endpoint = await _create_endpoint('0.0.0.0', 0, channel_params, socket_params['recv_buffer_size'])
+    conn = AsyncTCPConnection(endpoint, peer_address, **socket_params)
+    endpoint.connections[peer_address] = conn
+    await conn.connect(data)
+    return TCPStreamReader(conn), TCPStreamWriter(conn)
+
+# --- Aplicações de Exemplo ---
+
+async def tcp_server_example(port, channel_params=None, num_clients=1):
+    done = asyncio.Event()
+    results = []
+
+    async def handle_client(reader, writer):
+        data = await reader.read()
+        log_info(f"Recebidos {len(data)} bytes de {writer.get_extra_info('peername')}.", "APP-SERVER")
+        results.append(data)
+        writer.close()
+        await writer.wait_closed()
+        if len(results) == num_clients:
+            done.set()
+
+    async with await start_server(handle_client, port=port, channel_params=channel_params):
+        await done.wait()
+    return results
+
+async def tcp_client_example(dest_addr, data, channel_params=None):
+    reader, writer = await open_connection(*dest_addr, channel_params=channel_params)
+    writer.write(data)
+    await writer.drain()
+    writer.close()
+    await writer.wait_closed()
+
+if __name__ == '__main__':
+    async def main():
+        server_task = asyncio.ensure_future(tcp_server_example(17010))
+        await asyncio.sleep(0.1)
+        await tcp_client_example(('127.0.0.1', 17010), b'x' * 10240)
+        print(f"Recebido: {[len(d) for d in await server_task]}")
+
+    asyncio.run(main())
@@ -1,23 +1,16 @@
-import time
-import random
 from fase3.tcp_socket import SimpleTCPSocket
 from utils.logger import log_info, log_error
 
-def tcp_client_app(dest_addr, data_to_send, channel_params=None):
-    client_port = random.randint(10000, 20000)
-    client = SimpleTCPSocket(client_port, channel_params)
+def tcp_client_app(dest_addr, data_to_send, channel_params=None, fast_open=False):
+    """ Envia data_to_send e encerra a conexão. Com fast_open, a partir da segunda conexão com o mesmo servidor
+        os dados começam a ir no SYN (cookie em cache) """
+    # Porta 0: o sistema operacional escolhe uma porta efêmera livre
+    client = SimpleTCPSocket(0, channel_params, fast_open=fast_open)
     try:
-        log_info(f"Tentando conectar a {dest_addr}...", "APP-CLIENTE")
-        client.connect(dest_addr)
-        log_info(f"Conexão estabelecida. Enviando {len(data_to_send)} bytes.", "APP-CLIENTE")
+        log_info(f"Tentando conectar a {dest_addr} e enviar {len(data_to_send)} bytes...", "APP-CLIENTE")
+        client.connect(dest_addr, data_to_send)
         
-        # Envia dados
-        client.send(data_to_send)
-        
-        # Espera um pouco para garantir que os dados foram enviados
-        time.sleep(2)
-        
-        # Encerra a conexão
+        # close() envia o FIN depois dos dados pendentes e espera o encerramento (não é preciso esperar antes)
         client.close()
         
     except Exception as e:
@@ -25,9 +18,9 @@ def tcp_client_app(dest_addr, data_to_send, channel_params=None):
     finally:
         client.close()
 
-# Removido bloco de teste
+if __name__ == '__main__':
     SERVER_PORT = 17000
-    SERVER_ADDR = ('192.168.0.166', SERVER_PORT)
+    SERVER_ADDR = ('127.0.0.1', SERVER_PORT)
     
     # Canal perfeito para teste
     CHANNEL_CONFIG = {'loss_rate': 0.0, 'corrupt_rate': 0.0, 'delay_range': (0.0, 0.0)}
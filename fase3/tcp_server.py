@@ -1,44 +1,60 @@
-import time
+import threading
 from fase3.tcp_socket import SimpleTCPSocket, MSS
-from utils.logger import log_info, log_error
+from utils.logger import log_info, log_error, log_debug
 
-def tcp_server_app(port, channel_params=None):
-    server = SimpleTCPSocket(port, channel_params)
+def handle_client(conn):
+    """ Recebe dados de uma conexão aceita até o cliente encerrar o envio """
+    log_info(f"Conexão estabelecida com {conn.peer_address}", "APP-SERVER")
+    received_data = b''
     try:
-        server.listen()
-        log_info(f"Servidor escutando na porta {port}...", "APP-SERVER")
-        
-        # Aceita a conexão (bloqueante)
-        conn = server.accept()
-        log_info(f"Conexão estabelecida com {conn.peer_address}", "APP-SERVER")
-        
-        # Recebe dados
-        received_data = b''
         while True:
             data = conn.recv(MSS)
             if not data:
-                # Se a conexão estiver fechada e não houver mais dados
-                if conn.state in ['CLOSE_WAIT', 'CLOSED']:
-                    break
-                # Pequena pausa para evitar loop de CPU
-                time.sleep(0.01)
-                continue
+                # recv() retorna b'' quando o peer envia FIN e o buffer está vazio
+                break
                 
             received_data += data
-            log_info(f"Recebido {len(data)} bytes. Total: {len(received_data)}", "APP-SERVER")
+            log_debug(f"Recebido {len(data)} bytes de {conn.peer_address}. Total: {len(received_data)}", "APP-SERVER")
             
-        log_info(f"Transferência concluída. Total de dados recebidos: {len(received_data)} bytes.", "APP-SERVER")
+        log_info(f"Transferência concluída. Total de dados recebidos de {conn.peer_address}: {len(received_data)} bytes.", "APP-SERVER")
         
+    except Exception as e:
+        log_error(f"Erro com {conn.peer_address}: {e}", "APP-SERVER")
+    finally:
         # Encerra a conexão
         conn.close()
+    return received_data
+
+def tcp_server_app(port, channel_params=None, num_clients=1, fast_open=False):
+    """ Aceita num_clients conexões, cada uma atendida em sua própria thread (com fast_open, clientes com cookie
+        são aceitos já no SYN). Retorna os dados recebidos (uma lista, na ordem de accept, se num_clients > 1) """
+    server = SimpleTCPSocket(port, channel_params, fast_open=fast_open)
+    results = [b''] * num_clients
+    try:
+        server.listen()
+        log_info(f"Servidor escutando na porta {port}...", "APP-SERVER")
+        
+        def worker(index, conn):
+            results[index] = handle_client(conn)
+        
+        threads = []
+        for i in range(num_clients):
+            # Aceita a conexão (bloqueante)
+            conn = server.accept()
+            thread = threading.Thread(target=worker, args=(i, conn), daemon=True)
+            thread.start()
+            threads.append(thread)
+            
+        for thread in threads:
+            thread.join()
         
     except Exception as e:
         log_error(f"Erro: {e}", "APP-SERVER")
     finally:
         server.close()
-        return received_data
+    return results[0] if num_clients == 1 else results
 
-# Removido bloco de teste
+if __name__ == '__main__':
     SERVER_PORT = 17000
     
     # Canal perfeito para teste
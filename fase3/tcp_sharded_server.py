@@ -0,0 +1,209 @@
+import os
+import queue
+import signal
+import threading
+import time
+import multiprocessing
+from fase3.tcp_socket import SimpleTCPSocket
+from utils.logger import log_info, log_error, log_warning
+
+# Servidor em vários processos: cada worker tem seu próprio SimpleTCPSocket de escuta na mesma porta UDP
+# (SO_REUSEPORT) e o kernel distribui os datagramas pelo hash do endereço do peer, de modo que todos os segmentos
+# de uma conexão chegam sempre ao mesmo worker. Cada processo tem seu próprio GIL.
+
+ACCEPT_POLL = 0.2 # Intervalo em que o worker verifica o pedido de parada (segundos)
+REPORT_INTERVAL = 1.0 # Intervalo entre relatórios de métricas de cada worker (segundos)
+READY_TIMEOUT = 15.0 # Espera pelos workers em start() (segundos)
+DRAIN_TIMEOUT = 10.0 # Na parada, espera pelas conexões em andamento (segundos)
+WORKER_COUNTERS = ('accepted', 'active', 'completed', 'bytes', 'segments_sent', 'retransmissions')
+
+def _serve_connection(conn, stats, stats_lock):
+    """ Recebe até o FIN do cliente, encerra a conexão e soma suas estatísticas às do worker """
+    buffer = bytearray(64 * 1024)
+    received = 0
+    try:
+        while True:
+            n = conn.recv_into(buffer)
+            if n == 0:
+                break
+            received += n
+    except Exception as e:
+        log_error(f"Erro com {conn.peer_address}: {e}", "TCP-WORKER")
+    finally:
+        conn.close()
+    with stats_lock:
+        stats['active'] -= 1
+        stats['completed'] += 1
+        stats['bytes'] += received
+        stats['segments_sent'] += conn.segments_sent
+        stats['retransmissions'] += conn.retransmission_count
+
+def _worker_main(worker_id, port, channel_params, fastopen_key, stop_event, metrics_queue):
+    """ Processo worker: aceita conexões até stop_event e envia métricas ao supervisor """
+    # Ctrl+C chega a todo o grupo de processos: quem coordena a parada é o supervisor. SIGTERM (enviado ao grupo
+    # pelo gerenciador de serviços, ou só a este worker) também inicia a parada graciosa
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    terminate = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *args: terminate.set())
+    stats = dict.fromkeys(WORKER_COUNTERS, 0)
+    stats_lock = threading.Lock()
+
+    def report(final=False):
+        with stats_lock:
+            metrics_queue.put(dict(stats, worker=worker_id, pid=os.getpid(), final=final, time=time.time()))
+
+    server = None
+    threads = []
+
+    def serve(conn):
+        nonlocal threads
+        with stats_lock:
+            stats['accepted'] += 1
+            stats['active'] += 1
+        thread = threading.Thread(target=_serve_connection, args=(conn, stats, stats_lock), daemon=True)
+        thread.start()
+        threads = [t for t in threads if t.is_alive()]
+        threads.append(thread)
+
+    try:
+        server = SimpleTCPSocket(port, channel_params, fast_open=fastopen_key is not None, reuse_port=True)
+        if fastopen_key is not None:
+            server.fastopen_key = fastopen_key # Mesma chave em todos os workers: o cookie vale em qualquer um
+        server.listen()
+        report() # Pronto para aceitar
+        last_report = time.time()
+        while not (stop_event.is_set() or terminate.is_set()):
+            try:
+                serve(server.accept(timeout=ACCEPT_POLL))
+            except TimeoutError:
+                pass
+            if time.time() - last_report >= REPORT_INTERVAL:
+                report()
+                last_report = time.time()
+
+        # Parada: SYNs novos são descartados (backlog cheio). As conexões já na fila de accept(), ou terminando o
+        # handshake, também são aceitas e atendidas até o fim; depois as em andamento terminam
+        server.backlog = 0
+        deadline = time.time() + DRAIN_TIMEOUT
+        while True:
+            try:
+                serve(server.accept(timeout=ACCEPT_POLL if server.syn_queue else 0))
+            except TimeoutError:
+                if not server.syn_queue or time.time() >= deadline:
+                    break
+        for thread in threads:
+            thread.join(max(0.0, deadline - time.time()))
+    except Exception as e:
+        log_error(f"Worker {worker_id}: {e}", "TCP-WORKER")
+    finally:
+        if server is not None:
+            server.close()
+        report(final=True)
+
+class ShardedTCPServer:
+    """ Supervisor de num_workers processos, cada um com um SimpleTCPSocket de escuta na mesma porta (SO_REUSEPORT).
+        Agrega as métricas dos workers (metrics()) e coordena a parada: os workers deixam de aceitar conexões,
+        esperam as que estão em andamento e enviam o relatório final (stop()) """
+
+    def __init__(self, port, num_workers=None, channel_params=None, fast_open=False):
+        if not port:
+            raise ValueError("O servidor com vários workers precisa de uma porta fixa.")
+        self.port = port
+        self.num_workers = num_workers or os.cpu_count() or 1
+        self.channel_params = channel_params
+        self.fastopen_key = os.urandom(16) if fast_open else None
+        # spawn: os workers não herdam threads (wheel de timers, canal) do processo do supervisor
+        self._context = multiprocessing.get_context('spawn')
+        self.stop_event = self._context.Event()
+        self.metrics_queue = self._context.Queue()
+        self.workers = []
+        self.worker_metrics = {} # Último relatório de cada worker {worker_id: dict}
+
+    def start(self):
+        """ Inicia os workers e espera todos estarem escutando """
+        for worker_id in range(self.num_workers):
+            process = self._context.Process(target=_worker_main, name=f"tcp-worker-{worker_id}", daemon=True,
+                                            args=(worker_id, self.port, self.channel_params, self.fastopen_key,
+                                                  self.stop_event, self.metrics_queue))
+            process.start()
+            self.workers.append(process)
+
+        deadline = time.time() + READY_TIMEOUT
+        while len(self.worker_metrics) < self.num_workers:
+            if not self._receive_metrics(deadline - time.time()):
+                self.stop()
+                raise TimeoutError("Workers não ficaram prontos.")
+        log_info(f"{self.num_workers} workers escutando na porta {self.port} (SO_REUSEPORT).", "TCP-SHARDED")
+
+    def _receive_metrics(self, timeout):
+        """Guarda um relatório de worker; False se nenhum chegar em timeout segundos"""
+        try:
+            report = self.metrics_queue.get(timeout=max(0.0, timeout))
+        except queue.Empty:
+            return False
+        self.worker_metrics[report['worker']] = report
+        return True
+
+    def metrics(self):
+        """ Métricas agregadas: soma dos contadores dos workers, workers vivos e o último relatório de cada um """
+        while self._receive_metrics(0):
+            pass
+        for worker_id, process in enumerate(self.workers):
+            if process.exitcode not in (None, 0):
+                log_warning(f"Worker {worker_id} terminou com código {process.exitcode}.", "TCP-SHARDED")
+        reports = [self.worker_metrics[worker_id] for worker_id in sorted(self.worker_metrics)]
+        totals = {counter: sum(report[counter] for report in reports) for counter in WORKER_COUNTERS}
+        totals['workers'] = len(self.workers)
+        totals['alive'] = sum(process.is_alive() for process in self.workers)
+        totals['per_worker'] = reports
+        return totals
+
+    def stop(self, timeout=DRAIN_TIMEOUT + 5.0):
+        """ Parada graciosa: espera os relatórios finais dos workers; encerra à força quem passar de timeout """
+        self.stop_event.set()
+        deadline = time.time() + timeout
+        # A fila precisa ser esvaziada antes do join (o processo só termina depois de entregar o que enviou)
+        while any(not report['final'] for report in self.worker_metrics.values()) or \
+                len(self.worker_metrics) < len(self.workers):
+            if not any(process.is_alive() for process in self.workers):
+                break
+            if not self._receive_metrics(min(0.5, deadline - time.time())) and time.time() >= deadline:
+                break
+        while self._receive_metrics(0):
+            pass
+        for process in self.workers:
+            process.join(max(0.0, deadline - time.time()))
+            if process.is_alive():
+                log_warning(f"{process.name} não terminou a tempo. Encerrando à força.", "TCP-SHARDED")
+                process.terminate()
+                process.join()
+        log_info(f"Workers encerrados. Conexões atendidas: {self.metrics()['completed']}.", "TCP-SHARDED")
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+def tcp_sharded_server_app(port, num_workers=None, channel_params=None, fast_open=False):
+    """ Roda o servidor com vários workers até SIGINT/SIGTERM, registrando as métricas agregadas a cada
+        REPORT_INTERVAL segundos. Retorna as métricas finais """
+    stop_requested = threading.Event()
+    previous = {sig: signal.signal(sig, lambda *args: stop_requested.set()) for sig in (signal.SIGINT, signal.SIGTERM)}
+    server = ShardedTCPServer(port, num_workers, channel_params, fast_open)
+    try:
+        server.start()
+        while not stop_requested.wait(REPORT_INTERVAL):
+            m = server.metrics()
+            log_info(f"Workers vivos: {m['alive']}/{m['workers']} | Conexões: {m['completed']} atendidas, "
+                     f"{m['active']} ativas | Recebidos: {m['bytes'] / 1024 / 1024:.2f} MB", "TCP-SHARDED")
+    finally:
+        server.stop()
+        for sig, handler in previous.items():
+            signal.signal(sig, handler)
+    return server.metrics()
+
+if __name__ == '__main__':
+    SERVER_PORT = 17000
+    tcp_sharded_server_app(SERVER_PORT)
@@ -1,16 +1,49 @@
+import os
+import hmac
+import mmap
+import hashlib
 import socket
+import struct
 import threading
 import time
 import random
 from collections import deque
-from utils.packet import TCPSegment, set_flag, is_flag_set, SYN_BIT, ACK_BIT, FIN_BIT
-from utils.simulator import UnreliableChannel
-from utils.logger import log_info, log_error, log_debug
+from utils.packet import (TCPSegment, set_flag, is_flag_set, SYN_BIT, ACK_BIT, FIN_BIT, TCP_OPT_WSCALE, TCP_OPT_MSS,
+                          TCP_OPT_FASTOPEN, TCP_OPT_PMTU_PROBE, TCP_OPT_PMTU_ECHO, TCP_OPT_COMPRESS, TCP_HEADER_SIZE,
+                          TCP_MAX_OPTIONS_SIZE)
+from utils.simulator import UnreliableChannel, MAX_PACKET_SIZE, HEADER_OVERHEAD
+from utils.ring_buffer import RingBuffer
+from utils.instrumented_lock import InstrumentedLock
+from utils.timing_wheel import default_wheel
+from utils.compression import BlockEncoder, BlockDecoder, codecs_for, CODEC_NAMES, COMPRESS_BLOCK
+from utils.receive_pump import ReceivePump, set_socket_buffers, sendto_waiting
+from utils.profiling import stage, acquire
+from utils.logger import log_info, log_error, log_debug, log_warning
 
 # Constantes
 BUFFER_SIZE = 1024 * 4 # 4KB
-MSS = 1024 # Maximum Segment Size (tamanho máximo dos dados)
+MSS = 1024 # Maximum Segment Size padrão (tamanho máximo dos dados; usado se o peer não anunciar a opção MSS)
+MAX_MSS = MAX_PACKET_SIZE - HEADER_OVERHEAD - TCP_HEADER_SIZE - TCP_MAX_OPTIONS_SIZE # Segmento cabe em um datagrama
+MAX_WINDOW = 0xFFFF # Maior valor representável no campo Window Size (16 bits)
+MAX_WSCALE = 14 # Deslocamento máximo da opção Window Scale (RFC 7323)
+PERSIST_TIMEOUT_MIN = 0.5 # Intervalo inicial das sondas de janela zero (segundos)
+PERSIST_TIMEOUT_MAX = 8.0 # Limite do backoff exponencial das sondas
+UDP_RCVBUF_FACTOR = 4 # SO_RCVBUF = fator x recv_buffer_size (overhead do kernel por datagrama)
+DEFAULT_BACKLOG = 128 # Conexões em handshake + aguardando accept() por socket de escuta
+CLOSE_TIMEOUT = 5.0 # Tempo máximo sem progresso do peer durante close() (segundos)
+CLOSE_POLL_INTERVAL = 0.5 # close() verifica o progresso do peer neste intervalo (segundos)
+SYN_RCVD_TIMEOUT = 10.0 # Conexões meio-abertas são descartadas após este tempo (segundos)
+CONNECT_TIMEOUT = 15.0 # Tempo máximo do three-way handshake em connect() (segundos)
+MAX_RETRANSMISSIONS = 8 # Timeouts seguidos sem progresso antes de abortar a conexão
+DELAYED_ACK_TIMEOUT = 0.04 # ACK atrasado sai no máximo após este tempo (segundos)
+TIME_WAIT_TIMEOUT = 2.0 # Duração do TIME_WAIT (2MSL simplificado, segundos)
+SENDFILE_MAP_SIZE = 8 * 1024 * 1024 # sendfile() mapeia o arquivo em janelas deste tamanho
+PMTU_PROBE_TIMEOUT = 0.5 # Espera pelo eco de uma sonda de PLPMTUD (segundos)
+PMTU_PROBE_RETRIES = 2 # Sondas perdidas seguidas até concluir que o tamanho não passa
+PMTU_SEARCH_PRECISION = 64 # A busca binária termina quando o intervalo fica menor que isto (bytes)
 TIMEOUT_INITIAL = 1.0 # Timeout inicial em segundos
+MIN_RTO = 0.2 # Menor timeout de retransmissão quando o RTT é medido (segundos)
+FASTOPEN_COOKIE_SIZE = 8 # Cookie de fast open (bytes)
 
 # Estados da Conexão
 STATE_CLOSED = 'CLOSED'
@@ -25,20 +58,84 @@ STATE_TIME_WAIT = 'TIME_WAIT'
 STATE_CLOSE_WAIT = 'CLOSE_WAIT'
 STATE_LAST_ACK = 'LAST_ACK'
 
-class SimpleTCPSocket:
-    def __init__(self, port, channel_params=None):
-        """ Inicializa socket UDP subjacente e estruturas de dados """
-        self.udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        self.udp_socket.bind(('0.0.0.0', port))
-        self.port = port
-        
-        # Simulador de canal (pode ser None para canal perfeito)
-        self.channel = UnreliableChannel(**channel_params) if channel_params else None
-        
+# Flags de um segmento de regime permanente (ACK puro ou dados), verificadas pela predição de cabeçalho
+ACK_ONLY = set_flag(0, ACK_BIT)
+
+# Estados em que a aplicação pode ler do buffer de recepção
+READABLE_STATES = (STATE_ESTABLISHED, STATE_CLOSE_WAIT, STATE_FIN_WAIT_1, STATE_FIN_WAIT_2, STATE_CLOSING)
+# Estados em que o peer ainda pode enviar dados (SYN_RCVD: conexão aceita no SYN, com fast open)
+PEER_SENDING_STATES = (STATE_ESTABLISHED, STATE_FIN_WAIT_1, STATE_FIN_WAIT_2, STATE_SYN_RCVD)
+
+# Parâmetros guardados por peer pelos clientes com fast_open (como o tcp_metrics do Linux), para que a próxima
+# conexão comece aquecida: {(ip, porta): {'cookie', 'rtt', 'rttvar', 'mss'}}
+_peer_cache = {}
+_peer_cache_lock = threading.Lock()
+
+def clear_peer_cache():
+    """Esquece cookies e parâmetros de todos os peers"""
+    with _peer_cache_lock:
+        _peer_cache.clear()
+
+def window_scale_for(buffer_size):
+    """Menor deslocamento que permite anunciar buffer_size no campo de 16 bits"""
+    shift = 0
+    while (buffer_size >> shift) > MAX_WINDOW and shift < MAX_WSCALE:
+        shift += 1
+    return shift
+
+def connection_params(recv_buffer_size=BUFFER_SIZE, send_buffer_size=BUFFER_SIZE, window_scaling=True, nodelay=False,
+                      delayed_ack=True, mss=MSS, pmtu_probe=False, instrument_locks=False, fast_open=False,
+                      compression=False):
+    """Valida os parâmetros de uma conexão (os mesmos no SimpleTCPSocket e no tcp_asyncio; ver
+    SimpleTCPSocket.__init__) e os devolve no formato de TCPConnection._init_connection()"""
+    if not 0 < mss <= MAX_MSS:
+        raise ValueError(f"MSS deve estar entre 1 e {MAX_MSS}.")
+    return {'recv_buffer_size': recv_buffer_size, 'send_buffer_size': send_buffer_size,
+            'window_scaling': window_scaling, 'nodelay': nodelay, 'delayed_ack': delayed_ack, 'mss': mss,
+            'pmtu_probe': pmtu_probe, 'instrument_locks': instrument_locks, 'fast_open': fast_open,
+            'compression': codecs_for(compression)}
+
+def fastopen_cookie(key, addr):
+    """Cookie de fast open para o IP do cliente (hash com a chave secreta do listener)"""
+    return hashlib.blake2b(addr[0].encode(), key=key, digest_size=FASTOPEN_COOKIE_SIZE).digest()
+
+def segment_length(segment):
+    """Espaço de sequência ocupado pelo segmento (dados + 1 para SYN/FIN)"""
+    length = len(segment.data)
+    if is_flag_set(segment.flags, SYN_BIT):
+        length += 1
+    if is_flag_set(segment.flags, FIN_BIT):
+        length += 1
+    return length
+
+class TCPConnection:
+    """ Máquina de estados de uma conexão, independente do transporte: processamento de segmentos, envio (Nagle, ACK
+        atrasado, persist, PLPMTUD, compressão, FIN), retransmissão e leitura do buffer de recepção.
+        SimpleTCPSocket (threads) e tcp_asyncio.AsyncTCPConnection (event loop) implementam só a E/S, os timers e a
+        espera da aplicação, nos métodos da seção "Transporte" """
+
+    def _init_connection(self, recv_buffer_size, send_buffer_size, window_scaling, nodelay, delayed_ack, mss,
+                         pmtu_probe, instrument_locks, fast_open, compression):
+        """Estado de uma conexão (números de sequência, buffers, timers)"""
         # Estados da conexão
         self.state = STATE_CLOSED
-        self.lock = threading.Lock()
+        self.created_at = time.time()
+        
+        # O estado é dividido em duas metades com locks próprios, para que o processamento de ACKs, a entrega de
+        # dados, send() e recv() não se serializem:
+        # - send_lock: send_buffer, unacked_segments, next_seq_num, last_ack_rcvd, peer_window, persist, PLPMTUD
+        # - recv_lock: recv_buffer, ooo_segments, expected_seq_num, ACK atrasado
+        # Mudanças de estado da conexão exigem os dois, sempre na ordem send_lock -> recv_lock. Campos da outra
+        # metade são apenas lidos (inteiros, leitura atômica). Segmentos são montados com o lock adquirido e
+        # enfileirados em tx_queue; _flush() os transmite depois que o lock é liberado
+        lock_type = InstrumentedLock if instrument_locks else threading.Lock
+        self.send_lock = lock_type()
+        self.recv_lock = lock_type()
+        self.tx_queue = deque() # Segmentos prontos (bytes) aguardando transmissão fora dos locks
         self.is_running = True
+        self.closing = False # close() chamado: _service() envia o FIN quando o buffer de envio esvaziar
+        self.aborted = False # Encerrada por _abort() (peer inalcançável ou janela fechada em close())
+        self.close_progress = None # (último ACK, instante) vistos por _close_stalled()
         
         # Números de sequência e ACK
         self.isn = random.randint(0, 2**32 - 1) # Initial Sequence Number
@@ -50,37 +147,86 @@ class SimpleTCPSocket:
         
         # Buffers
         self.send_buffer = deque() # Dados da aplicação a serem enviados
-        self.recv_buffer = deque() # Dados recebidos a serem lidos pela aplicação
+        self.send_buffer_size = send_buffer_size # Limite de bytes não enviados + não confirmados
+        self.send_buffered = 0 # Bytes no send_buffer (ainda não enviados)
+        self.recv_buffer = RingBuffer(recv_buffer_size) # Dados recebidos a serem lidos pela aplicação
+        self.ooo_segments = {} # Dados fora de ordem dentro da janela {seq_num: data}
         self.unacked_segments = {} # Segmentos enviados e não confirmados {seq_num: (segment, timestamp)}
         
         # Controle de fluxo
-        self.recv_window = BUFFER_SIZE # Tamanho do buffer de recepção
-        self.peer_window = BUFFER_SIZE # Janela de recepção do peer (rwnd)
+        self.peer_window = BUFFER_SIZE # Janela de recepção do peer (rwnd, em bytes já escalados)
+        
+        # Window Scale: rcv_wscale é anunciado no SYN; ambos ficam 0 se o peer não suportar
+        self.window_scaling = window_scaling
+        self.rcv_wscale = window_scale_for(recv_buffer_size) if window_scaling else 0
+        self.snd_wscale = 0
+        
+        # MSS: mss é anunciado ao peer; snd_mss é o tamanho usado no envio (MSS do peer, ou o já validado pelo PLPMTUD)
+        self.mss = mss
+        self.snd_mss = MSS
+        
+        # PLPMTUD (RFC 8899, simplificado): busca binária entre um tamanho que passa e o MSS do peer,
+        # com sondas de enchimento que não consomem números de sequência
+        self.pmtu_probe = pmtu_probe
+        self.pmtu_low = 0 # Maior tamanho confirmado
+        self.pmtu_high = 0 # Limite superior da busca
+        self.pmtu_probe_size = None # Sonda em andamento
+        self.pmtu_probe_deadline = None
+        self.pmtu_probe_failures = 0
+        self.pmtu_probes_sent = 0
+        
+        # Nagle: segmentos menores que o MSS esperam o ACK dos dados em trânsito
+        self.nodelay = nodelay
+        
+        # ACK atrasado: confirma a cada 2 segmentos completos ou após DELAYED_ACK_TIMEOUT
+        # (qualquer segmento enviado com ACK, inclusive de dados, leva a confirmação junto: last_ack_sent avança)
+        self.delayed_ack = delayed_ack
+        self.last_ack_sent = 0 # Maior ACK já enviado ao peer
+        self.ack_deadline = None
+        
+        # Estatísticas (cada contador é alterado sob um único lock)
+        self.data_segments_sent = 0 # Dados, SYN, FIN e sondas (send_lock)
+        self.pure_acks_sent = 0 # Segmentos sem dados nem SYN/FIN, apenas confirmação (recv_lock)
+        self.predicted_acks = 0 # Segmentos tratados pela predição de cabeçalho (ACK puro / dados em ordem)
+        self.predicted_data = 0
+        self.slow_path_segments = 0
+        
+        # Persist timer (sondas quando o peer anuncia janela zero)
+        self.persist_deadline = None
+        self.persist_backoff = PERSIST_TIMEOUT_MIN
+        self.window_probe_count = 0
         
         # Controle de tempo (RTT adaptativo)
         self.estimated_rtt = TIMEOUT_INITIAL
         self.dev_rtt = TIMEOUT_INITIAL / 2
+        self.rtt_measured = False # Estimativa veio de uma medida (handshake ou cache do peer)
         self.retransmission_count = 0
+        self.consecutive_timeouts = 0 # Zerado a cada ACK novo
         
-        # Dados do peer
-        self.peer_address = None
+        # Fast open: o cliente põe dados no SYN se tiver cookie do servidor; o servidor os entrega antes do ACK final
+        self.fast_open = fast_open
+        self.syn_sent_at = None # Para a amostra de RTT do handshake
+        self.cached_mss = None # MSS da conexão anterior com o mesmo peer
+        self.fastopen_accepted = 0 # Bytes aceitos no SYN (servidor)
         
-        # Threads
-        self.recv_thread = threading.Thread(target=self._receive_loop)
-        self.send_thread = threading.Thread(target=self._send_loop)
+        # Compressão: codecs aceitos; encoder/decoder existem só se o handshake escolheu um codec. Os primeiros
+        # framed_pending bytes do send_buffer já são quadros (send_buffered passa a contá-los em bytes da rede)
+        self.compression = compression
+        self.encoder = None
+        self.decoder = None
+        self.framed_pending = 0
+        self.decoded = bytearray() # Bytes decodificados ainda não lidos pela aplicação (recv_lock)
         
-        # Eventos de sincronização
-        self.handshake_complete = threading.Event()
-        self.data_available = threading.Event()
-        self.close_complete = threading.Event()
+        # Dados do peer
+        self.peer_address = None
         
-        self.recv_thread.start()
-        self.send_thread.start()
-        log_info(f"Socket iniciado na porta {port}", "TCP")
+        # Encerramento
+        self.time_wait_deadline = None # Fim do TIME_WAIT (tratado por _service())
+        self.shutdown_after_time_wait = False # O fim do TIME_WAIT libera a conexão (_shutdown())
 
     def _calculate_timeout(self):
         """Calcula timeout baseado em RTT"""
-        return self.estimated_rtt + 4 * self.dev_rtt
+        return max(MIN_RTO, self.estimated_rtt + 4 * self.dev_rtt)
 
     def _update_rtt(self, sample_rtt):
         """Atualiza estimativa de RTT (Karn's Algorithm não implementado)"""
@@ -90,304 +236,1255 @@ class SimpleTCPSocket:
         self.dev_rtt = (1 - beta) * self.dev_rtt + beta * abs(sample_rtt - self.estimated_rtt)
         log_debug(f"RTT: Sample={sample_rtt:.3f}, Est={self.estimated_rtt:.3f}, Dev={self.dev_rtt:.3f}, Timeout={self._calculate_timeout():.3f}", "TCP-RTT")
 
-    def _send_segment(self, flags, data=b'', seq_num=None, ack_num=None, is_retransmission=False):
-        """Cria e envia segmento TCP"""
-        with self.lock:
-            current_seq = seq_num if seq_num is not None else self.next_seq_num
-            current_ack = ack_num if ack_num is not None else self.expected_seq_num
-            
-            segment = TCPSegment(
-                src_port=self.port,
-                dest_port=self.peer_address[1] if self.peer_address else 0,
-                seq_num=current_seq,
-                ack_num=current_ack,
-                flags=flags,
-                window_size=self.recv_window - len(self.recv_buffer),
-                data=data
-            )
+    def _advertised_window(self, flags):
+        """Janela de recepção anunciada (rwnd): bytes livres no buffer de recepção
+        (nunca escalada em segmentos SYN, conforme RFC 7323)"""
+        free = self.recv_buffer.free_space()
+        if not is_flag_set(flags, SYN_BIT):
+            free >>= self.rcv_wscale
+        return min(free, MAX_WINDOW)
+
+    def _peer_window_from(self, segment):
+        """Converte o campo Window Size do segmento recebido para bytes"""
+        if is_flag_set(segment.flags, SYN_BIT):
+            return segment.window_size
+        return segment.window_size << self.snd_wscale
+
+    def _syn_options(self):
+        """Opções anunciadas no SYN/SYN-ACK"""
+        options = {TCP_OPT_MSS: struct.pack('!H', self.mss)}
+        if self.window_scaling:
+            options[TCP_OPT_WSCALE] = bytes([self.rcv_wscale])
+        if self.state == STATE_SYN_SENT and self.compression:
+            options[TCP_OPT_COMPRESS] = bytes(self.compression)
+        elif self.encoder is not None:
+            options[TCP_OPT_COMPRESS] = bytes([self.encoder.codec])
+        return options
+
+    def _negotiate_options(self, segment):
+        """Aplica as opções do SYN/SYN-ACK do peer (escala só vale se ambos anunciarem)"""
+        if self.window_scaling and TCP_OPT_WSCALE in segment.options:
+            self.snd_wscale = min(segment.options[TCP_OPT_WSCALE][0], MAX_WSCALE)
+        else:
+            self.window_scaling = False
+            self.rcv_wscale = 0
+            self.snd_wscale = 0
+
+        # MSS: nunca envia segmentos maiores que o anunciado pelo peer
+        peer_mss = MSS
+        if len(segment.options.get(TCP_OPT_MSS, b'')) == 2:
+            peer_mss = struct.unpack('!H', segment.options[TCP_OPT_MSS])[0]
+        if self.pmtu_probe and peer_mss > MSS:
+            # PLPMTUD: começa no MSS padrão (ou no já validado na conexão anterior com o peer) e sonda até o MSS do peer
+            start = min(max(MSS, self.cached_mss or MSS), peer_mss)
+            self.snd_mss = start
+            self.pmtu_low, self.pmtu_high = start, peer_mss
+        else:
+            self.snd_mss = peer_mss
+
+        # Compressão: o servidor escolhe o primeiro codec da oferta que também aceita; o cliente confere a escolha
+        offer = segment.options.get(TCP_OPT_COMPRESS, b'')
+        if self.state == STATE_SYN_SENT:
+            codec = offer[0] if len(offer) == 1 and offer[0] in self.compression else None
+        else:
+            codec = next((codec for codec in offer if codec in self.compression), None)
+        if codec is not None:
+            self.encoder = BlockEncoder(codec)
+            self.decoder = BlockDecoder(codec)
+            log_debug(f"Compressão negociada: {CODEC_NAMES[codec]}.", "TCP")
+
+    def _load_peer_cache(self, addr):
+        """Aplica os parâmetros guardados da última conexão com addr; retorna o cookie (b'' se não houver)"""
+        with _peer_cache_lock:
+            cached = dict(_peer_cache.get(addr, {}))
+        if 'rtt' in cached:
+            self.estimated_rtt, self.dev_rtt = cached['rtt'], cached['rttvar']
+            self.rtt_measured = True
+        if 'mss' in cached:
+            self.cached_mss = self.snd_mss = cached['mss'] # Tamanho dos dados no SYN; o SYN-ACK confirma
+        return cached.get('cookie', b'')
+
+    def _store_peer_cache(self, cookie=None):
+        """Guarda RTT, MSS e (se veio no SYN-ACK) o cookie do peer para a próxima conexão"""
+        with _peer_cache_lock:
+            entry = _peer_cache.setdefault(self.peer_address, {})
+            if cookie:
+                entry['cookie'] = cookie
+            if self.rtt_measured:
+                entry['rtt'], entry['rttvar'] = self.estimated_rtt, self.dev_rtt
+            entry['mss'] = self.snd_mss
+
+    def _handshake_rtt_sample(self):
+        """Amostra de RTT do SYN ao SYN-ACK (descartada se o SYN foi retransmitido, como no algoritmo de Karn)"""
+        if self.retransmission_count:
+            return
+        sample = time.time() - self.syn_sent_at
+        if self.rtt_measured:
+            self._update_rtt(sample)
+        else:
+            # Primeira medida (RFC 6298): SRTT = R, RTTVAR = R/2
+            self.estimated_rtt, self.dev_rtt = sample, sample / 2
+            self.rtt_measured = True
+
+    def _requeue_syn_data(self, ack_num):
+        """Dados do SYN que o servidor não aceitou (cookie inválido ou sem fast open) voltam para o buffer de envio"""
+        syn_segment, _ = self.unacked_segments.pop(self.isn)
+        unsent = syn_segment.data[ack_num - self.isn - 1:]
+        self.next_seq_num = ack_num
+        self.send_buffer.appendleft(unsent)
+        self.send_buffered += len(unsent)
+        log_debug(f"{len(unsent)} bytes do SYN não aceitos pelo servidor. Reenviando após o handshake.", "TCP-CLIENT")
+
+    def _queue_segment(self, flags, data=b'', seq_num=None, ack_num=None, is_retransmission=False, options=None):
+        """Monta o segmento e o enfileira para _flush(). Segmentos que ocupam sequência (dados, SYN, FIN e sondas)
+        são montados com o send_lock adquirido; ACKs puros, com o recv_lock"""
+        current_seq = seq_num if seq_num is not None else self.next_seq_num
+        current_ack = ack_num if ack_num is not None else self.expected_seq_num
+        
+        segment = TCPSegment(
+            src_port=self.port,
+            dest_port=self.peer_address[1] if self.peer_address else 0,
+            seq_num=current_seq,
+            ack_num=current_ack,
+            flags=flags,
+            window_size=self._advertised_window(flags),
+            data=data,
+            options=options
+        )
+        self.tx_queue.append(segment.to_bytes())
+        
+        seg_len = segment_length(segment)
+        if seg_len == 0 and not data:
+            self.pure_acks_sent += 1
+        else:
+            self.data_segments_sent += 1
+        if is_flag_set(flags, ACK_BIT) and current_ack > self.last_ack_sent:
+            # Este segmento já confirma tudo até current_ack: o ACK atrasado pendente vai junto (piggyback)
+            self.last_ack_sent = current_ack
             
-            raw_segment = segment.to_bytes()
+        if not is_retransmission and seg_len > 0 and current_seq == self.next_seq_num:
+            # Armazena o segmento não confirmado apenas se for um segmento novo (dados ou FIN)
+            if is_flag_set(flags, SYN_BIT) or is_flag_set(flags, FIN_BIT):
+                self._wake_sender() # Montados fora de _service(): ele precisa armar o timer de retransmissão
+            self.unacked_segments[current_seq] = (segment, time.time())
+            self.next_seq_num += seg_len
             
-            if self.channel:
-                self.channel.send(raw_segment, self.udp_socket, self.peer_address)
-            else:
-                self.udp_socket.sendto(raw_segment, self.peer_address)
-                
-            if not is_retransmission and len(data) > 0:
-                # Armazena o segmento não confirmado apenas se for um segmento de dados novo
-                self.unacked_segments[current_seq] = (segment, time.time())
-                self.next_seq_num += len(data)
-                
-            return segment
+        return segment
 
-    def _retransmit_segments(self):
-        """Verifica e retransmite segmentos expirados"""
+    @property
+    def segments_sent(self):
+        """Total de segmentos enviados (inclusive retransmissões e ACKs puros)"""
+        return self.data_segments_sent + self.pure_acks_sent
+
+    def _retransmit_segments(self, now):
+        """Verifica e retransmite segmentos expirados (chamado com o send_lock adquirido).
+        Retorna o instante em que o próximo segmento expira (None se a conexão foi abortada)"""
         timeout = self._calculate_timeout()
+        
+        segments_to_retransmit = []
+        next_expiry = now + timeout
+        for seq, (segment, timestamp) in self.unacked_segments.items():
+            if now - timestamp >= timeout:
+                segments_to_retransmit.append(segment)
+            elif timestamp + timeout < next_expiry:
+                next_expiry = timestamp + timeout
+        
+        if segments_to_retransmit:
+            self.consecutive_timeouts += 1
+            if self.consecutive_timeouts > MAX_RETRANSMISSIONS:
+                self._abort(f"Peer {self.peer_address} não responde após {MAX_RETRANSMISSIONS} retransmissões.")
+                return None
+        
+        for segment in segments_to_retransmit:
+            log_info(f"Timeout! Retransmitindo segmento Seq={segment.seq_num}.", "TCP-SENDER")
+            self.retransmission_count += 1
+            self._queue_segment(segment.flags, segment.data, segment.seq_num, segment.ack_num, is_retransmission=True,
+                                options=segment.options)
+            # Atualiza o timestamp para evitar retransmissão imediata
+            self.unacked_segments[segment.seq_num] = (segment, now)
+        return next_expiry
+
+    def _take_from_send_buffer(self, max_bytes):
+        """Remove até max_bytes do início do buffer de envio (juntando várias escritas pequenas)"""
+        data = self.send_buffer.popleft()
+        if len(data) < max_bytes and self.send_buffer:
+            chunks = [data]
+            size = len(data)
+            while self.send_buffer and size < max_bytes:
+                chunk = self.send_buffer.popleft()
+                chunks.append(chunk)
+                size += len(chunk)
+            data = b''.join(chunks)
+        if len(data) > max_bytes:
+            self.send_buffer.appendleft(data[max_bytes:])
+            data = data[:max_bytes]
+        self.send_buffered -= len(data)
+        return data
+
+    def _take_framed(self, max_bytes):
+        """Compressão: retira até max_bytes de quadros do início do buffer de envio. Quando o quadro atual acaba, o
+        próximo bloco vira quadro (que volta para o início do buffer), e o segmento continua nele: o fim de um quadro
+        não sai como um segmento pequeno, que o Nagle seguraria até o ACK"""
+        chunks = []
+        size = 0
+        while size < max_bytes and self.send_buffer:
+            if self.framed_pending == 0:
+                with stage('tcp.compress'):
+                    frame = self.encoder.encode(self._take_from_send_buffer(COMPRESS_BLOCK))
+                self.send_buffer.appendleft(frame)
+                self.send_buffered += len(frame)
+                self.framed_pending = len(frame)
+            chunk = self._take_from_send_buffer(min(max_bytes - size, self.framed_pending))
+            self.framed_pending -= len(chunk)
+            chunks.append(chunk)
+            size += len(chunk)
+        return chunks[0] if len(chunks) == 1 else b''.join(chunks)
+
+    def _nagle_holds(self, sendable, in_flight):
+        """Nagle (RFC 896): segmento menor que o MSS espera enquanto houver dados não confirmados. Depois de close()
+        nada mais chega ao buffer: o fim dos dados (e do último quadro comprimido) sai logo, seguido do FIN"""
+        return not self.nodelay and not self.closing and sendable < self.snd_mss and in_flight > 0
+
+    def set_nodelay(self, enabled=True):
+        """ Liga/desliga o envio imediato de segmentos pequenos (equivalente a TCP_NODELAY) """
+        with self.send_lock:
+            self.nodelay = enabled
+        self._wake_sender()
+
+    def _check_pmtu_probe(self):
+        """PLPMTUD: trata a sonda expirada e envia a próxima da busca binária (chamado com o send_lock adquirido)"""
+        if not self.pmtu_probe or self.pmtu_high - self.pmtu_low < PMTU_SEARCH_PRECISION:
+            return
+        if self.pmtu_probe_size is not None:
+            if time.time() < self.pmtu_probe_deadline:
+                return
+            self.pmtu_probe_failures += 1
+            if self.pmtu_probe_failures >= PMTU_PROBE_RETRIES:
+                # O tamanho não passa pelo caminho: reduz o limite superior da busca
+                self.pmtu_high = self.pmtu_probe_size - 1
+                self.pmtu_probe_size = None
+                self.pmtu_probe_failures = 0
+                if self.pmtu_high - self.pmtu_low < PMTU_SEARCH_PRECISION:
+                    log_info(f"PLPMTUD concluído: MSS={self.snd_mss}.", "TCP-PMTU")
+                    return
+
+        size = self.pmtu_probe_size or (self.pmtu_low + self.pmtu_high + 1) // 2
+        self.pmtu_probe_size = size
+        self.pmtu_probe_deadline = time.time() + PMTU_PROBE_TIMEOUT
+        self.pmtu_probes_sent += 1
+        log_debug(f"Sonda de PMTU com {size} bytes (intervalo {self.pmtu_low}-{self.pmtu_high}).", "TCP-PMTU")
+        # Enchimento que não consome sequência: o receptor só ecoa o tamanho
+        self._queue_segment(set_flag(0, ACK_BIT), bytes(size), is_retransmission=True,
+                            options={TCP_OPT_PMTU_PROBE: struct.pack('!H', size)})
+
+    def _pmtu_probe_acked(self, size):
+        """Eco de uma sonda: o tamanho passa pelo caminho e passa a ser usado no envio"""
+        if size != self.pmtu_probe_size:
+            return
+        self.pmtu_low = size
+        self.snd_mss = size
+        self.pmtu_probe_size = None
+        self.pmtu_probe_failures = 0
+        if self.pmtu_high - self.pmtu_low < PMTU_SEARCH_PRECISION:
+            log_info(f"PLPMTUD concluído: MSS={self.snd_mss}.", "TCP-PMTU")
+        self._wake_sender()
+
+    def _schedule_ack(self):
+        """ACK atrasado: confirma já a cada 2 segmentos completos, senão após DELAYED_ACK_TIMEOUT
+        (chamado com o recv_lock adquirido, depois de avançar expected_seq_num)"""
+        if not self.delayed_ack or self.expected_seq_num - self.last_ack_sent >= 2 * self.mss:
+            self._send_ack()
+        elif self.ack_deadline is None:
+            self.ack_deadline = time.time() + DELAYED_ACK_TIMEOUT
+            self._wake_sender() # O transporte ajusta a espera para o novo prazo (ver _service())
+
+    def _send_ack(self):
+        """ACK cumulativo imediato, com a janela atual (chamado com o recv_lock adquirido)"""
+        self.ack_deadline = None
+        self._queue_segment(set_flag(0, ACK_BIT), seq_num=self.next_seq_num, ack_num=self.expected_seq_num)
+
+    def _check_delayed_ack(self):
+        """Envia o ACK atrasado vencido; retorna o tempo até o próximo prazo (ou None)"""
+        if self.ack_deadline is None:
+            return None
+        if self.last_ack_sent >= self.expected_seq_num:
+            # Já confirmado por um segmento de dados (piggyback)
+            self.ack_deadline = None
+            return None
+        remaining = self.ack_deadline - time.time()
+        if remaining <= 0:
+            self._send_ack()
+            return None
+        return remaining
+
+    def _send_space(self):
+        """Bytes que send() ainda pode enfileirar (não enviados + não confirmados <= send_buffer_size)"""
+        in_flight = self.next_seq_num - self.last_ack_rcvd
+        return max(0, self.send_buffer_size - self.send_buffered - in_flight)
+
+    def _send_window_probe(self):
+        """Sonda de janela zero: 1 byte já confirmado, que o peer responde com um ACK e a janela atual"""
+        log_debug(f"Janela do peer é zero. Enviando sonda (backoff={self.persist_backoff:.1f}s).", "TCP-SENDER")
+        self.window_probe_count += 1
+        self._queue_segment(set_flag(0, ACK_BIT), b'\x00', seq_num=self.last_ack_rcvd - 1, is_retransmission=True)
+
+    def _check_persist_timer(self):
+        """Arma/dispara o persist timer enquanto a janela do peer estiver fechada"""
+        if self.peer_window == 0 and self.send_buffer and not self.unacked_segments:
+            now = time.time()
+            if self.persist_deadline is None:
+                self.persist_deadline = now + self.persist_backoff
+            elif now >= self.persist_deadline:
+                self._send_window_probe()
+                self.persist_backoff = min(self.persist_backoff * 2, PERSIST_TIMEOUT_MAX)
+                self.persist_deadline = now + self.persist_backoff
+        else:
+            self.persist_deadline = None
+            self.persist_backoff = PERSIST_TIMEOUT_MIN
+
+    def _service(self):
+        """Retransmissões, envio de dados do buffer, persist timer, ACK atrasado e fim do TIME_WAIT de uma conexão.
+        Arma o timer do próximo prazo no wheel e retorna o tempo até o próximo ACK atrasado (None se não houver)"""
         now = time.time()
+        deadlines = []
+        with acquire(self.send_lock, 'tcp.lock_wait'):
+            rto_armed = bool(self.unacked_segments)
+            if rto_armed:
+                # Retransmissão continua durante o encerramento (FIN_WAIT_1, LAST_ACK, ...)
+                deadlines.append(self._retransmit_segments(now))
+                
+            if self.state in (STATE_ESTABLISHED, STATE_CLOSE_WAIT):
+                # Envio de dados do buffer, limitado pela janela anunciada pelo peer (em bytes)
+                in_flight = self.next_seq_num - self.last_ack_rcvd
+                while self.send_buffer and in_flight < self.peer_window:
+                    max_bytes = min(self.snd_mss, self.peer_window - in_flight)
+                    if self._nagle_holds(min(self.send_buffered, max_bytes), in_flight):
+                        break
+                    if self.encoder is not None:
+                        chunk = self._take_framed(max_bytes)
+                    else:
+                        chunk = self._take_from_send_buffer(max_bytes)
+                    self._queue_segment(set_flag(0, ACK_BIT), chunk)
+                    in_flight += len(chunk)
+                if self.closing and not self.send_buffer:
+                    self._queue_fin()
+                if not rto_armed and self.unacked_segments:
+                    # Primeiros segmentos em trânsito: arma o timer de retransmissão
+                    deadlines.append(now + self._calculate_timeout())
+                self._check_persist_timer()
+                self._check_pmtu_probe()
+                self._notify_writers()
+            deadlines.append(self.persist_deadline)
+            if self.pmtu_probe_size is not None:
+                deadlines.append(self.pmtu_probe_deadline)
+        with acquire(self.recv_lock, 'tcp.lock_wait'):
+            ack_due = self._check_delayed_ack()
+        self._flush()
+        if self.time_wait_deadline is not None:
+            if now >= self.time_wait_deadline:
+                self._transition_to_closed()
+            else:
+                deadlines.append(self.time_wait_deadline)
+        deadlines = [deadline for deadline in deadlines if deadline is not None]
+        if deadlines:
+            self._arm_wakeup(max(0.0, min(deadlines) - now))
+        return ack_due
+
+    def _queue_fin(self):
+        """FIN depois do último byte do buffer de envio (chamado com o send_lock adquirido, só quando o buffer
+        esvaziou: nunca há dados não enviados antes do FIN)"""
+        with acquire(self.recv_lock, 'tcp.lock_wait'):
+            if self.state == STATE_ESTABLISHED:
+                self.state = STATE_FIN_WAIT_1
+            elif self.state == STATE_CLOSE_WAIT:
+                self.state = STATE_LAST_ACK
+            else:
+                return
+            # FIN consome 1 byte de seq; retransmitido até ser confirmado
+            self._queue_segment(set_flag(ACK_ONLY, FIN_BIT), seq_num=self.next_seq_num)
+
+    def _remove_acked(self, ack_num):
+        """Descarta os segmentos confirmados (unacked_segments está em ordem crescente de sequência)"""
+        unacked = self.unacked_segments
+        while unacked:
+            seq = next(iter(unacked))
+            if seq + segment_length(unacked[seq][0]) > ack_num:
+                break
+            del unacked[seq]
+
+    def _header_prediction(self, segment):
+        """Fast path (predição de cabeçalho, como no TCP do BSD) para os dois casos de regime permanente em
+        ESTABLISHED: ACK puro que confirma dados novos (só o send_lock) e dados em ordem que não confirmam nada
+        novo (só o recv_lock). Retorna False para tudo o mais, que segue pela máquina de estados completa"""
+        if (self.state != STATE_ESTABLISHED or segment.flags != ACK_ONLY or segment.options
+                or segment.seq_num != self.expected_seq_num):
+            return False
         
-        with self.lock:
-            segments_to_retransmit = []
-            for seq, (segment, timestamp) in self.unacked_segments.items():
-                if now - timestamp > timeout:
-                    segments_to_retransmit.append(segment)
+        ack_num = segment.ack_num
+        data = segment.data
+        window = segment.window_size << self.snd_wscale
+        if not data:
+            # ACK puro: confirma dados novos, sem ir além do que foi enviado
+            with acquire(self.send_lock, 'tcp.lock_wait'):
+                if self.state != STATE_ESTABLISHED or not self.last_ack_rcvd < ack_num <= self.next_seq_num:
+                    return False
+                self.peer_window = window
+                self._remove_acked(ack_num)
+                self.last_ack_rcvd = ack_num
+                self.consecutive_timeouts = 0
+                self._notify_writers()
+                self.predicted_acks += 1
+            self._wake_sender()
+            return True
+        
+        # Dados: nada novo confirmado, sem lacunas pendentes e cabendo inteiros no buffer de recepção
+        # (last_ack_rcvd e expected_seq_num só são alterados por esta thread)
+        with acquire(self.recv_lock, 'tcp.lock_wait'):
+            if (self.state != STATE_ESTABLISHED or ack_num != self.last_ack_rcvd or self.ooo_segments
+                    or len(data) > self.recv_buffer.free_space()):
+                return False
+            self.recv_buffer.write(data)
+            self.expected_seq_num += len(data)
+            self._notify_readers()
+            self._schedule_ack()
+            self.predicted_data += 1
+        if window != self.peer_window:
+            # Atualização de janela: pertence à metade de envio
+            with acquire(self.send_lock, 'tcp.lock_wait'):
+                if ack_num == self.last_ack_rcvd:
+                    self.peer_window = window
+            self._wake_sender()
+        return True
+
+    def header_prediction_stats(self):
+        """ Acertos da predição de cabeçalho: {'acks', 'data', 'slow', 'hit_rate'} """
+        fast = self.predicted_acks + self.predicted_data
+        total = fast + self.slow_path_segments
+        return {'acks': self.predicted_acks, 'data': self.predicted_data, 'slow': self.slow_path_segments,
+                'hit_rate': fast / total if total else 0.0}
+
+    def compression_stats(self):
+        """ Compressão da conexão: codec negociado (None: sem compressão), bytes da aplicação e da rede em cada
+            sentido, blocos enviados crus por não comprimirem e tempo de CPU gasto comprimindo e descomprimindo """
+        if self.encoder is None:
+            return {'codec': None}
+        encoder, decoder = self.encoder, self.decoder
+        return {'codec': CODEC_NAMES[encoder.codec], 'sent_bytes': encoder.raw_bytes,
+                'sent_wire_bytes': encoder.wire_bytes,
+                'send_ratio': encoder.wire_bytes / encoder.raw_bytes if encoder.raw_bytes else 1.0,
+                'blocks': encoder.blocks, 'raw_blocks': encoder.raw_blocks, 'compress_cpu_ms': encoder.cpu_ns / 1e6,
+                'received_bytes': decoder.raw_bytes, 'received_wire_bytes': decoder.wire_bytes,
+                'decompress_cpu_ms': decoder.cpu_ns / 1e6}
+
+    def lock_stats(self):
+        """ Contenção dos locks de envio e recepção ({'send': ..., 'recv': ...}, ver InstrumentedLock.stats());
+            None se o socket não foi criado com instrument_locks=True """
+        if not isinstance(self.send_lock, InstrumentedLock):
+            return None
+        return {'send': self.send_lock.stats(), 'recv': self.recv_lock.stats()}
+
+    def _process_segment(self, segment, addr):
+        """Processa o segmento recebido com base no estado da conexão; as respostas ficam em tx_queue até o
+        _flush() do fim do lote"""
+        if not self._header_prediction(segment):
+            with acquire(self.send_lock, 'tcp.lock_wait'), acquire(self.recv_lock, 'tcp.lock_wait'):
+                self.slow_path_segments += 1
+                self._process_slow_path(segment, addr)
+
+    def _process_slow_path(self, segment, addr):
+        """Máquina de estados completa (chamado com os dois locks adquiridos)"""
+        # 0. Sonda de PLPMTUD: apenas enchimento; responde ecoando o tamanho, sem entregar dados
+        if TCP_OPT_PMTU_PROBE in segment.options:
+            if self.state in READABLE_STATES:
+                self._queue_segment(set_flag(0, ACK_BIT), seq_num=self.next_seq_num, ack_num=self.expected_seq_num,
+                                    options={TCP_OPT_PMTU_ECHO: segment.options[TCP_OPT_PMTU_PROBE]})
+            return
+        if len(segment.options.get(TCP_OPT_PMTU_ECHO, b'')) == 2:
+            self._pmtu_probe_acked(struct.unpack('!H', segment.options[TCP_OPT_PMTU_ECHO])[0])
+        
+        # 1. Processamento de ACK (cumulativo)
+        if is_flag_set(segment.flags, ACK_BIT):
+            ack_num = segment.ack_num
             
-            for segment in segments_to_retransmit:
-                log_info(f"Timeout! Retransmitindo segmento Seq={segment.seq_num}.", "TCP-SENDER")
-                self.retransmission_count += 1
-                self._send_segment(segment.flags, segment.data, segment.seq_num, segment.ack_num, is_retransmission=True)
-                # Atualiza o timestamp para evitar retransmissão imediata
-                self.unacked_segments[segment.seq_num] = (segment, now)
+            if ack_num >= self.last_ack_rcvd:
+                # Atualiza janela do peer (também em ACKs duplicados, que podem ser atualizações de janela)
+                self.peer_window = self._peer_window_from(segment)
+                self._wake_sender()
 
-    def _send_loop(self):
-        """Loop principal de envio e retransmissão"""
-        while self.is_running:
-            if self.state == STATE_ESTABLISHED:
-                self._retransmit_segments()
-                
-                # Envio de dados do buffer
-                with self.lock:
-                    if self.send_buffer and self.next_seq_num - self.last_ack_rcvd < self.peer_window:
-                        data_to_send = self.send_buffer.popleft()
-                        
-                        # Divide em segmentos MSS
-                        for i in range(0, len(data_to_send), MSS):
-                            chunk = data_to_send[i:i + MSS]
-                            self._send_segment(set_flag(0, ACK_BIT), chunk)
-                            
-            time.sleep(0.1) # Pequena pausa
+            if self.state == STATE_SYN_RCVD and ack_num == self.isn + 1:
+                # Servidor: ACK final do handshake -> ESTABLISHED
+                self.state = STATE_ESTABLISHED
+                self._handshake_completed()
+                if self.listener is not None:
+                    self.listener._connection_established(self)
 
-    def _receive_loop(self):
-        """Thread que recebe segmentos UDP e processa"""
-        while self.is_running:
-            try:
-                self.udp_socket.settimeout(0.5)
-                raw_segment, addr = self.udp_socket.recvfrom(BUFFER_SIZE)
+            if ack_num > self.last_ack_rcvd:
+                # Confirmação de novos dados
+                log_debug(f"Recebido ACK={ack_num}. Confirmando dados.", "TCP-RECEIVER")
                 
-                segment = TCPSegment.from_bytes(raw_segment)
+                # Remove segmentos confirmados do buffer de não confirmados
+                self._remove_acked(ack_num)
+                    
+                # Atualiza last_ack_rcvd (libera espaço no buffer de envio)
+                self.last_ack_rcvd = ack_num
+                self.consecutive_timeouts = 0
+                self._notify_writers()
                 
-                if segment is None or segment.is_corrupt():
-                    log_info("Segmento corrompido ou inválido. Descartando.", "TCP-RECEIVER")
-                    continue
+                # Atualiza RTT (simplificado: usa o tempo do segmento mais antigo confirmado)
+                # Não implementado RTT adaptativo completo aqui por complexidade
                 
-                # Se o peer_address não estiver definido, define
-                if not self.peer_address and self.state != STATE_LISTEN:
-                    self.peer_address = addr
+                # Lógica de estados de fechamento
+                # (apenas quando o próprio FIN foi confirmado)
+                if self.state == STATE_FIN_WAIT_1 and ack_num == self.next_seq_num:
+                    self.state = STATE_FIN_WAIT_2
+                elif self.state == STATE_CLOSING and ack_num == self.next_seq_num:
+                    self._enter_time_wait()
+                elif self.state == STATE_LAST_ACK and ack_num == self.next_seq_num:
+                    self.state = STATE_CLOSED
+                    self._close_completed()
+                    
+        # 2. Processamento de SYN
+        if is_flag_set(segment.flags, SYN_BIT):
+            if self.state == STATE_LISTEN:
+                # Servidor: SYN recebido -> SYN_RCVD
+                self.peer_address = addr
+                self.expected_seq_num = segment.seq_num + 1
+                self.peer_window = self._peer_window_from(segment)
+                self._negotiate_options(segment)
+                self.state = STATE_SYN_RCVD
                 
-                self._process_segment(segment, addr)
+                options = self._syn_options()
+                if self.fast_open and TCP_OPT_FASTOPEN in segment.options:
+                    cookie = self.listener._fastopen_cookie(addr)
+                    if hmac.compare_digest(segment.options[TCP_OPT_FASTOPEN], cookie):
+                        # Cookie válido: os dados do SYN já são entregues à aplicação (0-RTT)
+                        self.fastopen_accepted = self.recv_buffer.write(segment.data)
+                        self.expected_seq_num += self.fastopen_accepted
+                    else:
+                        # Pedido de cookie (ou cookie inválido): os dados do SYN são ignorados e o cliente os reenvia
+                        options[TCP_OPT_FASTOPEN] = cookie
                 
-            except socket.timeout:
-                continue
-            except Exception as e:
-                if self.is_running:
-                    log_error(f"Erro no loop de recepção: {e}", "TCP-RECEIVER")
-
-    def _process_segment(self, segment, addr):
-        """Processa o segmento recebido com base no estado da conexão"""
-        with self.lock:
-            # 1. Processamento de ACK (cumulativo)
-            if is_flag_set(segment.flags, ACK_BIT):
-                ack_num = segment.ack_num
+                # Envia SYN-ACK (SYN consome 1 byte de seq)
+                flags = set_flag(0, SYN_BIT)
+                flags = set_flag(flags, ACK_BIT)
+                self._queue_segment(flags, seq_num=self.isn, ack_num=self.expected_seq_num, options=options)
+                if self.fastopen_accepted:
+                    # accept() retorna já com os dados, sem esperar o ACK final do handshake
+                    self.listener._connection_established(self)
                 
-                if ack_num > self.last_ack_rcvd:
-                    # Confirmação de novos dados
-                    log_debug(f"Recebido ACK={ack_num}. Confirmando dados.", "TCP-RECEIVER")
-                    
-                    # Remove segmentos confirmados do buffer de não confirmados
-                    segments_to_remove = []
-                    for seq in self.unacked_segments.keys():
-                        if seq + len(self.unacked_segments[seq][0].data) <= ack_num:
-                            segments_to_remove.append(seq)
-                            
-                    for seq in segments_to_remove:
-                        del self.unacked_segments[seq]
-                        
-                    # Atualiza last_ack_rcvd
-                    self.last_ack_rcvd = ack_num
-                    
-                    # Atualiza RTT (simplificado: usa o tempo do segmento mais antigo confirmado)
-                    # Não implementado RTT adaptativo completo aqui por complexidade
-                    
-                    # Atualiza janela do peer
-                    self.peer_window = segment.window_size
-                    
-                    # Lógica de estados de fechamento
-                    if self.state == STATE_FIN_WAIT_1:
-                        self.state = STATE_FIN_WAIT_2
-                    elif self.state == STATE_LAST_ACK:
-                        self.state = STATE_CLOSED
-                        self.close_complete.set()
-                        
-            # 2. Processamento de SYN
-            if is_flag_set(segment.flags, SYN_BIT):
-                if self.state == STATE_LISTEN:
-                    # Servidor: SYN recebido -> SYN_RCVD
-                    self.peer_address = addr
+            elif self.state == STATE_SYN_SENT:
+                # Cliente: SYN-ACK recebido -> ESTABLISHED (o ACK pode cobrir também dados enviados no SYN)
+                if is_flag_set(segment.flags, ACK_BIT) and self.isn < segment.ack_num <= self.next_seq_num:
                     self.expected_seq_num = segment.seq_num + 1
-                    self.state = STATE_SYN_RCVD
-                    
-                    # Envia SYN-ACK
-                    flags = set_flag(0, SYN_BIT)
-                    flags = set_flag(flags, ACK_BIT)
-                    self._send_segment(flags, seq_num=self.isn, ack_num=self.expected_seq_num)
-                    
-                elif self.state == STATE_SYN_SENT:
-                    # Cliente: SYN-ACK recebido -> ESTABLISHED
-                    if is_flag_set(segment.flags, ACK_BIT) and segment.ack_num == self.isn + 1:
-                        self.expected_seq_num = segment.seq_num + 1
-                        self.state = STATE_ESTABLISHED
-                        
-                        # Envia ACK
-                        self._send_segment(set_flag(0, ACK_BIT), seq_num=self.isn + 1, ack_num=self.expected_seq_num)
-                        self.handshake_complete.set()
-                        
-            # 3. Processamento de Dados (apenas em ESTABLISHED)
-            if self.state == STATE_ESTABLISHED and len(segment.data) > 0:
-                if segment.seq_num == self.expected_seq_num:
-                    # Dados em ordem
-                    self.recv_buffer.append(segment.data)
-                    self.expected_seq_num += len(segment.data)
-                    self.data_available.set()
-                    
-                    # Envia ACK cumulativo
-                    self._send_segment(set_flag(0, ACK_BIT), seq_num=self.next_seq_num, ack_num=self.expected_seq_num)
-                else:
-                    # Dados fora de ordem ou duplicados (ignora e reenvia ACK do esperado)
-                    self._send_segment(set_flag(0, ACK_BIT), seq_num=self.next_seq_num, ack_num=self.expected_seq_num)
-                    
-            # 4. Processamento de FIN
-            if is_flag_set(segment.flags, FIN_BIT):
-                if self.state == STATE_ESTABLISHED:
-                    # Recebido FIN -> CLOSE_WAIT
-                    self.expected_seq_num += 1 # FIN consome 1 byte de seq
-                    self.state = STATE_CLOSE_WAIT
+                    self.peer_window = self._peer_window_from(segment)
+                    self._negotiate_options(segment)
+                    self.state = STATE_ESTABLISHED
+                    if self.isn in self.unacked_segments:
+                        self._requeue_syn_data(segment.ack_num)
                     
                     # Envia ACK
-                    self._send_segment(set_flag(0, ACK_BIT), seq_num=self.next_seq_num, ack_num=self.expected_seq_num)
-                    
-                elif self.state == STATE_FIN_WAIT_2:
-                    # Recebido FIN -> TIME_WAIT
-                    self.expected_seq_num += 1
+                    self._queue_segment(set_flag(0, ACK_BIT), seq_num=self.next_seq_num, ack_num=self.expected_seq_num)
+                    if self.fast_open:
+                        self._handshake_rtt_sample()
+                        self._store_peer_cache(segment.options.get(TCP_OPT_FASTOPEN))
+                    self._handshake_completed()
                     
-                    # Envia ACK
-                    self._send_segment(set_flag(0, ACK_BIT), seq_num=self.next_seq_num, ack_num=self.expected_seq_num)
+            elif self.state == STATE_ESTABLISHED and segment.seq_num + 1 == self.expected_seq_num:
+                # SYN-ACK retransmitido (o ACK do handshake se perdeu): confirma de novo
+                self._send_ack()
                     
-                    self.state = STATE_TIME_WAIT
-                    # Inicia timer de 2MSL (simplificado para 2 segundos)
-                    threading.Timer(2.0, lambda: self._transition_to_closed()).start()
+        # 3. Processamento de Dados (apenas em ESTABLISHED)
+        if self.state == STATE_ESTABLISHED and len(segment.data) > 0:
+            expected_before = self.expected_seq_num
+            had_gap = bool(self.ooo_segments)
+            self._receive_data(segment.seq_num, segment.data)
+            
+            in_order = (segment.seq_num == expected_before and
+                        self.expected_seq_num == expected_before + len(segment.data))
+            if in_order and not had_gap and not self.ooo_segments:
+                # Segmento em ordem e sem lacunas: o ACK pode esperar (ou ir junto com dados de resposta)
+                self._schedule_ack()
+            else:
+                # Fora de ordem, duplicado, lacuna preenchida ou buffer cheio: ACK imediato (RFC 5681),
+                # duplicado se o segmento estava fora de ordem
+                self._send_ack()
+                
+        # 4. Processamento de FIN (apenas em ordem, após todos os dados)
+        if is_flag_set(segment.flags, FIN_BIT) and segment.seq_num == self.expected_seq_num:
+            if self.state == STATE_ESTABLISHED:
+                # Recebido FIN -> CLOSE_WAIT
+                self.expected_seq_num += 1 # FIN consome 1 byte de seq
+                self.state = STATE_CLOSE_WAIT
+                self._notify_readers() # Leitores recebem EOF
+                
+                # Envia ACK
+                self._queue_segment(set_flag(0, ACK_BIT), seq_num=self.next_seq_num, ack_num=self.expected_seq_num)
+                
+            elif self.state == STATE_FIN_WAIT_2:
+                # Recebido FIN -> TIME_WAIT
+                self.expected_seq_num += 1
+                
+                # Envia ACK
+                self._queue_segment(set_flag(0, ACK_BIT), seq_num=self.next_seq_num, ack_num=self.expected_seq_num)
+                self._enter_time_wait()
+                
+            elif self.state == STATE_FIN_WAIT_1:
+                # Encerramento simultâneo: os dois FINs se cruzaram -> CLOSING (espera o ACK do próprio FIN)
+                self.expected_seq_num += 1
+                self.state = STATE_CLOSING
+                self._notify_readers()
+                self._queue_segment(set_flag(0, ACK_BIT), seq_num=self.next_seq_num, ack_num=self.expected_seq_num)
+        elif is_flag_set(segment.flags, FIN_BIT) and self.state in (STATE_TIME_WAIT, STATE_CLOSING):
+            # FIN retransmitido (o último ACK se perdeu): confirma de novo
+            self._send_ack()
+
+    def _enter_time_wait(self):
+        """Recebido o FIN do peer com o próprio FIN já confirmado (chamado com os dois locks adquiridos)"""
+        self.state = STATE_TIME_WAIT
+        self._notify_readers()
+        # O encerramento terminou deste lado: close() retorna e o TIME_WAIT segue em segundo plano
+        self._close_completed()
+        # Timer de 2MSL: _service() encerra a conexão no prazo. O TIME_WAIT cobre a retransmissão do FIN do peer
+        # caso este ACK se perca (nunca menor que 2 RTOs)
+        self.time_wait_deadline = time.time() + max(TIME_WAIT_TIMEOUT, 2 * self._calculate_timeout())
+        self._wake_sender()
+
+    def _receive_data(self, seq, data):
+        """Entrega dados em ordem ao buffer de recepção; guarda os fora de ordem que cabem na janela"""
+        offset = self.expected_seq_num - seq
+        if offset >= len(data):
+            return # Duplicado (já confirmado)
+        if offset > 0:
+            # Retransmissão parcialmente nova: descarta a parte já recebida
+            data = data[offset:]
+            seq = self.expected_seq_num
+
+        if seq > self.expected_seq_num:
+            # Fora de ordem: guarda se estiver dentro da janela anunciada
+            if seq + len(data) <= self.expected_seq_num + self.recv_buffer.free_space():
+                self.ooo_segments.setdefault(seq, bytes(data)) # data aponta para o buffer de recepção
+            return
+
+        # Dados em ordem: aceita apenas o que cabe no buffer de recepção
+        accepted = self.recv_buffer.write(data)
+        if accepted < len(data):
+            log_debug(f"Buffer de recepção cheio. Aceitos {accepted} de {len(data)} bytes.", "TCP-RECEIVER")
+        self.expected_seq_num += accepted
+
+        # Segmentos fora de ordem que se tornaram contíguos
+        while self.expected_seq_num in self.ooo_segments:
+            pending = self.ooo_segments.pop(self.expected_seq_num)
+            self.expected_seq_num += self.recv_buffer.write(pending)
+        if self.ooo_segments:
+            for stale in [s for s in self.ooo_segments if s < self.expected_seq_num]:
+                del self.ooo_segments[stale]
+
+        if accepted:
+            self._notify_readers()
 
     def _transition_to_closed(self):
-        with self.lock:
-            if self.state == STATE_TIME_WAIT:
-                self.state = STATE_CLOSED
-                self.close_complete.set()
-
-    def connect(self, dest_address):
-        """ Inicia conexão com three-way handshake """
-        with self.lock:
+        """Fim do TIME_WAIT: libera o socket se close() já retornou"""
+        with self.send_lock, self.recv_lock:
+            self.time_wait_deadline = None
+            if self.state != STATE_TIME_WAIT:
+                return
+            self.state = STATE_CLOSED
+            self._close_completed()
+            release = self.shutdown_after_time_wait
+        if release:
+            self._shutdown()
+
+    def _start_connect(self, dest_address, data):
+        """Início de connect(): enfileira o SYN e o transmite. Com fast_open e um cookie do servidor em cache, o
+        primeiro MSS de data vai no próprio SYN; sem cookie, o SYN pede um. Retorna os dados enviados no SYN"""
+        with self.send_lock, self.recv_lock:
             if self.state != STATE_CLOSED:
                 raise Exception("Socket já está em uso.")
             
             self.peer_address = dest_address
             self.state = STATE_SYN_SENT
             
-            # 1. Envia SYN
+            # 1. Envia SYN (consome 1 byte de seq, mais os dados que levar)
+            options = self._syn_options()
+            syn_data = b''
+            if self.fast_open:
+                cookie = self._load_peer_cache(dest_address)
+                options[TCP_OPT_FASTOPEN] = cookie
+                # Com compressão oferecida, os dados esperam o handshake: só o SYN-ACK diz se vão comprimidos
+                if cookie and not self.compression:
+                    syn_data = bytes(data[:self.snd_mss])
+            self.syn_sent_at = time.time()
             flags = set_flag(0, SYN_BIT)
-            self._send_segment(flags, seq_num=self.isn)
+            self._queue_segment(flags, syn_data, seq_num=self.isn, options=options)
+        self._flush()
+        return syn_data
+
+    def _after_read(self, free_before):
+        """Anuncia a janela reaberta se ela estava pequena demais para um segmento (chamado com o recv_lock
+        adquirido; o ACK sai em _flush())"""
+        threshold = min(self.mss, self.recv_buffer.capacity // 2)
+        if free_before < threshold <= self.recv_buffer.free_space() and self.state == STATE_ESTABLISHED:
+            self._queue_segment(set_flag(0, ACK_BIT), seq_num=self.next_seq_num, ack_num=self.expected_seq_num)
+
+    def _at_eof(self):
+        """Fim do fluxo para a aplicação (chamado com o recv_lock adquirido, depois de esperar por dados). Com
+        compressão, a conexão que termina no meio de um quadro perdeu dados: erro em vez de um EOF limpo"""
+        if self.decoded or self.recv_buffer:
+            return False
+        if self.decoder is not None and self.decoder.pending:
+            raise ConnectionError(f"Conexão com {self.peer_address} encerrada no meio de um quadro comprimido "
+                                  f"({len(self.decoder.pending)} bytes incompletos).")
+        return True
+
+    def _read(self, max_bytes):
+        """Retira até max_bytes para a aplicação (chamado com o recv_lock adquirido; b'' se ainda não há dados
+        completos). Com compressão, todos os bytes da rede do buffer de recepção (o que reabre a janela) são
+        decodificados antes; um quadro incompleto espera o resto dele. Um quadro inválido levanta ValueError: quem
+        chama, já sem o recv_lock, aborta a conexão com _decode_failed()"""
+        if self.decoder is None:
+            free_before = self.recv_buffer.free_space()
+            data = self.recv_buffer.read(max_bytes)
+            self._after_read(free_before)
+            return data
+        if not self.decoded and self.recv_buffer:
+            free_before = self.recv_buffer.free_space()
+            wire = self.recv_buffer.read(self.recv_buffer.capacity)
+            self._after_read(free_before)
+            with stage('tcp.decompress'):
+                self.decoded += self.decoder.feed(wire)
+        data = bytes(self.decoded[:max_bytes])
+        del self.decoded[:max_bytes]
+        return data
+
+    def _decode_failed(self, error):
+        """Quadro comprimido inválido em _read() (chamado sem send_lock/recv_lock): os bytes da rede já consumidos
+        não têm como ser entregues, então a conexão é abortada. Retorna o erro para a aplicação"""
+        reason = f"Quadro comprimido inválido de {self.peer_address} ({error}). Conexão abortada."
+        with self.send_lock:
+            self._abort(reason)
+        self._flush()
+        return ConnectionError(reason)
+
+    def _begin_close(self):
+        """Início de close(): o FIN sai por _service() depois de todos os dados pendentes no buffer de envio (ver
+        _queue_fin()). Retorna False se a conexão não está em um estado que envia FIN"""
+        if self.fast_open and self.listener is None and self.state in (STATE_ESTABLISHED, STATE_CLOSE_WAIT):
+            self._store_peer_cache() # RTT e MSS (após o PLPMTUD) mais recentes para a próxima conexão
+        with self.send_lock:
+            if self.state not in (STATE_ESTABLISHED, STATE_CLOSE_WAIT):
+                return False
+            self.closing = True
+            self.close_progress = (self.last_ack_rcvd, time.time())
+        self._wake_sender()
+        return True
+
+    def _close_stalled(self):
+        """Verificação periódica enquanto close() espera o fechamento completo; retorna True para desistir.
+        Segmentos não confirmados (dados ou FIN) ficam por conta do limite de retransmissões (MAX_RETRANSMISSIONS
+        aborta a conexão); sem nada em trânsito, desiste após CLOSE_TIMEOUT sem ACK novo do peer. Em LAST_ACK com só
+        o FIN pendente o peer já encerrou os dois sentidos (o ACK final pode ter se perdido depois do TIME_WAIT dele):
+        também desiste após CLOSE_TIMEOUT"""
+        with self.send_lock:
+            last_ack, last_progress = self.close_progress
+            now = time.time()
+            if self.last_ack_rcvd != last_ack:
+                self.close_progress = (self.last_ack_rcvd, now)
+                return False
+            fin_only = self.state == STATE_LAST_ACK and self.last_ack_rcvd == self.next_seq_num - 1
+            if (self.unacked_segments and not fin_only) or now - last_progress < CLOSE_TIMEOUT:
+                return False
+            if self.send_buffer:
+                # Janela do peer fechada: o FIN não pode sair antes desses dados
+                self._abort(f"Janela do peer {self.peer_address} continua fechada com {self.send_buffered} bytes "
+                            f"não enviados. Conexão abortada sem FIN.")
+            else:
+                log_warning("Timeout esperando fechamento completo.", "TCP-CLOSE")
+            return True
+
+    def _abort(self, reason):
+        """Encerra a conexão sem four-way handshake (peer inalcançável); chamado com o send_lock adquirido.
+        reason=None encerra sem registrar erro (handshake expirado ou descartado)"""
+        if reason:
+            log_error(reason, "TCP")
+        with self.recv_lock:
+            self.state = STATE_CLOSED
+            self.aborted = True
+            self._notify_readers()
+        self.unacked_segments.clear()
+        self.send_buffer.clear()
+        self.send_buffered = 0
+        self.framed_pending = 0
+        self._close_completed()
+        self._notify_writers()
+
+    # --- Transporte (implementado pelas subclasses) ---
+
+    def _flush(self):
+        """Transmite os segmentos de tx_queue (chamado sem send_lock/recv_lock)"""
+        raise NotImplementedError
+
+    def _wake_sender(self):
+        """Pede uma execução de _service() (dados novos, ACK, janela ou prazo alterados)"""
+        raise NotImplementedError
+
+    def _arm_wakeup(self, delay):
+        """Agenda _service() para o próximo prazo da conexão (RTO, persist, sonda de PMTU, TIME_WAIT)"""
+        raise NotImplementedError
+
+    def _notify_readers(self):
+        """Acorda a aplicação esperando dados ou EOF"""
+        raise NotImplementedError
+
+    def _notify_writers(self):
+        """Acorda a aplicação esperando espaço no buffer de envio"""
+        raise NotImplementedError
+
+    def _handshake_completed(self):
+        """Three-way handshake concluído (ESTABLISHED)"""
+        raise NotImplementedError
+
+    def _close_completed(self):
+        """Encerramento concluído deste lado (TIME_WAIT ou CLOSED, inclusive por _abort())"""
+        raise NotImplementedError
+
+    def _shutdown(self):
+        """Libera os recursos da conexão (fim do TIME_WAIT depois de close() ter retornado)"""
+        raise NotImplementedError
+
+class SimpleTCPSocket(TCPConnection):
+    def __init__(self, port, channel_params=None, recv_buffer_size=BUFFER_SIZE, send_buffer_size=BUFFER_SIZE,
+                 window_scaling=True, nodelay=False, delayed_ack=True, mss=MSS, pmtu_probe=False, instrument_locks=False,
+                 fast_open=False, timers=None, reuse_port=False, compression=False, rcvbuf=None, sndbuf=None):
+        """ Inicializa socket UDP subjacente e estruturas de dados (port=0 escolhe uma porta livre).
+            nodelay desativa o algoritmo de Nagle (como TCP_NODELAY); delayed_ack=False confirma cada segmento.
+            mss é o maior segmento que este socket aceita receber (anunciado no SYN); com pmtu_probe o emissor
+            começa em MSS e sonda (PLPMTUD) o maior tamanho que o caminho entrega, até o MSS do peer.
+            instrument_locks mede a contenção dos locks de envio e recepção (ver lock_stats()).
+            fast_open (como o TCP Fast Open, RFC 7413): o servidor emite cookies e entrega os dados que chegam no SYN
+            de um cliente com cookie válido; o cliente guarda cookie, RTT e MSS de cada peer (ver connect()).
+            timers: TimingWheel que acorda o _send_loop nos prazos (padrão: o wheel compartilhado do processo).
+            reuse_port (SO_REUSEPORT, apenas Linux/BSD): vários sockets de escuta, em processos diferentes, na mesma
+            porta; o kernel distribui os datagramas pelo hash do endereço do peer (ver tcp_sharded_server).
+            compression: codecs aceitos para comprimir o fluxo (True: todos os instalados; ou nomes em ordem de
+            preferência, como ('zstd', 'zlib')). O cliente oferece os seus no SYN e o servidor escolhe o primeiro que
+            também aceita; sem acordo, a conexão segue sem compressão (ver utils/compression.py e
+            compression_stats()).
+            rcvbuf/sndbuf: SO_RCVBUF/SO_SNDBUF do socket UDP (padrão: UDP_RCVBUF_FACTOR x recv_buffer_size, se maior
+            que o do sistema, e o SO_SNDBUF do sistema) """
+        self.socket_params = connection_params(recv_buffer_size, send_buffer_size, window_scaling, nodelay, delayed_ack,
+                                               mss, pmtu_probe, instrument_locks, fast_open, compression)
+        if reuse_port and not hasattr(socket, 'SO_REUSEPORT'):
+            raise ValueError("SO_REUSEPORT não é suportado nesta plataforma.")
+        self.udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        if reuse_port:
+            self.udp_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        self.udp_socket.bind(('0.0.0.0', port))
+        self.port = self.udp_socket.getsockname()[1]
+        
+        # O buffer do kernel precisa comportar uma janela inteira de datagramas (com overhead por pacote)
+        if rcvbuf is None:
+            kernel_rcvbuf = recv_buffer_size * UDP_RCVBUF_FACTOR
+            if kernel_rcvbuf > self.udp_socket.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF):
+                rcvbuf = kernel_rcvbuf
+        set_socket_buffers(self.udp_socket, rcvbuf, sndbuf)
+        
+        # Simulador de canal (pode ser None para canal perfeito)
+        self.channel = UnreliableChannel(**channel_params) if channel_params else None
+        
+        # Acorda o _send_loop quando há dados novos, ACKs, atualizações de janela ou timers vencidos
+        self.send_event = threading.Event()
+        self.timers = timers or default_wheel()
+        self.listener = None # Socket de escuta que criou esta conexão (None: socket UDP próprio)
+        # recvfrom() precisa comportar o maior segmento anunciado (cabeçalho + opções + MSS)
+        self.max_datagram = TCP_HEADER_SIZE + TCP_MAX_OPTIONS_SIZE + mss
+        self._init_connection(**self.socket_params)
+        
+        # Modo de escuta: conexões demultiplexadas por endereço do peer
+        self.connections = {} # {(ip, porta): SimpleTCPSocket}
+        self.syn_queue = {} # Conexões em SYN_RCVD {(ip, porta): SimpleTCPSocket}
+        self.accept_queue = deque() # Conexões estabelecidas aguardando accept()
+        self.conn_lock = threading.Lock() # Protege connections, syn_queue e accept_queue
+        self.accept_cond = threading.Condition(self.conn_lock)
+        self.backlog = 0
+        self.fastopen_key = os.urandom(16) if fast_open else None # Chave dos cookies emitidos por este listener
+        
+        # Threads: a ReceivePump lê os datagramas em lotes (o socket UDP fica não bloqueante)
+        self.pump = ReceivePump(self.udp_socket, self._receive_batch, self.max_datagram, "TCP-RECEIVER")
+        self.send_thread = threading.Thread(target=self._send_loop)
+        
+        self.pump.start()
+        self.send_thread.start()
+        log_info(f"Socket iniciado na porta {self.port}", "TCP")
+
+    @classmethod
+    def _from_listener(cls, listener, peer_address):
+        """Cria uma conexão que compartilha o socket UDP, o canal e as threads do socket de escuta"""
+        conn = cls.__new__(cls)
+        conn.udp_socket = listener.udp_socket
+        conn.port = listener.port
+        conn.channel = listener.channel
+        conn.send_event = listener.send_event # Acorda o _send_loop do listener, que serve todas as conexões
+        conn.timers = listener.timers
+        conn.listener = listener
+        conn.socket_params = listener.socket_params
+        conn._init_connection(**listener.socket_params)
+        conn.peer_address = peer_address
+        conn.state = STATE_LISTEN # O SYN recebido leva a conexão para SYN_RCVD
+        conn.connections = {}
+        conn.pump = None
+        conn.send_thread = None
+        return conn
+
+    def _init_connection(self, **params):
+        super()._init_connection(**params)
+        # Acorda leitores bloqueados em recv()/recv_into() quando chegam dados ou FIN
+        self.recv_cond = threading.Condition(self.recv_lock)
+        # Acorda send() quando o buffer de envio libera espaço
+        self.send_cond = threading.Condition(self.send_lock)
+        self.tx_lock = threading.Lock() # Apenas ordena a transmissão (nunca é esperado, ver _flush())
+        self.handshake_complete = threading.Event()
+        self.close_complete = threading.Event() # Também sinalizado ao entrar em TIME_WAIT
+        # Timer no wheel para o próximo prazo da conexão (RTO, persist, sonda de PMTU, TIME_WAIT)
+        self.wakeup_timer = None
+
+    def _fastopen_cookie(self, addr):
+        """Cookie do listener para o IP do cliente"""
+        return fastopen_cookie(self.fastopen_key, addr)
+
+    def _flush(self):
+        """Transmite os segmentos enfileirados, na ordem em que foram montados (chamado sem send_lock/recv_lock).
+        Uma única thread transmite por vez; as demais não esperam: deixam seus segmentos para ela"""
+        while self.tx_queue:
+            if not self.tx_lock.acquire(blocking=False):
+                return # Quem detém o tx_lock volta a verificar a fila depois de liberá-lo
+            try:
+                with stage('tcp.transmit'):
+                    while self.tx_queue:
+                        raw_segment = self.tx_queue.popleft()
+                        if self.channel:
+                            self.channel.send(raw_segment, self.udp_socket, self.peer_address)
+                        else:
+                            sendto_waiting(self.udp_socket, raw_segment, self.peer_address)
+            finally:
+                self.tx_lock.release()
+
+    def _arm_wakeup(self, delay):
+        """Agenda no wheel o despertar do _send_loop para o próximo prazo; mantém o timer já armado se ele vence antes
+        (um despertar antecipado só recalcula os prazos)"""
+        timer = self.wakeup_timer
+        if timer is not None:
+            if timer.active and timer.deadline <= self.timers.clock() + delay:
+                return
+            timer.cancel()
+        self.wakeup_timer = self.timers.schedule(delay, self.send_event.set)
+
+    def _wake_sender(self):
+        self.send_event.set()
+
+    def _notify_readers(self):
+        self.recv_cond.notify_all()
+
+    def _notify_writers(self):
+        self.send_cond.notify_all()
+
+    def _handshake_completed(self):
+        self.handshake_complete.set()
+
+    def _close_completed(self):
+        self.close_complete.set()
+
+    def _active_connections(self):
+        """Conexões do socket de escuta; descarta as meio-abertas há mais de SYN_RCVD_TIMEOUT"""
+        now = time.time()
+        with self.conn_lock:
+            for addr, conn in list(self.syn_queue.items()):
+                if now - conn.created_at >= SYN_RCVD_TIMEOUT:
+                    log_warning(f"Handshake com {addr} não completou. Descartando.", "TCP-SERVER")
+                    del self.syn_queue[addr]
+                    self.connections.pop(addr, None)
+                    conn.is_running = False
+            return list(self.connections.values())
+
+    def _send_loop(self):
+        """Loop principal de envio e retransmissão (do socket e de todas as conexões aceitas)"""
+        while self.is_running:
+            with stage('tcp.service'):
+                timeout = self._service()
+            if self.connections or self.syn_queue:
+                for conn in self._active_connections():
+                    with stage('tcp.service'):
+                        ack_due = conn._service()
+                    if ack_due is not None and (timeout is None or ack_due < timeout):
+                        timeout = ack_due
+                            
+            # Pausa até haver trabalho novo (send(), ACK, janela, timer do wheel) ou o próximo ACK atrasado.
+            # O ACK atrasado (40ms) fica na própria espera: passar pela thread do wheel somaria uma troca de
+            # thread ao prazo e prolongaria as paradas de Nagle + ACK atrasado
+            self.send_event.wait(timeout)
+            self.send_event.clear()
+
+    def _receive_batch(self, datagrams):
+        """Lote de datagramas lidos pela ReceivePump: os segmentos são processados em ordem e as respostas de cada
+        conexão (ACKs, dados liberados pela janela) saem juntas em um _flush() ao final do lote"""
+        touched = {}
+        with stage('tcp.receive'):
+            for raw_segment, addr in datagrams:
+                segment = TCPSegment.from_bytes(raw_segment)
+                
+                if segment is None or segment.is_corrupt():
+                    log_info("Segmento corrompido ou inválido. Descartando.", "TCP-RECEIVER")
+                    continue
+                
+                # Demultiplexação: conexões aceitas são identificadas pelo endereço (IP, porta) do peer
+                conn = self.connections.get(addr)
+                if conn is None and self.state == STATE_LISTEN:
+                    conn = self._handle_listen_segment(segment, addr)
+                elif conn is None:
+                    # Se o peer_address não estiver definido, define
+                    if not self.peer_address:
+                        self.peer_address = addr
+                    conn = self
+                    conn._process_segment(segment, addr)
+                else:
+                    conn._process_segment(segment, addr)
+                if conn is not None:
+                    touched[id(conn)] = conn
+        for conn in touched.values():
+            conn._flush()
+
+    def _handle_listen_segment(self, segment, addr):
+        """SYN de um peer novo: cria a conexão, se houver espaço no backlog (retorna a conexão, ou None)"""
+        if not is_flag_set(segment.flags, SYN_BIT) or is_flag_set(segment.flags, ACK_BIT):
+            return None # Sem conexão correspondente (um TCP real responderia com RST)
+
+        with self.conn_lock:
+            if len(self.syn_queue) + len(self.accept_queue) >= self.backlog:
+                log_warning(f"Backlog cheio ({self.backlog}). SYN de {addr} descartado.", "TCP-SERVER")
+                return None
+            conn = SimpleTCPSocket._from_listener(self, addr)
+            self.connections[addr] = conn
+            self.syn_queue[addr] = conn
+            # Descarte da conexão meio-aberta (ver _active_connections())
+            self.timers.schedule(SYN_RCVD_TIMEOUT, self.send_event.set)
+
+        conn._process_segment(segment, addr)
+        return conn
+
+    def _connection_established(self, conn):
+        """Chamado pela conexão filha ao completar o handshake: passa para a fila de accept()"""
+        with self.accept_cond:
+            if self.syn_queue.pop(conn.peer_address, None) is conn:
+                self.accept_queue.append(conn)
+                self.accept_cond.notify()
+
+    def _connection_closed(self, conn):
+        """Remove a conexão filha encerrada da tabela de demultiplexação"""
+        with self.conn_lock:
+            if self.connections.get(conn.peer_address) is conn:
+                del self.connections[conn.peer_address]
+            if self.syn_queue.get(conn.peer_address) is conn:
+                del self.syn_queue[conn.peer_address]
+
+    def connect(self, dest_address, data=b''):
+        """ Inicia conexão com three-way handshake e envia data (opcional) como send().
+            Com fast_open e um cookie do servidor em cache, o primeiro MSS de data vai no próprio SYN; sem cookie,
+            o SYN pede um e data segue após o handshake """
+        syn_data = self._start_connect(dest_address, data)
             
         # Aguarda SYN-ACK e ACK
-        if not self.handshake_complete.wait(timeout=5):
+        if not self.handshake_complete.wait(timeout=CONNECT_TIMEOUT):
             raise TimeoutError("Timeout no handshake de conexão.")
         
         log_info(f"Conexão estabelecida com {dest_address}. Estado: {self.state}", "TCP-CLIENT")
+        if len(data) > len(syn_data):
+            self.send(data[len(syn_data):])
 
-    def listen(self):
-        """ Coloca socket em modo de escuta """
-        with self.lock:
+    def listen(self, backlog=DEFAULT_BACKLOG):
+        """ Coloca socket em modo de escuta (backlog: conexões em handshake + aguardando accept) """
+        with self.send_lock, self.recv_lock:
             if self.state != STATE_CLOSED:
                 raise Exception("Socket já está em uso.")
+            self.backlog = backlog
             self.state = STATE_LISTEN
             log_info(f"Escutando na porta {self.port}. Estado: {self.state}", "TCP-SERVER")
 
-    def accept(self):
-        """ Aceita conexão entrante (completa handshake) """
+    def accept(self, timeout=None):
+        """ Aceita conexão entrante: retorna um novo SimpleTCPSocket já em ESTABLISHED """
         if self.state != STATE_LISTEN:
             raise Exception("Socket não está em modo de escuta.")
             
-        # Aguarda SYN_RCVD (recebimento do SYN)
-        while self.state != STATE_SYN_RCVD:
-            time.sleep(0.1)
-            
-        # Aguarda o ACK final do cliente
-        if not self.handshake_complete.wait(timeout=5):
-            raise TimeoutError("Timeout esperando ACK final do cliente.")
+        with self.accept_cond:
+            if not self.accept_cond.wait_for(lambda: self.accept_queue or not self.is_running, timeout):
+                raise TimeoutError("Timeout esperando conexão.")
+            if not self.accept_queue:
+                raise Exception("Socket de escuta encerrado.")
+            conn = self.accept_queue.popleft()
             
-        log_info(f"Conexão aceita de {self.peer_address}. Estado: {self.state}", "TCP-SERVER")
-        return self # Retorna o próprio socket (simplificação)
+        log_info(f"Conexão aceita de {conn.peer_address}. Estado: {conn.state}", "TCP-SERVER")
+        return conn
 
     def send(self, data):
-        """ Envia dados (pode bloquear se buffer cheio) """
-        if self.state != STATE_ESTABLISHED:
-            raise Exception("Conexão não estabelecida.")
+        """ Envia dados (bloqueia enquanto o buffer de envio estiver cheio) """
+        self._wait_fastopen_handshake()
+        if self.closing or self.state not in (STATE_ESTABLISHED, STATE_CLOSE_WAIT):
+            raise Exception("Conexão não estabelecida ou em encerramento.")
             
-        with self.lock:
-            self.send_buffer.append(data)
+        with acquire(self.send_cond, 'tcp.lock_wait'):
+            offset = 0
+            while offset < len(data):
+                with stage('tcp.buffer_wait'):
+                    self.send_cond.wait_for(lambda: self._send_space() > 0 or not self.is_running)
+                if not self.is_running:
+                    raise Exception("Conexão encerrada durante o envio.")
+                n = min(self._send_space(), len(data) - offset)
+                self.send_buffer.append(data[offset:offset + n] if n < len(data) else data)
+                self.send_buffered += n
+                offset += n
+                self.send_event.set()
             
         # O _send_loop cuidará do envio e retransmissão
 
-    def recv(self, buffer_size):
-        """ Recebe dados do buffer de recepção """
-        if self.state not in [STATE_ESTABLISHED, STATE_CLOSE_WAIT]:
+    def sendfile(self, file, offset=0, count=None):
+        """ Envia count bytes (padrão: até o fim) de um arquivo a partir de offset, sem lê-lo para a memória.
+            file é um caminho ou um objeto com fileno(). O arquivo é mapeado (mmap) em janelas de
+            SENDFILE_MAP_SIZE e os segmentos são fatias de memoryview da janela, enfileiradas só quando há
+            espaço no buffer de envio. Bloqueia como send(); retorna o número de bytes enviados """
+        own_file = isinstance(file, (str, bytes, os.PathLike))
+        f = open(file, 'rb') if own_file else file
+        pos = offset
+        try:
+            size = os.fstat(f.fileno()).st_size
+            end = size if count is None else min(size, offset + count)
+            while pos < end:
+                # O offset do mmap precisa ser múltiplo de ALLOCATIONGRANULARITY
+                map_start = pos - pos % mmap.ALLOCATIONGRANULARITY
+                length = min(SENDFILE_MAP_SIZE, end - map_start)
+                mapping = mmap.mmap(f.fileno(), length, access=mmap.ACCESS_READ, offset=map_start)
+                if hasattr(mapping, 'madvise'):
+                    mapping.madvise(mmap.MADV_SEQUENTIAL)
+                # A janela é desmapeada quando a última fatia (no buffer ou não confirmada) for liberada
+                view = memoryview(mapping)
+                del mapping
+                self.send(view[pos - map_start:])
+                del view
+                pos = map_start + length
+        finally:
+            if own_file:
+                f.close()
+            else:
+                f.seek(pos) # Como socket.sendfile(): a posição do arquivo avança o que foi enviado
+        return pos - offset
+
+    def recvfile(self, file, count=None):
+        """ Grava os dados recebidos em um arquivo (caminho ou objeto com write()) até o fim da conexão
+            ou até count bytes, com recv_into em um único buffer reutilizado. Retorna os bytes gravados """
+        own_file = isinstance(file, (str, bytes, os.PathLike))
+        f = open(file, 'wb') if own_file else file
+        buffer = bytearray(max(self.mss, self.recv_buffer.capacity))
+        view = memoryview(buffer)
+        total = 0
+        try:
+            while count is None or total < count:
+                nbytes = len(buffer) if count is None else min(len(buffer), count - total)
+                n = self.recv_into(view, nbytes)
+                if n == 0:
+                    break
+                f.write(view[:n])
+                total += n
+        finally:
+            if own_file:
+                f.close()
+        return total
+
+    def _wait_fastopen_handshake(self):
+        """Conexão aceita já no SYN (fast open): enviar ou encerrar espera o ACK final do handshake"""
+        if self.state == STATE_SYN_RCVD:
+            self.handshake_complete.wait(timeout=CONNECT_TIMEOUT)
+
+    def _wait_readable(self):
+        """Bloqueia (com o lock adquirido) até haver dados ou o peer encerrar o envio"""
+        if not self.recv_buffer and self.state not in READABLE_STATES and self.state != STATE_SYN_RCVD:
             raise Exception("Conexão não estabelecida ou fechada.")
-            
-        # Aguarda dados disponíveis
-        while not self.recv_buffer and self.is_running:
-            self.data_available.wait(timeout=0.1)
-            self.data_available.clear()
-            
-        with self.lock:
-            if not self.recv_buffer:
-                return b''
-                
-            # Junta todos os dados no buffer e retorna o tamanho solicitado
-            all_data = b''.join(self.recv_buffer)
-            self.recv_buffer.clear()
-            
-            data_to_return = all_data[:buffer_size]
-            
-            # Atualiza a janela de recepção (rwnd)
-            self.recv_window = BUFFER_SIZE - len(self.recv_buffer)
-            
-            return data_to_return
+
+        while not self.recv_buffer and self.is_running and self.state in PEER_SENDING_STATES:
+            self.recv_cond.wait()
+
+    def recv(self, buffer_size):
+        """ Recebe até buffer_size bytes do buffer de recepção (b'' indica fim da conexão) """
+        while True:
+            try:
+                with acquire(self.recv_cond, 'tcp.lock_wait'):
+                    if not self.decoded:
+                        self._wait_readable()
+                    eof = self._at_eof()
+                    data = self._read(buffer_size)
+            except ValueError as e:
+                raise self._decode_failed(e) from e
+            self._flush()
+            # Com compressão, bytes que só completam parte de um quadro não retornam nada: espera o resto
+            if data or eof:
+                return data
+
+    def recv_into(self, buffer, nbytes=None):
+        """ Copia dados recebidos diretamente para buffer (bytearray/memoryview); retorna a quantidade """
+        if self.decoder is not None:
+            data = self.recv(len(buffer) if nbytes is None else nbytes)
+            buffer[:len(data)] = data
+            return len(data)
+        with acquire(self.recv_cond, 'tcp.lock_wait'):
+            self._wait_readable()
+            free_before = self.recv_buffer.free_space()
+            n = self.recv_buffer.read_into(buffer, nbytes)
+            self._after_read(free_before)
+        self._flush()
+        return n
 
     def close(self):
         """ Fecha conexão (four-way handshake) """
-        with self.lock:
-            if self.state == STATE_ESTABLISHED:
-                self.state = STATE_FIN_WAIT_1
-                # 1. Envia FIN
-                self._send_segment(set_flag(0, FIN_BIT), seq_num=self.next_seq_num)
-                self.next_seq_num += 1 # FIN consome 1 byte de seq
-                
-            elif self.state == STATE_CLOSE_WAIT:
-                self.state = STATE_LAST_ACK
-                # 2. Envia FIN
-                self._send_segment(set_flag(0, FIN_BIT), seq_num=self.next_seq_num)
-                self.next_seq_num += 1
-                
-            else:
-                print(f"[CLOSE] Estado atual {self.state}. Fechando threads.")
-                self.is_running = False
-                return
-
-        # Aguarda o fechamento completo
-        if not self.close_complete.wait(timeout=5):
-            log_warning("Timeout esperando fechamento completo.", "TCP-CLOSE")
+        self._wait_fastopen_handshake()
+        wait_for_peer = self._begin_close()
+        if wait_for_peer:
+            # Aguarda o fechamento completo (ver _close_stalled())
+            while not self.close_complete.wait(timeout=CLOSE_POLL_INTERVAL):
+                if self._close_stalled():
+                    break
+        else:
+            print(f"[CLOSE] Estado atual {self.state}. Fechando threads.")
             
+        with self.send_lock, self.recv_lock:
+            # TIME_WAIT: as threads continuam (re-ACK de FINs retransmitidos) até o timer de 2MSL liberar o socket
+            self.shutdown_after_time_wait = self.state == STATE_TIME_WAIT
+        if not self.shutdown_after_time_wait:
+            self._shutdown()
+        if wait_for_peer:
+            log_info(f"Conexão encerrada. Estado: {self.state}", "TCP-CLOSE")
+
+    def _shutdown(self):
+        """Para as threads e libera o socket UDP (conexões aceitas apenas saem da tabela do listener)"""
         self.is_running = False
-        self.recv_thread.join()
-        self.send_thread.join()
+        if self.wakeup_timer is not None:
+            self.wakeup_timer.cancel()
+        with self.send_lock:
+            self.send_cond.notify_all()
+        with self.recv_lock:
+            self.recv_cond.notify_all()
+        if self.listener is None:
+            with self.accept_cond:
+                self.accept_cond.notify_all()
+        self.send_event.set()
+        
+        if self.listener is not None:
+            self.listener._connection_closed(self)
+            return
+        
+        # Socket de escuta: conexões aceitas ainda abertas perdem o socket UDP compartilhado
+        for conn in list(self.connections.values()):
+            conn._shutdown()
+            
+        self.pump.stop()
+        if self.send_thread is not threading.current_thread():
+            self.send_thread.join()
         self.udp_socket.close()
-        log_info(f"Conexão encerrada. Estado: {self.state}", "TCP-CLOSE")
 
 # --- Aplicações de Exemplo ---
 
@@ -5,10 +5,14 @@ project_root = os.path.dirname(current_dir)
 sys.path.insert(0, project_root)
 
 import time
+import tempfile
 import threading
+from concurrent.futures import wait
 from fase1.rdt20 import RDT20Sender, RDT20Receiver
 from fase1.rdt21 import RDT21Sender, RDT21Receiver
 from fase1.rdt30 import RDT30Sender, RDT30Receiver
+from fase1.rdt_mux import RDTMuxEndpoint
+from utils.channel_trace import ChannelTrace
 from utils.logger import log_info
 
 # Constantes de Teste
@@ -70,6 +74,137 @@ def run_rdt_test(SenderClass, ReceiverClass, sender_port, receiver_port, channel
     
     return all_correct, sender.retransmission_count, end_time - start_time
 
+def run_rdt30_async_test(num_messages, sender_port, receiver_port, test_name):
+    """ rdt_send() bloqueante x rdt_send_async() (Futures resolvidos pelo loop de ACKs, sem espera ativa) e
+        Futures das mensagens não confirmadas falhando no close() """
+    log_info(f"\n--- INICIANDO TESTE: {test_name} ({num_messages} mensagens) ---", "TEST_MAIN")
+    channel_config = {'loss_rate': 0.0, 'corrupt_rate': 0.0, 'delay_range': (0.0, 0.0)}
+    messages = [f"Mensagem assíncrona {i}".encode('utf-8') for i in range(num_messages)]
+    
+    receiver = RDT30Receiver(receiver_port, ('127.0.0.1', sender_port), channel_config)
+    receiver.start()
+    sender = RDT30Sender(sender_port, ('127.0.0.1', receiver_port), channel_config)
+    sender.start()
+    
+    # 1. Bloqueante: uma mensagem por vez
+    start_time = time.perf_counter()
+    for msg in messages:
+        sender.rdt_send(msg)
+    blocking_time = time.perf_counter() - start_time
+    
+    # 2. Assíncrono: todas enfileiradas de uma vez; o loop de ACKs envia a próxima assim que a anterior é confirmada
+    start_time = time.perf_counter()
+    futures = [sender.rdt_send_async(msg) for msg in messages]
+    done, not_done = wait(futures, timeout=30)
+    async_time = time.perf_counter() - start_time
+    sender.close()
+    receiver.close()
+    delivered_ok = (receiver.get_received_data() == messages * 2 and not not_done and
+                    all(future.exception() is None for future in done))
+    
+    # 3. Sem ACKs (perda de 100%): close() falha os Futures pendentes em vez de deixá-los esperando para sempre
+    lossy = RDT30Sender(sender_port, ('127.0.0.1', receiver_port), {'loss_rate': 1.0})
+    lossy.start()
+    pending = [lossy.rdt_send_async(msg) for msg in messages[:3]]
+    lossy.close()
+    failed_ok = all(future.done() and future.exception() is not None for future in pending)
+    
+    log_info("\n--- RESULTADOS ---", "TEST_MAIN")
+    log_info(f"rdt_send (bloqueante): {blocking_time / num_messages * 1000:.2f} ms por mensagem", "TEST_MAIN")
+    log_info(f"rdt_send_async:        {async_time / num_messages * 1000:.2f} ms por mensagem", "TEST_MAIN")
+    log_info(f"Futures pendentes falharam no close(): {'SIM' if failed_ok else 'NÃO'}", "TEST_MAIN")
+    all_ok = delivered_ok and failed_ok
+    log_info(f"Todas as mensagens chegaram corretamente: {'SIM' if all_ok else 'NÃO'}", "TEST_MAIN")
+    return all_ok, blocking_time, async_time
+
+def run_rdt_mux_test(num_sessions, messages_per_session, sender_port, receiver_port, channel_config, test_name):
+    """ Muitas sessões stop-and-wait em uma porta UDP de cada lado: todas as mensagens entregues, em ordem, por
+        sessão, com uma única thread de recepção por endpoint """
+    log_info(f"\n--- INICIANDO TESTE: {test_name} ({num_sessions} sessões x {messages_per_session} mensagens) ---",
+             "TEST_MAIN")
+    receiver = RDTMuxEndpoint(receiver_port, channel_config)
+    receiver.start()
+    sender = RDTMuxEndpoint(sender_port, channel_config)
+    sender.start()
+    # Threads além das entregas agendadas pelo simulador (threading.Timer, uma por pacote)
+    count_threads = lambda: sum(not isinstance(t, threading.Timer) for t in threading.enumerate())
+    threads_before = count_threads()
+    
+    # 1. Todas as sessões enviam ao mesmo tempo; cada uma tem no máximo um pacote em trânsito
+    start_time = time.perf_counter()
+    sessions = [sender.open_session(('127.0.0.1', receiver_port)) for _ in range(num_sessions)]
+    futures = [session.rdt_send_async(f"Sessão {session.session_id} mensagem {i}".encode('utf-8'))
+               for i in range(messages_per_session) for session in sessions]
+    done, not_done = wait(futures, timeout=60)
+    elapsed = time.perf_counter() - start_time
+    extra_threads = count_threads() - threads_before
+    stats = sender.stats()
+    sender.close()
+    receiver.close()
+    
+    # 2. Cada sessão do receptor tem exatamente as mensagens da sessão de mesmo ID, na ordem de envio
+    in_order = not not_done and all(future.exception() is None for future in done) and extra_threads == 0
+    for session in sessions:
+        peer = receiver.sessions.get((('127.0.0.1', sender_port), session.session_id))
+        expected = [f"Sessão {session.session_id} mensagem {i}".encode('utf-8') for i in range(messages_per_session)]
+        if peer is None or peer.get_received_data() != expected:
+            in_order = False
+            break
+    total = num_sessions * messages_per_session
+    
+    log_info("\n--- RESULTADOS ---", "TEST_MAIN")
+    log_info(f"Sessões no receptor: {len(receiver.sessions)} | Threads criadas pelas sessões: {extra_threads}",
+             "TEST_MAIN")
+    log_info(f"Vazão agregada: {total / elapsed:.0f} mensagens/s em {elapsed:.2f}s | "
+             f"Retransmissões: {stats['retransmissions']}", "TEST_MAIN")
+    log_info(f"Todas as mensagens chegaram corretamente: {'SIM' if in_order else 'NÃO'}", "TEST_MAIN")
+    return in_order, stats['retransmissions'], elapsed
+
+def run_trace_replay_test(sender_port, receiver_port, channel_config, test_name):
+    """ Grava o traço de uma execução com perdas e o reproduz duas vezes: stop-and-wait com o mesmo destino para cada
+        datagrama retransmite exatamente as mesmas vezes. Confere também a ida e volta do traço pelo arquivo e a
+        importação de uma saída do ping """
+    log_info(f"\n--- INICIANDO TESTE: {test_name} ---", "TEST_MAIN")
+    recorded = ChannelTrace()
+    ok, recorded_retransmissions, _ = run_rdt_test(RDT30Sender, RDT30Receiver, sender_port, receiver_port,
+                                                   dict(channel_config, trace=recorded), f"{test_name} (gravação)")
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'rdt30.trace')
+        recorded.save(path)
+        replays = []
+        for i in range(2):
+            loaded = ChannelTrace.load(path)
+            result = run_rdt_test(RDT30Sender, RDT30Receiver, sender_port + 2 * (i + 1), receiver_port + 2 * (i + 1),
+                                  dict(channel_config, trace=loaded), f"{test_name} (reprodução {i + 1})")
+            replays.append((result[0], result[1]))
+        # O arquivo guarda o atraso em microssegundos
+        round_trip = all(len(loaded) == len(fates) and all(
+                             (a.drop, a.corrupt_offset, a.corrupt_bit) == (b.drop, b.corrupt_offset, b.corrupt_bit)
+                             and abs(a.delay - b.delay) <= 1e-6 for a, b in zip(loaded, fates))
+                         for loaded, fates in zip(ChannelTrace.load(path).streams, recorded.streams))
+
+        # Ping com uma resposta perdida (icmp_seq=3): RTT/2 em cada direção, a perda em uma delas
+        ping_path = os.path.join(directory, 'ping.txt')
+        with open(ping_path, 'w') as f:
+            f.write("PING 10.0.0.1 (10.0.0.1) 56(84) bytes of data.\n")
+            for seq, rtt in ((1, 20.4), (2, 22.0), (4, 30.2)):
+                f.write(f"64 bytes from 10.0.0.1: icmp_seq={seq} ttl=64 time={rtt} ms\n")
+        imported = ChannelTrace.from_capture(ping_path).stats()
+
+    stats = recorded.stats()
+    deterministic = all(replay == (True, recorded_retransmissions) for replay in replays)
+    success = ok and deterministic and round_trip and imported == {'streams': 2, 'fates': 8, 'drops': 1,
+                                                                   'corruptions': 0}
+    log_info("\n--- RESULTADOS ---", "TEST_MAIN")
+    log_info(f"Traço gravado: {stats['fates']} datagramas, {stats['drops']} perdas, "
+             f"{stats['corruptions']} corrupções", "TEST_MAIN")
+    log_info(f"Retransmissões: gravação {recorded_retransmissions} | reproduções {[r for _, r in replays]}",
+             "TEST_MAIN")
+    log_info(f"Arquivo do traço idêntico ao gravado: {'SIM' if round_trip else 'NÃO'} | Ping importado: {imported}",
+             "TEST_MAIN")
+    log_info(f"Reprodução determinística: {'SIM' if success else 'NÃO'}", "TEST_MAIN")
+    return success, recorded_retransmissions, replays
+
 if __name__ == '__main__':
     # --- Teste 1A: rdt2.0 ---
     # 1. Canal perfeito
@@ -89,3 +224,14 @@ if __name__ == '__main__':
     # 1. Simular perda de 15% dos pacotes DATA e 15% dos ACKs, com atraso variável
     CHANNEL_CONFIG_30_LOSS = {'loss_rate': 0.15, 'corrupt_rate': 0.0, 'delay_range': (0.05, 0.5)}
     run_rdt_test(RDT30Sender, RDT30Receiver, SENDER_PORT_BASE + 6, RECEIVER_PORT_BASE + 6, CHANNEL_CONFIG_30_LOSS, "RDT3.0 - Perda (15%) e Atraso")
+    
+    # 2. API assíncrona (Futures) no canal perfeito
+    run_rdt30_async_test(200, SENDER_PORT_BASE + 8, RECEIVER_PORT_BASE + 8, "RDT3.0 - Envio Assíncrono (Futures)")
+    
+    # 3. Sessões multiplexadas em uma porta, com perda de 10%
+    CHANNEL_CONFIG_MUX_LOSS = {'loss_rate': 0.1, 'corrupt_rate': 0.05, 'delay_range': (0.0, 0.01)}
+    run_rdt_mux_test(200, 5, SENDER_PORT_BASE + 10, RECEIVER_PORT_BASE + 10, CHANNEL_CONFIG_MUX_LOSS, "RDT3.0 - Sessões Multiplexadas (perda de 10%)")
+    
+    # 4. Traço do canal: grava uma execução com perdas e a reproduz exatamente
+    CHANNEL_CONFIG_TRACE = {'loss_rate': 0.2, 'corrupt_rate': 0.1, 'delay_range': (0.0, 0.05)}
+    run_trace_replay_test(SENDER_PORT_BASE + 12, RECEIVER_PORT_BASE + 12, CHANNEL_CONFIG_TRACE, "RDT3.0 - Traço do Canal (gravação e reprodução)")
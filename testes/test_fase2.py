@@ -5,8 +5,16 @@ project_root = os.path.dirname(current_dir)
 sys.path.insert(0, project_root)
 
 import time
+import socket
+import tempfile
 import threading
-from fase2.gbn import GBNSender, GBNReceiver
+from fase2.gbn import GBNSender, GBNReceiver, GBNPacket, TIMEOUT, TYPE_DATA, BUFFER_SIZE
+from utils.fec import FECEncoder, FECDecoder, xor_parity, recover_missing
+from fase2.gbn_loop import GBNLoopSender, GBNLoopReceiver
+from utils.selector_loop import SelectorLoop
+from utils.fragmentation import Reassembler, fragment_packet
+from utils.timing_wheel import TimingWheel
+from utils import profiling
 from utils.logger import log_info
 
 # Constantes de Teste
@@ -28,8 +36,6 @@ def run_gbn_test(window_size, channel_config, test_name):
     time.sleep(0.5) 
     
     # 2. Inicializar Sender
-    # Nota: O tamanho da janela está fixo em 5 no gbn.py. Para variar, seria necessário refatorar a classe.
-    # Usaremos a implementação atual e focaremos no teste de perda.
     sender = GBNSender(SENDER_PORT, RECEIVER_ADDR, channel_config, window_size)
     sender.start()
     
@@ -74,6 +80,309 @@ def run_gbn_test(window_size, channel_config, test_name):
     
     return all_correct, sender.retransmission_count, throughput
 
+class VirtualClock:
+    """ Relógio controlado pelo teste (injetado no TimingWheel) """
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+def run_timer_restart_test(num_restarts, test_name):
+    """ Custo de reiniciar o timer da base, como o GBNSender faz a cada ACK: threading.Timer (uma thread nova por
+        reinício) x TimingWheel (agendar/cancelar em O(1) em uma única thread) """
+    log_info(f"\n--- INICIANDO TESTE: {test_name} ({num_restarts} reinícios) ---", "TEST_MAIN")
+    results = {}
+    
+    # 1. threading.Timer
+    threads_before = threading.active_count()
+    timer = None
+    start_time = time.perf_counter()
+    for _ in range(num_restarts):
+        if timer:
+            timer.cancel()
+        timer = threading.Timer(TIMEOUT, lambda: None)
+        timer.start()
+    elapsed = time.perf_counter() - start_time
+    timer.cancel()
+    results['threading.Timer'] = (elapsed, num_restarts)
+    
+    # 2. TimingWheel (o último timer precisa disparar uma única vez)
+    fired = []
+    wheel = TimingWheel()
+    wheel.start()
+    timer = None
+    start_time = time.perf_counter()
+    for _ in range(num_restarts):
+        if timer:
+            timer.cancel()
+        timer = wheel.schedule(0.05, fired.append, True)
+    elapsed = time.perf_counter() - start_time
+    results['TimingWheel'] = (elapsed, 1)
+    time.sleep(0.2)
+    wheel.stop()
+    wheel_ok = len(fired) == 1 and wheel.stats()['cancelled'] == num_restarts - 1
+    
+    log_info("\n--- RESULTADOS ---", "TEST_MAIN")
+    for name, (elapsed, threads) in results.items():
+        log_info(f"{name:16s}: {elapsed / num_restarts * 1e6:7.1f} us por reinício | Threads criadas: {threads}", "TEST_MAIN")
+    log_info(f"Threads ativas antes: {threads_before}, depois: {threading.active_count()}", "TEST_MAIN")
+    
+    # 3. Relógio virtual: nenhum timer dispara antes do prazo nem mais de um tick depois, em qualquer nível do wheel
+    clock = VirtualClock()
+    wheel = TimingWheel(clock=clock)
+    delays = [0.005, 0.04, 0.64, 0.65, 40.96, 41.0, 2621.44, 2700.0]
+    lateness = {}
+    for delay in delays:
+        wheel.schedule(delay, lambda d=delay: lateness.__setitem__(d, clock.now - d))
+    wheel.schedule(1.0, lateness.__setitem__, 'cancelado', None).cancel()
+    while len(wheel):
+        clock.now = round(clock.now + wheel.tick, 6)
+        wheel.advance()
+    clock_ok = (sorted(lateness) == sorted(delays) and
+                all(-1e-9 <= late <= wheel.tick + 1e-9 for late in lateness.values()))
+    log_info(f"Relógio virtual: {len(lateness)}/{len(delays)} timers no prazo (atraso máximo "
+             f"{max(lateness.values()) * 1000:.1f}ms)", "TEST_MAIN")
+    
+    all_ok = wheel_ok and clock_ok
+    log_info(f"Timers disparados corretamente: {'SIM' if all_ok else 'NÃO'}", "TEST_MAIN")
+    return all_ok
+
+def run_stage_profile_test(num_chunks, test_name):
+    """ Transferência curta com os estágios ativos (ProfileCapture('stages')): tempo por estágio, pilhas colapsadas
+        no arquivo e, ao final, os métodos de GBNPacket de volta sem medição """
+    log_info(f"\n--- INICIANDO TESTE: {test_name} ({num_chunks} pacotes) ---", "TEST_MAIN")
+    channel_config = {'loss_rate': 0.0, 'corrupt_rate': 0.0, 'delay_range': (0.0, 0.0)}
+    output = os.path.join(tempfile.mkdtemp(), 'gbn.collapsed')
+    
+    receiver = GBNReceiver(RECEIVER_PORT, ('127.0.0.1', SENDER_PORT), channel_config)
+    receiver.start()
+    sender = GBNSender(SENDER_PORT, ('127.0.0.1', RECEIVER_PORT), channel_config, 5)
+    sender.start()
+    with profiling.ProfileCapture('stages', output):
+        for i in range(num_chunks):
+            sender.rdt_send(f"Chunk {i:04d}".encode())
+        deadline = time.time() + 30
+        while len(receiver.received_data) < num_chunks and time.time() < deadline:
+            time.sleep(0.05)
+        stats = profiling.stage_stats()
+    sender.close()
+    receiver.close()
+    
+    with open(output) as f:
+        stacks = dict(line.rsplit(' ', 1) for line in f.read().splitlines())
+    expected = ('gbn.send', 'gbn.deliver', 'packet.encode', 'packet.checksum', 'channel.send', 'channel.sendto')
+    missing = [name for name in expected if name not in stats]
+    nested_ok = any(path.startswith('gbn.send;') and 'packet.encode' in path for path in stacks)
+    # Desativado, a classe volta a ter o método original (sem o invólucro que mede)
+    restored_ok = not hasattr(GBNPacket.to_bytes, '__wrapped__') and not profiling.stages_enabled()
+    
+    log_info("\n--- RESULTADOS ---", "TEST_MAIN")
+    log_info(f"Estágios medidos: {len(stats)} | Caminhos no arquivo: {len(stacks)}", "TEST_MAIN")
+    log_info(f"gbn.send: {stats.get('gbn.send', {}).get('calls', 0)} chamadas | Estágios ausentes: {missing or 'nenhum'}",
+             "TEST_MAIN")
+    all_ok = len(receiver.received_data) == num_chunks and not missing and nested_ok and restored_ok
+    log_info(f"Perfil por estágios correto: {'SIM' if all_ok else 'NÃO'}", "TEST_MAIN")
+    return all_ok
+
+def run_gbn_loop_test(window_size, channel_config, test_name):
+    """ GBN no SelectorLoop: a mesma transferência de 1MB do run_gbn_test, com emissor e receptor em um único loop
+        (uma thread, sem Timer por pacote nem por ACK) """
+    log_info(f"\n--- INICIANDO TESTE: {test_name} (Janela={window_size}) ---", "TEST_MAIN")
+    threads_before = threading.active_count()
+    loop = SelectorLoop()
+    loop.start()
+    receiver = GBNLoopReceiver(RECEIVER_PORT, ('127.0.0.1', SENDER_PORT), channel_config, loop)
+    receiver.start()
+    sender = GBNLoopSender(SENDER_PORT, ('127.0.0.1', RECEIVER_PORT), channel_config, window_size, loop)
+    sender.start()
+    
+    chunks = [f"Chunk {i:04d}: {'x' * (CHUNK_SIZE - 15)}".encode('utf-8') for i in range(NUM_CHUNKS)]
+    start_time = time.time()
+    peak_threads = 0
+    for chunk in chunks:
+        sender.rdt_send(chunk)
+        peak_threads = max(peak_threads, threading.active_count() - threads_before)
+    sender.flush()
+    total_time = time.time() - start_time
+    
+    sender.close()
+    receiver.close()
+    loop_stats = loop.stats()
+    loop.stop()
+    throughput = (DATA_SIZE * 8) / (total_time * 10**6)
+    
+    log_info("\n--- RESULTADOS ---", "TEST_MAIN")
+    log_info(f"Pacotes recebidos (aplicação): {len(receiver.get_received_data())} de {NUM_CHUNKS}", "TEST_MAIN")
+    log_info(f"Contagem de retransmissões: {sender.retransmission_count} | Timers disparados no loop: "
+             f"{loop_stats['timers_fired']}", "TEST_MAIN")
+    log_info(f"Threads criadas durante a transferência: {peak_threads}", "TEST_MAIN")
+    log_info(f"Tempo total: {total_time:.2f}s | Throughput efetivo: {throughput:.2f} Mbps", "TEST_MAIN")
+    all_correct = receiver.get_received_data() == chunks and peak_threads == 1
+    log_info(f"Todas as mensagens chegaram corretamente: {'SIM' if all_correct else 'NÃO'}", "TEST_MAIN")
+    return all_correct, sender.retransmission_count, throughput
+
+def run_fragmentation_test(message_size, num_messages, channel_config, test_name):
+    """ Mensagens maiores que um datagrama UDP: o canal fragmenta (ID da mensagem, índice e total) e o GBNReceiver
+        remonta cada uma antes de verificar o checksum. Também verifica o descarte antecipado de uma mensagem
+        incompleta e o limite do buffer de remontagem """
+    log_info(f"\n--- INICIANDO TESTE: {test_name} ({num_messages} mensagens de {message_size} bytes) ---", "TEST_MAIN")
+    messages = [bytes([i % 256]) * message_size for i in range(num_messages)]
+    
+    # 1. Transferência pelo GBN
+    receiver = GBNReceiver(RECEIVER_PORT, ('127.0.0.1', SENDER_PORT), channel_config)
+    receiver.start()
+    sender = GBNSender(SENDER_PORT, ('127.0.0.1', RECEIVER_PORT), channel_config, 5)
+    sender.start()
+    start_time = time.time()
+    for message in messages:
+        sender.rdt_send(message)
+    deadline = time.time() + 60
+    while len(receiver.get_received_data()) < num_messages and time.time() < deadline:
+        time.sleep(0.05)
+    total_time = time.time() - start_time
+    sender.close()
+    receiver.close()
+    delivered_ok = receiver.get_received_data() == messages
+    stats = receiver.reassembler.stats()
+    
+    # 2. Fragmento perdido: a mensagem incompleta é descartada quando chega a seguinte, sem esperar o timeout
+    clock = VirtualClock()
+    reassembler = Reassembler(timeout=10.0, max_bytes=3 * 65536, clock=clock)
+    first, second = fragment_packet(messages[0], 1, 65443), fragment_packet(messages[0], 2, 65443)
+    for fragment in first[:-1]:
+        reassembler.feed(fragment, 'peer')
+    outputs = [reassembler.feed(fragment, 'peer') for fragment in second]
+    early_ok = (outputs[-1] == messages[0] and reassembler.superseded == 1 and
+                reassembler.feed(first[-1], 'peer') is None and reassembler.stats()['pending'] == 0)
+    # 3. Buffer limitado: fragmentos de mensagens de vários peers além de max_bytes descartam as mais antigas
+    for peer in range(4):
+        reassembler.feed(first[0], peer)
+    bounded_ok = reassembler.buffered_bytes <= 3 * 65536 and reassembler.evicted == 1
+    
+    log_info("\n--- RESULTADOS ---", "TEST_MAIN")
+    log_info(f"Mensagens entregues: {len(receiver.get_received_data())} de {num_messages} em {total_time:.2f}s | "
+             f"Retransmissões: {sender.retransmission_count}", "TEST_MAIN")
+    log_info(f"Remontagem: {stats}", "TEST_MAIN")
+    log_info(f"Descarte antecipado: {'SIM' if early_ok else 'NÃO'} | Buffer limitado: {'SIM' if bounded_ok else 'NÃO'}",
+             "TEST_MAIN")
+    all_ok = delivered_ok and early_ok and bounded_ok
+    log_info(f"Todas as mensagens chegaram corretamente: {'SIM' if all_ok else 'NÃO'}", "TEST_MAIN")
+    return all_ok, sender.retransmission_count, total_time
+
+def run_gbn_fec_test(num_chunks, window_size, fec_block, channel_config, test_name):
+    """ GBN com paridade XOR (FEC) x GBN puro no mesmo canal com perda: goodput e tempo até a última entrega. Cada
+        perda recuperada pela paridade evita um timeout e a retransmissão da janela inteira """
+    log_info(f"\n--- INICIANDO TESTE: {test_name} (Janela={window_size}, {num_chunks} pacotes) ---", "TEST_MAIN")
+    chunks = [f"Chunk {i:04d}: {'x' * (CHUNK_SIZE - 15 - i % 7)}".encode('utf-8') for i in range(num_chunks)]
+    
+    # 1. Paridade: recupera qualquer pacote do bloco, inclusive com tamanhos diferentes
+    parity = xor_parity(chunks[:fec_block])
+    parity_ok = all(recover_missing(parity, chunks[:i] + chunks[i + 1:fec_block]) == chunks[i]
+                    for i in range(fec_block))
+    # Payloads acima de 64 KB: o XOR dos tamanhos não cabe em 16 bits
+    large = [b'x' * 70000, b'y' * 10]
+    encoder = FECEncoder(len(large))
+    block = [encoder.add(seq, payload) for seq, payload in enumerate(large)][-1]
+    large_ok = block is not None
+    for lost in range(len(large)):
+        decoder = FECDecoder()
+        decoder.add_parity(*block, expected=0)
+        for seq, payload in enumerate(large):
+            if seq != lost:
+                decoder.add_data(seq, payload, expected=0)
+        large_ok = large_ok and decoder.ready(lost) == large[lost]
+    
+    # 2. Mesma transferência sem FEC, com FEC fixo (1 paridade a cada fec_block) e com FEC adaptativo
+    results = {}
+    for mode, fec_params in (('GBN', {}), (f'FEC 1/{fec_block}', {'fec_block': fec_block}),
+                             ('FEC adaptativo', {'fec_block': fec_block, 'fec_adaptive': True})):
+        receiver = GBNReceiver(RECEIVER_PORT, ('127.0.0.1', SENDER_PORT), channel_config)
+        receiver.start()
+        sender = GBNSender(SENDER_PORT, ('127.0.0.1', RECEIVER_PORT), channel_config, window_size, **fec_params)
+        sender.start()
+        start_time = time.time()
+        for chunk in chunks:
+            sender.rdt_send(chunk)
+        deadline = time.time() + 120
+        while len(receiver.get_received_data()) < num_chunks and time.time() < deadline:
+            time.sleep(0.01)
+        total_time = time.time() - start_time
+        sender.close()
+        receiver.close()
+        recovered = receiver.fec.recovered if receiver.fec else 0
+        parities = sender.fec.parities_sent if sender.fec else 0
+        results[mode] = (receiver.get_received_data() == chunks, total_time, sender.retransmission_count, recovered,
+                         parities)
+    
+    log_info("\n--- RESULTADOS ---", "TEST_MAIN")
+    data_bits = sum(map(len, chunks)) * 8
+    for mode, (ok, total_time, retransmissions, recovered, parities) in results.items():
+        log_info(f"{mode:15s}: {'OK ' if ok else 'ERRO'} | {total_time:6.2f}s até a última entrega | goodput "
+                 f"{data_bits / total_time / 1e6:5.2f} Mbps | retransmissões: {retransmissions} | paridades: "
+                 f"{parities} | recuperados pela paridade: {recovered}", "TEST_MAIN")
+    all_correct = parity_ok and large_ok and all(result[0] for result in results.values())
+    log_info(f"Paridade XOR recupera qualquer pacote do bloco: {'SIM' if parity_ok else 'NÃO'}", "TEST_MAIN")
+    log_info(f"Paridade XOR recupera payloads acima de 64 KB: {'SIM' if large_ok else 'NÃO'}", "TEST_MAIN")
+    log_info(f"Todas as mensagens chegaram corretamente: {'SIM' if all_correct else 'NÃO'}", "TEST_MAIN")
+    return all_correct, results
+
+def run_burst_receive_test(num_bursts, burst_size, test_name, recv_pool=True):
+    """ Rajadas de DATA em ordem enviadas direto ao GBNReceiver, sem o simulador no envio: pacotes por segundo
+        processados pela ReceivePump, datagramas por lote, ACKs cumulativos (um por lote, não um por pacote) e pausas
+        do coletor de lixo. recv_pool=False lê com recvfrom() em vez do BufferPool (para comparação) """
+    log_info(f"\n--- INICIANDO TESTE: {test_name} ({num_bursts} rajadas de {burst_size} pacotes) ---", "TEST_MAIN")
+    channel_config = {'loss_rate': 0.0, 'corrupt_rate': 0.0, 'delay_range': (0.0, 0.0)}
+    blaster = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    blaster.bind(('127.0.0.1', SENDER_PORT))
+    receiver = GBNReceiver(RECEIVER_PORT, ('127.0.0.1', SENDER_PORT), channel_config, recv_pool=recv_pool)
+    receiver.start()
+    total = num_bursts * burst_size
+    chunks = [f"Chunk {seq:05d}".encode() for seq in range(total)]
+    packets = [GBNPacket(TYPE_DATA, seq, chunk).to_bytes() for seq, chunk in enumerate(chunks)]
+    
+    start_time = time.perf_counter()
+    with profiling.GCPauses() as gc_pauses:
+        for burst in range(num_bursts):
+            for raw in packets[burst * burst_size:(burst + 1) * burst_size]:
+                blaster.sendto(raw, ('127.0.0.1', RECEIVER_PORT))
+            deadline = time.time() + 5
+            while len(receiver.get_received_data()) < (burst + 1) * burst_size and time.time() < deadline:
+                time.sleep(0.0005)
+    total_time = time.perf_counter() - start_time
+    gc_stats = gc_pauses.stats()
+    pump_stats = receiver.pump.stats()
+    receiver.close()
+    stopped = not receiver.pump.thread.is_alive()
+    
+    blaster.setblocking(False)
+    acks = 0
+    while True:
+        try:
+            blaster.recv(BUFFER_SIZE)
+        except BlockingIOError:
+            break
+        acks += 1
+    blaster.close()
+    
+    delivered = len(receiver.get_received_data())
+    log_info("\n--- RESULTADOS ---", "TEST_MAIN")
+    log_info(f"Pacotes entregues: {delivered} de {total} em {total_time:.3f}s | {delivered / total_time:,.0f} pacotes/s",
+             "TEST_MAIN")
+    log_info(f"Despertares: {pump_stats['wakeups']} | Lotes: {pump_stats['batches']} | Média por lote: "
+             f"{pump_stats['avg_batch']:.1f} (máximo {pump_stats['max_batch']}) | ACKs enviados: {acks}", "TEST_MAIN")
+    log_info(f"Coletas do GC: {gc_stats['collections']} {tuple(gc_stats['by_generation'])} | Pausa total: "
+             f"{gc_stats['pause_ms']:.2f}ms (máxima {gc_stats['max_pause_ms']:.2f}ms)", "TEST_MAIN")
+    if pump_stats['pool']:
+        pool_stats = pump_stats['pool']
+        log_info(f"Buffers do pool: {pool_stats['created']} criados, {pool_stats['reused']} reutilizados "
+                 f"({pool_stats['reuse_ratio']:.1%})", "TEST_MAIN")
+    log_info(f"Thread de recepção encerrada sem datagrama de parada: {'SIM' if stopped else 'NÃO'}", "TEST_MAIN")
+    all_correct = (receiver.get_received_data() == chunks and stopped and
+                   pump_stats['batches'] < total and acks < total)
+    log_info(f"Todas as mensagens chegaram corretamente: {'SIM' if all_correct else 'NÃO'}", "TEST_MAIN")
+    return all_correct, delivered / total_time, gc_stats
+
 if __name__ == '__main__':
     # --- Teste 2: Go-Back-N ---
     
@@ -85,6 +394,28 @@ if __name__ == '__main__':
     CHANNEL_CONFIG_LOSS = {'loss_rate': 0.1, 'corrupt_rate': 0.0, 'delay_range': (0.0, 0.0)}
     run_gbn_test(5, CHANNEL_CONFIG_LOSS, "GBN - Perda (10%)")
     
-    # Nota: Para o Teste 4 (Análise de Desempenho com Janela Variável), seria necessário
-    # refatorar a classe GBNSender para aceitar o tamanho da janela como parâmetro.
-    # O teste atual usa o valor fixo de 5.
+    # Nota: a análise de desempenho com janela variável (1, 5 e 20, com perda e atraso) está nos cenários gbn do
+    # benchmark: python benchmarks/bench_protocols.py -k gbn
+    
+    # 3. Custo do timer por ACK (o GBN reinicia o timer da base a cada ACK)
+    run_timer_restart_test(5000, "Timer por ACK: threading.Timer x TimingWheel")
+    
+    # 4. Perfil por estágios (codificação, checksum, canal, locks) de uma transferência curta
+    run_stage_profile_test(200, "GBN - Perfil por Estágios")
+    
+    # 5. GBN no SelectorLoop (uma thread para emissor, receptor, timers e canal). Com perda, o tempo é dominado pelo
+    # timeout de 1s, como no teste 2; os cenários gbn-loop do benchmark cobrem perda, corrupção e atraso
+    run_gbn_loop_test(5, CHANNEL_CONFIG_PERFECT, "GBN (SelectorLoop) - Canal Perfeito")
+    
+    # 6. Mensagens de 200KB (4 fragmentos cada), com 5% de perda por fragmento
+    CHANNEL_CONFIG_FRAGMENT_LOSS = {'loss_rate': 0.05, 'corrupt_rate': 0.0, 'delay_range': (0.0, 0.0)}
+    run_fragmentation_test(200000, 20, CHANNEL_CONFIG_FRAGMENT_LOSS, "GBN - Fragmentação e Remontagem (perda de 5%)")
+    
+    # 7. FEC no canal do teste 2 (10% de perda): uma paridade XOR a cada 4 pacotes, fixa e adaptativa
+    run_gbn_fec_test(300, 5, 4, CHANNEL_CONFIG_LOSS, "GBN - FEC por Paridade XOR (perda de 10%)")
+    
+    # 8. Rajadas sem perda direto ao receptor: a ReceivePump lê todos os datagramas pendentes por despertar e os
+    # processa em lote, com um ACK cumulativo por lote. Com recvfrom() (um bytes novo por datagrama) e com o pool de
+    # buffers preenchidos por recvfrom_into(); bytes alocados por pacote: benchmarks/bench_micro.py -k recv
+    run_burst_receive_test(40, 256, "GBN - Recepção em Lotes (rajadas, recvfrom)", recv_pool=False)
+    run_burst_receive_test(40, 256, "GBN - Recepção em Lotes (rajadas, pool de buffers)")
@@ -5,11 +5,18 @@ project_root = os.path.dirname(current_dir)
 sys.path.insert(0, project_root)
 
 import time
+import asyncio
+import hashlib
+import tempfile
 import threading
 import random
-from fase3.tcp_socket import SimpleTCPSocket, MSS
+import multiprocessing
+from fase3.tcp_socket import SimpleTCPSocket, MSS, MAX_MSS, PMTU_SEARCH_PRECISION, clear_peer_cache
+from utils.packet import TCP_HEADER_SIZE
 from fase3.tcp_server import tcp_server_app
 from fase3.tcp_client import tcp_client_app
+from fase3 import tcp_asyncio
+from fase3.tcp_sharded_server import ShardedTCPServer
 from utils.logger import log_info, log_error
 
 # Constantes de Teste
@@ -17,6 +24,7 @@ SERVER_PORT = 17000
 SERVER_ADDR = ('127.0.0.1', SERVER_PORT)
 DATA_SIZE_10KB = 10240
 DATA_10KB = b'x' * DATA_SIZE_10KB
+TRANSFER_TIMEOUT = 120.0 # Uma transferência travada falha o teste em vez de travar a suíte (segundos)
 
 def run_tcp_test(data_to_send, channel_config, test_name):
     log_info(f"\n--- INICIANDO TESTE: {test_name} ---", "TEST_MAIN")
@@ -44,6 +52,588 @@ def run_tcp_test(data_to_send, channel_config, test_name):
     # Retorna True se o teste for concluído sem exceções (simplificação)
     return True
 
+def run_recv_into_test(data_to_send, channel_config, test_name, recv_buffer_size=4096):
+    """ Servidor lê com recv_into() em um buffer pré-alocado e compara byte a byte """
+    log_info(f"\n--- INICIANDO TESTE: {test_name} ---", "TEST_MAIN")
+    
+    port = SERVER_PORT + 1
+    server = SimpleTCPSocket(port, channel_config, recv_buffer_size=recv_buffer_size)
+    server.listen()
+    result = {}
+    
+    def server_side():
+        conn = server.accept()
+        received = bytearray(len(data_to_send))
+        view = memoryview(received)
+        total = 0
+        while total < len(received):
+            n = conn.recv_into(view[total:])
+            if n == 0:
+                break
+            total += n
+        result['data'] = bytes(received[:total])
+        result['extra'] = conn.recv(MSS) # Deve ser EOF (b'') após o FIN do cliente
+        conn.close()
+    
+    server_thread = threading.Thread(target=server_side)
+    server_thread.start()
+    
+    client_thread = threading.Thread(target=tcp_client_app, args=(('127.0.0.1', port), data_to_send, channel_config))
+    client_thread.start()
+    
+    client_thread.join()
+    server_thread.join()
+    server.close()
+    
+    all_correct = result.get('data') == data_to_send and result.get('extra') == b''
+    log_info(f"Bytes recebidos: {len(result.get('data', b''))}/{len(data_to_send)}", "TEST_MAIN")
+    log_info(f"Dados íntegros e em ordem: {'SIM' if all_correct else 'NÃO'}", "TEST_MAIN")
+    return all_correct
+
+def run_tcp_transfer(port, data_to_send, channel_config, server_params=None, client_params=None, read_delay=0.0):
+    """ Transfere data_to_send do cliente para o servidor; retorna (dados recebidos, tempo, conexão aceita, cliente) """
+    server = SimpleTCPSocket(port, channel_config, **(server_params or {}))
+    server.listen()
+    result = {}
+    
+    def server_side():
+        conn = server.accept()
+        time.sleep(read_delay) # Leitor lento: deixa a janela do servidor fechar
+        chunks = []
+        total = 0
+        buf = bytearray(64 * 1024)
+        while True:
+            n = conn.recv_into(buf)
+            if n == 0:
+                break
+            chunks.append(bytes(buf[:n]))
+            total += n
+            if total >= len(data_to_send):
+                result['end'] = time.time()
+        result['data'] = b''.join(chunks)
+        result['conn'] = conn
+        conn.close()
+    
+    server_thread = threading.Thread(target=server_side, daemon=True)
+    server_thread.start()
+    
+    client = SimpleTCPSocket(0, channel_config, **(client_params or {}))
+    client.connect(('127.0.0.1', port))
+    start = time.time()
+    client.send(data_to_send)
+    client.close()
+    server_thread.join(TRANSFER_TIMEOUT)
+    if server_thread.is_alive():
+        log_error(f"Servidor não terminou a transferência em {TRANSFER_TIMEOUT:.0f}s.", "TEST_MAIN")
+    data = result.get('data', b'') # Lido antes de server.close(), que libera um servidor travado em recv
+    server.close()
+    
+    elapsed = result.get('end', time.time()) - start
+    return data, elapsed, result.get('conn'), client
+
+def run_zero_window_test(channel_config, test_name):
+    """ Receptor lento com buffer pequeno: a janela fecha e o persist timer sonda o peer """
+    log_info(f"\n--- INICIANDO TESTE: {test_name} ---", "TEST_MAIN")
+    data = bytes(range(256)) * 40
+    received, elapsed, server, client = run_tcp_transfer(SERVER_PORT + 2, data, channel_config,
+                                                         server_params={'recv_buffer_size': 2048},
+                                                         read_delay=2.0)
+    all_correct = received == data
+    log_info(f"Sondas de janela zero enviadas: {client.window_probe_count}", "TEST_MAIN")
+    log_info(f"Dados íntegros e em ordem: {'SIM' if all_correct else 'NÃO'} ({elapsed:.2f}s)", "TEST_MAIN")
+    return all_correct
+
+def run_tcp_window_benchmark(buffer_sizes, channel_config, data_size=256 * 1024):
+    """ Throughput em função do tamanho dos buffers (janela) em um canal com atraso """
+    log_info(f"\n--- BENCHMARK: Throughput x Tamanho do Buffer ({data_size // 1024}KB, atraso={channel_config['delay_range']}) ---", "TEST_MAIN")
+    data = b'x' * data_size
+    results = []
+    for buffer_size in buffer_sizes:
+        params = {'recv_buffer_size': buffer_size, 'send_buffer_size': buffer_size}
+        received, elapsed, server, client = run_tcp_transfer(SERVER_PORT + 3, data, channel_config,
+                                                             server_params=params, client_params=params)
+        throughput = len(received) / elapsed / 1024 # KB/s
+        results.append((buffer_size, throughput, client.retransmission_count))
+    
+    log_info("\n--- RESULTADOS ---", "TEST_MAIN")
+    for buffer_size, throughput, retransmissions in results:
+        log_info(f"Buffer={buffer_size // 1024:6d}KB | Throughput={throughput:9.1f} KB/s | Retransmissões={retransmissions}", "TEST_MAIN")
+    return results
+
+def run_multi_client_test(num_clients, data_size, channel_config, test_name):
+    """ Um único socket de escuta atende num_clients conexões simultâneas (demultiplexadas por endereço) """
+    log_info(f"\n--- INICIANDO TESTE: {test_name} ---", "TEST_MAIN")
+    port = SERVER_PORT + 4
+    result = {}
+    
+    def server_side():
+        result['data'] = tcp_server_app(port, channel_config, num_clients=num_clients)
+    
+    server_thread = threading.Thread(target=server_side)
+    server_thread.start()
+    time.sleep(0.5) # Dá tempo para o servidor iniciar
+    
+    # Cada cliente envia um padrão diferente para detectar mistura entre conexões
+    payloads = [bytes([i % 256]) * data_size for i in range(num_clients)]
+    start = time.time()
+    client_threads = [threading.Thread(target=tcp_client_app, args=(('127.0.0.1', port), payload, channel_config))
+                      for payload in payloads]
+    for thread in client_threads:
+        thread.start()
+    for thread in client_threads:
+        thread.join()
+    server_thread.join()
+    elapsed = time.time() - start
+    
+    received = result.get('data', [])
+    all_correct = sorted(received) == sorted(payloads)
+    log_info(f"Conexões atendidas: {sum(1 for r in received if r)}/{num_clients} em {elapsed:.2f}s", "TEST_MAIN")
+    log_info(f"Dados íntegros e sem mistura entre conexões: {'SIM' if all_correct else 'NÃO'}", "TEST_MAIN")
+    return all_correct
+
+def run_asyncio_scale_test(num_connections, data_size, channel_config, test_name):
+    """ num_connections conexões simultâneas na versão asyncio, em um único processo e uma única thread """
+    log_info(f"\n--- INICIANDO TESTE: {test_name} ---", "TEST_MAIN")
+    payloads = [bytes([i % 256]) * data_size for i in range(num_connections)]
+    received = []
+    
+    async def handle_client(reader, writer):
+        received.append(await reader.read())
+        writer.close()
+        await writer.wait_closed()
+    
+    async def client(host, payload):
+        reader, writer = await tcp_asyncio.open_connection(host, server.port, channel_params=channel_config)
+        writer.write(payload)
+        await writer.drain()
+        writer.close()
+        await writer.wait_closed()
+    
+    async def main():
+        nonlocal server
+        threads_before = threading.active_count()
+        server = await tcp_asyncio.start_server(handle_client, port=SERVER_PORT + 5, channel_params=channel_config,
+                                                backlog=num_connections)
+        start = time.time()
+        async with server:
+            # Metade pelo nome: as respostas chegam de 127.0.0.1 e precisam encontrar a conexão
+            await asyncio.gather(*(client('localhost' if i % 2 else '127.0.0.1', payload)
+                                   for i, payload in enumerate(payloads)))
+            while len(received) < num_connections:
+                await asyncio.sleep(0.05)
+        elapsed = time.time() - start
+        return elapsed, threading.active_count() - threads_before
+    
+    server = None
+    elapsed, extra_threads = asyncio.run(main())
+    all_correct = sorted(received) == sorted(payloads)
+    log_info(f"Conexões: {len(received)}/{num_connections} em {elapsed:.2f}s | Threads extras: {extra_threads} "
+             f"(SimpleTCPSocket usaria {2 * (num_connections + 1)})", "TEST_MAIN")
+    log_info(f"Dados íntegros e sem mistura entre conexões: {'SIM' if all_correct else 'NÃO'}", "TEST_MAIN")
+    return all_correct
+
+def recv_exactly(conn, nbytes):
+    """ Lê exatamente nbytes (menos apenas se a conexão terminar) """
+    chunks = []
+    while nbytes > 0:
+        data = conn.recv(nbytes)
+        if not data:
+            break
+        chunks.append(data)
+        nbytes -= len(data)
+    return b''.join(chunks)
+
+def run_small_writes_benchmark(channel_config, num_writes=200, write_size=50, write_interval=0.001, rounds=50,
+                               message_size=64):
+    """ Segmentos e tempo com escritas pequenas e com requisição/resposta, para cada combinação
+        de Nagle (nodelay) e ACK atrasado """
+    log_info(f"\n--- BENCHMARK: Nagle e ACK atrasado ({num_writes} escritas de {write_size}B, {rounds} requisições de {message_size}B) ---", "TEST_MAIN")
+    port = SERVER_PORT + 6
+    configs = [(False, True), (True, True), (False, False), (True, False)] # (nodelay, delayed_ack)
+    results = []
+    for nodelay, delayed_ack in configs:
+        params = {'nodelay': nodelay, 'delayed_ack': delayed_ack}
+        server = SimpleTCPSocket(port, channel_config, **params)
+        server.listen()
+        result = {}
+        
+        def server_side():
+            conn = server.accept()
+            result['stream'] = recv_exactly(conn, num_writes * write_size)
+            for _ in range(rounds):
+                conn.send(recv_exactly(conn, message_size)) # Eco
+            recv_exactly(conn, 1) # Espera o FIN do cliente
+            result['conn'] = conn
+            conn.close()
+        
+        server_thread = threading.Thread(target=server_side)
+        server_thread.start()
+        client = SimpleTCPSocket(0, channel_config, **params)
+        client.connect(('127.0.0.1', port))
+        
+        # 1. Muitas escritas pequenas, espaçadas (menos que um RTT entre elas)
+        start = time.time()
+        for i in range(num_writes):
+            client.send(bytes([i % 256]) * write_size)
+            time.sleep(write_interval)
+        while client.last_ack_rcvd != client.next_seq_num or client.send_buffer:
+            time.sleep(0.001)
+        stream_time = time.time() - start
+        stream_segments = client.segments_sent
+        
+        # 2. Requisição/resposta: cada resposta pode levar o ACK da requisição junto
+        start = time.time()
+        ok = True
+        for i in range(rounds):
+            message = bytes([i % 256]) * message_size
+            client.send(message)
+            ok = ok and recv_exactly(client, message_size) == message
+        rr_time = time.time() - start
+        
+        client.close()
+        server_thread.join()
+        server.close()
+        
+        conn = result['conn']
+        expected_stream = b''.join(bytes([i % 256]) * write_size for i in range(num_writes))
+        ok = ok and result['stream'] == expected_stream
+        results.append((nodelay, delayed_ack, stream_segments, stream_time, rr_time,
+                        client.segments_sent + conn.segments_sent, client.pure_acks_sent + conn.pure_acks_sent, ok))
+    
+    log_info("\n--- RESULTADOS ---", "TEST_MAIN")
+    for nodelay, delayed_ack, stream_segments, stream_time, rr_time, total, pure_acks, ok in results:
+        log_info(f"Nagle={'não' if nodelay else 'sim'} | ACK atrasado={'sim' if delayed_ack else 'não'} | "
+                 f"Escritas: {stream_segments:4d} segmentos em {stream_time:.3f}s | Req/resp: {rr_time:.3f}s | "
+                 f"Total: {total:4d} segmentos ({pure_acks} só ACK) | Íntegro: {'SIM' if ok else 'NÃO'}", "TEST_MAIN")
+    return results
+
+def current_rss_kb():
+    """ Memória residente atual do processo em KB (Linux: /proc/self/statm) """
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') // 1024
+
+def file_md5(path):
+    digest = hashlib.md5()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def run_sendfile_test(file_size, channel_config, buffer_size=1024 * 1024, use_sendfile=True):
+    """ Transfere um arquivo de file_size bytes com sendfile()/recvfile() (ou send(f.read()), para comparar);
+        mede throughput e pico de memória residente durante a transferência """
+    mode = "sendfile" if use_sendfile else "send(f.read())"
+    log_info(f"\n--- INICIANDO TESTE: Arquivo de {file_size // (1024 * 1024)}MB com {mode} ---", "TEST_MAIN")
+    port = SERVER_PORT + 7
+    block = os.urandom(1024 * 1024)
+    with tempfile.NamedTemporaryFile(delete=False) as src:
+        for written in range(0, file_size, len(block)):
+            src.write(block[:file_size - written])
+    dst_path = src.name + '.recv'
+    
+    params = {'recv_buffer_size': buffer_size, 'send_buffer_size': buffer_size}
+    server = SimpleTCPSocket(port, channel_config, **params)
+    server.listen()
+    result = {}
+    
+    def server_side():
+        conn = server.accept()
+        result['received'] = conn.recvfile(dst_path)
+        result['end'] = time.time()
+        conn.close()
+    
+    # Amostra a memória residente durante a transferência
+    rss_start = current_rss_kb()
+    rss_peak = [rss_start]
+    sampling = threading.Event()
+    def sample_rss():
+        while not sampling.wait(0.05):
+            rss_peak[0] = max(rss_peak[0], current_rss_kb())
+    
+    server_thread = threading.Thread(target=server_side)
+    sampler = threading.Thread(target=sample_rss)
+    server_thread.start()
+    sampler.start()
+    
+    client = SimpleTCPSocket(0, channel_config, **params)
+    client.connect(('127.0.0.1', port))
+    start = time.time()
+    if use_sendfile:
+        client.sendfile(src.name)
+    else:
+        with open(src.name, 'rb') as f:
+            client.send(f.read())
+    client.close()
+    server_thread.join()
+    server.close()
+    sampling.set()
+    sampler.join()
+    
+    elapsed = result.get('end', time.time()) - start
+    all_correct = result.get('received') == file_size and file_md5(dst_path) == file_md5(src.name)
+    os.unlink(src.name)
+    os.unlink(dst_path)
+    
+    log_info(f"{mode}: {file_size / elapsed / (1024 * 1024):.2f} MB/s ({elapsed:.2f}s) | "
+             f"Pico de RSS: +{(rss_peak[0] - rss_start) / 1024:.1f} MB", "TEST_MAIN")
+    log_info(f"Arquivo íntegro: {'SIM' if all_correct else 'NÃO'}", "TEST_MAIN")
+    return all_correct
+
+def run_mss_benchmark(mss_values, channel_config, data_size=8 * 1024 * 1024, buffer_size=1024 * 1024):
+    """ Throughput em função do MSS negociado no handshake (menos segmentos = menos overhead por segmento) """
+    log_info(f"\n--- BENCHMARK: Throughput x MSS ({data_size // (1024 * 1024)}MB, buffer {buffer_size // 1024}KB) ---", "TEST_MAIN")
+    data = os.urandom(data_size)
+    results = []
+    for mss in mss_values:
+        params = {'recv_buffer_size': buffer_size, 'send_buffer_size': buffer_size, 'mss': mss}
+        received, elapsed, server, client = run_tcp_transfer(SERVER_PORT + 8, data, channel_config,
+                                                             server_params=params, client_params=params)
+        results.append((mss, client.snd_mss, len(received) / elapsed / (1024 * 1024), client.segments_sent,
+                        received == data))
+    
+    log_info("\n--- RESULTADOS ---", "TEST_MAIN")
+    for mss, snd_mss, throughput, segments, ok in results:
+        log_info(f"MSS={mss:6d} (usado {snd_mss:6d}) | Throughput={throughput:7.2f} MB/s | Segmentos={segments:6d} | "
+                 f"Íntegro: {'SIM' if ok else 'NÃO'}", "TEST_MAIN")
+    return results
+
+def run_pmtu_probe_test(path_mtu, test_name, chunk_size=1024 * 1024, time_limit=30.0):
+    """ Caminho com MTU menor que o MSS anunciado: o PLPMTUD encontra o maior segmento que passa
+        (o cliente continua enviando até a busca terminar, independente da vazão) """
+    log_info(f"\n--- INICIANDO TESTE: {test_name} ---", "TEST_MAIN")
+    channel_config = {'loss_rate': 0.0, 'corrupt_rate': 0.0, 'delay_range': (0.0, 0.0), 'mtu': path_mtu}
+    params = {'recv_buffer_size': 256 * 1024, 'send_buffer_size': 256 * 1024, 'mss': MAX_MSS, 'pmtu_probe': True}
+    port = SERVER_PORT + 9
+    server = SimpleTCPSocket(port, channel_config, **params)
+    server.listen()
+    digest = {}
+    
+    def server_side():
+        conn = server.accept()
+        md5 = hashlib.md5()
+        buf = bytearray(64 * 1024)
+        while True:
+            n = conn.recv_into(buf)
+            if n == 0:
+                break
+            md5.update(buf[:n])
+        digest['received'] = md5.hexdigest()
+        conn.close()
+    
+    server_thread = threading.Thread(target=server_side)
+    server_thread.start()
+    client = SimpleTCPSocket(0, channel_config, **params)
+    client.connect(('127.0.0.1', port))
+    sent = hashlib.md5()
+    start = time.time()
+    while client.pmtu_high - client.pmtu_low >= PMTU_SEARCH_PRECISION and time.time() - start < time_limit:
+        chunk = os.urandom(chunk_size)
+        client.send(chunk)
+        sent.update(chunk)
+    elapsed = time.time() - start
+    client.close()
+    server_thread.join()
+    server.close()
+    
+    # Maior payload que cabe no MTU em um segmento sem opções
+    best_mss = path_mtu - TCP_HEADER_SIZE
+    all_correct = (digest.get('received') == sent.hexdigest() and
+                   best_mss - PMTU_SEARCH_PRECISION <= client.snd_mss <= best_mss)
+    log_info(f"MTU do caminho={path_mtu} | MSS encontrado={client.snd_mss} (ideal {best_mss}) | "
+             f"Sondas={client.pmtu_probes_sent} | {elapsed:.2f}s", "TEST_MAIN")
+    log_info(f"Dados íntegros e MSS dentro da precisão da busca: {'SIM' if all_correct else 'NÃO'}", "TEST_MAIN")
+    return all_correct
+
+def run_header_prediction_test(channel_config, test_name, data_size=4 * 1024 * 1024):
+    """ Transferência em massa: fração dos segmentos tratada pela predição de cabeçalho em cada lado """
+    log_info(f"\n--- INICIANDO TESTE: {test_name} ---", "TEST_MAIN")
+    data = os.urandom(data_size)
+    params = {'recv_buffer_size': 256 * 1024, 'send_buffer_size': 256 * 1024}
+    received, elapsed, conn, client = run_tcp_transfer(SERVER_PORT + 10, data, channel_config,
+                                                       server_params=params, client_params=params)
+    for side, sock in (("Emissor (ACKs)", client), ("Receptor (dados)", conn)):
+        stats = sock.header_prediction_stats()
+        log_info(f"{side}: fast path ACK={stats['acks']} dados={stats['data']} | caminho geral={stats['slow']} | "
+                 f"acerto={stats['hit_rate'] * 100:.1f}%", "TEST_MAIN")
+    all_correct = received == data
+    log_info(f"Dados íntegros e em ordem: {'SIM' if all_correct else 'NÃO'} ({data_size / elapsed / (1024 * 1024):.2f} MB/s)", "TEST_MAIN")
+    return all_correct
+
+def run_bidirectional_lock_test(data_size, channel_config, test_name):
+    """ Os dois lados enviam e recebem ao mesmo tempo; mede a contenção dos locks de envio e recepção """
+    log_info(f"\n--- INICIANDO TESTE: {test_name} ---", "TEST_MAIN")
+    port = SERVER_PORT + 11
+    params = {'recv_buffer_size': 256 * 1024, 'send_buffer_size': 256 * 1024, 'instrument_locks': True}
+    server = SimpleTCPSocket(port, channel_config, **params)
+    server.listen()
+    accepted = {}
+    accept_thread = threading.Thread(target=lambda: accepted.setdefault('conn', server.accept()))
+    accept_thread.start()
+    client = SimpleTCPSocket(0, channel_config, **params)
+    client.connect(('127.0.0.1', port))
+    accept_thread.join()
+    conn = accepted['conn']
+    
+    upload, download = os.urandom(data_size), os.urandom(data_size)
+    received = {}
+    threads = [threading.Thread(target=client.send, args=(upload,)),
+               threading.Thread(target=conn.send, args=(download,)),
+               threading.Thread(target=lambda: received.setdefault('server', recv_exactly(conn, data_size))),
+               threading.Thread(target=lambda: received.setdefault('client', recv_exactly(client, data_size)))]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - start
+    
+    close_thread = threading.Thread(target=conn.close)
+    close_thread.start()
+    client.close()
+    close_thread.join()
+    server.close()
+    
+    for side, sock in (("Cliente", client), ("Servidor", conn)):
+        for name, stats in sock.lock_stats().items():
+            log_info(f"{side} lock {name}: {stats['acquisitions']} aquisições | contenção="
+                     f"{stats['contention_rate'] * 100:.2f}% | espera={stats['wait_time'] * 1000:.1f}ms "
+                     f"(máx {stats['max_wait'] * 1000:.2f}ms) | retido={stats['hold_time'] * 1000:.1f}ms", "TEST_MAIN")
+    all_correct = received.get('server') == upload and received.get('client') == download
+    log_info(f"Dados íntegros nos dois sentidos: {'SIM' if all_correct else 'NÃO'} "
+             f"({2 * data_size / elapsed / (1024 * 1024):.2f} MB/s somando os sentidos)", "TEST_MAIN")
+    return all_correct
+
+def run_fast_open_test(channel_config, test_name, fast_open=True, num_connections=3, data_size=1000):
+    """ Conexões curtas e seguidas ao mesmo servidor: com fast open, a partir da segunda os dados vão no SYN.
+        Mede o tempo até o primeiro byte chegar ao servidor e o tempo total de tcp_client_app """
+    log_info(f"\n--- INICIANDO TESTE: {test_name} ---", "TEST_MAIN")
+    port = SERVER_PORT + 12
+    server = SimpleTCPSocket(port, channel_config, fast_open=fast_open)
+    server.listen()
+    results = []
+    
+    def server_side():
+        for _ in range(num_connections):
+            conn = server.accept()
+            first = conn.recv(data_size)
+            first_byte_at = time.time()
+            received = first + recv_exactly(conn, data_size - len(first))
+            recv_exactly(conn, 1) # Espera o FIN do cliente
+            results.append((received, first_byte_at, conn.fastopen_accepted))
+            conn.close()
+    
+    server_thread = threading.Thread(target=server_side)
+    server_thread.start()
+    clear_peer_cache()
+    data = os.urandom(data_size)
+    timings = []
+    for _ in range(num_connections):
+        start = time.time()
+        tcp_client_app(('127.0.0.1', port), data, channel_config, fast_open=fast_open)
+        timings.append((start, time.time() - start))
+    server_thread.join()
+    server.close()
+    
+    all_correct = len(results) == num_connections
+    for i, ((received, first_byte_at, syn_bytes), (start, elapsed)) in enumerate(zip(results, timings)):
+        log_info(f"Conexão {i + 1}: dados no SYN={syn_bytes:5d} bytes | primeiro byte no servidor em "
+                 f"{(first_byte_at - start) * 1000:6.1f}ms | tcp_client_app: {elapsed * 1000:6.1f}ms", "TEST_MAIN")
+        # Com fast open, só a primeira conexão (que obtém o cookie) não leva dados no SYN
+        expected_syn_bytes = data_size if fast_open and i > 0 else 0
+        all_correct = all_correct and received == data and syn_bytes == expected_syn_bytes
+    log_info(f"Dados íntegros{' e entregues no SYN' if fast_open else ''}: {'SIM' if all_correct else 'NÃO'}", "TEST_MAIN")
+    return all_correct
+
+def sharded_load_client(port, num_connections, data_size, channel_config, done_queue):
+    """ Processo gerador de carga: conexões seguidas, cada uma enviando data_size bytes """
+    data = b'c' * data_size
+    completed = 0
+    for _ in range(num_connections):
+        client = SimpleTCPSocket(0, channel_config)
+        try:
+            client.connect(('127.0.0.1', port), data)
+            client.close()
+            completed += 1
+        except Exception as e:
+            log_error(f"Erro no cliente: {e}", "TEST_MAIN")
+            client.close()
+    done_queue.put(completed)
+
+def run_sharded_server_benchmark(worker_counts, channel_config, num_client_procs=4, conns_per_client=25,
+                                 data_size=64 * 1024):
+    """ Servidor com N processos worker na mesma porta (SO_REUSEPORT): conexões por segundo e throughput agregado
+        conforme N cresce. A carga também vem de vários processos, para o cliente não ser o gargalo """
+    log_info(f"\n--- INICIANDO TESTE: Servidor com Vários Processos (SO_REUSEPORT, {os.cpu_count()} núcleos) ---",
+             "TEST_MAIN")
+    port = SERVER_PORT + 13
+    total_connections = num_client_procs * conns_per_client
+    context = multiprocessing.get_context('spawn')
+    results = []
+    all_correct = True
+    for num_workers in worker_counts:
+        with ShardedTCPServer(port, num_workers, channel_config) as server:
+            done_queue = context.Queue()
+            clients = [context.Process(target=sharded_load_client,
+                                       args=(port, conns_per_client, data_size, channel_config, done_queue))
+                       for _ in range(num_client_procs)]
+            start_time = time.time()
+            for client in clients:
+                client.start()
+            completed = sum(done_queue.get() for _ in clients)
+            elapsed = time.time() - start_time
+            for client in clients:
+                client.join()
+        metrics = server.metrics()
+        per_worker = [report['completed'] for report in metrics['per_worker']]
+        correct = (completed == total_connections and metrics['completed'] == total_connections
+                   and metrics['bytes'] == total_connections * data_size)
+        all_correct = all_correct and correct
+        results.append((num_workers, completed / elapsed, metrics['bytes'] / elapsed / 1024 / 1024, per_worker,
+                        metrics['retransmissions'], correct))
+    
+    log_info("\n--- RESULTADOS ---", "TEST_MAIN")
+    for num_workers, conn_rate, throughput, per_worker, retransmissions, correct in results:
+        log_info(f"Workers: {num_workers:2d} | {conn_rate:7.1f} conexões/s | {throughput:6.2f} MB/s | "
+                 f"Conexões por worker: {per_worker} | Retransmissões: {retransmissions} | "
+                 f"Íntegro: {'SIM' if correct else 'NÃO'}", "TEST_MAIN")
+    return all_correct
+
+def run_compression_test(channel_config, test_name, data_size=2 * 1024 * 1024):
+    """ Compressão negociada no handshake: texto (comprime), bytes aleatórios (vão crus, sem gastar CPU em todo
+        bloco) e um servidor sem compressão (a conexão segue sem ela). Registra bytes na rede e CPU por conexão """
+    log_info(f"\n--- INICIANDO TESTE: {test_name} ---", "TEST_MAIN")
+    text = b''.join(b'%08d;sensor-%03d;temperatura=%.1f;status=ok\n' % (i, i % 97, 20 + i % 13 / 10)
+                    for i in range(data_size // 40))[:data_size]
+    params = {'recv_buffer_size': 64 * 1024, 'send_buffer_size': 64 * 1024}
+    compressed = dict(params, compression=True)
+    cases = [("Texto, sem compressão", text, params, params),
+             ("Texto, compressão", text, compressed, compressed),
+             ("Aleatório, compressão", os.urandom(data_size), compressed, compressed),
+             ("Servidor sem compressão", text, params, compressed)]
+    all_correct = True
+    for label, data, server_params, client_params in cases:
+        received, elapsed, conn, client = run_tcp_transfer(SERVER_PORT + 14, data, channel_config,
+                                                           server_params=server_params, client_params=client_params)
+        stats = client.compression_stats()
+        ok = received == data and stats['codec'] == (conn.compression_stats()['codec'] if conn else None)
+        if stats['codec'] is None:
+            ok = ok and label != "Texto, compressão"
+            log_info(f"{label:24s}: {'OK ' if ok else 'ERRO'} | {len(data)} bytes na rede | "
+                     f"{len(data) / elapsed / (1024 * 1024):7.2f} MB/s", "TEST_MAIN")
+        else:
+            received_stats = conn.compression_stats()
+            # Aleatório: nenhum bloco comprime, e as tentativas param depois dos primeiros
+            ok = ok and (stats['raw_blocks'] == stats['blocks'] if label.startswith("Aleatório")
+                         else stats['send_ratio'] < 0.5)
+            log_info(f"{label:24s}: {'OK ' if ok else 'ERRO'} | {stats['codec']}: {stats['sent_wire_bytes']} bytes na "
+                     f"rede ({stats['send_ratio'] * 100:.1f}%) | blocos crus: {stats['raw_blocks']}/{stats['blocks']} "
+                     f"| CPU: compressão {stats['compress_cpu_ms']:.1f}ms, descompressão "
+                     f"{received_stats['decompress_cpu_ms']:.1f}ms | {len(data) / elapsed / (1024 * 1024):7.2f} MB/s",
+                     "TEST_MAIN")
+        all_correct = all_correct and ok
+    log_info(f"Dados íntegros e compressão negociada corretamente: {'SIM' if all_correct else 'NÃO'}", "TEST_MAIN")
+    return all_correct
+
 if __name__ == '__main__':
     # --- Teste 3: TCP Simplificado ---
     
@@ -55,7 +645,62 @@ if __name__ == '__main__':
     CHANNEL_CONFIG_LOSS = {'loss_rate': 0.2, 'corrupt_rate': 0.0, 'delay_range': (0.0, 0.0)}
     run_tcp_test(DATA_10KB, CHANNEL_CONFIG_LOSS, "TCP - Retransmissão (20% de Perda)")
     
-    # 3. Teste de Encerramento (Requer análise de logs para FIN/ACK)
+    # 3. Buffer circular: leitura com recv_into() e janela menor que os dados enviados
+    DATA_PATTERN = bytes(range(256)) * 40
+    run_recv_into_test(DATA_PATTERN, CHANNEL_CONFIG_PERFECT, "TCP - recv_into com Buffer Circular (10KB, rwnd 3KB)", recv_buffer_size=3000)
+    
+    # 4. Controle de fluxo: janela zero e persist timer (com perdas, inclusive das atualizações de janela)
+    CHANNEL_CONFIG_LOSS_LOW = {'loss_rate': 0.1, 'corrupt_rate': 0.0, 'delay_range': (0.0, 0.0)}
+    run_zero_window_test(CHANNEL_CONFIG_LOSS_LOW, "TCP - Janela Zero e Persist Timer")
+    
+    # 5. Janelas grandes (Window Scale): throughput x buffer com RTT de 100ms
+    CHANNEL_CONFIG_DELAY = {'loss_rate': 0.0, 'corrupt_rate': 0.0, 'delay_range': (0.05, 0.05)}
+    run_tcp_window_benchmark([4 * 1024, 16 * 1024, 64 * 1024, 256 * 1024, 1024 * 1024], CHANNEL_CONFIG_DELAY)
+    
+    # 6. Vários clientes simultâneos no mesmo socket de escuta (accept backlog + demultiplexação)
+    run_multi_client_test(200, 4096, None, "TCP - 200 Clientes Simultâneos (4KB cada)")
+    
+    # 7. Versão asyncio: 1000 conexões simultâneas em um único processo, sem threads por conexão
+    run_asyncio_scale_test(1000, 4096, None, "TCP asyncio - 1000 Conexões Simultâneas (4KB cada)")
+    
+    # 8. Nagle e ACK atrasado: menos segmentos para escritas pequenas e tráfego requisição/resposta
+    CHANNEL_CONFIG_DELAY_LOW = {'loss_rate': 0.0, 'corrupt_rate': 0.0, 'delay_range': (0.01, 0.01)}
+    run_small_writes_benchmark(CHANNEL_CONFIG_DELAY_LOW)
+    
+    # 9. Arquivos: sendfile() (mmap + memoryview, memória limitada) vs send(f.read())
+    # (o enunciado pede 1GB: use run_sendfile_test(1024 * 1024 * 1024, None); aqui 64MB para o teste ser rápido)
+    run_sendfile_test(64 * 1024 * 1024, None)
+    run_sendfile_test(64 * 1024 * 1024, None, use_sendfile=False)
+    
+    # 10. MSS negociado no handshake: throughput x tamanho do segmento (canal perfeito)
+    run_mss_benchmark([536, 1024, 4096, 16384, MAX_MSS], None)
+    
+    # 11. PLPMTUD: MSS anunciado de 64KB em um caminho com MTU de 9000 bytes (jumbo frame)
+    run_pmtu_probe_test(9000, "TCP - PLPMTUD (MTU 9000)")
+    
+    # 12. Predição de cabeçalho: taxa de acerto do fast path sem e com perdas
+    run_header_prediction_test(None, "TCP - Predição de Cabeçalho (canal perfeito)")
+    run_header_prediction_test(CHANNEL_CONFIG_LOSS_LOW, "TCP - Predição de Cabeçalho (10% de perda)", data_size=256 * 1024)
+    
+    # 13. Locks separados de envio e recepção: contenção com tráfego nos dois sentidos
+    run_bidirectional_lock_test(16 * 1024 * 1024, None, "TCP - Contenção de Locks (16MB em cada sentido)")
+    run_bidirectional_lock_test(2 * 1024 * 1024, CHANNEL_CONFIG_DELAY_LOW, "TCP - Contenção de Locks (2MB, RTT 20ms)")
+    
+    # 14. Fast open: dados no SYN e parâmetros do peer em cache (RTT de 100ms)
+    run_fast_open_test(CHANNEL_CONFIG_DELAY, "TCP - Conexões Curtas sem Fast Open", fast_open=False)
+    run_fast_open_test(CHANNEL_CONFIG_DELAY, "TCP - Conexões Curtas com Fast Open (0-RTT)")
+    
+    # 15. Servidor com vários processos na mesma porta (SO_REUSEPORT): de 1 worker até o número de núcleos
+    worker_counts = sorted({1, 2, 4, os.cpu_count() or 1} & set(range(1, (os.cpu_count() or 1) + 1)))
+    run_sharded_server_benchmark(worker_counts, None)
+    
+    # 16. Compressão negociada no handshake (zlib; lz4/zstd se instalados), com 10% de perda
+    run_compression_test(None, "TCP - Compressão Negociada (canal perfeito)")
+    # Semente fixa: o mesmo padrão de perdas em toda execução
+    run_compression_test(dict(CHANNEL_CONFIG_LOSS_LOW, seed=48), "TCP - Compressão Negociada (10% de perda)",
+                         data_size=256 * 1024)
+    
+    # 17. Teste de Encerramento (Requer análise de logs para FIN/ACK)
     # O teste de encerramento está implícito no final de cada `tcp_client_app` e `tcp_server_app`.
     # Para verificar o controle de fluxo (Teste 3), seria necessário modificar a janela de recepção
     # no `SimpleTCPSocket` e observar o comportamento do cliente.
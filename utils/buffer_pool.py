@@ -0,0 +1,71 @@
+# Pool de buffers de recepção: bytearrays de tamanho fixo preenchidos com recvfrom_into(), em vez de um objeto bytes
+# novo a cada recvfrom(). O datagrama recebido é um memoryview do slot; os decodificadores fatiam esse memoryview (sem
+# copiar) e só o que é entregue à aplicação ou guardado para depois (fora de ordem, fragmentos, FEC) é copiado com
+# bytes(). O slot volta ao pool quando o pacote é entregue ou descartado: nos receptores, ao fim do lote.
+
+POOL_SLOTS = 64 # Slots livres guardados para reuso (o bastante para um lote inteiro da ReceivePump)
+
+class BufferSlot:
+    """ Buffer reutilizável de um BufferPool. data: memoryview dos bytes do último datagrama recebido """
+    __slots__ = ('pool', 'buffer', 'view', 'data')
+
+    def __init__(self, pool, size):
+        self.pool = pool
+        self.buffer = bytearray(size)
+        self.view = memoryview(self.buffer)
+        self.data = None
+
+    def recvfrom(self, sock):
+        """ recvfrom_into() no buffer do slot: (memoryview dos bytes recebidos, endereço) """
+        n, addr = sock.recvfrom_into(self.buffer)
+        self.data = self.view[:n]
+        return self.data, addr
+
+    def release(self):
+        """ Devolve o slot ao pool: os memoryviews de data deixam de valer (o próximo datagrama sobrescreve o buffer) """
+        self.data = None
+        self.pool.release(self)
+
+class BufferPool:
+    """ Slots de slot_size bytes, criados sob demanda e reutilizados: com o pool aquecido, receber um datagrama não
+        aloca o buffer. Até max_slots slots livres ficam guardados; os que voltam além disso são descartados.
+        Não é thread-safe: é usado pela thread que lê o socket """
+
+    def __init__(self, slot_size, max_slots=POOL_SLOTS):
+        if slot_size <= 0:
+            raise ValueError("Tamanho do slot deve ser positivo.")
+        self.slot_size = slot_size
+        self.max_slots = max_slots
+        self._free = []
+        # Estatísticas
+        self.created = 0
+        self.reused = 0
+        self.discarded = 0
+        self.in_use = 0
+        self.max_in_use = 0
+
+    def acquire(self):
+        if self._free:
+            slot = self._free.pop()
+            self.reused += 1
+        else:
+            slot = BufferSlot(self, self.slot_size)
+            self.created += 1
+        self.in_use += 1
+        if self.in_use > self.max_in_use:
+            self.max_in_use = self.in_use
+        return slot
+
+    def release(self, slot):
+        self.in_use -= 1
+        if len(self._free) < self.max_slots:
+            self._free.append(slot)
+        else:
+            self.discarded += 1
+
+    def stats(self):
+        """ {'slot_size', 'created', 'reused', 'discarded', 'in_use', 'max_in_use', 'reuse_ratio'} """
+        acquired = self.created + self.reused
+        return {'slot_size': self.slot_size, 'created': self.created, 'reused': self.reused,
+                'discarded': self.discarded, 'in_use': self.in_use, 'max_in_use': self.max_in_use,
+                'reuse_ratio': self.reused / acquired if acquired else 0.0}
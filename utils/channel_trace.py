@@ -0,0 +1,177 @@
+import re
+import struct
+import threading
+from collections import namedtuple
+
+# Traços do canal simulado: o destino de cada datagrama (perdido, byte e bit corrompidos, atraso), gravados por
+# um UnreliableChannel e reproduzidos exatamente por outro. Um traço tem um stream por canal, na ordem em que os
+# canais são criados (em uma execução, cada direção tem o seu): o n-ésimo datagrama enviado por um canal recebe o
+# n-ésimo destino do seu stream.
+#
+# Formato binário: cabeçalho (magic, versão, número de streams) e, para cada stream, o número de registros seguido
+# dos registros de 10 bytes: flags (bit 0: perdido, bit 1: corrompido), bit corrompido, byte corrompido e atraso em
+# microssegundos.
+
+TRACE_MAGIC = b'CHTR'
+TRACE_VERSION = 1
+TRACE_HEADER_FORMAT = '!4s B H'
+TRACE_RECORD_FORMAT = '!B B I I'
+TRACE_RECORD_SIZE = struct.calcsize(TRACE_RECORD_FORMAT)
+FLAG_DROP = 0x01
+FLAG_CORRUPT = 0x02
+
+# Destino de um datagrama: corrupt_offset é None se ele não é corrompido (tomado módulo o tamanho do datagrama)
+PacketFate = namedtuple('PacketFate', ['drop', 'corrupt_offset', 'corrupt_bit', 'delay'])
+DELIVER = PacketFate(False, None, 0, 0.0)
+DROP = PacketFate(True, None, 0, 0.0)
+
+_PING_REPLY = re.compile(r'icmp_seq=(\d+).*?time[=<]([\d.]+)\s*ms')
+_PING_TIMEOUT = re.compile(r'(?:timeout|timed out).*?icmp_seq[= ](\d+)', re.IGNORECASE)
+_LOSS_MARKERS = ('loss', 'lost', 'timeout', '-', '*', 'nan')
+
+class TraceStream:
+    """ Destinos de um canal: grava (append) ou reproduz (next_fate) em ordem """
+
+    def __init__(self, fates, replay, repeat=True):
+        self.fates = fates
+        self.replay = replay
+        self.repeat = repeat # Ao fim do stream, recomeça (False: entrega os demais datagramas sem perda nem atraso)
+        self.position = 0
+        self.wraps = 0
+        self._lock = threading.Lock() # O canal é usado por várias threads (aplicação, timers, loop de recepção)
+
+    def append(self, fate):
+        self.fates.append(fate)
+
+    def next_fate(self):
+        with self._lock:
+            if self.position >= len(self.fates):
+                if not self.repeat or not self.fates:
+                    return DELIVER
+                self.position = 0
+                self.wraps += 1
+            fate = self.fates[self.position]
+            self.position += 1
+            return fate
+
+class ChannelTrace:
+    """ Conjunto de streams de destinos. Gravação: ChannelTrace() passado aos canais (channel_params['trace']) e
+        save() ao final. Reprodução: ChannelTrace.load(), from_series() ou from_capture(); se houver mais canais que
+        streams, os streams são reaproveitados em ordem (cada canal com sua própria posição) """
+
+    def __init__(self, streams=None, repeat=True):
+        self.replay = streams is not None
+        self.streams = streams if streams is not None else []
+        self.repeat = repeat
+        self._attached = 0
+        self._lock = threading.Lock()
+
+    def attach(self):
+        """ Stream do próximo canal criado """
+        with self._lock:
+            index = self._attached
+            self._attached += 1
+            if not self.replay:
+                stream = TraceStream([], replay=False)
+                self.streams.append(stream.fates)
+                return stream
+            if not self.streams:
+                return TraceStream([], replay=True, repeat=False)
+            return TraceStream(self.streams[index % len(self.streams)], replay=True, repeat=self.repeat)
+
+    def save(self, path):
+        record = struct.Struct(TRACE_RECORD_FORMAT)
+        with open(path, 'wb') as f:
+            f.write(struct.pack(TRACE_HEADER_FORMAT, TRACE_MAGIC, TRACE_VERSION, len(self.streams)))
+            for fates in self.streams:
+                f.write(struct.pack('!I', len(fates)))
+                f.write(b''.join(record.pack((FLAG_DROP if fate.drop else 0) |
+                                             (FLAG_CORRUPT if fate.corrupt_offset is not None else 0),
+                                             fate.corrupt_bit, fate.corrupt_offset or 0,
+                                             min(round(fate.delay * 1e6), 0xFFFFFFFF))
+                                 for fate in fates))
+
+    @classmethod
+    def load(cls, path, repeat=True):
+        with open(path, 'rb') as f:
+            content = f.read()
+        header_size = struct.calcsize(TRACE_HEADER_FORMAT)
+        magic, version, count = struct.unpack_from(TRACE_HEADER_FORMAT, content)
+        if magic != TRACE_MAGIC or version != TRACE_VERSION:
+            raise ValueError(f"{path} não é um traço de canal (versão {TRACE_VERSION}).")
+        streams = []
+        offset = header_size
+        for _ in range(count):
+            (length,) = struct.unpack_from('!I', content, offset)
+            offset += 4
+            end = offset + length * TRACE_RECORD_SIZE
+            records = struct.iter_unpack(TRACE_RECORD_FORMAT, content[offset:end])
+            streams.append([PacketFate(bool(flags & FLAG_DROP), byte if flags & FLAG_CORRUPT else None, bit,
+                                       delay / 1e6) for flags, bit, byte, delay in records])
+            offset = end
+        return cls(streams, repeat)
+
+    @classmethod
+    def from_series(cls, samples, repeat=True):
+        """ Um stream a partir de uma série de atrasos em segundos (None: perda), usada por todos os canais """
+        return cls([[DROP if delay is None else PacketFate(False, None, 0, delay) for delay in samples]], repeat)
+
+    @classmethod
+    def from_capture(cls, path, repeat=True):
+        """ Série capturada fora do simulador:
+            - saída do ping: o atraso de cada direção é metade do RTT, e cada resposta que falta (icmp_seq pulado ou
+              timeout) é uma perda, atribuída alternadamente a um dos dois streams (ida e volta);
+            - texto com um atraso em ms por linha (ou a última coluna de um CSV); 'loss', 'timeout' ou '-' é perda """
+        with open(path) as f:
+            lines = f.read().splitlines()
+        if any('icmp_seq' in line for line in lines):
+            return cls(_parse_ping(lines), repeat)
+        samples = []
+        for line in lines:
+            value = line.strip().split(',')[-1].strip().lower()
+            if not value or value.startswith('#'):
+                continue
+            if value in _LOSS_MARKERS:
+                samples.append(None)
+                continue
+            try:
+                samples.append(float(value) / 1000)
+            except ValueError:
+                continue # Cabeçalho do CSV
+        return cls.from_series(samples, repeat)
+
+    def stats(self):
+        """ {'streams', 'fates', 'drops', 'corruptions'} """
+        fates = [fate for stream in self.streams for fate in stream]
+        return {'streams': len(self.streams), 'fates': len(fates), 'drops': sum(fate.drop for fate in fates),
+                'corruptions': sum(fate.corrupt_offset is not None for fate in fates)}
+
+def _parse_ping(lines):
+    replies = {}
+    timeouts = set()
+    for line in lines:
+        match = _PING_REPLY.search(line)
+        if match:
+            replies[int(match.group(1))] = float(match.group(2)) / 1000
+            continue
+        match = _PING_TIMEOUT.search(line)
+        if match:
+            timeouts.add(int(match.group(1)))
+    sequence = sorted(set(replies) | timeouts)
+    if not sequence:
+        return [[], []]
+    streams = [[], []]
+    lost = 0
+    delay = replies[min(replies)] / 2 if replies else 0.0
+    for seq in range(sequence[0], sequence[-1] + 1):
+        if seq in replies:
+            delay = replies[seq] / 2
+            fate = PacketFate(False, None, 0, delay)
+            streams[0].append(fate)
+            streams[1].append(fate)
+        else:
+            # A outra direção entregou: mantém o último atraso medido
+            streams[lost % 2].append(DROP)
+            streams[1 - lost % 2].append(PacketFate(False, None, 0, delay))
+            lost += 1
+    return streams
@@ -0,0 +1,187 @@
+import struct
+import time
+import zlib
+
+# Dependências opcionais: lz4 e zstd só são oferecidos no handshake se estiverem instalados
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Compressão do fluxo de bytes de uma conexão TCP, negociada no handshake. O emissor comprime blocos do buffer de
+# envio e os envia como quadros; os números de sequência, a janela e a segmentação em MSS valem sobre os bytes dos
+# quadros (os que vão pela rede). O receptor decodifica os quadros na leitura, então o buffer de recepção e a janela
+# anunciada também são contados em bytes da rede.
+#
+# Quadro: cabeçalho de 4 bytes (tipo no byte mais alto, tamanho do corpo nos outros 3) seguido do corpo, comprimido
+# ou cru (bloco que não comprime o suficiente vai como está).
+
+CODEC_ZLIB = 1
+CODEC_LZ4 = 2
+CODEC_ZSTD = 3
+CODEC_NAMES = {CODEC_ZLIB: 'zlib', CODEC_LZ4: 'lz4', CODEC_ZSTD: 'zstd'}
+CODEC_PREFERENCE = (CODEC_ZSTD, CODEC_LZ4, CODEC_ZLIB) # Oferta do cliente com compression=True
+
+FRAME_HEADER_FORMAT = '!I'
+FRAME_HEADER_SIZE = struct.calcsize(FRAME_HEADER_FORMAT)
+FRAME_RAW = 0
+FRAME_COMPRESSED = 1
+MAX_FRAME_BODY = 0xFFFFFF
+
+COMPRESS_BLOCK = 16 * 1024 # Bytes da aplicação por quadro
+COMPRESS_MAX_BLOCK = 1024 * 1024 # Maior bloco aceito na descompressão (limita blocos maliciosos)
+COMPRESS_MIN_SIZE = 64 # Blocos menores vão crus: o cabeçalho do codec come o ganho
+COMPRESS_MIN_SAVING = 0.9 # O bloco comprimido precisa ter no máximo esta fração do original
+COMPRESS_MAX_SKIP = 16 # Após blocos incompressíveis seguidos, até este número de blocos vai cru sem tentativa
+ZLIB_LEVEL = 6
+
+_frame_header = struct.Struct(FRAME_HEADER_FORMAT)
+
+# Descompressão limitada a COMPRESS_MAX_BLOCK. Corpo corrompido ou grande demais levanta ValueError, como um quadro
+# de tipo desconhecido (o socket aborta a conexão)
+
+def _zlib_decompress(body):
+    decompressor = zlib.decompressobj()
+    try:
+        raw = decompressor.decompress(body, COMPRESS_MAX_BLOCK)
+    except zlib.error:
+        raw = None
+    if raw is None or decompressor.unconsumed_tail or not decompressor.eof:
+        raise ValueError("Bloco zlib inválido ou maior que o permitido.")
+    return raw
+
+def _lz4_decompress(body):
+    decompressor = lz4_frame.LZ4FrameDecompressor()
+    try:
+        raw = decompressor.decompress(body, max_length=COMPRESS_MAX_BLOCK)
+    except RuntimeError:
+        raw = None
+    if raw is None or decompressor.unused_data or not decompressor.eof:
+        raise ValueError("Bloco lz4 inválido ou maior que o permitido.")
+    return raw
+
+def _zstd_decompressor():
+    decompressor = zstandard.ZstdDecompressor()
+    def decompress(body):
+        # max_output_size só vale para quadros sem o tamanho no cabeçalho: o tamanho declarado é conferido antes
+        try:
+            if zstandard.frame_content_size(body) <= COMPRESS_MAX_BLOCK:
+                return decompressor.decompress(body, max_output_size=COMPRESS_MAX_BLOCK)
+        except zstandard.ZstdError:
+            pass
+        raise ValueError("Bloco zstd inválido ou maior que o permitido.")
+    return decompress
+
+def _codec_functions(codec):
+    """ (comprimir, descomprimir) do codec """
+    if codec == CODEC_ZLIB:
+        return (lambda data: zlib.compress(data, ZLIB_LEVEL)), _zlib_decompress
+    if codec == CODEC_LZ4 and lz4_frame is not None:
+        return lz4_frame.compress, _lz4_decompress
+    if codec == CODEC_ZSTD and zstandard is not None:
+        return zstandard.ZstdCompressor().compress, _zstd_decompressor()
+    raise ValueError(f"Codec {CODEC_NAMES.get(codec, codec)} não está disponível.")
+
+def available_codecs():
+    """ Codecs utilizáveis neste processo, em ordem de preferência """
+    installed = {CODEC_ZLIB: True, CODEC_LZ4: lz4_frame is not None, CODEC_ZSTD: zstandard is not None}
+    return tuple(codec for codec in CODEC_PREFERENCE if installed[codec])
+
+def codecs_for(compression):
+    """ Codecs oferecidos para o parâmetro compression do socket: False/None (nenhum), True (todos os instalados) ou
+        uma sequência de nomes em ordem de preferência """
+    if not compression:
+        return ()
+    if compression is True:
+        return available_codecs()
+    ids = {name: codec for codec, name in CODEC_NAMES.items()}
+    codecs = []
+    for name in ([compression] if isinstance(compression, str) else compression):
+        if name not in ids:
+            raise ValueError(f"Codec desconhecido: {name}.")
+        if ids[name] not in available_codecs():
+            raise ValueError(f"Codec {name} não está instalado.")
+        codecs.append(ids[name])
+    return tuple(codecs)
+
+class BlockEncoder:
+    """ Comprime blocos do buffer de envio em quadros. Um bloco que não fica abaixo de COMPRESS_MIN_SAVING vai cru, e
+        os próximos também, sem tentar, por um número de blocos que dobra a cada bloco incompressível seguido (até
+        COMPRESS_MAX_SKIP): um fluxo já comprimido ou cifrado não paga a compressão de cada bloco """
+
+    def __init__(self, codec):
+        self.codec = codec
+        self._compress, _ = _codec_functions(codec)
+        self.skip = 0
+        self.backoff = 1
+        # Estatísticas
+        self.raw_bytes = 0
+        self.wire_bytes = 0
+        self.blocks = 0
+        self.raw_blocks = 0
+        self.cpu_ns = 0
+
+    def encode(self, raw):
+        body = None
+        if self.skip:
+            self.skip -= 1
+        elif len(raw) >= COMPRESS_MIN_SIZE:
+            start = time.thread_time_ns()
+            compressed = self._compress(raw)
+            self.cpu_ns += time.thread_time_ns() - start
+            if len(compressed) <= len(raw) * COMPRESS_MIN_SAVING:
+                body = compressed
+                self.backoff = 1
+            else:
+                self.skip = self.backoff
+                self.backoff = min(self.backoff * 2, COMPRESS_MAX_SKIP)
+        if body is None:
+            frame = _frame_header.pack(FRAME_RAW << 24 | len(raw)) + raw
+            self.raw_blocks += 1
+        else:
+            frame = _frame_header.pack(FRAME_COMPRESSED << 24 | len(body)) + body
+        self.raw_bytes += len(raw)
+        self.wire_bytes += len(frame)
+        self.blocks += 1
+        return frame
+
+class BlockDecoder:
+    """ Decodifica o fluxo de quadros; feed() aceita pedaços quaisquer e retorna os bytes dos quadros completos """
+
+    def __init__(self, codec):
+        self.codec = codec
+        _, self._decompress = _codec_functions(codec)
+        self.pending = bytearray()
+        # Estatísticas
+        self.wire_bytes = 0
+        self.raw_bytes = 0
+        self.cpu_ns = 0
+
+    def feed(self, wire):
+        self.pending += wire
+        self.wire_bytes += len(wire)
+        output = []
+        offset = 0
+        while len(self.pending) - offset >= FRAME_HEADER_SIZE:
+            (header,) = _frame_header.unpack_from(self.pending, offset)
+            kind, length = header >> 24, header & MAX_FRAME_BODY
+            end = offset + FRAME_HEADER_SIZE + length
+            if end > len(self.pending):
+                break
+            body = bytes(self.pending[offset + FRAME_HEADER_SIZE:end])
+            if kind == FRAME_COMPRESSED:
+                start = time.thread_time_ns()
+                body = self._decompress(body)
+                self.cpu_ns += time.thread_time_ns() - start
+            elif kind != FRAME_RAW:
+                raise ValueError(f"Quadro de tipo {kind} desconhecido.")
+            output.append(body)
+            offset = end
+        del self.pending[:offset]
+        data = b''.join(output)
+        self.raw_bytes += len(data)
+        return data
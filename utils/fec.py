@@ -0,0 +1,154 @@
+import struct
+
+# Correção de erros à frente (FEC) por paridade XOR: para cada bloco de k pacotes de dados, o emissor envia um pacote
+# de paridade com o XOR dos payloads. O receptor que tem k dos k + 1 pacotes do bloco reconstrói o que falta sem
+# esperar o timeout e a retransmissão. Um XOR recupera uma perda por bloco; o tamanho do bloco define a redundância
+# (1/k) e pode acompanhar a perda medida pelo receptor (FECEncoder adaptativo).
+#
+# Paridade: Total de pacotes do bloco (H), XOR dos tamanhos (I) e XOR dos payloads completados com zeros até o
+# maior deles. O primeiro número de sequência do bloco vai no cabeçalho do pacote que a carrega.
+
+FEC_PARITY_HEADER_FORMAT = '!H I'
+FEC_PARITY_HEADER_SIZE = struct.calcsize(FEC_PARITY_HEADER_FORMAT)
+FEC_LOSS_FORMAT = '!H' # Perda medida pelo receptor, em milésimos, no payload dos ACKs
+FEC_MIN_BLOCK = 2
+FEC_MAX_BLOCK = 64
+FEC_TARGET_RESIDUAL = 0.05 # Adaptativo: maior bloco cuja chance de 2+ perdas (irrecuperável) fica abaixo disto
+FEC_LOSS_ALPHA = 0.125 # Peso de cada bloco na média móvel da perda (como o SRTT do TCP)
+FEC_HORIZON = 4 * FEC_MAX_BLOCK # Pacotes fora de ordem guardados além do próximo esperado
+
+def xor_parity(payloads):
+    """ Paridade de um bloco de payloads """
+    length = max(map(len, payloads), default=0)
+    acc = 0
+    sizes = 0
+    for payload in payloads:
+        # XOR de inteiros grandes: uma operação em C por payload, em vez de um laço por byte
+        acc ^= int.from_bytes(payload.ljust(length, b'\0'), 'big')
+        sizes ^= len(payload)
+    return struct.pack(FEC_PARITY_HEADER_FORMAT, len(payloads), sizes) + acc.to_bytes(length, 'big')
+
+def recover_missing(parity, payloads):
+    """ Payload que falta no bloco, dados a paridade e os outros payloads """
+    _, size = struct.unpack_from(FEC_PARITY_HEADER_FORMAT, parity)
+    body = parity[FEC_PARITY_HEADER_SIZE:]
+    acc = int.from_bytes(body, 'big')
+    for payload in payloads:
+        acc ^= int.from_bytes(payload.ljust(len(body), b'\0'), 'big')
+        size ^= len(payload)
+    return acc.to_bytes(len(body), 'big')[:size]
+
+def block_for_loss(loss, max_block):
+    """ Maior bloco k (até max_block) em que um bloco de k + 1 pacotes perde 2 ou mais com probabilidade abaixo de
+        FEC_TARGET_RESIDUAL """
+    best = FEC_MIN_BLOCK
+    for k in range(FEC_MIN_BLOCK, max_block + 1):
+        n = k + 1
+        unrecoverable = 1 - (1 - loss) ** n - n * loss * (1 - loss) ** (n - 1)
+        if unrecoverable > FEC_TARGET_RESIDUAL:
+            break
+        best = k
+    return best
+
+class FECEncoder:
+    """ Lado do emissor: add() recebe cada pacote de dados na primeira transmissão e retorna (primeiro seq, paridade)
+        quando o bloco fecha. Com adaptive, o tamanho do bloco segue a perda informada nos ACKs (update_loss), entre
+        FEC_MIN_BLOCK e max_block; a mudança vale a partir do próximo bloco """
+
+    def __init__(self, block_size, adaptive=False, max_block=FEC_MAX_BLOCK):
+        self.max_block = max(FEC_MIN_BLOCK, min(max_block, FEC_MAX_BLOCK))
+        self.block_size = max(FEC_MIN_BLOCK, min(block_size, self.max_block))
+        self.adaptive = adaptive
+        self.loss = 0.0
+        self.first = None
+        self.payloads = []
+        self.parities_sent = 0
+
+    def add(self, seq, payload):
+        if not self.payloads:
+            self.first = seq
+        self.payloads.append(payload)
+        if len(self.payloads) < self.block_size:
+            return None
+        parity = xor_parity(self.payloads)
+        first = self.first
+        self.payloads = []
+        self.parities_sent += 1
+        if self.adaptive:
+            self.block_size = block_for_loss(self.loss, self.max_block)
+        return first, parity
+
+    def update_loss(self, raw):
+        """ raw: payload de um ACK (ignorado se não traz a perda medida) """
+        if len(raw) == struct.calcsize(FEC_LOSS_FORMAT):
+            self.loss = struct.unpack(FEC_LOSS_FORMAT, raw)[0] / 1000
+
+class FECDecoder:
+    """ Lado do receptor: guarda os payloads recentes (entregues e fora de ordem) e as paridades pendentes, e
+        reconstrói um pacote quando o seu bloco tem todos os outros. ready(seq) retorna o payload de seq se ele chegou
+        ou foi recuperado. Não é thread-safe: o receptor chama sob o seu lock (ou na thread do loop) """
+
+    def __init__(self, horizon=FEC_HORIZON):
+        self.horizon = horizon
+        self.payloads = {} # {seq: payload}
+        self.parities = {} # {primeiro seq: paridade}
+        self.loss = 0.0 # Média móvel da fração de pacotes de dados ausentes quando a paridade do bloco chega
+        # Estatísticas
+        self.recovered = 0
+        self.parities_received = 0
+
+    def add_data(self, seq, payload, expected):
+        if seq < expected or seq >= expected + self.horizon or seq in self.payloads:
+            return
+        self.payloads[seq] = payload
+        for first, parity in list(self.parities.items()):
+            if first <= seq < first + struct.unpack_from(FEC_PARITY_HEADER_FORMAT, parity)[0]:
+                self._try_recover(first)
+
+    def add_parity(self, first, parity, expected):
+        if len(parity) < FEC_PARITY_HEADER_SIZE:
+            return
+        (count, _) = struct.unpack_from(FEC_PARITY_HEADER_FORMAT, parity)
+        if count == 0 or first + count <= expected or first >= expected + self.horizon:
+            return # Bloco já entregue (ou longe demais)
+        self.parities_received += 1
+        missing = sum(seq not in self.payloads for seq in range(max(first, expected), first + count))
+        self.loss += FEC_LOSS_ALPHA * (missing / count - self.loss)
+        self.parities[first] = parity
+        self._try_recover(first)
+
+    def _try_recover(self, first):
+        parity = self.parities[first]
+        (count, _) = struct.unpack_from(FEC_PARITY_HEADER_FORMAT, parity)
+        block = range(first, first + count)
+        missing = [seq for seq in block if seq not in self.payloads]
+        if len(missing) > 1:
+            return
+        del self.parities[first]
+        if not missing:
+            return
+        self.payloads[missing[0]] = recover_missing(parity, [self.payloads[seq] for seq in block
+                                                             if seq != missing[0]])
+        self.recovered += 1
+
+    def ready(self, seq):
+        return self.payloads.get(seq)
+
+    def prune(self, expected):
+        """ Descarta o que nenhuma paridade ainda pode precisar: payloads de blocos já entregues e paridades de
+            blocos completos """
+        floor = expected - FEC_MAX_BLOCK
+        for seq in [seq for seq in self.payloads if seq < floor]:
+            del self.payloads[seq]
+        for first in [first for first in self.parities
+                      if first + struct.unpack_from(FEC_PARITY_HEADER_FORMAT, self.parities[first])[0] <= expected]:
+            del self.parities[first]
+
+    def loss_report(self):
+        """ Payload do ACK com a perda medida """
+        return struct.pack(FEC_LOSS_FORMAT, min(1000, round(self.loss * 1000)))
+
+    def stats(self):
+        """ {'recovered', 'parities_received', 'buffered', 'loss'} """
+        return {'recovered': self.recovered, 'parities_received': self.parities_received,
+                'buffered': len(self.payloads), 'loss': self.loss}
@@ -0,0 +1,145 @@
+import struct
+import time
+from utils.logger import log_warning, log_debug
+
+# Fragmentação de pacotes maiores que um datagrama UDP. Cada fragmento leva um cabeçalho com o ID da mensagem, o
+# índice do fragmento e o total de fragmentos; o receptor remonta a mensagem (Reassembler) antes de interpretá-la como
+# pacote. Pacotes que cabem em um datagrama seguem sem cabeçalho: o primeiro byte de um pacote RDT ou GBN é o tipo
+# (0 a 5), que nunca coincide com FRAGMENT_MAGIC.
+# A integridade fica com o checksum do pacote remontado: um fragmento corrompido invalida a mensagem inteira.
+
+# Magic: 2 bytes, MessageID: 4 bytes (I), Índice: 2 bytes (H), Total: 2 bytes (H)
+FRAGMENT_MAGIC = b'\xfa\x6d'
+FRAGMENT_HEADER_FORMAT = '!2s I H H'
+FRAGMENT_HEADER_SIZE = struct.calcsize(FRAGMENT_HEADER_FORMAT)
+MAX_FRAGMENTS = 0xFFFF
+MESSAGE_ID_SPACE = 2**32
+LATE_WINDOW = 1024 # IDs até esta distância atrás da mensagem mais recente do peer são fragmentos atrasados; mais
+                   # longe, o peer recomeçou a numeração (novo canal no mesmo endereço)
+
+REASSEMBLY_TIMEOUT = 2.0 # Mensagem incompleta há mais que isto é descartada (segundos)
+REASSEMBLY_MAX_BYTES = 8 * 1024 * 1024 # Bytes em remontagem; acima disso, as mensagens mais antigas são descartadas
+
+_fragment_header = struct.Struct(FRAGMENT_HEADER_FORMAT)
+
+def fragment_packet(packet_bytes, message_id, max_datagram):
+    """ Fragmentos (com cabeçalho) de até max_datagram bytes cada; o pacote inteiro se ele já cabe em um datagrama """
+    if len(packet_bytes) <= max_datagram:
+        return [packet_bytes]
+    chunk = max_datagram - FRAGMENT_HEADER_SIZE
+    count = -(-len(packet_bytes) // chunk)
+    if count > MAX_FRAGMENTS:
+        raise ValueError(f"Pacote de {len(packet_bytes)} bytes excede {MAX_FRAGMENTS} fragmentos.")
+    message_id %= MESSAGE_ID_SPACE
+    view = memoryview(packet_bytes)
+    return [_fragment_header.pack(FRAGMENT_MAGIC, message_id, index, count) + view[start:start + chunk]
+            for index, start in enumerate(range(0, len(packet_bytes), chunk))]
+
+def is_fragment(raw):
+    return raw[:2] == FRAGMENT_MAGIC and len(raw) >= FRAGMENT_HEADER_SIZE
+
+class _Partial:
+    """ Mensagem em remontagem """
+    __slots__ = ('fragments', 'received', 'size', 'started')
+
+    def __init__(self, count, started):
+        self.fragments = [None] * count
+        self.received = 0
+        self.size = 0
+        self.started = started
+
+class Reassembler:
+    """ Remonta as mensagens fragmentadas de cada peer. feed() recebe cada datagrama e retorna o pacote a ser
+        processado: o próprio datagrama se ele não é um fragmento, a mensagem completa no último fragmento, ou None.
+
+        Uma mensagem incompleta é descartada (e o protocolo retransmite o pacote inteiro, com um novo ID) quando:
+        - passa timeout segundos sem completar;
+        - chega um fragmento de uma mensagem posterior do mesmo peer: o canal entrega os fragmentos na ordem de
+          envio, então os que faltam já não vão chegar, e o buffer é liberado sem esperar o timeout;
+        - o buffer passa de max_bytes (as mais antigas primeiro).
+        Não é thread-safe: é usado pela thread que lê o socket """
+
+    def __init__(self, timeout=REASSEMBLY_TIMEOUT, max_bytes=REASSEMBLY_MAX_BYTES, clock=time.monotonic):
+        self.timeout = timeout
+        self.max_bytes = max_bytes
+        self.clock = clock
+        self.partials = {} # {(peer, ID): _Partial}, na ordem em que começaram
+        self.newest = {} # {peer: ID da mensagem mais recente}
+        self.buffered_bytes = 0
+        # Estatísticas
+        self.reassembled = 0
+        self.expired = 0
+        self.superseded = 0
+        self.evicted = 0
+        self.late = 0 # Fragmentos de mensagens já completas ou descartadas
+        self.invalid = 0
+
+    def feed(self, raw, peer=None):
+        if not is_fragment(raw):
+            return raw
+        _, message_id, index, count = _fragment_header.unpack_from(raw)
+        if count == 0 or index >= count:
+            self.invalid += 1
+            return None
+        now = self.clock()
+        self._expire(now)
+        key = (peer, message_id)
+        partial = self.partials.get(key)
+        if partial is None:
+            newest = self.newest.get(peer)
+            if newest is not None and (newest - message_id) % MESSAGE_ID_SPACE < LATE_WINDOW:
+                self.late += 1
+                return None
+            self._drop_superseded(peer, message_id)
+            self.newest[peer] = message_id
+            partial = self.partials[key] = _Partial(count, now)
+        elif len(partial.fragments) != count:
+            self.invalid += 1
+            return None
+        if partial.fragments[index] is None:
+            payload = bytes(raw[FRAGMENT_HEADER_SIZE:]) # raw pode ser um memoryview de um buffer reutilizado
+            partial.fragments[index] = payload
+            partial.received += 1
+            partial.size += len(payload)
+            self.buffered_bytes += len(payload)
+
+        if partial.received < count:
+            self._enforce_bound()
+            return None
+        del self.partials[key]
+        self.buffered_bytes -= partial.size
+        self.reassembled += 1
+        return b''.join(partial.fragments)
+
+    def _discard(self, key):
+        self.buffered_bytes -= self.partials.pop(key).size
+
+    def _expire(self, now):
+        # Dicionário em ordem de início: as expiradas estão no começo
+        while self.partials:
+            key, partial = next(iter(self.partials.items()))
+            if now - partial.started < self.timeout:
+                break
+            log_debug(f"Mensagem {key[1]} incompleta ({partial.received}/{len(partial.fragments)} fragmentos) "
+                      f"expirou.", "FRAGMENT")
+            self._discard(key)
+            self.expired += 1
+
+    def _drop_superseded(self, peer, message_id):
+        for key in [key for key in self.partials
+                    if key[0] == peer and 0 < (message_id - key[1]) % MESSAGE_ID_SPACE < LATE_WINDOW]:
+            self._discard(key)
+            self.superseded += 1
+
+    def _enforce_bound(self):
+        while self.buffered_bytes > self.max_bytes and self.partials:
+            key = next(iter(self.partials))
+            log_warning(f"Buffer de remontagem cheio: mensagem {key[1]} descartada.", "FRAGMENT")
+            self._discard(key)
+            self.evicted += 1
+
+    def stats(self):
+        """ {'pending', 'buffered_bytes', 'reassembled', 'expired', 'superseded', 'evicted', 'late', 'invalid'} """
+        return {'pending': len(self.partials), 'buffered_bytes': self.buffered_bytes,
+                'reassembled': self.reassembled, 'expired': self.expired, 'superseded': self.superseded,
+                'evicted': self.evicted, 'late': self.late, 'invalid': self.invalid}
@@ -0,0 +1,65 @@
+import threading
+import time
+
+class InstrumentedLock:
+    """ threading.Lock que mede contenção: aquisições, quantas precisaram esperar, tempo de espera e tempo
+        com o lock adquirido. Pode ser usado com threading.Condition e em blocos with """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._owner = None
+        self._acquired_at = 0.0
+        self.reset()
+
+    def reset(self):
+        """ Zera as estatísticas """
+        self.acquisitions = 0
+        self.contended = 0 # Aquisições que encontraram o lock ocupado
+        self.wait_time = 0.0 # Tempo total esperando pelo lock (segundos)
+        self.max_wait = 0.0
+        self.hold_time = 0.0 # Tempo total com o lock adquirido (segundos)
+
+    def acquire(self, blocking=True, timeout=-1):
+        if self._lock.acquire(False):
+            waited = None
+        else:
+            if not blocking:
+                return False
+            start = time.perf_counter()
+            if not self._lock.acquire(True, timeout):
+                return False
+            waited = time.perf_counter() - start
+        # As estatísticas só são alteradas por quem detém o lock
+        self.acquisitions += 1
+        if waited is not None:
+            self.contended += 1
+            self.wait_time += waited
+            self.max_wait = max(self.max_wait, waited)
+        self._owner = threading.get_ident()
+        self._acquired_at = time.perf_counter()
+        return True
+
+    def release(self):
+        self.hold_time += time.perf_counter() - self._acquired_at
+        self._owner = None
+        self._lock.release()
+
+    def locked(self):
+        return self._lock.locked()
+
+    def _is_owned(self):
+        """ Usado por threading.Condition para verificar se a thread atual detém o lock """
+        return self._owner == threading.get_ident()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+    def stats(self):
+        """ Estatísticas acumuladas: {'acquisitions', 'contended', 'contention_rate', 'wait_time', 'max_wait', 'hold_time'} """
+        return {'acquisitions': self.acquisitions, 'contended': self.contended,
+                'contention_rate': self.contended / self.acquisitions if self.acquisitions else 0.0,
+                'wait_time': self.wait_time, 'max_wait': self.max_wait, 'hold_time': self.hold_time}
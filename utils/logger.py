@@ -1,5 +1,6 @@
 import logging
 import sys
+from utils.profiling import stage
 
 def setup_logger(name, level=logging.INFO):
     """Configura um logger para o projeto."""
@@ -25,13 +26,17 @@ def setup_logger(name, level=logging.INFO):
 main_logger = setup_logger('ProjetoRedes')
 
 def log_info(message, component='MAIN'):
-    main_logger.info(f"[{component}] {message}")
+    with stage('log'):
+        main_logger.info(f"[{component}] {message}")
 
 def log_warning(message, component='MAIN'):
-    main_logger.warning(f"[{component}] {message}")
+    with stage('log'):
+        main_logger.warning(f"[{component}] {message}")
 
 def log_error(message, component='MAIN'):
-    main_logger.error(f"[{component}] {message}")
+    with stage('log'):
+        main_logger.error(f"[{component}] {message}")
 
 def log_debug(message, component='MAIN'):
-    main_logger.debug(f"[{component}] {message}")
+    with stage('log'):
+        main_logger.debug(f"[{component}] {message}")
@@ -1,6 +1,7 @@
 import struct
 import hashlib
 import random
+from utils.profiling import profiled
 
 # Constantes para Tipos de Pacote
 TYPE_DATA = 0
@@ -15,11 +16,27 @@ TYPE_FIN = 5
 RDT_HEADER_FORMAT = '!BB I'
 RDT_HEADER_SIZE = struct.calcsize(RDT_HEADER_FORMAT)
 
+# Formato do cabeçalho rdt com sessão (várias sessões multiplexadas em uma porta, ver fase1/rdt_mux.py)
+# SessionID: 4 bytes (I), Tipo: 1 byte (B), SeqNum: 1 byte (B), Checksum: 4 bytes (I)
+RDT_SESSION_HEADER_FORMAT = '!I BB I'
+RDT_SESSION_HEADER_SIZE = struct.calcsize(RDT_SESSION_HEADER_FORMAT)
+
 # Formato do cabeçalho TCP simplificado
 # Source Port (H), Dest Port (H), Seq Num (I), Ack Num (I), Header Len (B), Flags (B), Window Size (H), Checksum (H), Urgent Ptr (H)
 TCP_HEADER_FORMAT = '!HH II B B H H H'
 TCP_HEADER_SIZE = struct.calcsize(TCP_HEADER_FORMAT)
 
+# Opções TCP (formato TLV após o cabeçalho fixo; Header Len inclui as opções)
+TCP_OPT_END = 0
+TCP_OPT_NOP = 1
+TCP_OPT_MSS = 2 # Maximum Segment Size (RFC 9293): 2 bytes, maior payload que o emissor aceita receber
+TCP_OPT_WSCALE = 3 # Window Scale (RFC 7323): 1 byte com o deslocamento
+TCP_OPT_FASTOPEN = 34 # TCP Fast Open (RFC 7413): cookie do servidor; vazio no SYN pede um cookie novo
+TCP_OPT_COMPRESS = 252 # Compressão (experimental): no SYN, os codecs oferecidos; no SYN-ACK, o escolhido (1 byte)
+TCP_OPT_PMTU_PROBE = 253 # Sonda de PLPMTUD (tipo experimental, RFC 4727): 2 bytes com o tamanho sondado
+TCP_OPT_PMTU_ECHO = 254 # Resposta à sonda: ecoa o tamanho recebido
+TCP_MAX_OPTIONS_SIZE = 40
+
 class RDTPacket:
     def __init__(self, type, seq_num, data=b''):
         self.type = type
@@ -27,19 +44,22 @@ class RDTPacket:
         self.data = data
         self.checksum = self._calculate_checksum()
 
+    @profiled('packet.checksum')
     def _calculate_checksum(self):
         # Calcula o checksum do cabeçalho (sem o campo checksum) + dados
         # Usaremos um hash MD5 simples para simular o checksum
-        header_without_checksum = struct.pack('!BB', self.type, self.seq_num)
-        data_to_hash = header_without_checksum + self.data
-        return int(hashlib.md5(data_to_hash).hexdigest(), 16) & 0xFFFFFFFF
+        digest = hashlib.md5(struct.pack('!BB', self.type, self.seq_num))
+        digest.update(self.data) # Sem copiar os dados (podem ser um memoryview do buffer de recepção)
+        return int(digest.hexdigest(), 16) & 0xFFFFFFFF
 
+    @profiled('packet.encode')
     def to_bytes(self):
         # Recalcula o checksum antes de empacotar
         self.checksum = self._calculate_checksum()
         header = struct.pack(RDT_HEADER_FORMAT, self.type, self.seq_num, self.checksum)
         return header + self.data
 
+    @profiled('packet.decode')
     @classmethod
     def from_bytes(cls, raw_bytes):
         if len(raw_bytes) < RDT_HEADER_SIZE:
@@ -68,18 +88,88 @@ class RDTPacket:
     def __repr__(self):
         return f"RDTPacket(Type={self.type}, SeqNum={self.seq_num}, DataLen={len(self.data)}, Corrupt={self.is_corrupt()})"
 
+class RDTSessionPacket(RDTPacket):
+    """ RDTPacket com o ID da sessão no cabeçalho (coberto pelo checksum) """
+
+    def __init__(self, session_id, type, seq_num, data=b''):
+        self.session_id = session_id
+        super().__init__(type, seq_num, data)
+
+    @profiled('packet.checksum')
+    def _calculate_checksum(self):
+        digest = hashlib.md5(struct.pack('!IBB', self.session_id, self.type, self.seq_num))
+        digest.update(self.data) # Sem concatenar cabeçalho e dados
+        return int(digest.hexdigest(), 16) & 0xFFFFFFFF
+
+    @profiled('packet.encode')
+    def to_bytes(self):
+        self.checksum = self._calculate_checksum()
+        header = struct.pack(RDT_SESSION_HEADER_FORMAT, self.session_id, self.type, self.seq_num, self.checksum)
+        return header + self.data
+
+    @profiled('packet.decode')
+    @classmethod
+    def from_bytes(cls, raw_bytes):
+        if len(raw_bytes) < RDT_SESSION_HEADER_SIZE:
+            return None # Pacote incompleto
+        session_id, type, seq_num, received_checksum = struct.unpack(RDT_SESSION_HEADER_FORMAT,
+                                                                     raw_bytes[:RDT_SESSION_HEADER_SIZE])
+        # Sem passar pelo __init__: o checksum só é calculado uma vez, em is_corrupt()
+        packet = cls.__new__(cls)
+        packet.session_id = session_id
+        packet.type = type
+        packet.seq_num = seq_num
+        packet.data = raw_bytes[RDT_SESSION_HEADER_SIZE:]
+        packet.checksum = received_checksum
+        return packet
+
+    def __repr__(self):
+        return (f"RDTSessionPacket(Session={self.session_id}, Type={self.type}, SeqNum={self.seq_num}, "
+                f"DataLen={len(self.data)}, Corrupt={self.is_corrupt()})")
+
+def encode_tcp_options(options):
+    """Codifica {tipo: valor_bytes} em TLVs, completando com END até múltiplo de 4 bytes"""
+    raw = b''
+    for kind, value in options.items():
+        raw += struct.pack('!BB', kind, len(value) + 2) + value
+    raw += bytes(-len(raw) % 4) # Padding (TCP_OPT_END = 0)
+    if len(raw) > TCP_MAX_OPTIONS_SIZE:
+        raise ValueError("Opções TCP excedem 40 bytes.")
+    return raw
+
+def decode_tcp_options(raw):
+    """Decodifica TLVs de opções em {tipo: valor_bytes}; ignora opções malformadas"""
+    options = {}
+    i = 0
+    while i < len(raw):
+        kind = raw[i]
+        if kind == TCP_OPT_END:
+            break
+        if kind == TCP_OPT_NOP:
+            i += 1
+            continue
+        if i + 1 >= len(raw) or raw[i + 1] < 2:
+            break
+        length = raw[i + 1]
+        options[kind] = bytes(raw[i + 2:i + length])
+        i += length
+    return options
+
 class TCPSegment:
-    def __init__(self, src_port, dest_port, seq_num, ack_num, flags, window_size, data=b''):
+    def __init__(self, src_port, dest_port, seq_num, ack_num, flags, window_size, data=b'', options=None):
         self.src_port = src_port
         self.dest_port = dest_port
         self.seq_num = seq_num
         self.ack_num = ack_num
-        self.header_len = TCP_HEADER_SIZE // 4 # Em palavras de 4 bytes
+        self.options = options or {}
+        self.options_bytes = encode_tcp_options(self.options) if self.options else b''
+        self.header_len = (TCP_HEADER_SIZE + len(self.options_bytes)) // 4 # Em palavras de 4 bytes
         self.flags = flags
         self.window_size = window_size
         self.data = data
         self.checksum = 0 # O checksum será calculado no to_bytes
 
+    @profiled('packet.checksum')
     def _calculate_checksum(self):
         # Simplificação: Apenas um hash MD5 dos campos importantes + dados
         # Em um TCP real, o checksum é mais complexo (pseudo-cabeçalho + cabeçalho + dados)
@@ -88,9 +178,12 @@ class TCPSegment:
                                    self.seq_num, self.ack_num, 
                                    self.header_len, self.flags, 
                                    self.window_size, 0) # Checksum temporário 0
-        data_to_hash += self.data
-        return int(hashlib.md5(data_to_hash).hexdigest(), 16) & 0xFFFF
+        digest = hashlib.md5(data_to_hash)
+        digest.update(self.options_bytes)
+        digest.update(self.data) # Sem copiar os dados (podem ser um memoryview de um arquivo mapeado)
+        return int(digest.hexdigest(), 16) & 0xFFFF
 
+    @profiled('packet.encode')
     def to_bytes(self):
         self.checksum = self._calculate_checksum()
         header = struct.pack(TCP_HEADER_FORMAT, 
@@ -99,15 +192,15 @@ class TCPSegment:
                              self.header_len, self.flags, 
                              self.window_size, self.checksum, 
                              0) # Urgent Ptr
-        return header + self.data
+        return b''.join((header, self.options_bytes, self.data))
 
+    @profiled('packet.decode')
     @classmethod
     def from_bytes(cls, raw_bytes):
         if len(raw_bytes) < TCP_HEADER_SIZE:
             return None
 
         header_bytes = raw_bytes[:TCP_HEADER_SIZE]
-        data = raw_bytes[TCP_HEADER_SIZE:]
 
         try:
             (src_port, dest_port, seq_num, ack_num, header_len, flags, 
@@ -115,15 +208,18 @@ class TCPSegment:
         except struct.error:
             return None
 
-        # Cria um segmento temporário para verificar o checksum
-        temp_segment = cls(src_port, dest_port, seq_num, ack_num, flags, window_size, data)
-        
-        is_corrupt = temp_segment._calculate_checksum() != received_checksum
-        
-        # Retorna o segmento com o checksum recebido
-        segment = cls(src_port, dest_port, seq_num, ack_num, flags, window_size, data)
+        # Header Len (em palavras de 4 bytes) delimita as opções
+        options_end = header_len * 4
+        if options_end < TCP_HEADER_SIZE or options_end > len(raw_bytes):
+            return None
+        options = decode_tcp_options(raw_bytes[TCP_HEADER_SIZE:options_end])
+        data = raw_bytes[options_end:]
+
+        # Retorna o segmento com o checksum recebido (verificado por is_corrupt())
+        segment = cls(src_port, dest_port, seq_num, ack_num, flags, window_size, data, options)
+        segment.options_bytes = raw_bytes[TCP_HEADER_SIZE:options_end] # Bytes originais (com padding)
+        segment.header_len = header_len
         segment.checksum = received_checksum
-        segment.is_corrupt = is_corrupt
         
         return segment
 
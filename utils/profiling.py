@@ -0,0 +1,370 @@
+import atexit
+import cProfile
+import functools
+import gc
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+
+# Perfil dos caminhos quentes dos protocolos.
+# - Estágios: pontos de medição em packet, simulator, gbn e tcp_socket que acumulam, por caminho de estágios
+#   aninhados, chamadas, tempo total e tempo próprio (sem os estágios internos) com perf_counter_ns. Blocos dos
+#   protocolos usam with stage('gbn.send'): ..., que desativado custa uma chamada e um with vazio (~0,3 µs, contra
+#   dezenas de µs por pacote). Os métodos de codificação e checksum, de poucos µs, usam @profiled: desativado, o
+#   método original fica na classe e o custo é zero.
+# - Captura: ProfileCapture envolve uma execução em cProfile, tracemalloc ou nos estágios e grava um arquivo de
+#   pilhas colapsadas ("a;b;c valor" por linha), pronto para flamegraph.pl, speedscope ou inferno.
+# Definir PROJETO_REDES_PROFILE=modo[:arquivo] (ex.: cprofile:/tmp/gbn.collapsed) captura o processo inteiro,
+# gravando o arquivo na saída do interpretador.
+
+PROFILE_ENV = 'PROJETO_REDES_PROFILE'
+CAPTURE_MODES = ('stages', 'cprofile', 'tracemalloc')
+TRACEMALLOC_FRAMES = 32 # Profundidade das pilhas registradas pelo tracemalloc
+MIN_STACK_NS = 1000 # cProfile: caminhos com menos de 1 µs são omitidos
+MAX_STACK_DEPTH = 64
+
+_enabled = False
+_local = threading.local() # Pilha de estágios abertos de cada thread
+_records_lock = threading.Lock()
+_records = {} # {caminho (tupla de estágios): [chamadas, tempo total ns, tempo próprio ns]}
+_hooks = [] # Métodos com @profiled: [(classe, atributo, original, medido)]
+
+class _NullStage:
+    """ Estágio com a medição desativada """
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NULL_STAGE = _NullStage()
+
+class _Stage:
+    __slots__ = ('name', 'path', 'stack', 'child_ns', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        stack = getattr(_local, 'stack', None)
+        if stack is None:
+            stack = _local.stack = []
+        self.path = stack[-1].path + (self.name,) if stack else (self.name,)
+        self.stack = stack
+        self.child_ns = 0
+        stack.append(self)
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter_ns() - self.start
+        stack = self.stack
+        stack.pop()
+        if stack:
+            stack[-1].child_ns += elapsed
+        with _records_lock:
+            record = _records.get(self.path)
+            if record is None:
+                record = _records[self.path] = [0, 0, 0]
+            record[0] += 1
+            record[1] += elapsed
+            record[2] += elapsed - self.child_ns
+        return False
+
+class _TimedAcquire:
+    """ with de um lock (ou Condition) medindo a espera pela aquisição como um estágio """
+    __slots__ = ('lock', 'name')
+
+    def __init__(self, lock, name):
+        self.lock = lock
+        self.name = name
+
+    def __enter__(self):
+        with _Stage(self.name):
+            self.lock.acquire()
+        return self.lock
+
+    def __exit__(self, *exc):
+        self.lock.release()
+        return False
+
+def stage(name):
+    """ with stage('gbn.send'): ... acumula o tempo do bloco no estágio name (sem efeito se desativado) """
+    return _Stage(name) if _enabled else _NULL_STAGE
+
+def acquire(lock, name):
+    """ with acquire(self.lock, 'gbn.lock_wait'): equivale a with self.lock:, medindo a espera no estágio name """
+    return _TimedAcquire(lock, name) if _enabled else lock
+
+class _ProfiledMethod:
+    """ Marcador deixado por @profiled no corpo da classe; __set_name__ o troca pelo método original """
+
+    def __init__(self, name, method):
+        self.name = name
+        self.method = method
+
+    def __set_name__(self, owner, attribute):
+        method = self.method
+        wrapper_type = type(method) if isinstance(method, (classmethod, staticmethod)) else None
+        func = method.__func__ if wrapper_type else method
+        name = self.name
+
+        @functools.wraps(func)
+        def timed(*args, **kwargs):
+            with _Stage(name):
+                return func(*args, **kwargs)
+
+        measured = wrapper_type(timed) if wrapper_type else timed
+        _hooks.append((owner, attribute, method, measured))
+        setattr(owner, attribute, measured if _enabled else method)
+
+def profiled(name):
+    """ Decorador de método (também sobre @classmethod/@staticmethod) que mede cada chamada no estágio name.
+        Só instalado enquanto os estágios estão ativos: desativado, a classe tem o método original """
+    return lambda method: _ProfiledMethod(name, method)
+
+def enable_stages(reset=True):
+    global _enabled
+    if reset:
+        reset_stages()
+    _enabled = True
+    for owner, attribute, _, measured in _hooks:
+        setattr(owner, attribute, measured)
+
+def disable_stages():
+    global _enabled
+    _enabled = False
+    for owner, attribute, method, _ in _hooks:
+        setattr(owner, attribute, method)
+
+def stages_enabled():
+    return _enabled
+
+def reset_stages():
+    with _records_lock:
+        _records.clear()
+
+def stage_stats():
+    """ {estágio: {'calls', 'total_ns', 'self_ns'}} somando todos os caminhos em que o estágio aparece,
+        do maior para o menor tempo próprio """
+    with _records_lock:
+        records = [(path, list(record)) for path, record in _records.items()]
+    stats = {}
+    for path, (calls, total_ns, self_ns) in records:
+        entry = stats.setdefault(path[-1], {'calls': 0, 'total_ns': 0, 'self_ns': 0})
+        entry['calls'] += calls
+        entry['total_ns'] += total_ns
+        entry['self_ns'] += self_ns
+    return dict(sorted(stats.items(), key=lambda item: item[1]['self_ns'], reverse=True))
+
+def stage_report():
+    """ Linhas de texto com stage_stats(), para log """
+    stats = stage_stats()
+    total = sum(entry['self_ns'] for entry in stats.values()) or 1
+    lines = [f"{'estágio':22s} {'chamadas':>10s} {'total ms':>10s} {'próprio ms':>11s} {'próprio':>8s} {'µs/chamada':>11s}"]
+    for name, entry in stats.items():
+        lines.append(f"{name:22s} {entry['calls']:10d} {entry['total_ns'] / 1e6:10.1f} {entry['self_ns'] / 1e6:11.1f} "
+                     f"{entry['self_ns'] / total:8.1%} {entry['total_ns'] / entry['calls'] / 1e3:11.2f}")
+    return lines
+
+def collapsed_stages():
+    """ {'a;b;c': tempo próprio ns} de cada caminho de estágios aninhados """
+    with _records_lock:
+        return {';'.join(path): record[2] for path, record in _records.items()}
+
+def _frame_label(filename, lineno, funcname):
+    if filename == '~': # Funções nativas
+        return funcname.replace(';', ':')
+    return f"{funcname} ({os.path.basename(filename)}:{lineno})".replace(';', ':')
+
+def collapse_pstats(stats):
+    """ Pilhas colapsadas {'a;b;c': tempo próprio ns} a partir de um pstats.Stats. O cProfile só registra pares
+        chamador -> chamado, então o tempo de cada função é repartido entre os caminhos que levam a ela na
+        proporção do tempo que cada chamador passou nela. Recursões são cortadas e caminhos com menos de
+        MIN_STACK_NS omitidos """
+    entries = stats.stats
+    callees = {}
+    for func, (_, _, _, _, callers) in entries.items():
+        for caller, edge in callers.items():
+            callees.setdefault(caller, []).append((func, edge[3]))
+    stacks = {}
+
+    def walk(func, funcs, labels, time_on_path):
+        _, _, tt, ct, _ = entries[func]
+        share = time_on_path / ct if ct else 0.0
+        self_ns = tt * share * 1e9
+        if self_ns >= MIN_STACK_NS:
+            key = ';'.join(labels)
+            stacks[key] = stacks.get(key, 0) + self_ns
+        if len(labels) >= MAX_STACK_DEPTH:
+            return
+        for callee, edge_time in callees.get(func, ()):
+            callee_time = edge_time * share
+            if callee in funcs or callee_time * 1e9 < MIN_STACK_NS:
+                continue
+            walk(callee, funcs | {callee}, labels + [_frame_label(*callee)], callee_time)
+
+    for func, (_, _, _, ct, callers) in entries.items():
+        # Raízes: o tempo das chamadas sem chamador medido (a função onde a captura começou, o run() das threads).
+        # A mesma função pode ser raiz em uma thread e chamada por outra função em outra
+        root_time = ct - sum(edge[3] for caller, edge in callers.items() if caller != func)
+        if root_time * 1e9 >= MIN_STACK_NS:
+            walk(func, {func}, [_frame_label(*func)], root_time)
+    return {key: round(value) for key, value in stacks.items()}
+
+def collapse_tracemalloc(snapshot):
+    """ Pilhas colapsadas {'a;b;c': bytes} da memória alocada e ainda não liberada em snapshot """
+    stacks = {}
+    for stat in snapshot.statistics('traceback'):
+        # Quadros do mais antigo para o mais recente (o tracemalloc não registra o nome da função)
+        key = ';'.join(f"{os.path.basename(frame.filename)}:{frame.lineno}".replace(';', ':')
+                       for frame in stat.traceback)
+        stacks[key] = stacks.get(key, 0) + stat.size
+    return stacks
+
+def write_collapsed(path, stacks):
+    """ Grava {'a;b;c': valor} como "a;b;c valor" por linha (valores inteiros, caminhos vazios omitidos) """
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'w') as f:
+        for key in sorted(stacks):
+            if int(stacks[key]) > 0:
+                f.write(f"{key} {int(stacks[key])}\n")
+
+def default_output(mode):
+    return f"perfil-{mode}-{os.getpid()}.collapsed"
+
+class ProfileCapture:
+    """ Captura de perfil de um trecho da execução, gravada como pilhas colapsadas em output:
+        - 'stages': tempo próprio (ns) por caminho de estágios, em todas as threads;
+        - 'cprofile': tempo próprio (ns) por pilha de funções, na thread que inicia a captura e nas threads
+          criadas durante ela (threads que já estavam rodando não são medidas);
+        - 'tracemalloc': bytes alocados durante a captura e ainda não liberados ao final, por pilha.
+        Uso: with ProfileCapture('cprofile', 'gbn.collapsed'): ... """
+
+    def __init__(self, mode='cprofile', output=None):
+        if mode not in CAPTURE_MODES:
+            raise ValueError(f"Modo de perfil desconhecido: {mode} (use {', '.join(CAPTURE_MODES)})")
+        self.mode = mode
+        self.output = output or default_output(mode)
+        self.stats = None # pstats.Stats no modo cprofile, após stop()
+        self.peak_bytes = None # Pico de memória rastreada no modo tracemalloc, após stop()
+        self._profiles = []
+        self._profiles_lock = threading.Lock()
+        self._stages_were_enabled = False
+        self._active = False
+
+    def _thread_hook(self, frame, event, arg):
+        """ Primeiro evento de cada thread nova: passa a medi-la com um cProfile.Profile próprio """
+        profile = cProfile.Profile()
+        with self._profiles_lock:
+            self._profiles.append(profile)
+        profile.enable()
+
+    def start(self):
+        if self.mode == 'stages':
+            self._stages_were_enabled = _enabled
+            enable_stages()
+        elif self.mode == 'cprofile':
+            threading.setprofile(self._thread_hook)
+            profile = cProfile.Profile()
+            self._profiles.append(profile)
+            profile.enable()
+        else:
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+            tracemalloc.reset_peak()
+        self._active = True
+        return self
+
+    def stop(self):
+        """ Encerra a captura e grava o arquivo; retorna o caminho (None se a captura não estava ativa) """
+        if not self._active:
+            return None
+        self._active = False
+        if self.mode == 'stages':
+            if not self._stages_were_enabled:
+                disable_stages()
+            stacks = collapsed_stages()
+        elif self.mode == 'cprofile':
+            threading.setprofile(None)
+            self._profiles[0].disable()
+            with self._profiles_lock:
+                profiles = list(self._profiles)
+            self.stats = pstats.Stats(*profiles)
+            stacks = collapse_pstats(self.stats)
+        else:
+            snapshot = tracemalloc.take_snapshot()
+            self.peak_bytes = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            stacks = collapse_tracemalloc(snapshot)
+        write_collapsed(self.output, stacks)
+
+        from utils.logger import log_info # logger importa este módulo
+        if self.mode == 'stages':
+            for line in stage_report():
+                log_info(line, "PROFILE")
+        elif self.mode == 'tracemalloc':
+            log_info(f"Pico de memória rastreada: {self.peak_bytes / 1024:.1f} KB", "PROFILE")
+        log_info(f"Perfil ({self.mode}) gravado em {self.output}", "PROFILE")
+        return self.output
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+class GCPauses:
+    """ Pausas do coletor de lixo cíclico durante um trecho (via gc.callbacks, em todas as threads): coletas por
+        geração, tempo somado e a maior pausa. Uso: with GCPauses() as pauses: ...; pauses.stats() """
+
+    def __init__(self):
+        self.collections = [0, 0, 0]
+        self.pause_time = 0.0 # Segundos
+        self.max_pause = 0.0
+        self._started = None
+
+    def _callback(self, phase, info):
+        if phase == 'start':
+            self._started = time.perf_counter()
+        elif self._started is not None:
+            pause = time.perf_counter() - self._started
+            self._started = None
+            self.collections[info['generation']] += 1
+            self.pause_time += pause
+            self.max_pause = max(self.max_pause, pause)
+
+    def start(self):
+        gc.callbacks.append(self._callback)
+        return self
+
+    def stop(self):
+        if self._callback in gc.callbacks:
+            gc.callbacks.remove(self._callback)
+
+    def stats(self):
+        """ {'collections', 'by_generation', 'pause_ms', 'max_pause_ms'} """
+        return {'collections': sum(self.collections), 'by_generation': list(self.collections),
+                'pause_ms': self.pause_time * 1e3, 'max_pause_ms': self.max_pause * 1e3}
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+def _capture_from_env():
+    """ PROJETO_REDES_PROFILE=modo[:arquivo]: captura o processo inteiro, gravando ao sair. {pid} no nome do arquivo
+        separa os processos filhos (ex.: os workers de benchmarks/sweep.py), que herdam a variável """
+    value = os.environ.get(PROFILE_ENV)
+    if not value:
+        return None
+    mode, _, output = value.partition(':')
+    capture = ProfileCapture(mode, output.replace('{pid}', str(os.getpid())) or None).start()
+    atexit.register(capture.stop)
+    return capture
+
+env_capture = _capture_from_env()
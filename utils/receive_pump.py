@@ -0,0 +1,169 @@
+import select
+import selectors
+import socket
+import threading
+import time
+from utils.logger import log_error
+from utils.buffer_pool import BufferPool
+
+# Bomba de recepção compartilhada pelos loops com thread própria (receptores e emissores rdt, multiplexador, GBN e
+# SimpleTCPSocket). O socket fica não bloqueante e a thread espera no selectors junto com um socketpair de despertar;
+# a cada evento de leitura, lê todos os datagramas pendentes (até batch) e entrega o lote de uma vez ao handler, que
+# o processa com uma aquisição do lock e envia as respostas (ACKs) juntas ao final. stop() acorda a thread pelo
+# socketpair: sem datagrama 'stop' para desbloquear o recvfrom e sem timeout de socket para rever is_running.
+# Os datagramas são lidos com recvfrom_into() em slots de um BufferPool (utils/buffer_pool.py) e entregues ao handler
+# como memoryviews; os slots do lote voltam ao pool quando o handler retorna, então o handler copia com bytes() o que
+# guardar além do lote.
+
+RECV_BATCH = 64 # Datagramas lidos por lote (o restante fica para o próximo, sem esperar o select)
+SEND_WAIT_POLL = 0.1 # sendto_waiting() revê o socket neste intervalo (um socket fechado não acorda o select)
+
+def set_socket_buffers(sock, rcvbuf=None, sndbuf=None):
+    """ SO_RCVBUF/SO_SNDBUF do socket (None: mantém o atual). O kernel pode dobrar o valor (Linux) ou limitá-lo
+        (net.core.rmem_max/wmem_max) """
+    if rcvbuf:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf)
+    if sndbuf:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, sndbuf)
+
+def sendto_waiting(sock, data, addr):
+    """ sendto() em um socket não bloqueante com a semântica do bloqueante: com o buffer de envio cheio, espera o
+        socket ficar gravável em vez de descartar o datagrama """
+    while True:
+        try:
+            return sock.sendto(data, addr)
+        except BlockingIOError:
+            select.select([], [sock], [], SEND_WAIT_POLL)
+
+class ReceivePump:
+    """ Thread de recepção de um socket UDP: handler(datagramas) recebe a lista [(memoryview, endereço)] lida em um
+        evento de leitura (com pooled=False, [(bytes, endereço)] lidos com recvfrom()). Erros do socket (ICMP de porta
+        inalcançável, datagrama maior que buffer_size no Windows) e do handler são registrados com o componente do
+        dono e não param a thread """
+
+    def __init__(self, sock, handler, buffer_size, component, batch=RECV_BATCH, daemon=False, pooled=True):
+        sock.setblocking(False)
+        self.socket = sock
+        self.handler = handler
+        self.buffer_size = buffer_size
+        self.component = component
+        self.batch = batch
+        self.pool = BufferPool(buffer_size, batch) if pooled else None
+        self.selector = selectors.DefaultSelector()
+        self._wakeup_recv, self._wakeup_send = socket.socketpair()
+        self._wakeup_recv.setblocking(False)
+        self.selector.register(sock, selectors.EVENT_READ)
+        self.selector.register(self._wakeup_recv, selectors.EVENT_READ)
+        self.is_running = True
+        self._slots = [] # Slots do lote em processamento
+        self.thread = threading.Thread(target=self._run, name=f"ReceivePump-{component}", daemon=daemon)
+        # Estatísticas
+        self.wakeups = 0
+        self.batches = 0
+        self.datagrams = 0
+        self.max_batch = 0
+        self.busy_time = 0.0 # Segundos gastos lendo e processando lotes (sem a espera no select)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        """ Para a thread e espera o lote em andamento terminar (exceto se chamado pelo próprio handler) """
+        self.is_running = False
+        try:
+            self._wakeup_send.send(b'\0')
+        except OSError:
+            pass
+        if self.thread.is_alive() and self.thread is not threading.current_thread():
+            self.thread.join()
+
+    def _run(self):
+        try:
+            while self.is_running:
+                self.selector.select()
+                self.wakeups += 1
+                # Lê até esvaziar o socket: a próxima espera só começa quando não há mais nada pendente
+                start = time.perf_counter()
+                while self.is_running:
+                    datagrams = self._read_batch()
+                    if not datagrams:
+                        break
+                    self._handle(datagrams)
+                    if len(datagrams) < self.batch:
+                        break
+                self.busy_time += time.perf_counter() - start
+        finally:
+            self.selector.close()
+            self._wakeup_recv.close()
+            self._wakeup_send.close()
+
+    def _read_batch(self):
+        if self.pool is not None:
+            return self._read_batch_pooled()
+        datagrams = []
+        recvfrom = self.socket.recvfrom
+        buffer_size = self.buffer_size
+        while len(datagrams) < self.batch:
+            try:
+                datagrams.append(recvfrom(buffer_size))
+            except BlockingIOError:
+                break
+            except OSError as e:
+                if not self._socket_error(e):
+                    break
+        return datagrams
+
+    def _read_batch_pooled(self):
+        datagrams = []
+        slots = self._slots = []
+        acquire = self.pool.acquire
+        sock = self.socket
+        while len(datagrams) < self.batch:
+            slot = acquire()
+            try:
+                datagrams.append(slot.recvfrom(sock))
+            except BlockingIOError:
+                slot.release()
+                break
+            except OSError as e:
+                slot.release()
+                if not self._socket_error(e):
+                    break
+                continue
+            slots.append(slot)
+        return datagrams
+
+    def _socket_error(self, e):
+        """ Registra o erro de leitura; False se a thread deve parar de ler """
+        if not self.is_running:
+            return False
+        if getattr(e, "winerror", None) == 10040:
+            log_error("Datagrama maior que o buffer do socket. Ignorado com segurança.", self.component)
+        else:
+            log_error(f"Erro no loop de recepção: {e}", self.component)
+        if self.socket.fileno() == -1:
+            self.is_running = False # Socket fechado por baixo da thread
+            return False
+        return True
+
+    def _handle(self, datagrams):
+        self.batches += 1
+        self.datagrams += len(datagrams)
+        self.max_batch = max(self.max_batch, len(datagrams))
+        try:
+            self.handler(datagrams)
+        except Exception as e:
+            if self.is_running:
+                log_error(f"Erro no loop de recepção: {e}", self.component)
+        finally:
+            # Lote entregue ou descartado: os slots voltam ao pool
+            for slot in self._slots:
+                slot.release()
+            self._slots = []
+
+    def stats(self):
+        """ {'wakeups', 'batches', 'datagrams', 'max_batch', 'avg_batch', 'busy_time', 'pool'} (pool: stats() do
+            BufferPool, ou None) """
+        return {'wakeups': self.wakeups, 'batches': self.batches, 'datagrams': self.datagrams,
+                'max_batch': self.max_batch, 'avg_batch': self.datagrams / self.batches if self.batches else 0.0,
+                'busy_time': self.busy_time, 'pool': self.pool.stats() if self.pool is not None else None}
@@ -0,0 +1,64 @@
+class RingBuffer:
+    """ Buffer circular de bytes com capacidade fixa (sem realocação) """
+
+    def __init__(self, capacity):
+        if capacity <= 0:
+            raise ValueError("Capacidade do buffer deve ser positiva.")
+        self.capacity = capacity
+        self._storage = bytearray(capacity)
+        self._view = memoryview(self._storage)
+        self._head = 0 # Posição do primeiro byte a ser lido
+        self._size = 0 # Bytes armazenados
+
+    def __len__(self):
+        return self._size
+
+    def free_space(self):
+        """ Bytes que ainda cabem no buffer """
+        return self.capacity - self._size
+
+    def write(self, data):
+        """ Copia até free_space() bytes de data; retorna quantos foram escritos """
+        src = memoryview(data).cast('B')
+        n = min(len(src), self.capacity - self._size)
+        if n == 0:
+            return 0
+
+        tail = (self._head + self._size) % self.capacity
+        first = min(n, self.capacity - tail)
+        self._view[tail:tail + first] = src[:first]
+        if n > first:
+            # Dá a volta no final do armazenamento
+            self._view[0:n - first] = src[first:n]
+
+        self._size += n
+        return n
+
+    def read_into(self, buffer, nbytes=None):
+        """ Copia até nbytes para buffer (objeto gravável); retorna quantos foram copiados """
+        dst = memoryview(buffer).cast('B')
+        n = len(dst) if nbytes is None else min(nbytes, len(dst))
+        n = min(n, self._size)
+        if n == 0:
+            return 0
+
+        first = min(n, self.capacity - self._head)
+        dst[:first] = self._view[self._head:self._head + first]
+        if n > first:
+            dst[first:n] = self._view[0:n - first]
+
+        self._head = (self._head + n) % self.capacity
+        self._size -= n
+        if self._size == 0:
+            self._head = 0 # Mantém leituras futuras contíguas
+        return n
+
+    def read(self, nbytes):
+        """ Remove e retorna até nbytes como bytes """
+        out = bytearray(min(nbytes, self._size))
+        self.read_into(out)
+        return bytes(out)
+
+    def clear(self):
+        self._head = 0
+        self._size = 0
@@ -0,0 +1,175 @@
+import heapq
+import itertools
+import selectors
+import socket
+import threading
+import time
+from collections import deque
+from utils.logger import log_error
+
+# Event loop mínimo sobre selectors: sockets não bloqueantes, timers em um heap e uma fila de submissão para outras
+# threads. Tudo o que é registrado (leitores, timers, callbacks submetidos) roda na thread do loop, então o estado
+# dos protocolos não precisa de locks. call_later() tem a assinatura do asyncio, o que permite usar
+# UnreliableChannel.send_on_loop() com este loop.
+
+COMPACT_MIN_CANCELLED = 64 # O heap é reconstruído quando os timers cancelados passam disto e de metade do heap
+
+class LoopTimer:
+    """ Timer agendado com SelectorLoop.call_later(); cancel() só na thread do loop """
+    __slots__ = ('loop', 'deadline', 'callback', 'args', 'cancelled')
+
+    def __init__(self, loop, deadline, callback, args):
+        self.loop = loop
+        self.deadline = deadline
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        if not self.cancelled:
+            self.cancelled = True
+            self.loop._cancelled += 1
+
+class SelectorLoop:
+    """ Uma thread com selectors.select(): dispara os leitores prontos, os timers vencidos e os callbacks
+        submetidos por call_soon_threadsafe(). add_reader/remove_reader/call_later só podem ser chamados na thread do
+        loop (ou antes de start()); das outras threads, use call_soon_threadsafe() """
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.selector = selectors.DefaultSelector()
+        self._timers = [] # Heap [(deadline, ordem, LoopTimer)]
+        self._order = itertools.count() # Desempate: timers com o mesmo prazo disparam na ordem de agendamento
+        self._cancelled = 0
+        # Submissões de outras threads: deque.append/popleft são atômicos, e um byte no socketpair acorda o select()
+        self._ready = deque()
+        self._wakeup_pending = False
+        self._wakeup_recv, self._wakeup_send = socket.socketpair()
+        self._wakeup_recv.setblocking(False)
+        self._wakeup_send.setblocking(False)
+        self.selector.register(self._wakeup_recv, selectors.EVENT_READ, self._drain_wakeup)
+        self._thread = None
+        self.is_running = False
+        # Estatísticas
+        self.iterations = 0
+        self.timers_fired = 0
+        self.submitted = 0
+
+    def call_later(self, delay, callback, *args):
+        timer = LoopTimer(self, self.clock() + delay, callback, args)
+        heapq.heappush(self._timers, (timer.deadline, next(self._order), timer))
+        return timer
+
+    def call_soon_threadsafe(self, callback, *args):
+        """ Executa callback(*args) na thread do loop (de qualquer thread, sem locks) """
+        self._ready.append((callback, args))
+        if not self._wakeup_pending:
+            self._wakeup_pending = True
+            try:
+                self._wakeup_send.send(b'\0')
+            except (BlockingIOError, OSError):
+                pass # Buffer cheio (o loop já vai acordar) ou loop encerrado
+
+    def add_reader(self, sock, callback):
+        """ callback() é chamado quando sock tem dados; ele deve ler até BlockingIOError (ou até um limite) """
+        self.selector.register(sock, selectors.EVENT_READ, callback)
+
+    def remove_reader(self, sock):
+        try:
+            self.selector.unregister(sock)
+        except (KeyError, ValueError):
+            pass
+
+    def in_loop_thread(self):
+        return self._thread is threading.current_thread()
+
+    def _drain_wakeup(self):
+        self._wakeup_pending = False
+        try:
+            while self._wakeup_recv.recv(4096):
+                pass
+        except (BlockingIOError, OSError):
+            pass
+
+    def _run_timers(self):
+        now = self.clock()
+        timers = self._timers
+        while timers and timers[0][0] <= now:
+            timer = heapq.heappop(timers)[2]
+            if timer.cancelled:
+                self._cancelled -= 1
+                continue
+            self.timers_fired += 1
+            try:
+                timer.callback(*timer.args)
+            except Exception as e:
+                log_error(f"Erro em timer do loop: {e}", "LOOP")
+        if self._cancelled > COMPACT_MIN_CANCELLED and self._cancelled > len(timers) // 2:
+            self._timers = [entry for entry in timers if not entry[2].cancelled]
+            heapq.heapify(self._timers)
+            self._cancelled = 0
+
+    def _run_ready(self):
+        # Só o que já estava na fila: callbacks que submetem outros não prendem o loop aqui
+        for _ in range(len(self._ready)):
+            callback, args = self._ready.popleft()
+            self.submitted += 1
+            try:
+                callback(*args)
+            except Exception as e:
+                log_error(f"Erro em callback do loop: {e}", "LOOP")
+
+    def _run(self):
+        while self.is_running:
+            if self._ready:
+                timeout = 0
+            elif self._timers:
+                timeout = max(0.0, self._timers[0][0] - self.clock())
+            else:
+                timeout = None
+            for key, _ in self.selector.select(timeout):
+                try:
+                    key.data()
+                except Exception as e:
+                    log_error(f"Erro em leitor do loop: {e}", "LOOP")
+            self._run_timers()
+            self._run_ready()
+            self.iterations += 1
+
+    def start(self):
+        """ Inicia a thread do loop """
+        if self._thread is not None:
+            return
+        self.is_running = True
+        self._thread = threading.Thread(target=self._run, name="SelectorLoop", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """ Para a thread (timers pendentes não disparam mais) e fecha o seletor. Não pode ser chamado na thread do
+            loop """
+        thread = self._thread
+        if thread is None:
+            return
+        self.call_soon_threadsafe(setattr, self, 'is_running', False)
+        thread.join()
+        self._thread = None
+        self.selector.close()
+        self._wakeup_recv.close()
+        self._wakeup_send.close()
+
+    def stats(self):
+        """ {'iterations', 'timers_pending', 'timers_fired', 'submitted'} """
+        return {'iterations': self.iterations, 'timers_pending': len(self._timers) - self._cancelled,
+                'timers_fired': self.timers_fired, 'submitted': self.submitted}
+
+_default_loop = None
+_default_loop_lock = threading.Lock()
+
+def default_loop():
+    """ Loop compartilhado pelo processo, com sua thread iniciada no primeiro uso """
+    global _default_loop
+    with _default_loop_lock:
+        if _default_loop is None:
+            _default_loop = SelectorLoop()
+            _default_loop.start()
+        return _default_loop
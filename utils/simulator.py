@@ -1,53 +1,117 @@
+import itertools
 import random
 import threading
 import time
+from utils.fragmentation import fragment_packet
+from utils.channel_trace import PacketFate
+from utils.profiling import stage
+from utils.receive_pump import sendto_waiting
 
 MAX_PACKET_SIZE = 65507  # Limite real do UDP
 HEADER_OVERHEAD = 64     # Margem de segurança
 
 class UnreliableChannel:
-    def __init__(self, loss_rate=0.0, corrupt_rate=0.0, delay_range=(0.0, 0.0)):
+    def __init__(self, loss_rate=0.0, corrupt_rate=0.0, delay_range=(0.0, 0.0), mtu=None, seed=None, trace=None):
+        """seed: semente dos sorteios deste canal (None: não reprodutível). trace: ChannelTrace
+        (utils/channel_trace.py) que grava o destino de cada datagrama ou, se foi carregado, os reproduz no lugar dos
+        sorteios."""
         self.loss_rate = loss_rate
         self.corrupt_rate = corrupt_rate
         self.delay_range = delay_range
-        print(f"[SIMULADOR] Canal inicializado: Perda={loss_rate*100:.1f}%, Corrupção={corrupt_rate*100:.1f}%, Atraso={delay_range[0]:.3f}-{delay_range[1]:.3f}s")
+        self.mtu = mtu # Maior datagrama (payload UDP) que o caminho entrega; None = sem limite
+        self.random = random.Random(seed)
+        self.trace = trace.attach() if trace is not None else None
+        self._message_ids = itertools.count(self.random.getrandbits(32)) # ID dos pacotes fragmentados
+        print(f"[SIMULADOR] Canal inicializado: Perda={loss_rate*100:.1f}%, Corrupção={corrupt_rate*100:.1f}%, Atraso={delay_range[0]:.3f}-{delay_range[1]:.3f}s"
+              + (f", MTU={mtu}" if mtu else "") + (f", Semente={seed}" if seed is not None else "")
+              + ((", Traço=reprodução" if self.trace.replay else ", Traço=gravação") if self.trace else ""))
 
     def send(self, packet_bytes, dest_socket, dest_addr):
-        """Divide e envia pacotes grandes de forma segura."""
-        if random.random() < self.loss_rate:
-            print(f"[SIMULADOR] Pacote para {dest_addr} PERDIDO.")
-            return
-
-        # Quebra o pacote em pedaços menores que o limite UDP
-        fragments = []
-        for i in range(0, len(packet_bytes), MAX_PACKET_SIZE - HEADER_OVERHEAD):
-            frag = packet_bytes[i:i + (MAX_PACKET_SIZE - HEADER_OVERHEAD)]
-            fragments.append(frag)
-
-        for frag in fragments:
-            # Corrupção simulada
-            if random.random() < self.corrupt_rate:
-                frag = self._corrupt_packet(frag)
-                print(f"[SIMULADOR] Fragmento CORROMPIDO ({len(frag)} bytes).")
-
-            delay = random.uniform(*self.delay_range)
+        """Divide e envia pacotes grandes de forma segura. Fragmentos sem atraso saem já, na thread de quem envia
+        (como no send_on_loop): uma thread por fragmento entregaria fora de ordem pacotes enviados em sequência."""
+        with stage('channel.send'):
+            for frag, delay in self._plan_delivery(packet_bytes, dest_addr):
+                if delay > 0:
+                    with stage('channel.schedule'):
+                        threading.Timer(delay, self._safe_send, (dest_socket, frag, dest_addr, True)).start()
+                else:
+                    self._safe_send(dest_socket, frag, dest_addr, True)
+
+    def send_on_loop(self, packet_bytes, transport, dest_addr, loop):
+        """Mesmo destino de send(), mas agendado no event loop asyncio (sem uma thread por fragmento)."""
+        for frag, delay in self._plan_delivery(packet_bytes, dest_addr):
             if delay > 0:
-                print(f"[SIMULADOR] Atrasando fragmento {len(frag)} bytes por {delay:.3f}s.")
+                loop.call_later(delay, self._safe_send, transport, frag, dest_addr)
+            else:
+                self._safe_send(transport, frag, dest_addr)
+
+    def _plan_delivery(self, packet_bytes, dest_addr):
+        """Sorteia perda, corrupção e atraso: retorna [(fragmento, atraso)] (vazio se o pacote foi perdido)."""
+        with stage('channel.plan'):
+            if self.mtu and len(packet_bytes) > self.mtu:
+                # Como um enlace com DF: pacotes acima do MTU são descartados, sem aviso ao emissor
+                print(f"[SIMULADOR] Pacote de {len(packet_bytes)} bytes para {dest_addr} excede o MTU ({self.mtu}). DESCARTADO.")
+                return []
+
+            # Pacotes acima do limite UDP viram fragmentos com cabeçalho, remontados pelo receptor (Reassembler).
+            # A perda é sorteada por fragmento: perder um deles perde a mensagem inteira
+            fragments = fragment_packet(packet_bytes, next(self._message_ids), MAX_PACKET_SIZE - HEADER_OVERHEAD)
+
+            kind = "Pacote" if len(fragments) == 1 else "Fragmento"
+            deliveries = []
+            for frag in fragments:
+                fate = self._next_fate(len(frag))
+                if fate.drop:
+                    print(f"[SIMULADOR] {kind} para {dest_addr} PERDIDO.")
+                    continue
 
-            threading.Timer(delay, lambda f=frag: self._safe_send(dest_socket, f, dest_addr)).start()
+                # Corrupção simulada
+                if fate.corrupt_offset is not None:
+                    frag = self._corrupt_packet(frag, fate.corrupt_offset, fate.corrupt_bit)
+                    print(f"[SIMULADOR] {kind} CORROMPIDO ({len(frag)} bytes).")
 
-    def _safe_send(self, sock, frag, addr):
+                delay = fate.delay
+                if delay > 0:
+                    print(f"[SIMULADOR] Atrasando {kind.lower()} {len(frag)} bytes por {delay:.3f}s.")
+
+                deliveries.append((frag, delay))
+            return deliveries
+
+    def _safe_send(self, sock, frag, addr, wait=False):
+        """sock pode ser um socket UDP ou um DatagramTransport (ambos têm sendto). wait: fora do event loop, um
+        socket não bloqueante espera espaço no buffer de envio como um socket bloqueante esperaria (no loop, buffer
+        cheio é perda)"""
         try:
             if len(frag) > MAX_PACKET_SIZE:
-                frag = frag[:MAX_PACKET_SIZE]
-            sock.sendto(frag, addr)
+                print(f"[SIMULADOR] Fragmento de {len(frag)} bytes acima do limite UDP. DESCARTADO.")
+                return
+            with stage('channel.sendto'):
+                if wait:
+                    sendto_waiting(sock, frag, addr)
+                else:
+                    sock.sendto(frag, addr)
         except Exception as e:
             print(f"[SIMULADOR] Erro ao enviar fragmento: {e}")
 
-    def _corrupt_packet(self, packet):
+    def _next_fate(self, length):
+        """Destino do próximo datagrama: do traço em reprodução, ou sorteado (e gravado, se houver traço)."""
+        if self.trace is not None and self.trace.replay:
+            return self.trace.next_fate()
+        if self.random.random() < self.loss_rate:
+            fate = PacketFate(True, None, 0, 0.0)
+        else:
+            offset = bit = None
+            if self.random.random() < self.corrupt_rate and length:
+                offset = self.random.randint(0, length - 1)
+                bit = self.random.randint(0, 7)
+            fate = PacketFate(False, offset, bit or 0, self.random.uniform(*self.delay_range))
+        if self.trace is not None:
+            self.trace.append(fate)
+        return fate
+
+    def _corrupt_packet(self, packet, offset, bit):
         if not packet:
             return packet
         p = bytearray(packet)
-        i = random.randint(0, len(p) - 1)
-        p[i] ^= 1 << random.randint(0, 7)
+        p[offset % len(p)] ^= 1 << bit
         return bytes(p)
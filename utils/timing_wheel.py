@@ -0,0 +1,199 @@
+import threading
+import time
+from utils.logger import log_error
+
+TICK = 0.01 # Resolução padrão dos timers (segundos)
+WHEEL_BITS = 6 # 64 posições por nível
+WHEEL_LEVELS = 4 # 64^4 ticks (~46h com TICK=0.01) antes de limitar ao último nível
+
+class TimerHandle:
+    """ Timer agendado em um TimingWheel; cancel() o remove em O(1) """
+    __slots__ = ('wheel', 'deadline', 'expires', 'callback', 'args', 'bucket')
+
+    def __init__(self, wheel, deadline, expires, callback, args):
+        self.wheel = wheel
+        self.deadline = deadline # Instante de disparo no relógio do wheel
+        self.expires = expires # Tick de disparo
+        self.callback = callback
+        self.args = args
+        self.bucket = None # Posição atual no wheel (None: disparado ou cancelado)
+
+    @property
+    def active(self):
+        """ True enquanto o timer ainda vai disparar """
+        return self.bucket is not None
+
+    def cancel(self):
+        """ Cancela o timer; retorna False se ele já disparou ou já foi cancelado """
+        with self.wheel._lock:
+            if self.bucket is None:
+                return False
+            self.bucket.discard(self)
+            self.bucket = None
+            self.wheel._count -= 1
+            self.wheel.cancelled += 1
+            return True
+
+class TimingWheel:
+    """ Timing wheel hierárquico (Varghese & Lauck): agendar e cancelar custam O(1), independentemente de quantos
+        timers existem. O nível 0 tem uma posição por tick; cada nível acima cobre 64 posições do anterior e é
+        redistribuído (cascade) quando o nível de baixo dá a volta.
+
+        Os callbacks rodam em uma única thread (start()) ou em quem chamar advance(), por exemplo um event loop ou um
+        teste com relógio virtual (clock injetável, sem start()). Callbacks devem ser curtos: os demais timers
+        esperam por eles """
+
+    def __init__(self, tick=TICK, clock=time.monotonic):
+        self.tick = tick
+        self.clock = clock
+        self._mask = (1 << WHEEL_BITS) - 1
+        self._levels = [[set() for _ in range(1 << WHEEL_BITS)] for _ in range(WHEEL_LEVELS)]
+        self._origin = clock()
+        self._current = 0 # Próximo tick a processar
+        self._count = 0 # Timers agendados
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._wake_at = None # Tick até o qual a thread dorme (None: sem prazo)
+        self._thread = None
+        self.is_running = False
+        # Estatísticas
+        self.scheduled = 0
+        self.cancelled = 0
+        self.fired = 0
+
+    def __len__(self):
+        return self._count
+
+    def _place(self, handle):
+        """Coloca o timer no nível em que o tick de disparo cabe (chamado com o lock adquirido)"""
+        expires = handle.expires
+        delta = expires - self._current
+        if delta >= 1 << (WHEEL_BITS * WHEEL_LEVELS):
+            # Além do alcance do wheel: fica no último nível e é recolocado quando ele for redistribuído
+            expires = self._current + (1 << (WHEEL_BITS * WHEEL_LEVELS)) - 1
+        level = 0
+        while level < WHEEL_LEVELS - 1 and delta >= 1 << (WHEEL_BITS * (level + 1)):
+            level += 1
+        bucket = self._levels[level][(expires >> (WHEEL_BITS * level)) & self._mask]
+        bucket.add(handle)
+        handle.bucket = bucket
+
+    def schedule(self, delay, callback, *args):
+        """ Agenda callback(*args) para daqui a delay segundos (arredondado para cima no tick); retorna o TimerHandle """
+        deadline = self.clock() + delay
+        expires = max(-(-(deadline - self._origin) // self.tick), 0)
+        with self._lock:
+            handle = TimerHandle(self, deadline, max(int(expires), self._current), callback, args)
+            self._place(handle)
+            self._count += 1
+            self.scheduled += 1
+            if self._thread is not None and (self._wake_at is None or handle.expires < self._wake_at):
+                self._wakeup.notify()
+        return handle
+
+    def _cascade(self, level):
+        """Redistribui a posição atual do nível (chamado com o lock adquirido)"""
+        index = (self._current >> (WHEEL_BITS * level)) & self._mask
+        bucket = self._levels[level][index]
+        self._levels[level][index] = set()
+        for handle in bucket:
+            self._place(handle)
+        return index
+
+    def _expire(self, now_tick):
+        """Processa os ticks até now_tick; retorna os timers vencidos (chamado com o lock adquirido)"""
+        due = []
+        while self._current <= now_tick:
+            if not self._count:
+                self._current = now_tick + 1 # Wheel vazio: nada a percorrer
+                break
+            if self._current & self._mask == 0:
+                level = 1
+                while level < WHEEL_LEVELS and self._cascade(level) == 0:
+                    level += 1
+            index = self._current & self._mask
+            bucket = self._levels[0][index]
+            if bucket:
+                self._levels[0][index] = set()
+                for handle in bucket:
+                    handle.bucket = None
+                self._count -= len(bucket)
+                due.extend(bucket)
+            self._current += 1
+        return due
+
+    def advance(self, now=None):
+        """ Dispara os timers vencidos até now (padrão: clock()), na thread de quem chama; retorna quantos dispararam """
+        if now is None:
+            now = self.clock()
+        with self._lock:
+            due = self._expire(int((now - self._origin) // self.tick))
+        due.sort(key=lambda handle: handle.deadline)
+        for handle in due:
+            self.fired += 1
+            try:
+                handle.callback(*handle.args)
+            except Exception as e:
+                log_error(f"Erro no callback de timer {handle.callback!r}: {e}", "TIMER")
+        return len(due)
+
+    def _next_tick(self):
+        """Tick do próximo timer do nível 0 ou, se não houver, da próxima redistribuição (chamado com o lock adquirido)"""
+        if not self._count:
+            return None
+        for offset in range(1 << WHEEL_BITS):
+            tick = self._current + offset
+            if tick & self._mask == 0 and offset:
+                return tick
+            if self._levels[0][tick & self._mask]:
+                return tick
+        return self._current + (1 << WHEEL_BITS)
+
+    def _run(self):
+        while self.is_running:
+            with self._lock:
+                self._wake_at = self._next_tick()
+                if self._wake_at is None:
+                    self._wakeup.wait()
+                else:
+                    timeout = self._origin + self._wake_at * self.tick - self.clock()
+                    if timeout > 0:
+                        self._wakeup.wait(timeout)
+                self._wake_at = None
+            if self.is_running:
+                self.advance()
+
+    def start(self):
+        """ Inicia a thread que dispara os timers """
+        with self._lock:
+            if self._thread is not None:
+                return
+            self.is_running = True
+            self._thread = threading.Thread(target=self._run, name="TimingWheel", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """ Para a thread (timers pendentes não disparam mais) """
+        with self._lock:
+            thread = self._thread
+            self.is_running = False
+            self._thread = None
+            self._wakeup.notify()
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+
+    def stats(self):
+        """ {'pending', 'scheduled', 'cancelled', 'fired'} """
+        return {'pending': self._count, 'scheduled': self.scheduled, 'cancelled': self.cancelled, 'fired': self.fired}
+
+_default_wheel = None
+_default_wheel_lock = threading.Lock()
+
+def default_wheel():
+    """ Wheel compartilhado pelo processo (RDT 3.0, GBN e TCP), com sua thread iniciada no primeiro uso """
+    global _default_wheel
+    with _default_wheel_lock:
+        if _default_wheel is None:
+            _default_wheel = TimingWheel()
+            _default_wheel.start()
+        return _default_wheel